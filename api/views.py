@@ -3,21 +3,14 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from .models import TrackingStatus, Location
 import json
-import math
+
+from bot.geo import haversine as calculate_distance
 
 # Константы для определения местоположения работы
 WORK_LATITUDE = 55.7539  # Красная площадь
 WORK_LONGITUDE = 37.6208  # Красная площадь
 WORK_RADIUS = 100  # метров
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Вычисление расстояния между двумя точками в метрах"""
-    R = 6371000  # радиус Земли в метрах
-    lat1_rad, lat2_rad = math.radians(lat1), math.radians(lat2)
-    delta_lat, delta_lon = math.radians(lat2-lat1), math.radians(lon2-lon1)
-    a = math.sin(delta_lat/2)**2 + math.cos(lat1_rad)*math.cos(lat2_rad)*math.sin(delta_lon/2)**2
-    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-
 @csrf_exempt
 @require_http_methods(["POST"])
 def toggle_tracking(request):
@@ -1,8 +1,15 @@
 import sqlite3
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timezone
 import logging
 from config.settings import config
+from bot.db_pool import get_pool
+from bot.user_cache import get_user_cache
+from bot.zones import get_zone_index
+from bot.geofence import get_geofence_engine
+from bot.track_filter import STATIONARY, get_track_filter
+from bot.location_events import location_events, make_location_event
 
 logger = logging.getLogger(__name__)
 
@@ -11,11 +18,19 @@ class Database:
     
     def __init__(self, db_path="driver.db"):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self.user_cache = get_user_cache(db_path)
+        self.zone_index = get_zone_index(db_path)
+        # Гистерезис и время пребывания в зоне (см. bot/geofence.py); без него — сырое попадание в зону
+        self.geofence = (get_geofence_engine(db_path, self.zone_index, seed=self.get_geofence_seed)
+                         if config.GEOFENCE_HYSTERESIS else None)
+        # Отсев выбросов, сглаживание и прореживание стоянок до записи (см. bot/track_filter.py)
+        self.track_filter = get_track_filter(db_path) if config.TRACK_FILTER_ENABLED else None
         self.init_db()
     
     def init_db(self):
         """Инициализация базы данных"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         # Таблица статуса отслеживания
@@ -126,10 +141,104 @@ class Database:
                 heading REAL,
                 is_at_work BOOLEAN DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                zone_id INTEGER,
                 FOREIGN KEY (user_id) REFERENCES users (id)
             )
         ''')
         
+        # Последняя точка каждого пользователя: обновляется в той же транзакции,
+        # что и вставка в user_locations, чтобы «где сейчас X» не зависело от объёма истории
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_last_location'")
+        last_location_table_exists = c.fetchone() is not None
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS user_last_location (
+                user_id INTEGER PRIMARY KEY,
+                location_id INTEGER NOT NULL,
+                telegram_id BIGINT NOT NULL,
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                accuracy REAL,
+                altitude REAL,
+                speed REAL,
+                heading REAL,
+                is_at_work BOOLEAN DEFAULT 0,
+                created_at TIMESTAMP,
+                zone_id INTEGER
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_user_last_location_telegram_id ON user_last_location (telegram_id)')
+        if not last_location_table_exists:
+            # Миграция: заполняем последние точки из уже накопленной истории
+            c.execute('''
+                INSERT INTO user_last_location
+                (user_id, location_id, telegram_id, latitude, longitude, accuracy, altitude, speed, heading, is_at_work, created_at)
+                SELECT user_id, id, telegram_id, latitude, longitude, accuracy, altitude, speed, heading, is_at_work, created_at
+                FROM user_locations
+                WHERE id IN (SELECT MAX(id) FROM user_locations GROUP BY user_id)
+            ''')
+            if c.rowcount:
+                logger.info(f"Заполнена таблица user_last_location: {c.rowcount} пользователей")
+        
+        # Миграция: зона, в которой была точка (см. bot/zones.py)
+        for table in ('user_locations', 'user_last_location'):
+            c.execute(f"PRAGMA table_info({table})")
+            if 'zone_id' not in [row[1] for row in c.fetchall()]:
+                c.execute(f"ALTER TABLE {table} ADD COLUMN zone_id INTEGER")
+        
+        # Рабочие зоны: несколько кругов и многоугольников на пользователя.
+        # revision растёт при каждом изменении — по ней процессы дочитывают изменения индекса
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS zones (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                latitude REAL,
+                longitude REAL,
+                radius REAL,
+                polygon TEXT,
+                is_active BOOLEAN DEFAULT 1,
+                revision INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_zones_revision ON zones (revision)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_zones_user_id ON zones (user_id)')
+        
+        # Въезды и выезды по каждой зоне (пишет монитор бота)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS zone_transitions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                zone_id INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                location_id INTEGER NOT NULL,
+                created_at TIMESTAMP,
+                UNIQUE (location_id, zone_id, type)
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_zone_transitions_user_id ON zone_transitions (user_id, id)')
+        
+        # Общая таблица ETA водителей до рабочей точки: заполняется фоновым
+        # пакетным расчётом (web/eta_refresher.py), /api/eta только читает её
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS driver_eta (
+                user_id INTEGER PRIMARY KEY,
+                eta_seconds INTEGER,
+                distance_meters INTEGER,
+                source TEXT,
+                consider_traffic BOOLEAN DEFAULT 1,
+                car_latitude REAL,
+                car_longitude REAL,
+                work_latitude REAL,
+                work_longitude REAL,
+                location_id INTEGER,
+                computed_at REAL NOT NULL
+            )
+        ''')
+        
         # Таблица пользователей
         c.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -268,13 +377,33 @@ class Database:
             c.execute('DROP TABLE users')
             c.execute('ALTER TABLE users_new RENAME TO users')
         
+        # Миграция: индексы для горячих запросов по user_locations.
+        # (telegram_id, id) — последняя точка/история по telegram_id и MAX(id) по получателям,
+        # (user_id, id) — последняя точка по user_id в /api/current_location и /api/eta
+        c.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'user_locations'")
+        existing_indexes = {row[0] for row in c.fetchall()}
+        for index_name, index_columns in (
+            ('idx_user_locations_telegram_id_id', 'telegram_id, id'),
+            ('idx_user_locations_user_id_id', 'user_id, id'),
+        ):
+            if index_name not in existing_indexes:
+                logger.info(f"Создаём индекс {index_name}...")
+                c.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON user_locations ({index_columns})')
+        # Статусы доставки обновляются по (notification_log_id, recipient_telegram_id)
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_notification_details_log_recipient
+            ON notification_details (notification_log_id, recipient_telegram_id)
+        ''')
+        
         conn.commit()
+        # Обновляем статистику планировщика (дёшево, если ничего не изменилось)
+        c.execute('PRAGMA optimize')
         conn.close()
         logger.info("База данных инициализирована")
     
     def get_tracking_status(self):
         """Получение статуса отслеживания"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         c.execute('SELECT is_active FROM tracking_status WHERE id = 1')
         result = c.fetchone()
@@ -283,7 +412,7 @@ class Database:
     
     def set_tracking_status(self, is_active):
         """Установка статуса отслеживания"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         c.execute('''
             UPDATE tracking_status 
@@ -296,7 +425,7 @@ class Database:
     
     def add_location(self, latitude, longitude, distance=None, is_at_work=False):
         """Добавление записи о местоположении"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         c.execute('''
             INSERT INTO locations (latitude, longitude, distance, is_at_work)
@@ -308,7 +437,7 @@ class Database:
     
     def get_last_location(self):
         """Получение последнего местоположения"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         c.execute('''
             SELECT latitude, longitude, distance, is_at_work, timestamp
@@ -331,7 +460,7 @@ class Database:
     
     def get_location_history(self, limit=10):
         """Получение истории местоположений"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         c.execute('''
             SELECT latitude, longitude, timestamp, distance, is_at_work
@@ -355,7 +484,7 @@ class Database:
     
     def get_setting(self, key, default=None):
         """Получение настройки"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         c.execute('SELECT value FROM settings WHERE key = ?', (key,))
         result = c.fetchone()
@@ -364,7 +493,7 @@ class Database:
     
     def set_setting(self, key, value):
         """Установка настройки"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         c.execute('''
             INSERT OR REPLACE INTO settings (key, value, updated_at)
@@ -375,12 +504,12 @@ class Database:
         logger.info(f"Настройка {key} изменена на: {value}")
     
     def get_connection(self):
-        """Получение соединения с базой данных"""
-        return sqlite3.connect(self.db_path)
+        """Получение соединения с базой данных из общего пула (close() возвращает его в пул)"""
+        return self.pool.get_connection()
 
     def create_user(self, telegram_id, username=None, first_name=None, last_name=None):
         """Создать нового пользователя"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         import json
         default_buttons = json.dumps([
@@ -400,7 +529,10 @@ class Database:
 
     def get_user_by_telegram_id(self, telegram_id):
         """Получить пользователя по telegram_id"""
-        conn = sqlite3.connect(self.db_path)
+        cached = self.user_cache.get('telegram_id', telegram_id)
+        if cached is not None:
+            return cached
+        conn = self.get_connection()
         c = conn.cursor()
         c.execute('''
             SELECT * FROM users WHERE telegram_id = ?
@@ -415,12 +547,16 @@ class Database:
                 user['buttons'] = json.loads(user['buttons']) if user['buttons'] else []
             except Exception:
                 user['buttons'] = []
+            self.user_cache.put(user)
             return user
         return None
 
     def get_user_by_id(self, user_id):
         """Получить пользователя по ID"""
-        conn = sqlite3.connect(self.db_path)
+        cached = self.user_cache.get('id', user_id)
+        if cached is not None:
+            return cached
+        conn = self.get_connection()
         c = conn.cursor()
         c.execute('''
             SELECT * FROM users WHERE id = ?
@@ -435,31 +571,67 @@ class Database:
                 user['buttons'] = json.loads(user['buttons']) if user['buttons'] else []
             except Exception:
                 user['buttons'] = []
+            self.user_cache.put(user)
             return user
         return None
 
-    def get_user_role(self, telegram_id):
-        """Получить роль пользователя"""
-        conn = sqlite3.connect(self.db_path)
+    def get_users_by_telegram_ids(self, telegram_ids):
+        """Получить пользователей по списку telegram_id одним запросом: {telegram_id: user}"""
+        import json
+        result = {}
+        missing = []
+        for telegram_id in dict.fromkeys(telegram_ids):
+            cached = self.user_cache.get('telegram_id', telegram_id)
+            if cached is not None:
+                result[telegram_id] = cached
+            else:
+                missing.append(telegram_id)
+        if not missing:
+            return result
+        conn = self.get_connection()
         c = conn.cursor()
-        c.execute('''
-            SELECT role FROM users WHERE telegram_id = ?
-        ''', (telegram_id,))
-        result = c.fetchone()
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            c.execute(f'SELECT * FROM users WHERE telegram_id IN ({placeholders})', chunk)
+            columns = [desc[0] for desc in c.description]
+            for row in c.fetchall():
+                user = dict(zip(columns, row))
+                try:
+                    user['buttons'] = json.loads(user['buttons']) if user['buttons'] else []
+                except Exception:
+                    user['buttons'] = []
+                self.user_cache.put(user)
+                result[user['telegram_id']] = user
         conn.close()
-        role = result[0] if result else None
+        # Ключи — в том виде, в котором их передали
+        for telegram_id in missing:
+            if telegram_id not in result:
+                try:
+                    user = result.get(int(telegram_id))
+                except (TypeError, ValueError):
+                    user = None
+                if user is not None:
+                    result[telegram_id] = user
+        return result
+
+    def get_user_role(self, telegram_id):
+        """Получить роль пользователя"""
+        user = self.get_user_by_telegram_id(telegram_id)
+        role = user.get('role') if user else None
         logger.info(f"DATABASE: get_user_role({telegram_id}) = {role}")
         return role
     
     def set_user_role(self, telegram_id, role):
         """Установить роль пользователя (admin, driver, recipient)"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         c.execute('''
             UPDATE users SET role = ? WHERE telegram_id = ?
         ''', (role, telegram_id))
         conn.commit()
         conn.close()
+        self.user_cache.invalidate('telegram_id', telegram_id)
         logger.info(f"Роль пользователя {telegram_id} установлена как: {role}")
     
     def is_recipient_only(self, telegram_id):
@@ -490,7 +662,7 @@ class Database:
             '🚗 Подъезжаю к дому'
         ], ensure_ascii=False)
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         try:
             logger.info(f"CREATE_USER_WITH_LOGIN: попытка создания пользователя {login} с email: '{email}'")
@@ -509,7 +681,10 @@ class Database:
     
     def get_user_by_login(self, login):
         """Получить пользователя по логину"""
-        conn = sqlite3.connect(self.db_path)
+        cached = self.user_cache.get('login', login)
+        if cached is not None:
+            return cached
+        conn = self.get_connection()
         c = conn.cursor()
         # Исключаем NULL значения из поиска
         c.execute('''
@@ -529,13 +704,17 @@ class Database:
             # Диагностика email
             logger.info(f"GET_USER_BY_LOGIN: пользователь {login}, email: '{user.get('email')}', тип: {type(user.get('email'))}")
             
+            self.user_cache.put(user)
             return user
         return None
 
     def get_user_by_email(self, email):
         """Получить пользователя по email (без учета регистра и с обрезкой пробелов)"""
         normalized_email = (email or "").strip().lower()
-        conn = sqlite3.connect(self.db_path)
+        cached = self.user_cache.get('email', normalized_email)
+        if cached is not None:
+            return cached
+        conn = self.get_connection()
         c = conn.cursor()
         # Сравнение по lower() обеспечивает поиск без учета регистра
         c.execute('''
@@ -553,6 +732,7 @@ class Database:
             except Exception:
                 user['buttons'] = []
             logger.info(f"GET_USER_BY_EMAIL: пользователь {email} найден")
+            self.user_cache.put(user)
             return user
         logger.info(f"GET_USER_BY_EMAIL: пользователь {email} не найден")
         return None
@@ -580,7 +760,7 @@ class Database:
     
     def get_all_users(self):
         """Получить всех пользователей для администрирования"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         c.execute('''
             SELECT id, telegram_id, login, first_name, last_name, auth_type, role, created_at, last_login, email, phone, password_hash
@@ -598,12 +778,15 @@ class Database:
     
     def delete_user_by_id(self, user_id):
         """Удалить пользователя по ID"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         c.execute('DELETE FROM users WHERE id = ?', (user_id,))
         deleted = c.rowcount > 0
+        c.execute('DELETE FROM user_last_location WHERE user_id = ?', (user_id,))
+        c.execute('DELETE FROM driver_eta WHERE user_id = ?', (user_id,))
         conn.commit()
         conn.close()
+        self.user_cache.invalidate('id', user_id)
         if deleted:
             logger.info(f"Пользователь с ID {user_id} удален")
         return deleted
@@ -617,7 +800,7 @@ class Database:
         if 'buttons' in kwargs and isinstance(kwargs['buttons'], list):
             import json
             kwargs['buttons'] = json.dumps(kwargs['buttons'], ensure_ascii=False)
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         fields = []
         values = []
@@ -629,6 +812,7 @@ class Database:
         c.execute(sql, values)
         conn.commit()
         conn.close()
+        self.user_cache.invalidate('telegram_id', telegram_id)
         logger.info(f"Обновлены настройки пользователя telegram_id={telegram_id}: {kwargs}")
 
     def update_user_settings_by_login(self, login, **kwargs):
@@ -639,7 +823,7 @@ class Database:
         if 'buttons' in kwargs and isinstance(kwargs['buttons'], list):
             import json
             kwargs['buttons'] = json.dumps(kwargs['buttons'], ensure_ascii=False)
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         fields = []
         values = []
@@ -651,11 +835,12 @@ class Database:
         c.execute(sql, values)
         conn.commit()
         conn.close()
+        self.user_cache.invalidate('login', login)
         logger.info(f"Обновлены настройки пользователя login={login}: {kwargs}")
 
     def bind_telegram_to_user(self, login, telegram_id, username=None, first_name=None, last_name=None):
         """Привязать Telegram ID к существующему пользователю по логину"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         # Проверяем, что пользователь с таким логином существует
@@ -679,12 +864,14 @@ class Database:
         
         conn.commit()
         conn.close()
+        self.user_cache.invalidate('login', login)
+        self.user_cache.invalidate('telegram_id', telegram_id)
         logger.info(f"Telegram ID {telegram_id} привязан к пользователю {login}")
         return True, "Telegram аккаунт успешно привязан"
 
     def unbind_telegram_from_user(self, login_or_id):
         """Отвязать Telegram аккаунт от пользователя по логину или ID"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         # Определяем, что передано - логин или ID
@@ -718,6 +905,7 @@ class Database:
         
         conn.commit()
         conn.close()
+        self.user_cache.invalidate('id', user['id'])
         logger.info(f"Telegram аккаунт отвязан от пользователя {login_or_id}")
         return True, "Telegram аккаунт успешно отвязан"
 
@@ -737,7 +925,7 @@ class Database:
         # Устанавливаем время истечения (1 час)
         expires_at = datetime.now() + timedelta(hours=1)
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         # Удаляем старые коды для этого пользователя
@@ -782,7 +970,7 @@ class Database:
         """Проверить код восстановления пароля"""
         from datetime import datetime
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         c.execute('''
@@ -810,7 +998,7 @@ class Database:
 
     def mark_reset_code_used(self, reset_id):
         """Отметить код восстановления как использованный"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         c.execute('UPDATE password_reset_codes SET used = 1 WHERE id = ?', (reset_id,))
@@ -827,7 +1015,7 @@ class Database:
         password_hash = hashlib.pbkdf2_hmac('sha256', new_password.encode(), salt.encode(), 100000)
         password_hash_hex = salt + password_hash.hex()
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         c.execute('''
@@ -838,13 +1026,15 @@ class Database:
         
         conn.commit()
         conn.close()
+        # В кэше лежит password_hash — старый пароль не должен проходить verify_password
+        self.user_cache.invalidate('login', login)
         
         logger.info(f"Пароль пользователя {login} сброшен")
         return True
     
     def create_invitation(self, inviter_id, invite_code):
         """Создать приглашение получателя уведомлений"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         # Получаем информацию о приглашающем
@@ -870,7 +1060,7 @@ class Database:
     
     def get_invitation_by_code(self, invite_code):
         """Получить приглашение по коду"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         c.execute('''
@@ -894,7 +1084,7 @@ class Database:
     def accept_invitation(self, invite_code, recipient_telegram_id, recipient_username=None, 
                          recipient_first_name=None, recipient_last_name=None):
         """Принять приглашение"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         try:
@@ -920,7 +1110,7 @@ class Database:
     
     def get_user_invitations(self, user_id):
         """Получить все приглашения пользователя (как приглашающего)"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         c.execute('''
@@ -944,7 +1134,7 @@ class Database:
     
     def get_all_invitations(self):
         """Получить все приглашения для админ-панели"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         c.execute('''
@@ -972,7 +1162,7 @@ class Database:
     
     def delete_invitation(self, invitation_id):
         """Удалить приглашение по ID"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         try:
@@ -1009,7 +1199,7 @@ class Database:
     def create_notification_log(self, notification_type, sender_id=None, sender_telegram_id=None, 
                                sender_login=None, notification_text=""):
         """Создать запись в логе уведомлений"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         try:
@@ -1033,7 +1223,7 @@ class Database:
     def add_notification_detail(self, notification_log_id, recipient_telegram_id, 
                                recipient_name=None, status="pending", error_message=None):
         """Добавить деталь отправки уведомления"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         try:
@@ -1056,7 +1246,7 @@ class Database:
     def update_notification_detail(self, notification_log_id, recipient_telegram_id, 
                                   status, error_message=None):
         """Обновить статус отправки уведомления"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         try:
@@ -1076,9 +1266,47 @@ class Database:
             logger.error(f"Ошибка обновления детали уведомления: {e}")
             return False
     
+    def add_notification_details_batch(self, notification_log_id, details):
+        """Добавить детали отправки одной транзакцией: details — [(telegram_id, имя, статус)]"""
+        conn = self.get_connection()
+        c = conn.cursor()
+        
+        try:
+            c.executemany('''
+                INSERT INTO notification_details 
+                (notification_log_id, recipient_telegram_id, recipient_name, status)
+                VALUES (?, ?, ?, ?)
+            ''', [(notification_log_id, tg_id, name, status) for tg_id, name, status in details])
+            conn.commit()
+            conn.close()
+            return True
+        except Exception as e:
+            conn.close()
+            logger.error(f"Ошибка пакетного добавления деталей уведомления: {e}")
+            return False
+    
+    def update_notification_details_batch(self, notification_log_id, updates):
+        """Обновить статусы отправки одной транзакцией: updates — [(telegram_id, статус, ошибка)]"""
+        conn = self.get_connection()
+        c = conn.cursor()
+        
+        try:
+            c.executemany('''
+                UPDATE notification_details 
+                SET status = ?, error_message = ?, sent_at = CURRENT_TIMESTAMP
+                WHERE notification_log_id = ? AND recipient_telegram_id = ?
+            ''', [(status, error, notification_log_id, tg_id) for tg_id, status, error in updates])
+            conn.commit()
+            conn.close()
+            return True
+        except Exception as e:
+            conn.close()
+            logger.error(f"Ошибка пакетного обновления деталей уведомления: {e}")
+            return False
+    
     def complete_notification_log(self, notification_log_id, sent_count, failed_count):
         """Завершить лог уведомления с итоговой статистикой"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         try:
@@ -1102,7 +1330,7 @@ class Database:
     
     def mark_confirmation_sent(self, notification_log_id):
         """Отметить, что подтверждение отправлено"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         try:
@@ -1126,7 +1354,7 @@ class Database:
     
     def get_notification_log(self, notification_log_id):
         """Получить лог уведомления по ID"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         c.execute('''
@@ -1149,7 +1377,7 @@ class Database:
     
     def get_notification_details(self, notification_log_id):
         """Получить детали отправки уведомления"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         c.execute('''
@@ -1171,7 +1399,7 @@ class Database:
     
     def get_recent_notifications(self, limit=10):
         """Получить последние уведомления"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         c.execute('''
@@ -1200,56 +1428,227 @@ class Database:
     def add_user_location(self, telegram_id, latitude, longitude, accuracy=None, 
                          altitude=None, speed=None, heading=None, is_at_work=None):
         """Добавить местоположение пользователя"""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        
         try:
             # Получаем user_id по telegram_id
             user_info = self.get_user_by_telegram_id(telegram_id)
             if not user_info:
-                conn.close()
                 return False
-            
-            # Если статус "в работе" не передан, определяем автоматически с учетом роли
-            if is_at_work is None:
-                from bot.utils import is_at_work
-                user_role = user_info.get('role')
-                user_work_lat = user_info.get('work_latitude')
-                user_work_lon = user_info.get('work_longitude')
-                user_work_radius = user_info.get('work_radius')
-                is_at_work = is_at_work(latitude, longitude, user_role, user_work_lat, user_work_lon, user_work_radius)
-            
-            c.execute('''
-                INSERT INTO user_locations 
-                (user_id, telegram_id, latitude, longitude, accuracy, altitude, speed, heading, is_at_work)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (user_info['id'], telegram_id, latitude, longitude, accuracy, altitude, speed, heading, is_at_work))
-            
-            location_id = c.lastrowid
-            conn.commit()
-            conn.close()
-            
-            logger.info(f"Местоположение пользователя {telegram_id} добавлено: {latitude}, {longitude}")
-            return location_id
         except Exception as e:
-            conn.close()
             logger.error(f"Ошибка добавления местоположения пользователя {telegram_id}: {e}")
             return False
+        return self.add_location_for_user(user_info, telegram_id, latitude, longitude, accuracy,
+                                          altitude, speed, heading, is_at_work)
+    
+    def add_location_for_user(self, user_info, telegram_id, latitude, longitude, accuracy=None,
+                              altitude=None, speed=None, heading=None, is_at_work=None):
+        """
+        Добавить точку уже известного пользователя
+
+        telegram_id для пользователей без Telegram — их id (так исторически пишет /api/location).
+        Возвращает id записи, None — точка отсеяна фильтром трека, False — ошибка.
+        """
+        try:
+            point = self.make_location_point(user_info, telegram_id, latitude, longitude, accuracy,
+                                             altitude, speed, heading, is_at_work)
+            if point['filtered']:
+                logger.debug(f"Точка пользователя {telegram_id} не записана фильтром трека: {point['filtered']}")
+                return None
+            location_id = self.add_locations_batch([point])[0]
+        except Exception as e:
+            logger.error(f"Ошибка добавления местоположения пользователя {telegram_id}: {e}")
+            return False
+        logger.info(f"Местоположение пользователя {telegram_id} добавлено: {latitude}, {longitude}")
+        return location_id
+    
+    def make_location_point(self, user_info, telegram_id, latitude, longitude, accuracy=None,
+                            altitude=None, speed=None, heading=None, is_at_work=None, timestamp=None):
+        """
+        Подготовить точку к записи: статус "в работе", зона и время фиксируются в момент приёма
+
+        Точка сначала проходит фильтр трека (timestamp — время точки на устройстве, если
+        известно). В point['filtered'] причина, по которой точку писать не нужно, или None.
+        """
+        # Тот же формат и часовой пояс (UTC), что и у CURRENT_TIMESTAMP
+        created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            timestamp = float(timestamp) if timestamp is not None else time.time()
+        except (TypeError, ValueError):
+            timestamp = time.time()
+        filtered = None
+        if self.track_filter is not None:
+            latitude, longitude, filtered = self.track_filter.check(
+                user_info['id'], latitude, longitude, accuracy, timestamp)
+        if filtered:
+            # Выброс не должен менять статус: отвечаем статусом последней записанной точки
+            is_at_work, zone_id = self.track_filter.last_status(user_info['id'])
+        elif is_at_work is None and self.geofence is not None:
+            # Устойчивый статус: гистерезис, время пребывания и фильтр по accuracy
+            result = self.geofence.update(user_info, latitude, longitude, accuracy, created_at=created_at)
+            is_at_work, zone_id = result['is_at_work'], result['zone_id']
+        else:
+            # Зона — по индексу зон пользователя и зоне из профиля, с учетом роли
+            at_work, zone_id = self.zone_index.resolve(user_info, latitude, longitude)
+            # Если статус "в работе" не передан, определяем автоматически
+            if is_at_work is None:
+                is_at_work = at_work
+            elif not is_at_work:
+                zone_id = None
+        point = {
+            'user_id': user_info['id'],
+            'telegram_id': telegram_id,
+            'role': user_info.get('role'),
+            'latitude': latitude,
+            'longitude': longitude,
+            'accuracy': accuracy,
+            'altitude': altitude,
+            'speed': speed,
+            'heading': heading,
+            'is_at_work': 1 if is_at_work else 0,
+            'zone_id': zone_id,
+            'created_at': created_at,
+            'filtered': filtered,
+        }
+        if not filtered and self.track_filter is not None and \
+                self.track_filter.redundant(user_info['id'], point, timestamp):
+            point['filtered'] = STATIONARY
+        return point
+    
+    def get_geofence_seed(self, user_id):
+        """Статус последней записанной точки пользователя: (is_at_work, zone_id, created_at) или None"""
+        conn = self.get_connection()
+        try:
+            row = conn.execute(
+                'SELECT is_at_work, zone_id, created_at FROM user_last_location WHERE user_id = ?', (user_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return (bool(row[0]), row[1], row[2]) if row else None
+    
+    def add_locations_batch(self, points):
+        """
+        Записать пачку точек одной транзакцией
+
+        История пишется в user_locations, последняя точка — в user_last_location,
+        после коммита по каждой точке публикуется событие. Возвращает список id.
+        """
+        conn = self.get_connection()
+        c = conn.cursor()
+        location_ids = []
+        try:
+            for p in points:
+                c.execute('''
+                    INSERT INTO user_locations 
+                    (user_id, telegram_id, latitude, longitude, accuracy, altitude, speed, heading, is_at_work, created_at, zone_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (p['user_id'], p['telegram_id'], p['latitude'], p['longitude'], p['accuracy'],
+                      p['altitude'], p['speed'], p['heading'], p['is_at_work'], p['created_at'], p.get('zone_id')))
+                location_ids.append(c.lastrowid)
+            c.executemany('''
+                INSERT INTO user_last_location
+                (user_id, location_id, telegram_id, latitude, longitude, accuracy, altitude, speed, heading, is_at_work, created_at, zone_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    location_id = excluded.location_id,
+                    telegram_id = excluded.telegram_id,
+                    latitude = excluded.latitude,
+                    longitude = excluded.longitude,
+                    accuracy = excluded.accuracy,
+                    altitude = excluded.altitude,
+                    speed = excluded.speed,
+                    heading = excluded.heading,
+                    is_at_work = excluded.is_at_work,
+                    created_at = excluded.created_at,
+                    zone_id = excluded.zone_id
+                WHERE excluded.location_id > user_last_location.location_id
+            ''', [(p['user_id'], location_id, p['telegram_id'], p['latitude'], p['longitude'], p['accuracy'],
+                   p['altitude'], p['speed'], p['heading'], p['is_at_work'], p['created_at'], p.get('zone_id'))
+                  for p, location_id in zip(points, location_ids)])
+            conn.commit()
+        finally:
+            conn.close()
+        
+        for p, location_id in zip(points, location_ids):
+            location_events.publish(make_location_event(
+                location_id, p['user_id'], p['telegram_id'], p['is_at_work'], p['created_at'], p['role'],
+                p.get('zone_id')
+            ))
+        return location_ids
+    
+    def get_eta_candidates(self, active_since):
+        """Водители с рабочей точкой и точкой не старше active_since (UTC, '%Y-%m-%d %H:%M:%S')"""
+        conn = self.get_connection()
+        c = conn.cursor()
+        c.execute('''
+            SELECT u.id, ul.location_id, ul.latitude, ul.longitude, u.work_latitude, u.work_longitude
+            FROM users u
+            JOIN user_last_location ul ON ul.user_id = u.id
+            WHERE u.role IN ('driver', 'admin')
+              AND u.work_latitude IS NOT NULL AND u.work_longitude IS NOT NULL
+              AND ul.created_at >= ?
+        ''', (active_since,))
+        columns = ['user_id', 'location_id', 'car_lat', 'car_lon', 'work_lat', 'work_lon']
+        rows = [dict(zip(columns, row)) for row in c.fetchall()]
+        conn.close()
+        return rows
+    
+    def save_driver_etas(self, etas):
+        """Записать рассчитанные ETA одной транзакцией"""
+        if not etas:
+            return
+        conn = self.get_connection()
+        c = conn.cursor()
+        c.executemany('''
+            INSERT INTO driver_eta
+            (user_id, eta_seconds, distance_meters, source, consider_traffic,
+             car_latitude, car_longitude, work_latitude, work_longitude, location_id, computed_at)
+            VALUES (:user_id, :eta_seconds, :distance_meters, :source, :consider_traffic,
+                    :car_lat, :car_lon, :work_lat, :work_lon, :location_id, :computed_at)
+            ON CONFLICT(user_id) DO UPDATE SET
+                eta_seconds = excluded.eta_seconds,
+                distance_meters = excluded.distance_meters,
+                source = excluded.source,
+                consider_traffic = excluded.consider_traffic,
+                car_latitude = excluded.car_latitude,
+                car_longitude = excluded.car_longitude,
+                work_latitude = excluded.work_latitude,
+                work_longitude = excluded.work_longitude,
+                location_id = excluded.location_id,
+                computed_at = excluded.computed_at
+        ''', etas)
+        conn.commit()
+        conn.close()
+    
+    def get_driver_eta(self, user_id):
+        """Последний рассчитанный ETA водителя или None"""
+        conn = self.get_connection()
+        c = conn.cursor()
+        c.execute('''
+            SELECT user_id, eta_seconds, distance_meters, source, consider_traffic,
+                   car_latitude, car_longitude, work_latitude, work_longitude, location_id, computed_at
+            FROM driver_eta WHERE user_id = ?
+        ''', (user_id,))
+        row = c.fetchone()
+        conn.close()
+        if row:
+            columns = ['user_id', 'eta_seconds', 'distance_meters', 'source', 'consider_traffic',
+                       'car_lat', 'car_lon', 'work_lat', 'work_lon', 'location_id', 'computed_at']
+            return dict(zip(columns, row))
+        return None
     
     def get_user_last_location(self, telegram_id):
         """Получить последнее местоположение пользователя"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         c.execute('''
-            SELECT ul.id, ul.user_id, ul.telegram_id, ul.latitude, ul.longitude,
+            SELECT ul.location_id, ul.user_id, ul.telegram_id, ul.latitude, ul.longitude,
                    ul.accuracy, ul.altitude, ul.speed, ul.heading, ul.is_at_work, ul.created_at,
                    u.first_name, u.last_name, u.username, u.role,
                    u.work_latitude, u.work_longitude, u.work_radius
-            FROM user_locations ul
+            FROM user_last_location ul
             JOIN users u ON ul.user_id = u.id
             WHERE ul.telegram_id = ?
-            ORDER BY ul.created_at DESC
+            ORDER BY ul.location_id DESC
             LIMIT 1
         ''', (telegram_id,))
         
@@ -1278,23 +1677,22 @@ class Database:
             return location_data
         return None
     
-    def get_user_location_history(self, telegram_id, limit=10):
-        """Получить историю местоположений пользователя"""
-        conn = sqlite3.connect(self.db_path)
+    def get_user_location_history(self, telegram_id, limit=10, since=None, until=None):
+        """
+        Получить историю местоположений пользователя
+
+        Читает горячую таблицу и, если точек не хватает, месячные архивы
+        (см. bot/retention.py). since/until — границы created_at.
+        """
+        from bot.retention import fetch_user_track
+        conn = self.get_connection()
         c = conn.cursor()
         
-        c.execute('''
-            SELECT ul.id, ul.user_id, ul.telegram_id, ul.latitude, ul.longitude,
-                   ul.accuracy, ul.altitude, ul.speed, ul.heading, ul.is_at_work, ul.created_at,
-                   u.first_name, u.last_name, u.username
-            FROM user_locations ul
-            JOIN users u ON ul.user_id = u.id
-            WHERE ul.telegram_id = ?
-            ORDER BY ul.created_at DESC
-            LIMIT ?
-        ''', (telegram_id, limit))
-        
-        rows = c.fetchall()
+        rows = fetch_user_track(c, telegram_id, '''
+            ul.id, ul.user_id, ul.telegram_id, ul.latitude, ul.longitude,
+            ul.accuracy, ul.altitude, ul.speed, ul.heading, ul.is_at_work, ul.created_at,
+            u.first_name, u.last_name, u.username
+        ''', limit=limit, since=since, until=until)
         conn.close()
         
         if rows:
@@ -1306,21 +1704,17 @@ class Database:
     
     def get_recipient_locations(self, limit=50):
         """Получить последние местоположения всех получателей уведомлений"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         c = conn.cursor()
         
         c.execute('''
-            SELECT ul.id, ul.user_id, ul.telegram_id, ul.latitude, ul.longitude,
+            SELECT ul.location_id, ul.user_id, ul.telegram_id, ul.latitude, ul.longitude,
                    ul.accuracy, ul.altitude, ul.speed, ul.heading, ul.is_at_work, ul.created_at,
                    u.first_name, u.last_name, u.username, u.role
-            FROM user_locations ul
-            JOIN users u ON ul.user_id = u.id
-            WHERE u.role = 'recipient' AND ul.telegram_id IS NOT NULL
-            AND ul.id = (
-                SELECT MAX(ul2.id) 
-                FROM user_locations ul2 
-                WHERE ul2.telegram_id = ul.telegram_id
-            )
+            FROM users u
+            JOIN user_last_location ul ON ul.user_id = u.id
+            WHERE u.role = 'recipient' AND u.telegram_id IS NOT NULL
+            AND ul.telegram_id = u.telegram_id
             ORDER BY ul.created_at DESC
             LIMIT ?
         ''', (limit,))
@@ -0,0 +1,174 @@
+"""
+Пул долгоживущих соединений SQLite
+
+Открытие соединения и прогрев кэша страниц стоят дороже самих запросов,
+поэтому соединения не закрываются после каждого метода, а возвращаются в пул.
+Вызывающий код по-прежнему пишет conn = ...get_connection() / conn.close():
+get_connection() выдаёт на каждое взятие из пула свою обёртку (ConnectionLease),
+её close() откатывает незавершённую транзакцию и кладёт соединение обратно,
+а не закрывает его. Повторный close() той же обёртки (например, в except и в
+finally) ничего не делает, даже если соединение уже выдано другому потоку.
+"""
+
+import logging
+import os
+import queue
+import sqlite3
+import threading
+
+from config.settings import config
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionLease:
+    """Соединение SQLite, выданное из пула: close() возвращает его в пул ровно один раз"""
+
+    __slots__ = ('_conn', '_pool', '_lock')
+
+    def __init__(self, conn, pool):
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _connection(self):
+        conn = self._conn
+        if conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return conn
+
+    def __getattr__(self, name):
+        return getattr(self._connection(), name)
+
+    def __setattr__(self, name, value):
+        # row_factory, isolation_level и т.п. — настройки самого соединения
+        setattr(self._connection(), name, value)
+
+    def __enter__(self):
+        self._connection().__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._connection().__exit__(*exc_info)
+
+    def close(self):
+        with self._lock:
+            conn = self._conn
+            object.__setattr__(self, '_conn', None)
+        if conn is not None:
+            self._pool.release(conn)
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений SQLite с WAL и настроенными PRAGMA"""
+
+    def __init__(self, db_path, max_size=8, busy_timeout_ms=5000, cache_size_kb=8192,
+                 mmap_size_mb=64, statement_cache_size=256):
+        self.db_path = db_path
+        self.max_size = max(1, int(max_size))
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self.cache_size_kb = int(cache_size_kb)
+        self.mmap_size_mb = int(mmap_size_mb)
+        # sqlite3 кэширует подготовленные выражения на уровне соединения,
+        # поэтому с долгоживущими соединениями повторные запросы не компилируются заново
+        self.statement_cache_size = int(statement_cache_size)
+        self._idle = queue.LifoQueue(maxsize=self.max_size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0}
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000.0,
+            check_same_thread=False,  # соединение переходит между потоками, но используется одним за раз
+            cached_statements=self.statement_cache_size,
+        )
+        c = conn.cursor()
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA synchronous=NORMAL")
+        c.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        c.execute(f"PRAGMA cache_size=-{self.cache_size_kb}")
+        c.execute("PRAGMA temp_store=MEMORY")
+        if self.mmap_size_mb > 0:
+            c.execute(f"PRAGMA mmap_size={self.mmap_size_mb * 1024 * 1024}")
+        c.close()
+        with self._lock:
+            self.stats['created'] += 1
+        return conn
+
+    def get_connection(self):
+        """Взять соединение из пула (или открыть новое, если свободных нет)"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            return ConnectionLease(self._open(), self)
+        with self._lock:
+            self.stats['reused'] += 1
+        return ConnectionLease(conn, self)
+
+    def release(self, conn):
+        """Вернуть соединение в пул (вызывается из ConnectionLease.close())"""
+        try:
+            if conn.in_transaction:
+                # Незакоммиченные изменения не должны «перетечь» к следующему пользователю
+                conn.rollback()
+        except sqlite3.Error as e:
+            logger.warning(f"DB_POOL: соединение повреждено, закрываем: {e}")
+            conn.close()
+            return
+        if self._closed:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            with self._lock:
+                self.stats['discarded'] += 1
+            conn.close()
+
+    def close_all(self):
+        """Закрыть все простаивающие соединения (при остановке процесса или после fork)"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+
+    def reset(self):
+        """Сбросить пул: закрыть соединения и снова разрешить выдачу новых"""
+        self.close_all()
+        self._closed = False
+
+
+# Пулы разделяются всеми экземплярами Database, открытыми на один и тот же файл
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path):
+    """Получить общий пул соединений для файла базы данных"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(
+                db_path,
+                max_size=config.DB_POOL_SIZE,
+                busy_timeout_ms=config.DB_BUSY_TIMEOUT_MS,
+                cache_size_kb=config.DB_CACHE_SIZE_KB,
+                mmap_size_mb=config.DB_MMAP_SIZE_MB,
+                statement_cache_size=config.DB_STATEMENT_CACHE_SIZE,
+            )
+            _pools[key] = pool
+        return pool
+
+
+def reset_all_pools():
+    """Закрыть соединения всех пулов (например, в дочернем процессе после fork)"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.reset()
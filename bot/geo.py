@@ -0,0 +1,208 @@
+"""
+Геометрические ядра: расстояния и попадание точек в зоны
+
+Один модуль вместо копий формулы гаверсинуса по проекту. Скалярные функции
+для одиночных вызовов, пакетные — для массивов точек и зон (приём пачки
+точек, пересчёт статусов, аналитика треков).
+
+Если установлен numpy, пакетные функции считают векторно и возвращают
+ndarray; без него — те же формулы в цикле и обычные списки. numpy не
+обязательная зависимость.
+
+Быстрый путь: для проверки радиуса сначала считается равнопромежуточная
+(equirectangular) аппроксимация, а точный гаверсинус — только для точек у
+границы зоны, где аппроксимация могла ошибиться.
+"""
+
+import math
+
+try:
+    import numpy as np
+except ImportError:  # без numpy пакетные функции считают в цикле
+    np = None
+
+EARTH_RADIUS_M = 6371000  # Радиус Земли в метрах
+
+# Относительная погрешность equirectangular на расстояниях до десятков км
+# заметно меньше 1%; точки в этой полосе у границы перепроверяем гаверсинусом
+FAST_PATH_MARGIN = 0.01
+FAST_PATH_MARGIN_M = 1.0
+
+# Погрешность точки, для которой устройство её не передало (м):
+# общая для фильтра трека и геозон
+DEFAULT_ACCURACY_M = 30.0
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Расстояние между двумя точками по формуле гаверсинуса
+    Возвращает расстояние в метрах
+    """
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    delta_lat = math.radians(lat2 - lat1)
+    delta_lon = math.radians(lon2 - lon1)
+
+    a = (math.sin(delta_lat / 2) ** 2 +
+         math.cos(lat1_rad) * math.cos(lat2_rad) *
+         math.sin(delta_lon / 2) ** 2)
+
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return EARTH_RADIUS_M * c
+
+
+def equirectangular(lat1, lon1, lat2, lon2):
+    """Быстрая оценка расстояния в метрах (точна на городских расстояниях)"""
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_M * math.sqrt(x * x + y * y)
+
+
+def is_within(lat, lon, center_lat, center_lon, radius_m):
+    """Точка в круге радиуса radius_m (быстрый путь + гаверсинус у границы)"""
+    approx = equirectangular(lat, lon, center_lat, center_lon)
+    if abs(approx - radius_m) > radius_m * FAST_PATH_MARGIN + FAST_PATH_MARGIN_M:
+        return approx <= radius_m
+    return haversine(lat, lon, center_lat, center_lon) <= radius_m
+
+
+# ---------- пакетные функции ----------
+
+def _as_arrays(*values):
+    return [np.asarray(v, dtype=float) for v in values]
+
+
+def haversine_many(lats, lons, lat2, lon2):
+    """
+    Расстояния от массива точек до точки (или попарно до массива точек той же длины)
+
+    Returns:
+        ndarray или list: метры для каждой точки
+    """
+    if np is None:
+        if isinstance(lat2, (int, float)):
+            return [haversine(a, b, lat2, lon2) for a, b in zip(lats, lons)]
+        return [haversine(a, b, c, d) for a, b, c, d in zip(lats, lons, lat2, lon2)]
+    lat1, lon1, lat2, lon2 = _as_arrays(lats, lons, lat2, lon2)
+    lat1_rad, lat2_rad = np.radians(lat1), np.radians(lat2)
+    a = (np.sin((lat2_rad - lat1_rad) / 2) ** 2 +
+         np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(np.radians(lon2 - lon1) / 2) ** 2)
+    return EARTH_RADIUS_M * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def equirectangular_many(lats, lons, lat2, lon2):
+    """То же, что haversine_many, в равнопромежуточной аппроксимации"""
+    if np is None:
+        if isinstance(lat2, (int, float)):
+            return [equirectangular(a, b, lat2, lon2) for a, b in zip(lats, lons)]
+        return [equirectangular(a, b, c, d) for a, b, c, d in zip(lats, lons, lat2, lon2)]
+    lat1, lon1, lat2, lon2 = _as_arrays(lats, lons, lat2, lon2)
+    x = np.radians(lon2 - lon1) * np.cos(np.radians((lat1 + lat2) / 2))
+    y = np.radians(lat2 - lat1)
+    return EARTH_RADIUS_M * np.hypot(x, y)
+
+
+def distance_matrix(lats, lons, zone_lats, zone_lons, fast=False):
+    """
+    Матрица расстояний N точек x M центров
+
+    Returns:
+        ndarray (N, M) или список строк
+    """
+    if np is None:
+        func = equirectangular if fast else haversine
+        return [[func(a, b, c, d) for c, d in zip(zone_lats, zone_lons)] for a, b in zip(lats, lons)]
+    lat1, lon1, lat2, lon2 = _as_arrays(lats, lons, zone_lats, zone_lons)
+    lat1, lon1 = lat1[:, None], lon1[:, None]
+    kernel = equirectangular_many if fast else haversine_many
+    return kernel(lat1, lon1, lat2[None, :], lon2[None, :])
+
+
+def within_radius(lats, lons, center_lats, center_lons, radii):
+    """
+    Попарная проверка: i-я точка в i-м круге (или все точки в одном круге)
+
+    Returns:
+        ndarray bool или list
+    """
+    if np is None:
+        if isinstance(center_lats, (int, float)):
+            return [is_within(a, b, center_lats, center_lons, radii) for a, b in zip(lats, lons)]
+        return [is_within(a, b, c, d, r) for a, b, c, d, r in zip(lats, lons, center_lats, center_lons, radii)]
+    lat1, lon1, lat2, lon2, radii = _as_arrays(lats, lons, center_lats, center_lons, radii)
+    return _within(lat1, lon1, lat2, lon2, radii)
+
+
+def _within(lat1, lon1, lat2, lon2, radii):
+    """Векторная проверка радиуса с перепроверкой пограничных точек гаверсинусом"""
+    approx = equirectangular_many(lat1, lon1, lat2, lon2)
+    result = approx <= radii
+    border = np.abs(approx - radii) <= radii * FAST_PATH_MARGIN + FAST_PATH_MARGIN_M
+    if border.any():
+        shape = np.broadcast(lat1, lon1, lat2, lon2, radii).shape
+        b = [np.broadcast_to(v, shape)[border] for v in (lat1, lon1, lat2, lon2, radii)]
+        result[border] = haversine_many(b[0], b[1], b[2], b[3]) <= b[4]
+    return result
+
+
+def points_in_zones(lats, lons, zones):
+    """
+    Матрица попаданий N точек x M зон; zones — [(lat, lon, радиус_м), ...]
+
+    Returns:
+        ndarray bool (N, M) или список строк
+    """
+    if np is None:
+        return [[is_within(a, b, z[0], z[1], z[2]) for z in zones] for a, b in zip(lats, lons)]
+    lat1, lon1 = _as_arrays(lats, lons)
+    zones = np.asarray(zones, dtype=float).reshape(-1, 3)
+    return _within(lat1[:, None], lon1[:, None], zones[None, :, 0], zones[None, :, 1], zones[None, :, 2])
+
+
+def is_at_work_batch(lats, lons, zones, zone_index=None):
+    """
+    Статус "в работе" для пачки точек
+
+    Args:
+        zones: [(lat, lon, радиус_м) или None, ...] — рабочие зоны; None — зона не задана
+        zone_index: для каждой точки номер её зоны (-1 — зоны нет, например получатель);
+                    без него точка "в работе", если попадает хотя бы в одну зону
+
+    Returns:
+        list[bool]
+    """
+    valid = [i for i, z in enumerate(zones)
+             if z is not None and z[0] is not None and z[1] is not None and z[2] is not None]
+    if zone_index is None:
+        if not valid or not len(lats):
+            return [False] * len(lats)
+        hits = points_in_zones(lats, lons, [zones[i] for i in valid])
+        if np is None:
+            return [any(row) for row in hits]
+        return hits.any(axis=1).tolist()
+
+    if np is not None:
+        result = np.zeros(len(lats), dtype=bool)
+        if not valid:
+            return result.tolist()
+        table = np.full((len(zones), 3), np.nan)
+        table[valid] = [zones[i] for i in valid]
+        index = np.asarray(zone_index, dtype=int)
+        mask = index >= 0
+        mask[mask] = ~np.isnan(table[index[mask], 0])
+        z = table[index[mask]]
+        lat1, lon1 = _as_arrays(lats, lons)
+        result[mask] = _within(lat1[mask], lon1[mask], z[:, 0], z[:, 1], z[:, 2])
+        return result.tolist()
+
+    valid = set(valid)
+    pairs = [(p, zone_index[p]) for p in range(len(lats)) if zone_index[p] in valid]
+    result = [False] * len(lats)
+    if not pairs:
+        return result
+    hits = within_radius([lats[p] for p, _ in pairs], [lons[p] for p, _ in pairs],
+                         [zones[z][0] for _, z in pairs], [zones[z][1] for _, z in pairs],
+                         [zones[z][2] for _, z in pairs])
+    for (p, _z), hit in zip(pairs, hits):
+        result[p] = bool(hit)
+    return result
@@ -0,0 +1,219 @@
+"""
+Геозоны с гистерезисом и временем пребывания
+
+Сырой флаг "точка внутри радиуса" на границе зоны дребезжит: GPS-шум в
+десятки метров даёт цепочку въезд/выезд/въезд, а монитор на каждый переход
+пишет состояние и упирается в антиспам. GeofenceEngine решает по каждому
+водителю отдельно:
+
+- въезд засчитывается, только если точка внутри зоны с учётом погрешности
+  (расстояние до границы + ACCURACY_WEIGHT * accuracy <= 0), выезд — только
+  если точка дальше границы на exit_margin_m с учётом погрешности; между ними
+  полоса гистерезиса, в которой состояние не меняется;
+- новое состояние должно продержаться enter_dwell_sec / exit_dwell_sec
+  (по времени точек), иначе кандидат сбрасывается;
+- точки с погрешностью больше max_accuracy_m не участвуют.
+
+Движок подтверждает переходы сам, поэтому в user_locations пишется уже
+устойчивый is_at_work и zone_id, а монитор бота (bot/main.py) уведомляет по
+их смене без своих правил подтверждения. Состояние водителя живёт в памяти
+процесса и сверяется с user_last_location: если последнюю точку водителя
+записал другой процесс, подтверждённое состояние берётся оттуда.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from config.settings import config
+from bot.geo import DEFAULT_ACCURACY_M
+from bot.transitions import ARRIVAL, DEPARTURE, parse_created_at
+from bot.zones import PROFILE_ZONE_ID, profile_zone
+
+logger = logging.getLogger(__name__)
+
+# Доля погрешности (accuracy, м), на которую точка "сдвигается" в худшую сторону
+ACCURACY_WEIGHT = 0.5
+
+_NO_PENDING = object()
+
+
+class GeofenceState:
+    """Подтверждённая зона водителя и кандидат на смену"""
+
+    __slots__ = ('zone', 'pending', 'pending_since', 'last_ts', 'seen')
+
+    def __init__(self, zone=None, seen=None):
+        self.zone = zone                # подтверждённая зона (None — вне зон)
+        self.pending = _NO_PENDING      # кандидат: зона или None (выезд)
+        self.pending_since = None
+        self.last_ts = None
+        self.seen = seen                # created_at последней учтённой точки
+
+
+class GeofenceEngine:
+    """Машина состояний геозон по водителям; zone_index — bot.zones.ZoneIndex или None (только зона профиля)"""
+
+    def __init__(self, zone_index=None, enter_dwell_sec=15, exit_dwell_sec=30, exit_margin_m=30,
+                 max_accuracy_m=150, accuracy_weight=ACCURACY_WEIGHT, seed=None):
+        self.zone_index = zone_index
+        self.enter_dwell_sec = float(enter_dwell_sec)
+        self.exit_dwell_sec = float(exit_dwell_sec)
+        self.exit_margin_m = float(exit_margin_m)
+        self.max_accuracy_m = float(max_accuracy_m)
+        self.accuracy_weight = float(accuracy_weight)
+        # seed(user_id) -> (is_at_work, zone_id, created_at) последней записанной точки или None
+        self.seed = seed
+        self._states = {}
+        self._lock = threading.Lock()
+        self.stats = {'points': 0, 'ignored_accuracy': 0, 'hysteresis_holds': 0,
+                      'dwell_resets': 0, 'transitions': 0, 'reseeded': 0}
+
+    # ---------- зоны ----------
+
+    def _zone(self, user_info, zone_id):
+        if zone_id == PROFILE_ZONE_ID:
+            return profile_zone(user_info)
+        return self.zone_index.get(zone_id) if self.zone_index is not None else None
+
+    def _entered_zone(self, user_info, lat, lon, accuracy):
+        """Самая маленькая зона, в которой точка уверенно (с учётом погрешности)"""
+        candidates = list(self.zone_index.candidates(user_info.get('id'), lat, lon)) if self.zone_index else []
+        zone = profile_zone(user_info)
+        if zone is not None:
+            candidates.append(zone)
+        margin = self.accuracy_weight * accuracy
+        best = None
+        for zone in candidates:
+            if zone.signed_distance(lat, lon) + margin <= 0 and (best is None or zone.area < best.area):
+                best = zone
+        return best
+
+    def _observe(self, user_info, state, lat, lon, accuracy):
+        """Какое состояние подтверждает точка: зона, None (вне зон) или текущее (полоса гистерезиса)"""
+        if state.zone is not None:
+            current = self._zone(user_info, state.zone)
+            if current is not None:
+                distance = current.signed_distance(lat, lon)
+                if distance - self.accuracy_weight * accuracy <= self.exit_margin_m:
+                    # Не вышли уверенно: остаёмся, даже если точка формально за границей
+                    if distance > 0:
+                        self.stats['hysteresis_holds'] += 1
+                    entered = self._entered_zone(user_info, lat, lon, accuracy)
+                    # Переезд во вложенную/соседнюю зону засчитываем только при уверенном въезде
+                    if entered is not None and entered.id != state.zone and entered.area < current.area:
+                        return entered.id
+                    return state.zone
+        entered = self._entered_zone(user_info, lat, lon, accuracy)
+        return entered.id if entered is not None else None
+
+    # ---------- состояние ----------
+
+    def _state(self, user_id, seeded):
+        state = self._states.get(user_id)
+        if seeded is not None:
+            is_at_work, zone_id, seen = seeded
+            if is_at_work and zone_id is None:
+                zone_id = PROFILE_ZONE_ID   # точки до появления зон
+            zone_id = zone_id if is_at_work else None
+            # Последнюю точку записал другой процесс (или состояние ещё не заведено)
+            if state is None or (seen and (state.seen is None or seen > state.seen)):
+                if state is not None:
+                    self.stats['reseeded'] += 1
+                state = self._states[user_id] = GeofenceState(zone_id, seen)
+        if state is None:
+            state = self._states[user_id] = GeofenceState()
+        return state
+
+    def update(self, user_info, lat, lon, accuracy=None, ts=None, created_at=None):
+        """
+        Учесть точку водителя
+
+        Args:
+            ts: время точки (timestamp); по умолчанию created_at или текущее время
+            created_at: created_at точки в формате SQLite — для сверки с user_last_location
+
+        Returns:
+            dict: {'is_at_work', 'zone_id', 'transitions', 'ignored'}; transitions —
+            [(ARRIVAL | DEPARTURE, zone_id), ...] подтверждённые этой точкой
+        """
+        if user_info.get('role') == 'recipient':
+            return {'is_at_work': False, 'zone_id': None, 'transitions': [], 'ignored': False}
+        if ts is None:
+            ts = (parse_created_at(created_at) if created_at else None) or time.time()
+        lat, lon = float(lat), float(lon)
+        accuracy = float(accuracy) if accuracy is not None else DEFAULT_ACCURACY_M
+        # Чтение базы — вне блокировки, чтобы не выстраивать в очередь точки других водителей
+        seeded = self.seed(user_info.get('id')) if self.seed is not None else None
+        with self._lock:
+            self.stats['points'] += 1
+            state = self._state(user_info.get('id'), seeded)
+            transitions = []
+            ignored = accuracy > self.max_accuracy_m
+            if ignored:
+                self.stats['ignored_accuracy'] += 1
+            else:
+                observed = self._observe(user_info, state, lat, lon, accuracy)
+                if observed == state.zone:
+                    if state.pending is not _NO_PENDING:
+                        self.stats['dwell_resets'] += 1
+                    state.pending, state.pending_since = _NO_PENDING, None
+                else:
+                    if state.pending is _NO_PENDING or state.pending != observed:
+                        state.pending, state.pending_since = observed, ts
+                    dwell = self.enter_dwell_sec if observed is not None else self.exit_dwell_sec
+                    if ts - state.pending_since >= dwell:
+                        if state.zone is not None:
+                            transitions.append((DEPARTURE, state.zone))
+                        if observed is not None:
+                            transitions.append((ARRIVAL, observed))
+                        state.zone = observed
+                        state.pending, state.pending_since = _NO_PENDING, None
+                        self.stats['transitions'] += 1
+            state.last_ts = ts
+            if created_at:
+                state.seen = created_at
+            return {'is_at_work': state.zone is not None, 'zone_id': state.zone,
+                    'transitions': transitions, 'ignored': ignored}
+
+    def forget(self, user_id):
+        with self._lock:
+            self._states.pop(user_id, None)
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['drivers'] = len(self._states)
+            stats['pending'] = sum(1 for s in self._states.values() if s.pending is not _NO_PENDING)
+        return stats
+
+
+def create_geofence_engine(zone_index=None, seed=None):
+    return GeofenceEngine(
+        zone_index,
+        enter_dwell_sec=config.GEOFENCE_ENTER_DWELL_SEC,
+        exit_dwell_sec=config.GEOFENCE_EXIT_DWELL_SEC,
+        exit_margin_m=config.GEOFENCE_EXIT_MARGIN_M,
+        max_accuracy_m=config.GEOFENCE_MAX_ACCURACY_M,
+        accuracy_weight=config.GEOFENCE_ACCURACY_WEIGHT,
+        seed=seed,
+    )
+
+
+# Движки разделяются всеми экземплярами Database, открытыми на один и тот же файл
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_geofence_engine(db_path, zone_index=None, seed=None):
+    """Получить общий движок геозон для файла базы данных"""
+    key = os.path.abspath(db_path)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = _engines[key] = create_geofence_engine(zone_index, seed)
+        return engine
@@ -0,0 +1,231 @@
+"""
+Отложенная пакетная запись точек местоположения (write-behind)
+
+/api/location считает геозону в памяти, кладёт точку в очередь и сразу
+отвечает устройству. Фоновый поток забирает точки пачками и пишет их одной
+транзакцией через Database.add_locations_batch: один коммит (и один fsync
+WAL) на пачку вместо коммита на каждую точку.
+
+Очередь ограничена. Если она заполнена, поток запроса ждёт место в очереди
+до put_timeout_ms — это и есть обратное давление, оно считается в метриках.
+Если места так и нет, поток запроса под блокировкой записи сам дописывает
+очередь и затем свою точку: точки одного водителя попадают в базу в порядке
+приёма, и переходы геозон не видят более новую точку раньше старой.
+
+Ошибка записи пачки (например, database is locked) не теряет её целиком:
+пачка повторяется один раз, затем точки пишутся по одной, и потерянными
+считаются только те, что не записались.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from config.settings import config
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повтором пачки после ошибки записи
+RETRY_DELAY_SEC = 0.1
+
+
+class LocationIngest:
+    """Очередь точек с фоновым групповым коммитом"""
+
+    def __init__(self, database, max_queue=10000, batch_size=200, max_latency_ms=250, enabled=True,
+                 put_timeout_ms=1000):
+        self.database = database
+        self.batch_size = max(1, int(batch_size))
+        self.max_latency = max(0, int(max_latency_ms)) / 1000.0
+        self.put_timeout = max(0, int(put_timeout_ms)) / 1000.0
+        self.enabled = enabled
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._lock = threading.Lock()
+        # Держит фоновый поток от выборки пачки до её записи и поток запроса при синхронной записи
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self.stats = {
+            'enqueued': 0,
+            'written': 0,
+            'batches': 0,
+            'sync_writes': 0,       # запись в потоке запроса (очередь полна или ingest выключен)
+            'blocked_puts': 0,      # ожидание места в заполненной очереди
+            'retries': 0,           # повторы пачки после ошибки записи
+            'dropped': 0,           # точки, которые не удалось записать
+            'max_queue_depth': 0,
+            'max_batch': 0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+            'max_wait_ms': 0.0,     # от приёма точки до коммита
+        }
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='location-ingest', daemon=True)
+            self._thread.start()
+
+    def submit(self, point):
+        """
+        Принять точку (см. Database.make_location_point)
+
+        Returns:
+            bool: True — точка принята (в очередь или записана синхронно)
+        """
+        entry = (time.monotonic(), point)
+        if self.enabled and not self._stopping:
+            self._ensure_thread()
+            try:
+                try:
+                    self._queue.put_nowait(entry)
+                except queue.Full:
+                    with self._lock:
+                        self.stats['blocked_puts'] += 1
+                    self._queue.put(entry, timeout=self.put_timeout)
+                with self._lock:
+                    self.stats['enqueued'] += 1
+                    depth = self._queue.qsize()
+                    if depth > self.stats['max_queue_depth']:
+                        self.stats['max_queue_depth'] = depth
+                return True
+            except queue.Full:
+                logger.warning("⚠️ INGEST: очередь заполнена, дописываем её и точку синхронно")
+        with self._lock:
+            self.stats['sync_writes'] += 1
+        with self._write_lock:
+            # Сначала более старые точки из очереди, затем эта: порядок по водителю сохраняется
+            pending = self._drain()
+            if pending:
+                self._write(pending)
+                for _ in pending:
+                    self._queue.task_done()
+            return self._write([entry]) == 0
+
+    def _drain(self):
+        entries = []
+        while True:
+            try:
+                entries.append(self._queue.get_nowait())
+            except queue.Empty:
+                return entries
+
+    def _collect_batch(self):
+        """Дождаться первой точки, затем добрать пачку до batch_size или до max_latency"""
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first[0] + self.max_latency
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        """Записать пачку: повтор после ошибки, затем по одной точке. Возвращает число потерянных точек"""
+        started = time.monotonic()
+        points = [point for _, point in batch]
+        failed = 0
+        try:
+            self.database.add_locations_batch(points)
+        except Exception as e:
+            logger.warning(f"⚠️ INGEST: ошибка записи пачки из {len(batch)} точек, повторяем: {e}")
+            with self._lock:
+                self.stats['retries'] += 1
+            time.sleep(RETRY_DELAY_SEC)
+            try:
+                self.database.add_locations_batch(points)
+            except Exception as e:
+                logger.error(f"❌ INGEST: повтор пачки не удался, пишем точки по одной: {e}")
+                for point in points:
+                    try:
+                        self.database.add_locations_batch([point])
+                    except Exception as e:
+                        failed += 1
+                        logger.error(f"❌ INGEST: точка водителя {point.get('telegram_id')} не записана: {e}")
+        finished = time.monotonic()
+        flush_ms = (finished - started) * 1000
+        wait_ms = (finished - batch[0][0]) * 1000
+        with self._lock:
+            self.stats['written'] += len(batch) - failed
+            self.stats['dropped'] += failed
+            self.stats['batches'] += 1
+            self.stats['total_flush_ms'] += flush_ms
+            self.stats['max_flush_ms'] = max(self.stats['max_flush_ms'], flush_ms)
+            self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], wait_ms)
+            self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+        return failed
+
+    def _run(self):
+        logger.info("🚀 INGEST: фоновая запись точек запущена")
+        while True:
+            with self._write_lock:
+                batch = self._collect_batch()
+                if batch:
+                    self._write(batch)
+                    for _ in batch:
+                        self._queue.task_done()
+            if not batch and self._stopping:
+                break
+
+    def flush(self):
+        """Дождаться записи всех принятых точек"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def stop(self):
+        """Дописать очередь и остановить фоновый поток"""
+        self._stopping = True
+        self.flush()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+        self._thread = None
+
+    def reset_after_fork(self):
+        """В дочернем процессе поток родителя не существует — начинаем с пустой очереди"""
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['queue_capacity'] = self._queue.maxsize
+        stats['avg_flush_ms'] = round(stats['total_flush_ms'] / stats['batches'], 3) if stats['batches'] else 0.0
+        return stats
+
+
+def _create_ingest():
+    from bot.database import db
+    ingest = LocationIngest(
+        db,
+        max_queue=config.INGEST_QUEUE_SIZE,
+        batch_size=config.INGEST_BATCH_SIZE,
+        max_latency_ms=config.INGEST_MAX_LATENCY_MS,
+        enabled=config.INGEST_ASYNC,
+        put_timeout_ms=config.INGEST_PUT_TIMEOUT_MS,
+    )
+    atexit.register(ingest.stop)
+    return ingest
+
+
+# Глобальный экземпляр очереди записи
+location_ingest = _create_ingest()
@@ -0,0 +1,129 @@
+"""
+Шина событий о новых точках местоположения
+
+add_user_location публикует событие сразу после коммита. Подписчики в том же
+процессе получают его напрямую (callback), а в другие процессы (веб → бот)
+оно уходит датаграммой через локальный unix-сокет. Потеря датаграммы не
+критична: монитор бота раз в LOCATION_EVENTS_SWEEP_SEC досматривает новые
+строки user_locations по id.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+
+from config.settings import config
+
+logger = logging.getLogger(__name__)
+
+
+def make_location_event(location_id, user_id, telegram_id, is_at_work, created_at, role=None, zone_id=None):
+    """Сформировать событие о новой точке (zone_id — зона из bot/zones.py)"""
+    return {
+        'id': location_id,
+        'user_id': user_id,
+        'telegram_id': telegram_id,
+        'is_at_work': 1 if is_at_work else 0,
+        'created_at': created_at,
+        'role': role,
+        'zone_id': zone_id,
+    }
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, bus, callback):
+        self.bus = bus
+        self.callback = callback
+
+    def datagram_received(self, data, addr):
+        try:
+            event = json.loads(data.decode('utf-8'))
+        except Exception as e:
+            logger.warning(f"⚠️ LOCATION_EVENTS: некорректная датаграмма: {e}")
+            return
+        self.bus.stats['received_socket'] += 1
+        self.callback(event)
+
+
+class LocationEventBus:
+    """Публикация событий о точках подписчикам процесса и в локальный сокет"""
+
+    def __init__(self, socket_path=None):
+        self.socket_path = socket_path if hasattr(socket, 'AF_UNIX') else None
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._sock = None
+        self._listening = False
+        self.stats = {'published': 0, 'sent_socket': 0, 'socket_errors': 0, 'received_socket': 0}
+
+    def subscribe(self, callback):
+        """Подписаться на события этого процесса"""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def publish(self, event):
+        """Отправить событие подписчикам и (если слушатель в другом процессе) в сокет"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.stats['published'] += 1
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error(f"❌ LOCATION_EVENTS: ошибка подписчика: {e}")
+        if self.socket_path and not self._listening:
+            self._send(event)
+
+    def _send(self, event):
+        try:
+            if self._sock is None:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                sock.setblocking(False)
+                self._sock = sock
+            self._sock.sendto(json.dumps(event).encode('utf-8'), self.socket_path)
+            self.stats['sent_socket'] += 1
+        except OSError:
+            # Бот не запущен или очередь сокета переполнена — событие подберёт досмотр по id
+            self.stats['socket_errors'] += 1
+
+    async def start_listener(self, callback):
+        """Начать приём событий из других процессов. Возвращает transport или None"""
+        if not self.socket_path:
+            return None
+        loop = asyncio.get_running_loop()
+        try:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(self.socket_path)
+            transport, _protocol = await loop.create_datagram_endpoint(
+                lambda: _DatagramProtocol(self, callback), sock=sock
+            )
+        except OSError as e:
+            logger.warning(f"⚠️ LOCATION_EVENTS: не удалось открыть сокет {self.socket_path}: {e}")
+            return None
+        self._listening = True
+        logger.info(f"📡 LOCATION_EVENTS: слушаем {self.socket_path}")
+        return transport
+
+    def stop_listener(self, transport):
+        if transport is None:
+            return
+        transport.close()
+        self._listening = False
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+
+# Глобальный экземпляр шины
+location_events = LocationEventBus(config.LOCATION_EVENTS_SOCKET)
@@ -4,7 +4,6 @@ import contextlib
 import os
 import sys
 import time
-import sqlite3
 
 # Добавляем путь к корневой директории проекта
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -18,21 +17,15 @@ from bot.handlers import (
 )
 from bot.database import db
 from bot.utils import create_work_notification
-from bot.state import (
-    load_last_checked_id, save_last_checked_id, 
-    load_last_checked_time, save_last_checked_time, 
-    load_last_notification_type, save_last_notification_type,
-    can_send_notification, save_last_arrival_time, save_last_departure_time
-)
+from bot.state import state_store, can_send_notification
 from bot.notification_system import notification_system
+from bot.location_events import location_events
+from bot.retention import create_compactor
+from bot.travel_model import TravelModelTrainer
+from bot.transitions import TransitionDetector, ARRIVAL, DEPARTURE, MIN_NOTIFY_INTERVAL_SEC
+from bot.zones import ZoneTransitionTracker, PROFILE_ZONE_ID, record_transitions
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-LAST_ID_FILE = os.path.join(BASE_DIR, "last_checked_id.txt")  # Теперь файл будет рядом с bot/main.py
-LAST_TIME_FILE = os.path.join(BASE_DIR, "last_checked_time.txt")  # новый файл для времени последнего выхода
-
-
-
-# Удаляю определения функций load_last_checked_id, save_last_checked_id, load_last_checked_time, save_last_checked_time
 
 # Настройка логирования
 logging.basicConfig(
@@ -44,327 +37,216 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-async def monitor_database(application: Application):
-    # Переходим на помпо-пользовательскую детекцию переходов
-    # Используем в памяти последние проверенные ID/время/тип на пользователя
-    per_user_last_checked_id = {}
-    per_user_last_checked_time = {}
-    per_user_last_notification_type = {}
-    logger.info("🚀 Мониторинг базы данных запущен (персональная детекция по пользователям)")
+# Параметры уведомлений по типу перехода: (подпись для логов, текст, сохранение времени)
+TRANSITION_LABELS = {
+    (ARRIVAL, False): 'Прибытие',
+    (ARRIVAL, True): 'Прибытие (быстрый переход)',
+    (DEPARTURE, False): 'Выезд',
+    (DEPARTURE, True): 'Выезд (быстрый переход)',
+}
 
-    import time as t
+RECENT_LOCATIONS_QUERY = """
+    SELECT ul.id, ul.user_id, ul.telegram_id, ul.is_at_work, ul.created_at, ul.zone_id
+    FROM user_locations ul
+    JOIN users u ON ul.user_id = u.id
+    WHERE u.role IN ('driver', 'admin') AND ul.telegram_id IS NOT NULL
+"""
 
-    while True:
-        try:
-            conn = sqlite3.connect('driver.db')
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                SELECT ul.id, ul.user_id, ul.telegram_id, ul.is_at_work, ul.created_at
-                FROM user_locations ul
-                JOIN users u ON ul.user_id = u.id
-                WHERE u.role IN ('driver', 'admin') AND ul.telegram_id IS NOT NULL
-                ORDER BY ul.id DESC
-                LIMIT 200
-                """
-            )
-            rows = cursor.fetchall()
-            conn.close()
 
-            logger.info(f"📊 Мониторинг: получено {len(rows)} последних записей")
+def fetch_driver_locations(after_id=None, limit=200):
+    """Точки водителей: последние limit штук (after_id=None) или новые после after_id по возрастанию id"""
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    if after_id is None:
+        cursor.execute(RECENT_LOCATIONS_QUERY + " ORDER BY ul.id DESC LIMIT ?", (limit,))
+        rows = cursor.fetchall()[::-1]
+    else:
+        cursor.execute(RECENT_LOCATIONS_QUERY + " AND ul.id > ? ORDER BY ul.id LIMIT ?", (after_id, limit))
+        rows = cursor.fetchall()
+    conn.close()
+    return rows
 
-            # Группируем записи по telegram_id
-            from collections import defaultdict
-            by_user = defaultdict(list)
-            for row in rows:
-                rec_id, user_id, tg_id, is_at_work, created_at = row
-                by_user[tg_id].append((rec_id, user_id, is_at_work, created_at))
 
-            # Обрабатываем каждого пользователя с минимум двумя точками
-            for tg_id, entries in by_user.items():
-                if len(entries) < 2:
-                    continue
-                # Последние по времени уже в порядке DESC по id
-                (curr_id, inviter_user_id, curr_is_at_work, curr_time) = entries[0]
-                (prev_id, _prev_user_id, prev_is_at_work, prev_time) = entries[1]
-                prev2_is_at_work = entries[2][2] if len(entries) >= 3 else None
+def get_invited_recipients(inviter_user_id):
+    """telegram_id получателей, принявших приглашение водителя"""
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT u.telegram_id
+        FROM invitations i
+        JOIN users u ON u.telegram_id = i.recipient_telegram_id
+        WHERE i.inviter_id = ? AND i.status = 'accepted' AND u.telegram_id IS NOT NULL
+        """,
+        (inviter_user_id,)
+    )
+    recipients = [r[0] for r in cursor.fetchall()]
+    conn.close()
+    return recipients
 
-                try:
-                    curr_ts = t.mktime(t.strptime(curr_time, "%Y-%m-%d %H:%M:%S"))
-                    prev_ts = t.mktime(t.strptime(prev_time, "%Y-%m-%d %H:%M:%S"))
-                except Exception:
-                    # Если формат неожиданный — пропускаем пользователя
-                    continue
 
-                dt_prev_curr = curr_ts - prev_ts
+async def notify_transition(detector, tg_id, candidate, zone_name=None):
+    """Отправить уведомление о переходе. Возвращает True, если оно отправлено"""
+    kind = candidate['type']
+    label = TRANSITION_LABELS[(kind, candidate['fast'])]
+    pattern = '0→1' if kind == ARRIVAL else '1→0'
+    if candidate['fast']:
+        logger.info(f"DEBUG[{tg_id}]: обнаружен шаблон {pattern} (быстрый), подтверждаем по последним двум точкам")
+    else:
+        logger.info(f"DEBUG[{tg_id}]: переход {pattern} подтвержден (dt={candidate['dt']}s, prev2={candidate['prev2']})")
+
+    if detector.is_too_early(tg_id, candidate):
+        logger.info(f"{label}: слишком рано после последней проверки (<{MIN_NOTIFY_INTERVAL_SEC}s)")
+        return False
+    if not can_send_notification(kind, max_interval_minutes=30, telegram_id=tg_id):
+        logger.info(f"⏰ {label}: заблокировано временными ограничениями")
+        return False
+    tracking_active = db.get_tracking_status()
+    logger.info(f"📡 Отслеживание активно: {tracking_active}")
+    if not tracking_active:
+        logger.info(f"{label}: отслеживание выключено, уведомление не отправлено")
+        return False
+
+    inviter_user_id = candidate['user_id']
+    recipients = get_invited_recipients(inviter_user_id)
+    logger.info(f"👥 Получателей ({label}, по приглашениям {inviter_user_id}): {len(recipients)}")
+    if not recipients:
+        logger.warning(f"❌ {label}: нет получателей")
+        return False
+
+    system_info = {'id': None, 'telegram_id': None, 'login': 'system', 'role': 'system'}
+    notification_text = create_work_notification() if kind == ARRIVAL else "Выехали"
+    if kind == ARRIVAL and zone_name:
+        # У водителя несколько точек подачи — получателю нужно знать, какая
+        notification_text = f"{notification_text} ({zone_name})"
+    result = await notification_system.send_notification_with_confirmation(
+        notification_type='automatic',
+        sender_info=system_info,
+        recipients=recipients,
+        notification_text=notification_text,
+        custom_confirmation=True
+    )
+    if not result['success']:
+        logger.warning(f"❌ {label}[{tg_id}]: отправка не удалась")
+        return False
+
+    # Фиксируем успешную отправку только после успеха
+    detector.mark_sent(tg_id, candidate)
+    state_store.update(
+        tg_id,
+        last_checked_id=candidate['curr_id'],
+        last_checked_time=candidate['curr_ts'],
+        last_notification_type=kind,
+        **{'last_arrival_time' if kind == ARRIVAL else 'last_departure_time': candidate['curr_ts']}
+    )
+    logger.info(f"📊 АВТО[{tg_id}]: {label.lower()} — отправлено {result['sent_count']} из {result['total_recipients']}")
+    return True
 
-                def confirmed_transition(new_state: int) -> bool:
-                    if prev2_is_at_work is not None and prev2_is_at_work == new_state:
-                        return True
-                    return dt_prev_curr >= 5
 
-                last_checked_id = per_user_last_checked_id.get(tg_id, 0)
-                last_checked_time = per_user_last_checked_time.get(tg_id, 0.0)
-                last_notification_type = per_user_last_notification_type.get(tg_id)
+async def monitor_database(application: Application):
+    """
+    Детекция въезда/выезда по событиям о новых точках
+
+    Точки приходят из location_events (в процессе и через локальный сокет),
+    каждая сразу прогоняется через машину состояний водителя. Раз в
+    LOCATION_EVENTS_SWEEP_SEC новые строки досматриваются по id — на случай
+    потерянных событий и записей, сделанных в обход add_user_location, —
+    и повторно проверяются водители, чьё уведомление не удалось отправить.
+    """
+    # С гистерезисом статус в базе уже подтверждён (bot/geofence.py) — повторно не подтверждаем
+    confirm = not config.GEOFENCE_HYSTERESIS
+    detector = TransitionDetector(confirm=confirm)
+    detector.restore(state_store.drivers())
+    zones = ZoneTransitionTracker(confirm=confirm)
+    zone_transitions = []
+    pending = set()
+    events = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    sweep_interval = config.LOCATION_EVENTS_SWEEP_SEC
+
+    def on_event(event):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    location_events.subscribe(on_event)
+    listener = await location_events.start_listener(on_event)
+    logger.info("🚀 Мониторинг местоположений запущен (события + досмотр по id)")
+
+    async def process(tg_id):
+        candidate = detector.evaluate(tg_id)
+        if candidate is None:
+            pending.discard(tg_id)
+            return
+        zone_id = zones.last_zone(tg_id)
+        zone_name = db.zone_index.zone_name(zone_id) if zone_id not in (None, PROFILE_ZONE_ID) else None
+        if await notify_transition(detector, tg_id, candidate, zone_name):
+            pending.discard(tg_id)
+        else:
+            pending.add(tg_id)
 
-                # Въезд 0→1
-                if (
-                    prev_is_at_work == 0 and curr_is_at_work == 1 and
-                    curr_id != last_checked_id and
-                    last_notification_type != 'arrival' and
-                    confirmed_transition(1)
-                ):
-                    logger.info(
-                        f"DEBUG[{tg_id}]: переход 0→1 подтвержден (dt={dt_prev_curr}s, prev2={prev2_is_at_work})"
-                    )
-                    if curr_ts - last_checked_time >= 10:
-                        if can_send_notification('arrival', max_interval_minutes=30):
-                            # Проверяем статус отслеживания
-                            conn = sqlite3.connect('driver.db')
-                            cursor = conn.cursor()
-                            cursor.execute('SELECT is_active FROM tracking_status WHERE id = 1')
-                            result = cursor.fetchone()
-                            tracking_active = result[0] if result else False
-                            conn.close()
-                            logger.info(f"📡 Отслеживание активно: {tracking_active}")
-                            if tracking_active:
-                                conn = sqlite3.connect('driver.db')
-                                cursor = conn.cursor()
-                                cursor.execute(
-                                    """
-                                    SELECT u.telegram_id
-                                    FROM invitations i
-                                    JOIN users u ON u.telegram_id = i.recipient_telegram_id
-                                    WHERE i.inviter_id = ? AND i.status = 'accepted' AND u.telegram_id IS NOT NULL
-                                    """,
-                                    (inviter_user_id,)
-                                )
-                                recipients = [r[0] for r in cursor.fetchall()]
-                                conn.close()
-                                logger.info(f"👥 Получателей (по приглашениям {inviter_user_id}): {len(recipients)}")
-                                if recipients:
-                                    system_info = {'id': None, 'telegram_id': None, 'login': 'system', 'role': 'system'}
-                                    result = await notification_system.send_notification_with_confirmation(
-                                        notification_type='automatic',
-                                        sender_info=system_info,
-                                        recipients=recipients,
-                                        notification_text=create_work_notification(),
-                                        custom_confirmation=True
-                                    )
-                                    if result['success']:
-                                        # Фиксируем успешную отправку только после успеха
-                                        per_user_last_checked_id[tg_id] = curr_id
-                                        per_user_last_checked_time[tg_id] = curr_ts
-                                        per_user_last_notification_type[tg_id] = 'arrival'
-                                        save_last_arrival_time(curr_ts)
-                                        logger.info(
-                                            f"📊 АВТО[{tg_id}]: прибытие — отправлено {result['sent_count']} из {result['total_recipients']}"
-                                        )
-                                    else:
-                                        logger.warning(f"❌ Прибытие[{tg_id}]: отправка не удалась")
-                                else:
-                                    logger.warning("❌ Прибытие: нет получателей")
-                            else:
-                                logger.info("Прибытие: отслеживание выключено, уведомление не отправлено")
-                        else:
-                            logger.info("⏰ Прибытие: заблокировано временными ограничениями")
-                    else:
-                        logger.info("Прибытие: слишком рано после последней проверки (<10s)")
+    def add_rows(rows):
+        touched = []
+        for rec_id, user_id, tg_id, is_at_work, created_at, zone_id in rows:
+            zone_transitions.extend(zones.add_point(tg_id, rec_id, user_id, zone_id, created_at))
+            if detector.add_point(tg_id, rec_id, user_id, is_at_work, created_at):
+                touched.append(tg_id)
+        return list(dict.fromkeys(touched))
 
-                # Дополнительное подтверждение прибытия при быстром переходе:
-                # Если последние две точки уже 1, а третья с конца была 0, значит переход 0→1 состоялся слишком быстро (<5s)
-                # и мог быть пропущен. В таком случае отправляем прибытие сейчас (однократно).
-                if (
-                    prev_is_at_work == 1 and curr_is_at_work == 1 and
-                    prev2_is_at_work == 0 and
-                    curr_id != last_checked_id and
-                    last_notification_type != 'arrival'
-                ):
-                    logger.info(f"DEBUG[{tg_id}]: обнаружен шаблон 0→1 (быстрый), подтверждаем прибытие по последним двум точкам 1→1")
-                    if curr_ts - last_checked_time >= 10:
-                        if can_send_notification('arrival', max_interval_minutes=30):
-                            # Проверяем статус отслеживания
-                            conn = sqlite3.connect('driver.db')
-                            cursor = conn.cursor()
-                            cursor.execute('SELECT is_active FROM tracking_status WHERE id = 1')
-                            result = cursor.fetchone()
-                            tracking_active = result[0] if result else False
-                            conn.close()
-                            logger.info(f"📡 Отслеживание активно: {tracking_active}")
-                            if tracking_active:
-                                conn = sqlite3.connect('driver.db')
-                                cursor = conn.cursor()
-                                cursor.execute(
-                                    """
-                                    SELECT u.telegram_id
-                                    FROM invitations i
-                                    JOIN users u ON u.telegram_id = i.recipient_telegram_id
-                                    WHERE i.inviter_id = ? AND i.status = 'accepted' AND u.telegram_id IS NOT NULL
-                                    """,
-                                    (inviter_user_id,)
-                                )
-                                recipients = [r[0] for r in cursor.fetchall()]
-                                conn.close()
-                                logger.info(f"👥 Получателей (быстрый переход, {inviter_user_id}): {len(recipients)}")
-                                if recipients:
-                                    system_info = {'id': None, 'telegram_id': None, 'login': 'system', 'role': 'system'}
-                                    result = await notification_system.send_notification_with_confirmation(
-                                        notification_type='automatic',
-                                        sender_info=system_info,
-                                        recipients=recipients,
-                                        notification_text=create_work_notification(),
-                                        custom_confirmation=True
-                                    )
-                                    if result['success']:
-                                        per_user_last_checked_id[tg_id] = curr_id
-                                        per_user_last_checked_time[tg_id] = curr_ts
-                                        per_user_last_notification_type[tg_id] = 'arrival'
-                                        save_last_arrival_time(curr_ts)
-                                        logger.info(
-                                            f"📊 АВТО[{tg_id}]: прибытие (быстрый переход) — отправлено {result['sent_count']} из {result['total_recipients']}"
-                                        )
-                                    else:
-                                        logger.warning(f"❌ Прибытие[{tg_id}] (быстрый переход): отправка не удалась")
-                                else:
-                                    logger.warning("❌ Прибытие (быстрый переход): нет получателей")
-                            else:
-                                logger.info("Прибытие (быстрый переход): отслеживание выключено, уведомление не отправлено")
-                        else:
-                            logger.info("⏰ Прибытие (быстрый переход): заблокировано временными ограничениями")
-                    else:
-                        logger.info("Прибытие (быстрый переход): слишком рано после последней проверки (<10s)")
+    async def save_zone_transitions():
+        """Записать въезды/выезды по отдельным зонам (повторы после перезапуска отбрасываются)"""
+        if not zone_transitions:
+            return
+        batch = list(zone_transitions)
+        zone_transitions.clear()
+        for t in await loop.run_in_executor(None, record_transitions, db, batch):
+            action = 'въезд' if t['type'] == ARRIVAL else 'выезд'
+            logger.info(f"📍 Зона «{db.zone_index.zone_name(t['zone_id'])}» [{t['telegram_id']}]: {action}")
 
-                # Выезд 1→0
-                if (
-                    prev_is_at_work == 1 and curr_is_at_work == 0 and
-                    curr_id != last_checked_id and
-                    last_notification_type != 'departure' and
-                    confirmed_transition(0)
-                ):
-                    logger.info(
-                        f"DEBUG[{tg_id}]: переход 1→0 подтвержден (dt={dt_prev_curr}s, prev2={prev2_is_at_work})"
-                    )
-                    if curr_ts - last_checked_time >= 10:
-                        if can_send_notification('departure', max_interval_minutes=30):
-                            # Проверяем статус отслеживания (как и для прибытия)
-                            conn = sqlite3.connect('driver.db')
-                            cursor = conn.cursor()
-                            cursor.execute('SELECT is_active FROM tracking_status WHERE id = 1')
-                            result = cursor.fetchone()
-                            tracking_active = result[0] if result else False
-                            conn.close()
-                            logger.info(f"📡 Отслеживание активно: {tracking_active}")
-                            if tracking_active:
-                                conn = sqlite3.connect('driver.db')
-                                cursor = conn.cursor()
-                                cursor.execute(
-                                    """
-                                    SELECT u.telegram_id
-                                    FROM invitations i
-                                    JOIN users u ON u.telegram_id = i.recipient_telegram_id
-                                    WHERE i.inviter_id = ? AND i.status = 'accepted' AND u.telegram_id IS NOT NULL
-                                    """,
-                                    (inviter_user_id,)
-                                )
-                                users = [u[0] for u in cursor.fetchall()]
-                                conn.close()
-                                logger.info(f"👥 Получателей для уведомления о выезде (по приглашениям {inviter_user_id}): {len(users)}")
-                                if users:
-                                    system_info = {'id': None, 'telegram_id': None, 'login': 'system', 'role': 'system'}
-                                    result = await notification_system.send_notification_with_confirmation(
-                                        notification_type='automatic',
-                                        sender_info=system_info,
-                                        recipients=users,
-                                        notification_text="Выехали",
-                                        custom_confirmation=True
-                                    )
-                                    if result['success']:
-                                        # Фиксируем успешную отправку только после успеха
-                                        per_user_last_checked_id[tg_id] = curr_id
-                                        per_user_last_checked_time[tg_id] = curr_ts
-                                        per_user_last_notification_type[tg_id] = 'departure'
-                                        save_last_departure_time(curr_ts)
-                                        logger.info(
-                                            f"📊 АВТО[{tg_id}]: выезд — отправлено {result['sent_count']} из {result['total_recipients']}"
-                                        )
-                                    else:
-                                        logger.warning(f"❌ Выезд[{tg_id}]: отправка не удалась")
-                                else:
-                                    logger.warning("❌ Выезд: нет пользователей")
-                            else:
-                                logger.info("Выезд: отслеживание выключено, уведомление не отправлено")
-                        else:
-                            logger.info("⏰ Выезд: заблокировано временными ограничениями")
-                    else:
-                        logger.info("Выезд: слишком рано после последней проверки (<10s)")
+    sweep_cursor = 0
+    last_sweep = 0.0
+    try:
+        # Стартовое состояние: те же последние 200 точек, что читал опрос
+        rows = await loop.run_in_executor(None, fetch_driver_locations)
+        if rows:
+            sweep_cursor = max(r[0] for r in rows)
+        for tg_id in add_rows(rows):
+            await process(tg_id)
+        await save_zone_transitions()
+        last_sweep = time.monotonic()
+
+        while True:
+            try:
+                timeout = max(0.0, last_sweep + sweep_interval - time.monotonic())
+                try:
+                    event = await asyncio.wait_for(events.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    event = None
 
-                # Дополнительное подтверждение выезда при быстром переходе:
-                # Если последние две точки уже 0, а третья с конца была 1, значит переход 1→0 произошёл слишком быстро
-                # и мог быть пропущен. В таком случае отправляем «Выехали» сейчас (однократно).
-                if (
-                    prev_is_at_work == 0 and curr_is_at_work == 0 and
-                    prev2_is_at_work == 1 and
-                    curr_id != last_checked_id and
-                    last_notification_type != 'departure'
-                ):
-                    logger.info(f"DEBUG[{tg_id}]: обнаружен шаблон 1→0 (быстрый), подтверждаем выезд по последним двум точкам 0→0")
-                    if curr_ts - last_checked_time >= 10:
-                        if can_send_notification('departure', max_interval_minutes=30):
-                            # Проверяем статус отслеживания
-                            conn = sqlite3.connect('driver.db')
-                            cursor = conn.cursor()
-                            cursor.execute('SELECT is_active FROM tracking_status WHERE id = 1')
-                            result = cursor.fetchone()
-                            tracking_active = result[0] if result else False
-                            conn.close()
-                            logger.info(f"📡 Отслеживание активно: {tracking_active}")
-                            if tracking_active:
-                                conn = sqlite3.connect('driver.db')
-                                cursor = conn.cursor()
-                                cursor.execute(
-                                    """
-                                    SELECT u.telegram_id
-                                    FROM invitations i
-                                    JOIN users u ON u.telegram_id = i.recipient_telegram_id
-                                    WHERE i.inviter_id = ? AND i.status = 'accepted' AND u.telegram_id IS NOT NULL
-                                    """,
-                                    (inviter_user_id,)
-                                )
-                                users = [u[0] for u in cursor.fetchall()]
-                                conn.close()
-                                logger.info(f"👥 Получателей для уведомления о выезде (быстрый переход, {inviter_user_id}): {len(users)}")
-                                if users:
-                                    system_info = {'id': None, 'telegram_id': None, 'login': 'system', 'role': 'system'}
-                                    result = await notification_system.send_notification_with_confirmation(
-                                        notification_type='automatic',
-                                        sender_info=system_info,
-                                        recipients=users,
-                                        notification_text="Выехали",
-                                        custom_confirmation=True
-                                    )
-                                    if result['success']:
-                                        per_user_last_checked_id[tg_id] = curr_id
-                                        per_user_last_checked_time[tg_id] = curr_ts
-                                        per_user_last_notification_type[tg_id] = 'departure'
-                                        save_last_departure_time(curr_ts)
-                                        logger.info(
-                                            f"📊 АВТО[{tg_id}]: выезд (быстрый переход) — отправлено {result['sent_count']} из {result['total_recipients']}"
-                                        )
-                                    else:
-                                        logger.warning(f"❌ Выезд[{tg_id}] (быстрый переход): отправка не удалась")
-                                else:
-                                    logger.warning("❌ Выезд (быстрый переход): нет пользователей")
-                            else:
-                                logger.info("Выезд (быстрый переход): отслеживание выключено, уведомление не отправлено")
-                        else:
-                            logger.info("⏰ Выезд (быстрый переход): заблокировано временными ограничениями")
-                    else:
-                        logger.info("Выезд (быстрый переход): слишком рано после последней проверки (<10s)")
+                if event is not None:
+                    tg_id = event.get('telegram_id')
+                    if tg_id and event.get('role') in ('driver', 'admin'):
+                        zone_transitions.extend(zones.add_point(tg_id, event['id'], event['user_id'],
+                                                                event.get('zone_id'), event['created_at']))
+                        if detector.add_point(tg_id, event['id'], event['user_id'],
+                                              event['is_at_work'], event['created_at']):
+                            await process(tg_id)
 
-            await asyncio.sleep(2)
-        except Exception as e:
-            logger.error(f"Ошибка мониторинга базы данных: {e}")
-            await asyncio.sleep(5)
+                if time.monotonic() - last_sweep >= sweep_interval:
+                    last_sweep = time.monotonic()
+                    rows = await loop.run_in_executor(None, fetch_driver_locations, sweep_cursor, 1000)
+                    if rows:
+                        sweep_cursor = rows[-1][0]
+                        logger.info(f"📊 Мониторинг: досмотр нашёл {len(rows)} новых записей")
+                    for tg_id in set(add_rows(rows)) | pending:
+                        await process(tg_id)
+                await save_zone_transitions()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка мониторинга базы данных: {e}")
+                await asyncio.sleep(5)
+    finally:
+        location_events.unsubscribe(on_event)
+        location_events.stop_listener(listener)
 
 async def main():
     """Основная функция"""
@@ -398,6 +280,13 @@ async def main():
         # Запускаем мониторинг базы данных в отдельной задаче
         asyncio.create_task(monitor_database(application))
         
+        # Фоновый перенос старых точек в месячные архивы с прореживанием
+        asyncio.create_task(create_compactor(db).run_forever(config.LOCATION_COMPACT_INTERVAL_SEC))
+        
+        # Дообучение модели времени в пути на новых точках (до того, как они уйдут в архив)
+        if config.TRAVEL_MODEL_ENABLED:
+            asyncio.create_task(TravelModelTrainer(db).run_forever(config.TRAVEL_MODEL_TRAIN_INTERVAL_SEC))
+        
         # Запускаем бота с настройками
         await application.run_polling(
             drop_pending_updates=True,
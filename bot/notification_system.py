@@ -1,18 +1,168 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import asyncio
+import functools
 import logging
+import time
 from datetime import datetime
+from config.settings import config
 from bot.database import db
 from bot.utils import create_work_notification
 
 logger = logging.getLogger(__name__)
 
+# Повторов при ответе Telegram "Too Many Requests" (RetryAfter)
+MAX_RETRY_AFTER_ATTEMPTS = 2
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now):
+        """Сколько ждать до появления токена (0 — можно сейчас)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class TelegramRateLimiter:
+    """
+    Общий лимит Bot API и лимит на один чат
+
+    Работает внутри одного event loop: проверка и списание токенов идут без
+    await между ними, поэтому блокировка не нужна.
+    """
+
+    MAX_CHAT_BUCKETS = 1000
+
+    def __init__(self, global_rate=30, chat_rate=1):
+        self.global_bucket = TokenBucket(global_rate) if global_rate > 0 else None
+        self.chat_rate = chat_rate
+        self.chat_buckets = {}
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.MAX_CHAT_BUCKETS:
+                # Полные корзины ничем не отличаются от новых — их можно забыть
+                for key in [k for k, b in self.chat_buckets.items() if b.is_full(now)]:
+                    del self.chat_buckets[key]
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+        return bucket
+
+    async def acquire(self, chat_id):
+        while True:
+            now = time.monotonic()
+            chat_bucket = self._chat_bucket(chat_id, now) if self.chat_rate > 0 else None
+            wait = max(
+                self.global_bucket.wait_time(now) if self.global_bucket else 0.0,
+                chat_bucket.wait_time(now) if chat_bucket else 0.0,
+            )
+            if wait <= 0:
+                if self.global_bucket:
+                    self.global_bucket.take()
+                if chat_bucket:
+                    chat_bucket.take()
+                return
+            await asyncio.sleep(wait)
+
+
+def _retry_after_seconds(error):
+    """Пауза из ошибки RetryAfter (секунды или timedelta), иначе None"""
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is None:
+        return None
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return None
+
+
+def _describe_error(recipient_id, e):
+    error_msg = str(e)
+
+    # Специальная обработка ошибок SOCKS
+    if "Missing dependencies for SOCKS support" in error_msg:
+        error_msg = "Ошибка SOCKS прокси - попробуйте перезапустить бота"
+        logger.warning(f"🔧 SOCKS ошибка для {recipient_id}: {e}")
+    elif "SOCKS" in error_msg:
+        error_msg = "Проблема с SOCKS соединением"
+        logger.warning(f"🔧 SOCKS проблема для {recipient_id}: {e}")
+    return error_msg
+
+
+def _display_name(user_info):
+    return f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}"
+
+
 class NotificationSystem:
     """Система отправки уведомлений с подтверждениями"""
     
-    def __init__(self, bot_application=None):
+    def __init__(self, bot_application=None, concurrency=None, global_rate=None, chat_rate=None):
         self.bot = bot_application
+        self.concurrency = max(1, concurrency if concurrency is not None else config.NOTIFY_CONCURRENCY)
+        self.rate_limiter = TelegramRateLimiter(
+            global_rate=config.TELEGRAM_GLOBAL_RATE if global_rate is None else global_rate,
+            chat_rate=config.TELEGRAM_CHAT_RATE if chat_rate is None else chat_rate,
+        )
+    
+    async def _run_db(self, func, *args, **kwargs):
+        """Синхронный вызов базы в пуле потоков, чтобы не блокировать event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+    
+    async def _send_one(self, chat_id, text):
+        """Отправить одно сообщение с учётом лимитов и RetryAfter"""
+        for attempt in range(MAX_RETRY_AFTER_ATTEMPTS + 1):
+            await self.rate_limiter.acquire(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return
+            except Exception as e:
+                pause = _retry_after_seconds(e)
+                if pause is None or attempt == MAX_RETRY_AFTER_ATTEMPTS:
+                    raise
+                logger.warning(f"⏳ Telegram просит подождать {pause:.1f}s перед отправкой в {chat_id}")
+                await asyncio.sleep(pause)
+    
+    async def _fan_out(self, chat_ids, text):
+        """
+        Параллельная отправка одного текста в несколько чатов
+
+        Returns:
+            list: [(chat_id, ошибка или None)] в порядке chat_ids
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def deliver(chat_id):
+            async with semaphore:
+                try:
+                    await self._send_one(chat_id, text)
+                    return chat_id, None
+                except Exception as e:
+                    return chat_id, e
+        
+        return await asyncio.gather(*(deliver(chat_id) for chat_id in chat_ids))
     
     async def send_notification_with_confirmation(self, notification_type, sender_info, 
                                                  recipients, notification_text=None, 
@@ -20,6 +170,10 @@ class NotificationSystem:
         """
         Отправить уведомления с системой подтверждений
         
+        Получателям сообщения уходят параллельно (не больше concurrency
+        одновременно, с учётом лимитов Telegram), детали доставки пишутся
+        в базу двумя пакетами в пуле потоков.
+        
         Args:
             notification_type (str): Тип уведомления ('manual', 'automatic', 'arrival', 'departure')
             sender_info (dict): Информация об отправителе
@@ -30,94 +184,69 @@ class NotificationSystem:
         Returns:
             dict: Результат отправки
         """
+        text = notification_text or create_work_notification()
+        
         # Создаем лог уведомления
-        notification_log_id = db.create_notification_log(
+        notification_log_id = await self._run_db(
+            db.create_notification_log,
             notification_type=notification_type,
             sender_id=sender_info.get('id'),
             sender_telegram_id=sender_info.get('telegram_id'),
             sender_login=sender_info.get('login'),
-            notification_text=notification_text or create_work_notification()
+            notification_text=text
         )
         
         if not notification_log_id:
             logger.error("Не удалось создать лог уведомления")
             return {'success': False, 'error': 'Ошибка создания лога'}
         
-        # Добавляем получателей в детали
+        # Имена получателей одним запросом, детали — одной транзакцией
+        users = await self._run_db(db.get_users_by_telegram_ids, recipients)
+        details = []
         for recipient_id in recipients:
-            user_info = db.get_user_by_telegram_id(recipient_id)
-            recipient_name = f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip() if user_info else None
-            
-            db.add_notification_detail(
-                notification_log_id=notification_log_id,
-                recipient_telegram_id=recipient_id,
-                recipient_name=recipient_name,
-                status="pending"
-            )
+            user_info = users.get(recipient_id)
+            recipient_name = _display_name(user_info).strip() if user_info else None
+            details.append((recipient_id, recipient_name, "pending"))
+        await self._run_db(db.add_notification_details_batch, notification_log_id, details)
         
         # Отправляем уведомления
         sent_count = 0
         failed_count = 0
         successful_recipients = []
         failed_recipients = []
+        updates = []
         
-        for recipient_id in recipients:
-            try:
-                if self.bot:
-                    await self.bot.send_message(
-                        chat_id=recipient_id,
-                        text=notification_text or create_work_notification()
-                    )
-                    
-                    # Обновляем статус на успешный
-                    db.update_notification_detail(
-                        notification_log_id=notification_log_id,
-                        recipient_telegram_id=recipient_id,
-                        status="sent"
-                    )
-                    
-                    sent_count += 1
-                    user_info = db.get_user_by_telegram_id(recipient_id)
-                    if user_info:
-                        successful_recipients.append(f"• {user_info.get('first_name', '')} {user_info.get('last_name', '')}")
-                    else:
-                        successful_recipients.append(f"• ID: {recipient_id}")
-                    
-                    logger.info(f"✅ Уведомление отправлено: {recipient_id}")
-                    
+        if self.bot:
+            results = await self._fan_out(recipients, text)
+        else:
+            logger.error("Bot application не инициализирован")
+            results = []
+            failed_count = len(recipients)
+        
+        for recipient_id, error in results:
+            user_info = users.get(recipient_id)
+            if error is None:
+                updates.append((recipient_id, "sent", None))
+                sent_count += 1
+                if user_info:
+                    successful_recipients.append(f"• {_display_name(user_info)}")
                 else:
-                    logger.error("Bot application не инициализирован")
-                    failed_count += 1
-                    
-            except Exception as e:
-                error_msg = str(e)
-                
-                # Специальная обработка ошибок SOCKS
-                if "Missing dependencies for SOCKS support" in error_msg:
-                    error_msg = "Ошибка SOCKS прокси - попробуйте перезапустить бота"
-                    logger.warning(f"🔧 SOCKS ошибка для {recipient_id}: {e}")
-                elif "SOCKS" in error_msg:
-                    error_msg = "Проблема с SOCKS соединением"
-                    logger.warning(f"🔧 SOCKS проблема для {recipient_id}: {e}")
-                
-                db.update_notification_detail(
-                    notification_log_id=notification_log_id,
-                    recipient_telegram_id=recipient_id,
-                    status="failed",
-                    error_message=error_msg
-                )
-                
+                    successful_recipients.append(f"• ID: {recipient_id}")
+                logger.info(f"✅ Уведомление отправлено: {recipient_id}")
+            else:
+                error_msg = _describe_error(recipient_id, error)
+                updates.append((recipient_id, "failed", error_msg))
                 failed_count += 1
-                user_info = db.get_user_by_telegram_id(recipient_id)
                 if user_info:
-                    failed_recipients.append(f"• {user_info.get('first_name', '')} {user_info.get('last_name', '')} (ошибка: {error_msg})")
+                    failed_recipients.append(f"• {_display_name(user_info)} (ошибка: {error_msg})")
                 else:
                     failed_recipients.append(f"• ID: {recipient_id} (ошибка: {error_msg})")
-                
-                logger.error(f"❌ Ошибка отправки уведомления {recipient_id}: {e}")
+                logger.error(f"❌ Ошибка отправки уведомления {recipient_id}: {error}")
         
-        # Завершаем лог
-        db.complete_notification_log(notification_log_id, sent_count, failed_count)
+        # Статусы доставки и завершение лога
+        if updates:
+            await self._run_db(db.update_notification_details_batch, notification_log_id, updates)
+        await self._run_db(db.complete_notification_log, notification_log_id, sent_count, failed_count)
         
         # Отправляем подтверждения только водителю и администратору
         if custom_confirmation and sent_count > 0:
@@ -156,7 +285,15 @@ class NotificationSystem:
         )
         
         # Отмечаем, что подтверждения отправлены
-        db.mark_confirmation_sent(notification_log_id)
+        await self._run_db(db.mark_confirmation_sent, notification_log_id)
+    
+    def _get_telegram_ids_by_role(self, role):
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT telegram_id FROM users WHERE role = ? AND telegram_id IS NOT NULL", (role,))
+        telegram_ids = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return telegram_ids
     
     async def _send_driver_confirmation(self, notification_log_id, sender_info, 
                                        successful_recipients, failed_recipients, 
@@ -166,11 +303,7 @@ class NotificationSystem:
             return
         
         # Получаем всех водителей
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT telegram_id FROM users WHERE role = 'driver' AND telegram_id IS NOT NULL")
-        drivers = cursor.fetchall()
-        conn.close()
+        drivers = await self._run_db(self._get_telegram_ids_by_role, 'driver')
         
         if not drivers:
             return
@@ -190,15 +323,11 @@ class NotificationSystem:
 {chr(10).join(failed_recipients)}"""
         
         # Отправляем подтверждение водителям
-        for (driver_telegram_id,) in drivers:
-            try:
-                await self.bot.send_message(
-                    chat_id=driver_telegram_id,
-                    text=confirmation_text
-                )
+        for driver_telegram_id, error in await self._fan_out(drivers, confirmation_text):
+            if error is None:
                 logger.info(f"✅ Подтверждение отправлено водителю {driver_telegram_id}")
-            except Exception as e:
-                logger.error(f"❌ Ошибка отправки подтверждения водителю {driver_telegram_id}: {e}")
+            else:
+                logger.error(f"❌ Ошибка отправки подтверждения водителю {driver_telegram_id}: {error}")
     
     async def _send_admin_confirmation(self, notification_log_id, sender_info, 
                                       successful_recipients, failed_recipients, 
@@ -208,11 +337,7 @@ class NotificationSystem:
             return
         
         # Получаем всех администраторов
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT telegram_id FROM users WHERE role = 'admin' AND telegram_id IS NOT NULL")
-        admins = cursor.fetchall()
-        conn.close()
+        admins = await self._run_db(self._get_telegram_ids_by_role, 'admin')
         
         if not admins:
             return
@@ -238,15 +363,11 @@ class NotificationSystem:
 {chr(10).join(failed_recipients)}"""
         
         # Отправляем подтверждение администраторам
-        for (admin_telegram_id,) in admins:
-            try:
-                await self.bot.send_message(
-                    chat_id=admin_telegram_id,
-                    text=confirmation_text
-                )
+        for admin_telegram_id, error in await self._fan_out(admins, confirmation_text):
+            if error is None:
                 logger.info(f"✅ Подтверждение отправлено администратору {admin_telegram_id}")
-            except Exception as e:
-                logger.error(f"❌ Ошибка отправки подтверждения администратору {admin_telegram_id}: {e}")
+            else:
+                logger.error(f"❌ Ошибка отправки подтверждения администратору {admin_telegram_id}: {error}")
     
     def get_notification_statistics(self, days=7):
         """Получить статистику уведомлений за последние дни"""
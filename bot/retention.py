@@ -0,0 +1,335 @@
+"""
+Хранение истории местоположений: партиции по месяцам, прореживание, сроки хранения
+
+user_locations остаётся «горячей» таблицей за последние LOCATION_HOT_DAYS дней:
+в неё пишет ingest, по ней работают монитор бота и индексы. Компактор
+переносит более старые точки в месячные таблицы user_locations_YYYYMM,
+по дороге прореживая трек (одна точка на N секунд или Дуглас–Пекер), и
+удаляет месячные таблицы старше LOCATION_RETENTION_DAYS.
+
+Точки, где меняется is_at_work или зона (zone_id), при прореживании
+сохраняются всегда — по ним восстанавливаются въезды, выезды и переходы
+между зонами.
+
+Запуск вручную: python -m bot.retention [--vacuum]
+"""
+
+import asyncio
+import logging
+import math
+import re
+import sys
+from datetime import datetime, timedelta, timezone
+
+from config.settings import config
+
+logger = logging.getLogger(__name__)
+
+PARTITION_PREFIX = 'user_locations_'
+PARTITION_RE = re.compile(r'^user_locations_(\d{4})(\d{2})$')
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+LOCATION_COLUMNS = ('id', 'user_id', 'telegram_id', 'latitude', 'longitude', 'accuracy',
+                    'altitude', 'speed', 'heading', 'is_at_work', 'created_at', 'zone_id')
+
+
+def partition_name(created_at):
+    """Имя месячной таблицы для created_at ('YYYY-MM-DD HH:MM:SS')"""
+    return f"{PARTITION_PREFIX}{created_at[0:4]}{created_at[5:7]}"
+
+
+def ensure_partition(cursor, name):
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            telegram_id BIGINT NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            accuracy REAL,
+            altitude REAL,
+            speed REAL,
+            heading REAL,
+            is_at_work BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP,
+            zone_id INTEGER
+        )
+    ''')
+    # Партиции, созданные до появления зон
+    cursor.execute(f"PRAGMA table_info({name})")
+    if 'zone_id' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {name} ADD COLUMN zone_id INTEGER")
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{name}_telegram_id_id ON {name} (telegram_id, id)')
+
+
+def list_partitions(cursor):
+    """Месячные таблицы от новой к старой"""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'user_locations\\_%' ESCAPE '\\'")
+    names = [row[0] for row in cursor.fetchall() if PARTITION_RE.match(row[0])]
+    return sorted(names, reverse=True)
+
+
+def _month_bounds(name):
+    """Начало месяца партиции и начало следующего (строки в формате created_at)"""
+    year, month = (int(x) for x in PARTITION_RE.match(name).groups())
+    start = datetime(year, month, 1)
+    end = datetime(year + (month == 12), month % 12 + 1, 1)
+    return start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT)
+
+
+def fetch_user_track(cursor, telegram_id, columns, limit=None, since=None, until=None):
+    """
+    Точки пользователя от новых к старым: горячая таблица, затем месячные партиции
+
+    Args:
+        columns (str): список колонок SELECT (ul — таблица точек, u — users)
+        limit (int): сколько точек нужно; партиции читаются, пока не наберётся
+        since, until (str): границы created_at [since, until)
+
+    Returns:
+        list: строки результата
+    """
+    tables = ['user_locations']
+    for name in list_partitions(cursor):
+        start, end = _month_bounds(name)
+        if (since and end <= since) or (until and start >= until):
+            continue
+        tables.append(name)
+
+    where = ['ul.telegram_id = ?']
+    params = [telegram_id]
+    if since:
+        where.append('ul.created_at >= ?')
+        params.append(since)
+    if until:
+        where.append('ul.created_at < ?')
+        params.append(until)
+
+    rows = []
+    for table in tables:
+        remaining = None if limit is None else limit - len(rows)
+        if remaining is not None and remaining <= 0:
+            break
+        sql = (f"SELECT {columns} FROM {table} ul JOIN users u ON ul.user_id = u.id "
+               f"WHERE {' AND '.join(where)} ORDER BY ul.id DESC")
+        if remaining is not None:
+            cursor.execute(sql + " LIMIT ?", params + [remaining])
+        else:
+            cursor.execute(sql, params)
+        rows.extend(cursor.fetchall())
+    return rows
+
+
+def _point_segment_distance_m(p, a, b):
+    """Расстояние от p до отрезка ab в метрах (локальная проекция, для коротких отрезков)"""
+    ref_lat = a['latitude']
+    bx = math.radians(b['longitude'] - a['longitude']) * math.cos(math.radians(ref_lat)) * 6371000
+    by = math.radians(b['latitude'] - a['latitude']) * 6371000
+    px = math.radians(p['longitude'] - a['longitude']) * math.cos(math.radians(ref_lat)) * 6371000
+    py = math.radians(p['latitude'] - a['latitude']) * 6371000
+    seg_len2 = bx ** 2 + by ** 2
+    if seg_len2 == 0:
+        return math.hypot(px, py)
+    t = max(0.0, min(1.0, (px * bx + py * by) / seg_len2))
+    return math.hypot(px - t * bx, py - t * by)
+
+
+def douglas_peucker(points, epsilon_m):
+    """Индексы точек, оставшихся после упрощения Дугласа–Пекера"""
+    if len(points) <= 2:
+        return list(range(len(points)))
+    keep = {0, len(points) - 1}
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        max_dist, index = 0.0, None
+        for i in range(start + 1, end):
+            dist = _point_segment_distance_m(points[i], points[start], points[end])
+            if dist > max_dist:
+                max_dist, index = dist, i
+        if index is not None and max_dist > epsilon_m:
+            keep.add(index)
+            stack.append((start, index))
+            stack.append((index, end))
+    return sorted(keep)
+
+
+class LocationCompactor:
+    """Перенос старых точек в месячные партиции с прореживанием и удаление просроченных партиций"""
+
+    def __init__(self, database, hot_days=7, retention_days=365, mode='interval',
+                 interval_sec=60, epsilon_m=15.0, chunk_size=5000):
+        self.database = database
+        self.hot_days = hot_days
+        self.retention_days = retention_days
+        self.mode = mode
+        self.interval_sec = interval_sec
+        self.epsilon_m = epsilon_m
+        self.chunk_size = chunk_size
+        self.stats = {'runs': 0, 'scanned': 0, 'archived': 0, 'dropped_points': 0, 'dropped_partitions': 0}
+
+    def _downsample(self, rows, state):
+        """
+        Отобрать точки одного пользователя (по возрастанию id)
+
+        state — состояние пользователя между пачками: время последней сохранённой
+        точки, последний статус (is_at_work, zone_id) и последняя пропущенная точка
+        """
+        if not rows:
+            return []
+        if self.mode == 'dp':
+            points = [dict(zip(LOCATION_COLUMNS, r)) for r in rows]
+            keep = set(douglas_peucker(points, self.epsilon_m))
+            prev_state = state.get('status')
+            for i, p in enumerate(points):
+                status = (p['is_at_work'], p['zone_id'])
+                if prev_state is not None and status != prev_state:
+                    keep.add(i)
+                    if i > 0:
+                        keep.add(i - 1)
+                prev_state = status
+            state['status'] = prev_state
+            return [rows[i] for i in sorted(keep)]
+
+        kept = []
+        for row in rows:
+            ts = _parse_ts(row[10])
+            status = (row[9], row[11])
+            changed = state.get('status') is not None and status != state['status']
+            if changed or state.get('ts') is None or ts is None or ts - state['ts'] >= self.interval_sec:
+                if changed and state.get('pending') is not None:
+                    # Последняя точка перед сменой статуса — чтобы переход был виден в архиве
+                    kept.append(state['pending'])
+                kept.append(row)
+                state['ts'] = ts
+                state['pending'] = None
+            else:
+                state['pending'] = row
+            state['status'] = status
+        return kept
+
+    def compact_once(self, now=None):
+        """Один проход компактора. Возвращает статистику прохода"""
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        cutoff = (now - timedelta(days=self.hot_days)).strftime(TIME_FORMAT)
+        run = {'scanned': 0, 'archived': 0, 'dropped_points': 0, 'dropped_partitions': 0}
+        user_state = {}
+        last_id = 0
+
+        while True:
+            conn = self.database.get_connection()
+            c = conn.cursor()
+            try:
+                c.execute(
+                    f"SELECT {', '.join(LOCATION_COLUMNS)} FROM user_locations WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, self.chunk_size)
+                )
+                rows = c.fetchall()
+                old_rows = []
+                for row in rows:
+                    if row[10] is not None and row[10] >= cutoff:
+                        break
+                    old_rows.append(row)
+                if not old_rows:
+                    break
+
+                by_key = {}
+                for row in old_rows:
+                    name = partition_name(row[10] or cutoff)
+                    by_key.setdefault((name, row[1]), []).append(row)
+                kept_total = 0
+                for (name, user_id), user_rows in by_key.items():
+                    kept = self._downsample(user_rows, user_state.setdefault((name, user_id), {}))
+                    ensure_partition(c, name)
+                    c.executemany(
+                        f"INSERT OR IGNORE INTO {name} ({', '.join(LOCATION_COLUMNS)}) VALUES ({', '.join('?' * len(LOCATION_COLUMNS))})",
+                        kept
+                    )
+                    kept_total += len(kept)
+                # Прочитанные строки идут подряд по id, поэтому удаляем диапазоном
+                c.execute('DELETE FROM user_locations WHERE id >= ? AND id <= ?', (old_rows[0][0], old_rows[-1][0]))
+                conn.commit()
+            finally:
+                conn.close()
+
+            run['scanned'] += len(old_rows)
+            run['archived'] += kept_total
+            run['dropped_points'] += len(old_rows) - kept_total
+            last_id = old_rows[-1][0]
+            if len(old_rows) < len(rows) or len(rows) < self.chunk_size:
+                break
+
+        run['dropped_partitions'] = self.drop_expired_partitions(now)
+        for key, value in run.items():
+            self.stats[key] += value
+        self.stats['runs'] += 1
+        if run['scanned'] or run['dropped_partitions']:
+            logger.info(
+                f"🗄️ RETENTION: перенесено {run['archived']} из {run['scanned']} точек "
+                f"(прорежено {run['dropped_points']}), удалено партиций: {run['dropped_partitions']}"
+            )
+        return run
+
+    def drop_expired_partitions(self, now):
+        if not self.retention_days:
+            return 0
+        oldest_kept = (now - timedelta(days=self.retention_days)).strftime(TIME_FORMAT)
+        conn = self.database.get_connection()
+        c = conn.cursor()
+        dropped = 0
+        try:
+            for name in list_partitions(c):
+                _start, end = _month_bounds(name)
+                if end <= oldest_kept:
+                    c.execute(f'DROP TABLE IF EXISTS {name}')
+                    dropped += 1
+            # Старая таблица locations (одиночный трекер) живёт по тем же срокам
+            c.execute('DELETE FROM locations WHERE timestamp < ?', (oldest_kept,))
+            conn.commit()
+        finally:
+            conn.close()
+        return dropped
+
+    async def run_forever(self, interval_sec):
+        """Фоновый компактор для event loop бота"""
+        loop = asyncio.get_running_loop()
+        logger.info(f"🚀 RETENTION: компактор запущен (горячие {self.hot_days} дн., хранение {self.retention_days} дн., режим {self.mode})")
+        while True:
+            try:
+                await loop.run_in_executor(None, self.compact_once)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ RETENTION: ошибка компактора: {e}")
+            await asyncio.sleep(interval_sec)
+
+
+def _parse_ts(created_at):
+    try:
+        return datetime.strptime(created_at, TIME_FORMAT).timestamp()
+    except Exception:
+        return None
+
+
+def create_compactor(database):
+    return LocationCompactor(
+        database,
+        hot_days=config.LOCATION_HOT_DAYS,
+        retention_days=config.LOCATION_RETENTION_DAYS,
+        mode=config.LOCATION_DOWNSAMPLE_MODE,
+        interval_sec=config.LOCATION_DOWNSAMPLE_SEC,
+        epsilon_m=config.LOCATION_DOWNSAMPLE_EPSILON_M,
+    )
+
+
+if __name__ == '__main__':
+    from bot.database import db
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    result = create_compactor(db).compact_once()
+    print(result)
+    if '--vacuum' in sys.argv:
+        # Возвращаем освободившееся место файловой системе (блокирует базу на время работы)
+        conn = db.get_connection()
+        conn.execute('VACUUM')
+        conn.close()
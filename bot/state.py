@@ -1,8 +1,24 @@
-import os
+"""
+Состояние мониторинга переходов
+
+Всё состояние хранится в памяти одного StateStore и сбрасывается на диск
+атомарным снимком (bot_state.json) при каждом изменении. Изменения бывают
+только при отправке уведомлений, поэтому проверки в цикле мониторинга диск
+не читают вовсе.
+
+Состояние ведётся по водителям (ключ — telegram_id). Общая запись GLOBAL_KEY
+нужна для старого API без telegram_id и для значений, перенесённых из
+прежних файлов last_*.txt.
+"""
+
+import json
 import logging
+import os
+import threading
 import time
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = os.path.join(BASE_DIR, "bot_state.json")
 LAST_ID_FILE = os.path.join(BASE_DIR, "last_checked_id.txt")
 LAST_TIME_FILE = os.path.join(BASE_DIR, "last_checked_time.txt")
 LAST_NOTIFICATION_TYPE_FILE = os.path.join(BASE_DIR, "last_notification_type.txt")
@@ -10,129 +26,201 @@ LAST_ARRIVAL_TIME_FILE = os.path.join(BASE_DIR, "last_arrival_time.txt")
 LAST_DEPARTURE_TIME_FILE = os.path.join(BASE_DIR, "last_departure_time.txt")
 logger = logging.getLogger(__name__)
 
-def load_last_checked_id():
-    try:
-        with open(LAST_ID_FILE, "r") as f:
-            value = int(f.read().strip())
-            logger.info(f"Загружен last_checked_id: {value}")
-            return value
-    except Exception as e:
-        logger.warning(f"Не удалось загрузить last_checked_id: {e}")
-        return 0
-
-def save_last_checked_id(last_id):
-    try:
-        with open(LAST_ID_FILE, "w") as f:
-            f.write(str(last_id))
-        logger.info(f"Сохранён last_checked_id: {last_id}")
-    except Exception as e:
-        logger.error(f"Не удалось сохранить last_checked_id: {e}")
-
-def load_last_checked_time():
-    try:
-        with open(LAST_TIME_FILE, "r") as f:
-            value = float(f.read().strip())
-            logger.info(f"Загружено время последнего уведомления: {value}")
-            return value
-    except Exception as e:
-        logger.warning(f"Не удалось загрузить время последнего уведомления: {e}")
-        return 0.0
-
-def save_last_checked_time(ts):
-    try:
-        with open(LAST_TIME_FILE, "w") as f:
-            f.write(str(ts))
-        logger.info(f"Сохранено время последнего уведомления: {ts}")
-    except Exception as e:
-        logger.error(f"Не удалось сохранить время последнего уведомления: {e}")
-
-def load_last_notification_type():
-    try:
-        with open(LAST_NOTIFICATION_TYPE_FILE, "r") as f:
-            value = f.read().strip()
-            logger.info(f"Загружен тип последнего уведомления: {value}")
-            return value
-    except Exception as e:
-        logger.warning(f"Не удалось загрузить тип последнего уведомления: {e}")
-        return None
-
-def save_last_notification_type(notification_type):
-    try:
-        with open(LAST_NOTIFICATION_TYPE_FILE, "w") as f:
-            f.write(str(notification_type))
-        logger.info(f"Сохранён тип последнего уведомления: {notification_type}")
-    except Exception as e:
-        logger.error(f"Не удалось сохранить тип последнего уведомления: {e}")
-
-def load_last_arrival_time():
+GLOBAL_KEY = '*'
+STATE_VERSION = 1
+
+# Поле состояния -> (старый файл, преобразование значения)
+LEGACY_FILES = {
+    'last_checked_id': (LAST_ID_FILE, int),
+    'last_checked_time': (LAST_TIME_FILE, float),
+    'last_notification_type': (LAST_NOTIFICATION_TYPE_FILE, str),
+    'last_arrival_time': (LAST_ARRIVAL_TIME_FILE, float),
+    'last_departure_time': (LAST_DEPARTURE_TIME_FILE, float),
+}
+
+
+def _key(telegram_id):
+    return GLOBAL_KEY if telegram_id is None else str(telegram_id)
+
+
+class StateStore:
+    """Состояние по водителям в памяти с атомарными снимками на диск"""
+
+    def __init__(self, path=STATE_FILE, legacy_files=None):
+        self.path = path
+        self.legacy_files = LEGACY_FILES if legacy_files is None else legacy_files
+        self._state = None
+        self._lock = threading.RLock()
+
+    def _ensure_loaded(self):
+        if self._state is not None:
+            return
+        state = None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            state = data.get('drivers', {})
+            logger.info(f"Загружено состояние мониторинга: {len(state)} записей")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Не удалось прочитать {self.path}: {e}")
+        if state is None:
+            state = self._migrate_legacy()
+        self._state = state
+
+    def _migrate_legacy(self):
+        """Перенос значений из старых файлов last_*.txt в общую запись"""
+        migrated = {}
+        for field, (path, cast) in self.legacy_files.items():
+            try:
+                with open(path, 'r') as f:
+                    raw = f.read().strip()
+                if raw:
+                    migrated[field] = cast(raw)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logger.warning(f"Не удалось перенести {field} из {path}: {e}")
+        state = {GLOBAL_KEY: migrated} if migrated else {}
+        if migrated:
+            logger.info(f"Перенесено состояние из старых файлов: {', '.join(sorted(migrated))}")
+            self._state = state
+            self._write_snapshot()
+        return state
+
+    def _write_snapshot(self):
+        """Записать снимок: временный файл, fsync, атомарная замена"""
+        tmp_path = f"{self.path}.tmp"
+        payload = {'version': STATE_VERSION, 'saved_at': time.time(), 'drivers': self._state}
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            try:
+                dir_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+            except OSError:
+                pass
+        except Exception as e:
+            logger.error(f"Не удалось сохранить состояние мониторинга: {e}")
+
+    def get(self, field, telegram_id=None, default=None):
+        """Значение поля водителя; если у водителя его нет — из общей записи"""
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._state.get(_key(telegram_id), {})
+            if field in entry:
+                return entry[field]
+            return self._state.get(GLOBAL_KEY, {}).get(field, default)
+
+    def update(self, telegram_id=None, **values):
+        """Изменить поля водителя и сразу записать снимок"""
+        with self._lock:
+            self._ensure_loaded()
+            self._state.setdefault(_key(telegram_id), {}).update(values)
+            self._write_snapshot()
+
+    def drivers(self):
+        """Собственные записи водителей: {telegram_id: {поле: значение}}"""
+        with self._lock:
+            self._ensure_loaded()
+            result = {}
+            for key, entry in self._state.items():
+                if key == GLOBAL_KEY:
+                    continue
+                try:
+                    result[int(key)] = dict(entry)
+                except ValueError:
+                    result[key] = dict(entry)
+            return result
+
+    def reset(self):
+        """Очистить состояние (используется симуляцией)"""
+        with self._lock:
+            self._state = {}
+            self._write_snapshot()
+
+
+state_store = StateStore()
+
+
+# Совместимый API: без telegram_id работает с общей записью
+
+def load_last_checked_id(telegram_id=None):
+    return int(state_store.get('last_checked_id', telegram_id, 0))
+
+def save_last_checked_id(last_id, telegram_id=None):
+    state_store.update(telegram_id, last_checked_id=int(last_id))
+    logger.info(f"Сохранён last_checked_id: {last_id}")
+
+def load_last_checked_time(telegram_id=None):
+    return float(state_store.get('last_checked_time', telegram_id, 0.0))
+
+def save_last_checked_time(ts, telegram_id=None):
+    state_store.update(telegram_id, last_checked_time=float(ts))
+    logger.info(f"Сохранено время последнего уведомления: {ts}")
+
+def load_last_notification_type(telegram_id=None):
+    return state_store.get('last_notification_type', telegram_id)
+
+def save_last_notification_type(notification_type, telegram_id=None):
+    state_store.update(telegram_id, last_notification_type=notification_type)
+    logger.info(f"Сохранён тип последнего уведомления: {notification_type}")
+
+def load_last_arrival_time(telegram_id=None):
     """Загрузить время последнего уведомления о прибытии"""
-    try:
-        with open(LAST_ARRIVAL_TIME_FILE, "r") as f:
-            value = float(f.read().strip())
-            logger.info(f"Загружено время последнего уведомления о прибытии: {value}")
-            return value
-    except Exception as e:
-        logger.warning(f"Не удалось загрузить время последнего уведомления о прибытии: {e}")
-        return 0.0
-
-def save_last_arrival_time(ts):
+    return float(state_store.get('last_arrival_time', telegram_id, 0.0))
+
+def save_last_arrival_time(ts, telegram_id=None):
     """Сохранить время последнего уведомления о прибытии"""
-    try:
-        with open(LAST_ARRIVAL_TIME_FILE, "w") as f:
-            f.write(str(ts))
-        logger.info(f"Сохранено время последнего уведомления о прибытии: {ts}")
-    except Exception as e:
-        logger.error(f"Не удалось сохранить время последнего уведомления о прибытии: {e}")
-
-def load_last_departure_time():
+    state_store.update(telegram_id, last_arrival_time=float(ts))
+    logger.info(f"Сохранено время последнего уведомления о прибытии: {ts}")
+
+def load_last_departure_time(telegram_id=None):
     """Загрузить время последнего уведомления о выезде"""
-    try:
-        with open(LAST_DEPARTURE_TIME_FILE, "r") as f:
-            value = float(f.read().strip())
-            logger.info(f"Загружено время последнего уведомления о выезде: {value}")
-            return value
-    except Exception as e:
-        logger.warning(f"Не удалось загрузить время последнего уведомления о выезде: {e}")
-        return 0.0
-
-def save_last_departure_time(ts):
+    return float(state_store.get('last_departure_time', telegram_id, 0.0))
+
+def save_last_departure_time(ts, telegram_id=None):
     """Сохранить время последнего уведомления о выезде"""
-    try:
-        with open(LAST_DEPARTURE_TIME_FILE, "w") as f:
-            f.write(str(ts))
-        logger.info(f"Сохранено время последнего уведомления о выезде: {ts}")
-    except Exception as e:
-        logger.error(f"Не удалось сохранить время последнего уведомления о выезде: {e}")
-
-def can_send_notification(notification_type, max_interval_minutes=30):
+    state_store.update(telegram_id, last_departure_time=float(ts))
+    logger.info(f"Сохранено время последнего уведомления о выезде: {ts}")
+
+def can_send_notification(notification_type, max_interval_minutes=30, telegram_id=None):
     """
     Проверить, можно ли отправить уведомление данного типа
-    
+
     Args:
         notification_type (str): Тип уведомления ('arrival' или 'departure')
         max_interval_minutes (int): Максимальный интервал в минутах между уведомлениями
-    
+        telegram_id (int): Водитель; без него проверяется общая запись
+
     Returns:
         bool: True если можно отправить уведомление
     """
     current_time = time.time()
     max_interval_seconds = max_interval_minutes * 60
-    
+
     if notification_type == 'arrival':
-        last_time = load_last_arrival_time()
+        last_time = load_last_arrival_time(telegram_id)
     elif notification_type == 'departure':
-        last_time = load_last_departure_time()
+        last_time = load_last_departure_time(telegram_id)
     else:
         logger.warning(f"Неизвестный тип уведомления: {notification_type}")
         return True
-    
+
     time_diff = current_time - last_time
     can_send = time_diff >= max_interval_seconds
-    
+
     if can_send:
         logger.info(f"✅ Можно отправить уведомление {notification_type}. Прошло {time_diff/60:.1f} минут")
     else:
         remaining_minutes = (max_interval_seconds - time_diff) / 60
         logger.info(f"⏳ Уведомление {notification_type} заблокировано. Осталось {remaining_minutes:.1f} минут")
-    
-    return can_send 
\ No newline at end of file
+
+    return can_send
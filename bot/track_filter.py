@@ -0,0 +1,185 @@
+"""
+Фильтр трека между приёмом точки и записью
+
+Устройства присылают и грубые точки (accuracy в сотни метров — вышка или
+Wi-Fi вместо GPS), и невозможные скачки. Такие точки дёргают геозоны и
+запускают лишние расчёты ETA. TrackFilter держит на каждого пользователя
+O(1) состояние и по каждой точке решает:
+
+- accuracy больше max_accuracy_m — точка отбрасывается;
+- скорость от последней принятой точки (за вычетом погрешности) больше
+  max_speed — точка отбрасывается; после max_rejects таких точек подряд
+  считаем, что устройство действительно переместилось, и начинаем заново;
+- при smooth (TRACK_FILTER_SMOOTH, по умолчанию выключено) принятая точка
+  сглаживается скалярным фильтром Калмана по положению. На прогоне
+  tests/replay_track_filter.py сглаживание ухудшает точки в движении
+  сильнее, чем улучшает стоянки, а экономию записей дают отсев и стоянки;
+- если пользователь стоит (сдвиг от последней записанной точки меньше
+  stationary_m), статус и зона не изменились и с последней записи прошло
+  меньше stationary_sec, точка не пишется — это экономит записи на стоянках.
+"""
+
+import os
+import threading
+import time
+
+from config.settings import config
+from bot.geo import DEFAULT_ACCURACY_M, equirectangular
+
+# Сколько точек подряд за пределами скорости означают реальное перемещение
+MAX_REJECTS = 3
+
+ACCURACY = 'accuracy'
+SPEED = 'speed'
+STATIONARY = 'stationary'
+
+
+class TrackState:
+    """Оценка положения пользователя и последняя записанная точка"""
+
+    __slots__ = ('lat', 'lon', 'variance', 'ts', 'rejects',
+                 'stored_lat', 'stored_lon', 'stored_ts', 'is_at_work', 'zone_id')
+
+    def __init__(self):
+        self.lat = self.lon = self.variance = self.ts = None
+        self.rejects = 0
+        self.stored_lat = self.stored_lon = self.stored_ts = None
+        self.is_at_work = 0
+        self.zone_id = None
+
+
+class TrackFilter:
+    """Отсев выбросов, сглаживание и прореживание стоянок по каждому пользователю"""
+
+    def __init__(self, max_accuracy_m=500, max_speed_kmh=250, smooth=False,
+                 stationary_m=15, stationary_sec=120, max_rejects=MAX_REJECTS):
+        self.max_accuracy_m = float(max_accuracy_m)
+        self.max_speed = float(max_speed_kmh) / 3.6
+        self.smooth = smooth
+        self.stationary_m = float(stationary_m)
+        self.stationary_sec = float(stationary_sec)
+        self.max_rejects = int(max_rejects)
+        self._states = {}
+        self._lock = threading.Lock()
+        self.stats = {'points': 0, 'rejected_accuracy': 0, 'rejected_speed': 0,
+                      'dropped_stationary': 0, 'resets': 0, 'stored': 0}
+
+    def check(self, user_id, latitude, longitude, accuracy=None, ts=None):
+        """
+        Проверить и сгладить точку
+
+        Returns:
+            tuple: (latitude, longitude, reason) — reason None для принятой точки,
+            ACCURACY или SPEED для отброшенной (координаты тогда исходные)
+        """
+        ts = time.time() if ts is None else float(ts)
+        latitude, longitude = float(latitude), float(longitude)
+        accuracy = float(accuracy) if accuracy is not None else DEFAULT_ACCURACY_M
+        with self._lock:
+            self.stats['points'] += 1
+            if accuracy > self.max_accuracy_m:
+                self.stats['rejected_accuracy'] += 1
+                return latitude, longitude, ACCURACY
+            state = self._states.get(user_id)
+            if state is None:
+                state = self._states[user_id] = TrackState()
+            if state.lat is None or ts < state.ts:
+                # Первая точка или точка из прошлого (устройство досылает очередь): оценку не трогаем
+                if state.lat is None:
+                    state.lat, state.lon, state.variance, state.ts = latitude, longitude, accuracy ** 2, ts
+                return latitude, longitude, None
+
+            dt = max(ts - state.ts, 1.0)
+            distance = equirectangular(state.lat, state.lon, latitude, longitude)
+            if (distance - accuracy) / dt > self.max_speed:
+                state.rejects += 1
+                if state.rejects < self.max_rejects:
+                    self.stats['rejected_speed'] += 1
+                    return latitude, longitude, SPEED
+                # Устройство и правда там: начинаем оценку заново
+                self.stats['resets'] += 1
+                state.lat, state.lon, state.variance, state.ts, state.rejects = (
+                    latitude, longitude, accuracy ** 2, ts, 0)
+                return latitude, longitude, None
+            state.rejects = 0
+
+            if not self.smooth:
+                state.lat, state.lon, state.variance, state.ts = latitude, longitude, accuracy ** 2, ts
+                return latitude, longitude, None
+            # Процесс: за время с прошлой точки положение могло уйти на наблюдаемый сдвиг
+            variance = state.variance + distance * distance
+            gain = variance / (variance + accuracy * accuracy)
+            state.lat += gain * (latitude - state.lat)
+            state.lon += gain * (longitude - state.lon)
+            state.variance = (1 - gain) * variance
+            state.ts = ts
+            return state.lat, state.lon, None
+
+    def redundant(self, user_id, point, ts=None):
+        """
+        Точка стоянки, которую можно не писать: почти там же, статус и зона те же,
+        с последней записи прошло меньше stationary_sec. Иначе точка считается записанной
+        """
+        ts = time.time() if ts is None else float(ts)
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is None:
+                state = self._states[user_id] = TrackState()
+            if (
+                self.stationary_sec > 0 and state.stored_ts is not None and
+                0 <= ts - state.stored_ts < self.stationary_sec and
+                point['is_at_work'] == state.is_at_work and point.get('zone_id') == state.zone_id and
+                equirectangular(state.stored_lat, state.stored_lon,
+                                point['latitude'], point['longitude']) < self.stationary_m
+            ):
+                self.stats['dropped_stationary'] += 1
+                return True
+            state.stored_lat, state.stored_lon, state.stored_ts = point['latitude'], point['longitude'], ts
+            state.is_at_work, state.zone_id = point['is_at_work'], point.get('zone_id')
+            self.stats['stored'] += 1
+            return False
+
+    def last_status(self, user_id):
+        """(is_at_work, zone_id) последней записанной точки"""
+        state = self._states.get(user_id)
+        return (state.is_at_work, state.zone_id) if state is not None else (0, None)
+
+    def forget(self, user_id):
+        with self._lock:
+            self._states.pop(user_id, None)
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['devices'] = len(self._states)
+        skipped = stats['rejected_accuracy'] + stats['rejected_speed'] + stats['dropped_stationary']
+        stats['saved_writes_pct'] = round(100.0 * skipped / stats['points'], 1) if stats['points'] else 0.0
+        return stats
+
+
+def create_track_filter():
+    return TrackFilter(
+        max_accuracy_m=config.TRACK_FILTER_MAX_ACCURACY_M,
+        max_speed_kmh=config.TRACK_FILTER_MAX_SPEED_KMH,
+        smooth=config.TRACK_FILTER_SMOOTH,
+        stationary_m=config.TRACK_FILTER_STATIONARY_M,
+        stationary_sec=config.TRACK_FILTER_STATIONARY_SEC,
+    )
+
+
+# Фильтры разделяются всеми экземплярами Database, открытыми на один и тот же файл
+_filters = {}
+_filters_lock = threading.Lock()
+
+
+def get_track_filter(db_path):
+    """Получить общий фильтр трека для файла базы данных"""
+    key = os.path.abspath(db_path)
+    with _filters_lock:
+        track_filter = _filters.get(key)
+        if track_filter is None:
+            track_filter = _filters[key] = create_track_filter()
+        return track_filter
@@ -0,0 +1,150 @@
+"""
+Детекция переходов въезд/выезд по точкам водителя
+
+Правила те же, что исторически применял опрос monitor_database, но вынесены
+в чистые функции, чтобы ими пользовались и инкрементальный обработчик событий,
+и режим повторного прогона по истории (tests/replay_transitions.py).
+
+Если статус уже подтверждён при записи (гистерезис в bot/geofence.py),
+детектор создаётся с confirm=False и уведомляет по первой смене статуса.
+"""
+
+import time
+
+ARRIVAL = 'arrival'
+DEPARTURE = 'departure'
+
+# Сколько последних точек водителя нужно для принятия решения
+WINDOW_SIZE = 3
+# Минимальный интервал между уведомлениями по одному водителю (сек)
+MIN_NOTIFY_INTERVAL_SEC = 10
+# Переход подтверждается, если между двумя точками прошло не меньше (сек)
+CONFIRM_GAP_SEC = 5
+
+
+def parse_created_at(created_at):
+    """Перевести created_at из SQLite ('%Y-%m-%d %H:%M:%S') в timestamp"""
+    try:
+        return time.mktime(time.strptime(created_at, "%Y-%m-%d %H:%M:%S"))
+    except Exception:
+        return None
+
+
+def detect_transition(window, last_checked_id=0, last_notification_type=None, confirm=True):
+    """
+    Найти переход по окну последних точек водителя
+
+    Args:
+        window (list): точки (id, user_id, is_at_work, created_at), от новой к старой
+        last_checked_id (int): id точки, по которой уже отправлено уведомление
+        last_notification_type (str): тип последнего отправленного уведомления
+        confirm (bool): требовать подтверждения смены статуса следующей точкой или паузой
+
+    Returns:
+        dict | None: кандидат на уведомление {'type', 'fast', 'curr_id', 'curr_ts',
+        'user_id', 'dt', 'prev2'} или None
+    """
+    if len(window) < 2:
+        return None
+
+    curr_id, user_id, curr_is_at_work, curr_time = window[0]
+    _prev_id, _prev_user_id, prev_is_at_work, prev_time = window[1]
+    prev2_is_at_work = window[2][2] if len(window) >= 3 else None
+
+    curr_ts = parse_created_at(curr_time)
+    prev_ts = parse_created_at(prev_time)
+    if curr_ts is None or prev_ts is None:
+        # Если формат неожиданный — пропускаем пользователя
+        return None
+
+    dt_prev_curr = curr_ts - prev_ts
+    if curr_id == last_checked_id:
+        return None
+
+    def confirmed_transition(new_state):
+        if not confirm:
+            return True
+        if prev2_is_at_work is not None and prev2_is_at_work == new_state:
+            return True
+        return dt_prev_curr >= CONFIRM_GAP_SEC
+
+    candidate = None
+    if last_notification_type != ARRIVAL:
+        # Въезд 0→1
+        if prev_is_at_work == 0 and curr_is_at_work == 1 and confirmed_transition(1):
+            candidate = (ARRIVAL, False)
+        # Быстрый въезд: последние две точки уже 1, а третья с конца была 0
+        elif prev_is_at_work == 1 and curr_is_at_work == 1 and prev2_is_at_work == 0:
+            candidate = (ARRIVAL, True)
+    if candidate is None and last_notification_type != DEPARTURE:
+        # Выезд 1→0
+        if prev_is_at_work == 1 and curr_is_at_work == 0 and confirmed_transition(0):
+            candidate = (DEPARTURE, False)
+        # Быстрый выезд: последние две точки уже 0, а третья с конца была 1
+        elif prev_is_at_work == 0 and curr_is_at_work == 0 and prev2_is_at_work == 1:
+            candidate = (DEPARTURE, True)
+
+    if candidate is None:
+        return None
+    return {
+        'type': candidate[0],
+        'fast': candidate[1],
+        'curr_id': curr_id,
+        'curr_ts': curr_ts,
+        'user_id': user_id,
+        'dt': dt_prev_curr,
+        'prev2': prev2_is_at_work,
+    }
+
+
+class TransitionDetector:
+    """Инкрементальная машина состояний переходов по каждому водителю"""
+
+    def __init__(self, confirm=True):
+        self.confirm = confirm
+        self.windows = {}
+        self.last_checked_id = {}
+        self.last_checked_time = {}
+        self.last_notification_type = {}
+
+    def restore(self, drivers):
+        """Восстановить последние уведомления из сохранённого состояния {telegram_id: {...}}"""
+        for telegram_id, entry in drivers.items():
+            if 'last_checked_id' in entry:
+                self.last_checked_id[telegram_id] = int(entry['last_checked_id'])
+            if 'last_checked_time' in entry:
+                self.last_checked_time[telegram_id] = float(entry['last_checked_time'])
+            if entry.get('last_notification_type'):
+                self.last_notification_type[telegram_id] = entry['last_notification_type']
+
+    def add_point(self, telegram_id, location_id, user_id, is_at_work, created_at):
+        """Добавить точку в окно водителя. Возвращает False для дублей и устаревших точек"""
+        window = self.windows.setdefault(telegram_id, [])
+        if window and location_id <= window[0][0]:
+            return False
+        window.insert(0, (location_id, user_id, 1 if is_at_work else 0, created_at))
+        del window[WINDOW_SIZE:]
+        return True
+
+    def evaluate(self, telegram_id):
+        """Проверить текущее окно водителя на переход"""
+        window = self.windows.get(telegram_id)
+        if not window:
+            return None
+        return detect_transition(
+            window,
+            self.last_checked_id.get(telegram_id, 0),
+            self.last_notification_type.get(telegram_id),
+            self.confirm,
+        )
+
+    def is_too_early(self, telegram_id, candidate):
+        """Слишком рано после последнего уведомления по этому водителю"""
+        last_time = self.last_checked_time.get(telegram_id, 0.0)
+        return candidate['curr_ts'] - last_time < MIN_NOTIFY_INTERVAL_SEC
+
+    def mark_sent(self, telegram_id, candidate):
+        """Зафиксировать успешно отправленное уведомление"""
+        self.last_checked_id[telegram_id] = candidate['curr_id']
+        self.last_checked_time[telegram_id] = candidate['curr_ts']
+        self.last_notification_type[telegram_id] = candidate['type']
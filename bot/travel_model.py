@@ -0,0 +1,478 @@
+"""
+Модель типичного времени в пути по собственным трекам водителей
+
+Обучение — один проход SQL по всей истории (горячая таблица и месячные
+архивы): оконная функция LAG превращает соседние точки трека в шаги
+(метры, секунды), шаги группируются по ячейке сетки, дню недели и
+интервалу времени суток. В travel_time_stats хранятся только суммы
+(метры, секунды, число шагов), поэтому дообучение на новых точках —
+прибавление к суммам, а сама модель занимает несколько тысяч строк.
+
+Темп (секунд на метр) = сумма секунд / сумма метров: так время по ячейкам
+складывается без смещения, которое дало бы среднее скоростей. Если данных
+по ячейке в нужное время мало, берём её же в тот же тип дня
+(будни/выходные), затем за всё время, затем средний темп города в это
+время.
+
+Маршрут для прогноза — линия маршрута, если она известна, иначе прямая,
+умноженная на коэффициент извилистости, измеренный по реальным поездкам.
+
+Проверка — по прошлым въездам в рабочую зону (переход is_at_work 0 → 1):
+для точек трека за 5–40 минут до въезда сравниваем прогноз с фактическим
+временем. Модель для проверки обучается только на данных до начала
+проверочного периода.
+
+    python -m bot.travel_model train [--full]
+    python -m bot.travel_model eval [--test-days 14]
+"""
+
+import asyncio
+import logging
+import math
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from config.settings import config
+from bot.retention import TIME_FORMAT, list_partitions
+from bot.utils import calculate_distance
+
+logger = logging.getLogger(__name__)
+
+# Шаг трека учитывается, если между точками не больше MAX_STEP_GAP_SEC
+# и скорость правдоподобна (стоянки и выбросы GPS отбрасываются)
+MAX_STEP_GAP_SEC = 180
+MIN_STEP_SPEED_MPS = 0.7
+MAX_STEP_SPEED_MPS = 50.0
+MAX_ACCURACY_M = 100.0
+
+# Уровень (ячейка/время) используется, если по нему набрано столько метров
+MIN_SAMPLE_M = 300.0
+
+# Длина кусочка маршрута при прогнозе
+PREDICT_STEP_M = 100.0
+
+# Поездки для коэффициента извилистости и проверки
+TRIP_MAX_GAP_SEC = 600
+EVAL_OFFSETS_MIN = (5, 10, 20, 40)
+MIN_TRIP_DISTANCE_M = 500.0
+DEFAULT_DETOUR_FACTOR = 1.3
+
+
+def ensure_sql_math(conn):
+    """sqrt/cos/radians/floor в SQL: встроены в сборки SQLite с math functions, иначе регистрируем"""
+    try:
+        conn.execute("SELECT sqrt(4.0), cos(0.0), radians(180.0), floor(1.5)").fetchone()
+    except Exception:
+        conn.create_function('sqrt', 1, math.sqrt, deterministic=True)
+        conn.create_function('cos', 1, math.cos, deterministic=True)
+        conn.create_function('radians', 1, math.radians, deterministic=True)
+        conn.create_function('floor', 1, math.floor, deterministic=True)
+
+
+# Шаги трека → суммы по (ячейка, день недели, интервал суток).
+# Точки с id в (:last_id, :max_id] плюс последняя уже учтённая точка каждого
+# водителя, чтобы первый новый шаг тоже попал в выборку. Верхняя граница —
+# MAX(id), прочитанный до выборки: точки, записанные позже, войдут в следующее
+# дообучение, а не дважды.
+_STEPS_SQL = """
+WITH pts AS (
+    SELECT id, telegram_id, latitude, longitude, accuracy, is_at_work, created_at
+    FROM {table} WHERE id > :last_id AND (:max_id IS NULL OR id <= :max_id)
+      AND (:until IS NULL OR created_at < :until)
+    UNION ALL
+    SELECT t.id, t.telegram_id, t.latitude, t.longitude, t.accuracy, t.is_at_work, t.created_at
+    FROM {table} t JOIN (
+        SELECT MAX(id) AS id FROM {table} WHERE id <= :last_id GROUP BY telegram_id
+    ) b ON t.id = b.id
+),
+seq AS (
+    SELECT id, latitude AS lat, longitude AS lon, accuracy, is_at_work, created_at,
+           LAG(latitude) OVER w AS plat, LAG(longitude) OVER w AS plon,
+           LAG(accuracy) OVER w AS pacc, LAG(is_at_work) OVER w AS pwork,
+           LAG(created_at) OVER w AS prev_ts
+    FROM pts
+    WINDOW w AS (PARTITION BY telegram_id ORDER BY id)
+),
+steps AS (
+    SELECT (julianday(created_at) - julianday(prev_ts)) * 86400.0 AS dt,
+           radians(lon - plon) * cos(radians((lat + plat) / 2)) * 6371000.0 AS dx,
+           radians(lat - plat) * 6371000.0 AS dy,
+           (lat + plat) / 2 AS mlat, (lon + plon) / 2 AS mlon,
+           datetime(prev_ts, :tz) AS local_ts
+    FROM seq
+    WHERE plat IS NOT NULL AND id > :last_id
+      AND NOT (is_at_work AND pwork)
+      AND COALESCE(accuracy, 0) <= :max_acc AND COALESCE(pacc, 0) <= :max_acc
+),
+moving AS (
+    SELECT dt, sqrt(dx * dx + dy * dy) AS dist, mlat, mlon, local_ts
+    FROM steps WHERE dt > 0 AND dt <= :max_gap
+)
+SELECT CAST(floor(mlat / :cell) AS INTEGER) AS ci,
+       CAST(floor(mlon / :cell) AS INTEGER) AS cj,
+       CAST(strftime('%w', local_ts) AS INTEGER) AS dow,
+       CAST(strftime('%H', local_ts) AS INTEGER) / :hpb AS bucket,
+       SUM(dist) AS meters, SUM(dt) AS seconds, COUNT(*) AS steps
+FROM moving
+WHERE dist >= :min_speed * dt AND dist <= :max_speed * dt
+GROUP BY ci, cj, dow, bucket
+"""
+
+# Въезды в рабочую зону: переход is_at_work 0 → 1
+_ARRIVALS_SQL = """
+SELECT id, telegram_id, latitude, longitude, created_at FROM (
+    SELECT id, telegram_id, latitude, longitude, created_at, is_at_work,
+           LAG(is_at_work) OVER (PARTITION BY telegram_id ORDER BY id) AS pwork
+    FROM {table} WHERE (:since IS NULL OR created_at >= :since)
+) WHERE is_at_work = 1 AND pwork = 0
+"""
+
+
+def create_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS travel_time_stats (
+            ci INTEGER NOT NULL,
+            cj INTEGER NOT NULL,
+            dow INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            meters REAL NOT NULL,
+            seconds REAL NOT NULL,
+            steps INTEGER NOT NULL,
+            PRIMARY KEY (ci, cj, dow, bucket)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS travel_time_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+
+def _source_tables(cursor):
+    """Таблицы точек от старых к новым: архивы, затем горячая"""
+    return list(reversed(list_partitions(cursor))) + ['user_locations']
+
+
+def _params(last_id=0, until=None, max_id=None):
+    return {
+        'last_id': last_id,
+        'max_id': max_id,
+        'until': until,
+        'tz': f"{config.TRAVEL_MODEL_TZ_OFFSET_HOURS:+d} hours",
+        'max_acc': MAX_ACCURACY_M,
+        'max_gap': MAX_STEP_GAP_SEC,
+        'min_speed': MIN_STEP_SPEED_MPS,
+        'max_speed': MAX_STEP_SPEED_MPS,
+        'cell': config.TRAVEL_MODEL_CELL_DEG,
+        'hpb': config.TRAVEL_MODEL_HOURS_PER_BUCKET,
+    }
+
+
+def extract_stats(conn, tables, last_id=0, until=None, max_id=None):
+    """
+    Суммы шагов по (ci, cj, dow, bucket) из таблиц точек: [(ci, cj, dow, bucket, метры, секунды, шаги)]
+
+    max_id ограничивает горячую таблицу user_locations; id архивов меньше её id.
+    """
+    ensure_sql_math(conn)
+    totals = {}
+    for table in tables:
+        params = _params(last_id, until, max_id if table == 'user_locations' else None)
+        for ci, cj, dow, bucket, meters, seconds, steps in conn.execute(_STEPS_SQL.format(table=table), params):
+            key = (ci, cj, dow, bucket)
+            m, s, n = totals.get(key, (0.0, 0.0, 0))
+            totals[key] = (m + meters, s + seconds, n + steps)
+    return [key + value for key, value in totals.items()]
+
+
+def _parse_ts(value):
+    return datetime.strptime(value, TIME_FORMAT).replace(tzinfo=timezone.utc)
+
+
+def extract_trips(conn, since=None, until=None, offsets_min=EVAL_OFFSETS_MIN):
+    """
+    Поездки к рабочей зоне: для каждого въезда — точки трека за offsets_min минут до него
+
+    Returns:
+        list: dict(origin_lat, origin_lon, dest_lat, dest_lon, start (datetime UTC),
+                   actual_sec, track_m) — track_m: длина трека от точки до въезда
+    """
+    trips = []
+    cursor = conn.cursor()
+    longest = max(offsets_min)
+    for table in _source_tables(cursor):
+        arrivals = conn.execute(_ARRIVALS_SQL.format(table=table), {'since': since}).fetchall()
+        for arrival_id, telegram_id, dest_lat, dest_lon, arrived_at in arrivals:
+            if until and arrived_at >= until:
+                continue
+            arrived = _parse_ts(arrived_at)
+            window_sec = (longest + 5) * 60
+            # Назад от въезда по индексу (telegram_id, id); курсор читается лениво,
+            # так что просматривается только сама поездка, а не вся история водителя
+            rows = conn.execute(
+                f"SELECT latitude, longitude, is_at_work, created_at FROM {table} "
+                f"WHERE telegram_id = ? AND id <= ? ORDER BY id DESC",
+                (telegram_id, arrival_id)
+            )
+            # Идём от въезда назад, пока трек непрерывен, и набираем длину пройденного пути
+            track_m = 0.0
+            prev_lat, prev_lon, prev_ts = None, None, arrived
+            wanted = sorted(offsets_min)
+            for lat, lon, at_work, created_at in rows:
+                ts = _parse_ts(created_at)
+                # Разрыв трека или предыдущее пребывание на работе — поездка началась позже
+                if (prev_ts - ts).total_seconds() > TRIP_MAX_GAP_SEC or (at_work and prev_lat is not None):
+                    break
+                if (arrived - ts).total_seconds() > window_sec:
+                    break
+                if prev_lat is not None:
+                    track_m += calculate_distance(lat, lon, prev_lat, prev_lon)
+                prev_lat, prev_lon, prev_ts = lat, lon, ts
+                elapsed = (arrived - ts).total_seconds()
+                while wanted and elapsed >= wanted[0] * 60:
+                    wanted.pop(0)
+                    if calculate_distance(lat, lon, dest_lat, dest_lon) >= MIN_TRIP_DISTANCE_M:
+                        trips.append({
+                            'origin_lat': lat, 'origin_lon': lon,
+                            'dest_lat': dest_lat, 'dest_lon': dest_lon,
+                            'start': ts, 'actual_sec': elapsed, 'track_m': track_m,
+                        })
+                if not wanted:
+                    break
+    return trips
+
+
+def detour_factor(trips):
+    """Медиана отношения длины трека к прямому расстоянию"""
+    ratios = []
+    for trip in trips:
+        straight = calculate_distance(trip['origin_lat'], trip['origin_lon'], trip['dest_lat'], trip['dest_lon'])
+        if straight > 0 and trip['track_m'] >= straight:
+            ratios.append(trip['track_m'] / straight)
+    return statistics.median(ratios) if ratios else DEFAULT_DETOUR_FACTOR
+
+
+class TravelTimeModel:
+    """Темп по ячейкам с откатом к более общим уровням; хранит только агрегаты"""
+
+    def __init__(self, rows, detour=DEFAULT_DETOUR_FACTOR, cell_deg=None, hours_per_bucket=None,
+                 tz_offset_hours=None, min_sample_m=MIN_SAMPLE_M):
+        self.cell_deg = cell_deg or config.TRAVEL_MODEL_CELL_DEG
+        self.hours_per_bucket = hours_per_bucket or config.TRAVEL_MODEL_HOURS_PER_BUCKET
+        self.tz_offset = timedelta(hours=config.TRAVEL_MODEL_TZ_OFFSET_HOURS if tz_offset_hours is None else tz_offset_hours)
+        self.detour = float(detour)
+        self.min_sample_m = min_sample_m
+        # Уровни: (ячейка, день, интервал) → (ячейка, будни/выходные, интервал) → ячейка → город в это время → город
+        levels = [{}, {}, {}, {}, {}]
+        for ci, cj, dow, bucket, meters, seconds, _steps in rows:
+            daytype = 1 if dow in (0, 6) else 0
+            for level, key in enumerate(((ci, cj, dow, bucket), (ci, cj, daytype, bucket), (ci, cj),
+                                         (daytype, bucket), ())):
+                m, s = levels[level].get(key, (0.0, 0.0))
+                levels[level][key] = (m + meters, s + seconds)
+        # Оставляем только темп (секунд на метр) там, где данных достаточно
+        self._pace = [{k: s / m for k, (m, s) in level.items() if m >= min_sample_m} for level in levels]
+        self.trained_meters = sum(m for m, _s in levels[4].values())
+
+    def __bool__(self):
+        return bool(self._pace[4])
+
+    @property
+    def size(self):
+        return sum(len(level) for level in self._pace)
+
+    def pace(self, lat, lon, when):
+        """(секунд на метр, уровень 0..4) для точки в момент when (UTC)"""
+        local = when + self.tz_offset
+        dow = (local.weekday() + 1) % 7  # как strftime('%w'): 0 — воскресенье
+        bucket = local.hour // self.hours_per_bucket
+        daytype = 1 if dow in (0, 6) else 0
+        ci, cj = math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+        for level, key in enumerate(((ci, cj, dow, bucket), (ci, cj, daytype, bucket), (ci, cj),
+                                     (daytype, bucket), ())):
+            value = self._pace[level].get(key)
+            if value is not None:
+                return value, level
+        return None, None
+
+    def predict(self, from_lat, from_lon, to_lat, to_lon, when=None, points=None):
+        """
+        Время в пути по линии маршрута (или по прямой с коэффициентом извилистости)
+
+        Returns:
+            tuple: (секунды, метры, покрытие) — покрытие: доля пути, где темп известен по самой ячейке
+        """
+        when = when or datetime.now(timezone.utc)
+        path = points or [(from_lat, from_lon), (to_lat, to_lon)]
+        factor = 1.0 if points else self.detour
+        seconds = meters = covered = 0.0
+        for (lat1, lon1), (lat2, lon2) in zip(path, path[1:]):
+            length = calculate_distance(lat1, lon1, lat2, lon2) * factor
+            pieces = max(1, int(math.ceil(length / PREDICT_STEP_M)))
+            for k in range(pieces):
+                t = (k + 0.5) / pieces
+                pace, level = self.pace(lat1 + (lat2 - lat1) * t, lon1 + (lon2 - lon1) * t,
+                                        when + timedelta(seconds=seconds))
+                if pace is None:
+                    return None, None, 0.0
+                piece = length / pieces
+                seconds += piece * pace
+                meters += piece
+                if level <= 2:
+                    covered += piece
+        return seconds, meters, (covered / meters if meters else 0.0)
+
+    @classmethod
+    def load(cls, conn):
+        """Модель из travel_time_stats (пустая, если обучения ещё не было)"""
+        try:
+            rows = conn.execute("SELECT ci, cj, dow, bucket, meters, seconds, steps FROM travel_time_stats").fetchall()
+            meta = dict(conn.execute("SELECT key, value FROM travel_time_meta").fetchall())
+        except Exception:
+            rows, meta = [], {}
+        return cls(rows, detour=float(meta.get('detour_factor') or DEFAULT_DETOUR_FACTOR))
+
+
+def train(database, full=False):
+    """
+    Дообучение на новых точках горячей таблицы (или полное переобучение по всей истории)
+
+    Returns:
+        dict: сколько групп обновлено, новый last_id, коэффициент извилистости
+    """
+    started = time.perf_counter()
+    conn = database.get_connection()
+    try:
+        cursor = conn.cursor()
+        create_tables(cursor)
+        meta = dict(cursor.execute("SELECT key, value FROM travel_time_meta").fetchall())
+        last_id = 0 if full else int(meta.get('last_id') or 0)
+        max_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM user_locations").fetchone()[0]
+        tables = _source_tables(cursor) if full else ['user_locations']
+        rows = extract_stats(conn, tables, last_id=last_id, max_id=max_id)
+        # Поездки для коэффициента извилистости — только при полном обучении или раз в сутки,
+        # при дообучении — за последние TRAVEL_MODEL_DETOUR_DAYS дней
+        refresh_detour = full or time.time() - float(meta.get('detour_at') or 0) > 86400
+        if refresh_detour:
+            since = None if full else (datetime.now(timezone.utc) - timedelta(days=config.TRAVEL_MODEL_DETOUR_DAYS)).strftime(TIME_FORMAT)
+            detour = detour_factor(extract_trips(conn, since=since))
+        else:
+            detour = float(meta.get('detour_factor') or DEFAULT_DETOUR_FACTOR)
+
+        if full:
+            cursor.execute("DELETE FROM travel_time_stats")
+        cursor.executemany('''
+            INSERT INTO travel_time_stats (ci, cj, dow, bucket, meters, seconds, steps)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(ci, cj, dow, bucket) DO UPDATE SET
+                meters = meters + excluded.meters,
+                seconds = seconds + excluded.seconds,
+                steps = steps + excluded.steps
+        ''', rows)
+        updates = [('last_id', str(max_id)), ('trained_at', str(time.time()))]
+        if refresh_detour:
+            updates += [('detour_factor', f"{detour:.3f}"), ('detour_at', str(time.time()))]
+        cursor.executemany("INSERT OR REPLACE INTO travel_time_meta (key, value) VALUES (?, ?)", updates)
+        conn.commit()
+    finally:
+        conn.close()
+    result = {'groups': len(rows), 'last_id': max_id, 'detour_factor': round(detour, 3),
+              'elapsed_sec': round(time.perf_counter() - started, 2)}
+    logger.info(f"🧠 TRAVEL_MODEL: {'полное обучение' if full else 'дообучение'}: {result}")
+    return result
+
+
+def evaluate(database, test_days=14, speed_kmh=None):
+    """
+    Проверка на въездах последних test_days дней; модель обучается на данных до них
+
+    Returns:
+        dict: число поездок и ошибки модели и оценки по прямой (MAE, MAPE, p90)
+    """
+    # Та же средняя скорость, что у оценки по прямой в /api/eta
+    speed_kmh = speed_kmh or float(os.environ.get('ETA_FALLBACK_SPEED_KMH', 30))
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=test_days)).strftime(TIME_FORMAT)
+    conn = database.get_connection()
+    try:
+        ensure_sql_math(conn)
+        tables = _source_tables(conn.cursor())
+        train_trips = extract_trips(conn, until=cutoff)
+        model = TravelTimeModel(extract_stats(conn, tables, until=cutoff), detour=detour_factor(train_trips))
+        test_trips = extract_trips(conn, since=cutoff)
+    finally:
+        conn.close()
+
+    errors = {'model': [], 'straight_line': []}
+    covered = []
+    for trip in test_trips:
+        actual = trip['actual_sec']
+        predicted, _meters, coverage = model.predict(trip['origin_lat'], trip['origin_lon'],
+                                                     trip['dest_lat'], trip['dest_lon'], when=trip['start'])
+        straight = calculate_distance(trip['origin_lat'], trip['origin_lon'], trip['dest_lat'], trip['dest_lon'])
+        baseline = straight / (speed_kmh / 3.6)
+        if predicted is not None:
+            errors['model'].append((predicted - actual, actual))
+            covered.append(coverage)
+        errors['straight_line'].append((baseline - actual, actual))
+
+    def summary(pairs):
+        if not pairs:
+            return None
+        abs_err = sorted(abs(e) for e, _a in pairs)
+        return {
+            'n': len(pairs),
+            'mae_sec': round(statistics.mean(abs_err), 1),
+            'mape': round(statistics.mean(abs(e) / a for e, a in pairs if a > 0) * 100, 1),
+            'p90_sec': round(abs_err[min(len(abs_err) - 1, int(0.9 * len(abs_err)))], 1),
+            'bias_sec': round(statistics.mean(e for e, _a in pairs), 1),
+        }
+
+    return {
+        'test_since': cutoff,
+        'train_trips': len(train_trips),
+        'test_trips': len(test_trips),
+        'model_size': model.size,
+        'detour_factor': round(model.detour, 3),
+        'mean_coverage': round(statistics.mean(covered), 3) if covered else None,
+        'model': summary(errors['model']),
+        'straight_line': summary(errors['straight_line']),
+    }
+
+
+class TravelModelTrainer:
+    """Периодическое дообучение в event loop бота"""
+
+    def __init__(self, database):
+        self.database = database
+
+    async def run_forever(self, interval_sec):
+        loop = asyncio.get_running_loop()
+        logger.info(f"🚀 TRAVEL_MODEL: дообучение каждые {interval_sec} с")
+        while True:
+            try:
+                await loop.run_in_executor(None, train, self.database)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ TRAVEL_MODEL: ошибка обучения: {e}")
+            await asyncio.sleep(interval_sec)
+
+
+if __name__ == '__main__':
+    from bot.database import db
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    command = sys.argv[1] if len(sys.argv) > 1 else 'train'
+    if command == 'train':
+        print(train(db, full='--full' in sys.argv))
+    elif command == 'eval':
+        days = int(sys.argv[sys.argv.index('--test-days') + 1]) if '--test-days' in sys.argv else 14
+        for key, value in evaluate(db, test_days=days).items():
+            print(f"{key}: {value}")
+    else:
+        print(__doc__)
+        sys.exit(1)
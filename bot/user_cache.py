@@ -0,0 +1,147 @@
+"""
+Кэш профилей пользователей в памяти процесса (TTL + LRU)
+
+get_user_by_telegram_id и соседние методы вызываются почти на каждый запрос
+и на каждого получателя уведомления. Кэш хранит профиль один раз и находит
+его по id, telegram_id, login и email. Все изменения users в Database
+сбрасывают запись явно. Изменения из другого процесса (веб ↔ бот) становятся
+видны не позже чем через TTL.
+
+Отсутствие пользователя не кэшируется: только что созданный пользователь
+должен находиться сразу.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from config.settings import config
+
+LOOKUP_FIELDS = ('id', 'telegram_id', 'login', 'email')
+
+
+def _normalize(field, value):
+    if value is None:
+        return None
+    if field in ('id', 'telegram_id'):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return value
+    if field == 'email':
+        return str(value).strip().lower() or None
+    return value
+
+
+def _copy_user(user):
+    """Копия профиля: вызывающий код может менять dict и список кнопок"""
+    copy = dict(user)
+    if isinstance(copy.get('buttons'), list):
+        copy['buttons'] = list(copy['buttons'])
+    return copy
+
+
+class UserCache:
+    """Потокобезопасный TTL+LRU кэш профилей с поиском по нескольким ключам"""
+
+    def __init__(self, max_size=1024, ttl_sec=30, enabled=True):
+        self.max_size = max(1, int(max_size))
+        self.ttl_sec = float(ttl_sec)
+        self.enabled = enabled
+        self._entries = OrderedDict()   # user_id -> (expires_at, user, keys)
+        self._keys = {}                 # (field, value) -> user_id
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, field, value):
+        """Профиль из кэша (копия) или None"""
+        if not self.enabled:
+            return None
+        key = (field, _normalize(field, value))
+        now = time.monotonic()
+        with self._lock:
+            user_id = key[1] if field == 'id' else self._keys.get(key)
+            entry = self._entries.get(user_id) if user_id is not None else None
+            if entry is None or entry[0] <= now or key not in entry[2]:
+                if entry is not None and entry[0] <= now:
+                    self._drop(user_id)
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.stats['hits'] += 1
+            return _copy_user(entry[1])
+
+    def put(self, user):
+        """Положить профиль, прочитанный из базы"""
+        if not self.enabled or not user or user.get('id') is None:
+            return
+        user_id = user['id']
+        keys = {(field, _normalize(field, user.get(field))) for field in LOOKUP_FIELDS}
+        keys = {k for k in keys if k[1] is not None}
+        with self._lock:
+            self._drop(user_id)
+            for key in keys:
+                # Ключ мог принадлежать другому пользователю (например, перепривязанный telegram_id)
+                other = self._keys.get(key)
+                if other is not None and other != user_id:
+                    self._drop(other)
+            self._entries[user_id] = (time.monotonic() + self.ttl_sec, _copy_user(user), keys)
+            for key in keys:
+                self._keys[key] = user_id
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, field, value):
+        """Сбросить все записи, у которых поле field равно value"""
+        target = _normalize(field, value)
+        if target is None:
+            return
+        with self._lock:
+            stale = [user_id for user_id, (_exp, _user, keys) in self._entries.items() if (field, target) in keys]
+            for user_id in stale:
+                self._drop(user_id)
+            self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+
+    def _drop(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        for key in entry[2]:
+            if self._keys.get(key) == user_id:
+                del self._keys[key]
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+# Кэши разделяются всеми экземплярами Database, открытыми на один и тот же файл
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_user_cache(db_path):
+    """Получить общий кэш профилей для файла базы данных"""
+    key = os.path.abspath(db_path)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = UserCache(
+                max_size=config.USER_CACHE_SIZE,
+                ttl_sec=config.USER_CACHE_TTL_SEC,
+                enabled=config.USER_CACHE_ENABLED,
+            )
+            _caches[key] = cache
+        return cache
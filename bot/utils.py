@@ -1,31 +1,10 @@
-import math
 import logging
 from datetime import datetime, timedelta
 from config.settings import config
+from bot.geo import haversine as calculate_distance, is_within
 
 logger = logging.getLogger(__name__)
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """
-    Расчет расстояния между двумя точками по формуле гаверсинуса
-    Возвращает расстояние в метрах
-    """
-    R = 6371000  # Радиус Земли в метрах
-    
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    delta_lat = math.radians(lat2 - lat1)
-    delta_lon = math.radians(lon2 - lon1)
-    
-    a = (math.sin(delta_lat / 2) ** 2 + 
-         math.cos(lat1_rad) * math.cos(lat2_rad) * 
-         math.sin(delta_lon / 2) ** 2)
-    
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    distance = R * c
-    
-    return distance
-
 def is_at_work(latitude, longitude, user_role=None, user_work_lat=None, user_work_lon=None, user_work_radius=None):
     """
     Проверка, ожидает ли водитель (находится в рабочей зоне)
@@ -46,11 +25,7 @@ def is_at_work(latitude, longitude, user_role=None, user_work_lat=None, user_wor
         # Если координаты не установлены, возвращаем False
         return False
     
-    distance = calculate_distance(
-        latitude, longitude,
-        work_lat, work_lon
-    )
-    return distance <= work_radius
+    return is_within(latitude, longitude, work_lat, work_lon, work_radius)
 
 def get_greeting():
     """
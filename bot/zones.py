@@ -0,0 +1,503 @@
+"""
+Рабочие зоны водителей: несколько именованных кругов и многоугольников на пользователя
+
+Зоны хранятся в таблице zones (создаётся в Database.init_db). ZoneIndex
+держит их в памяти в сетке ячеек с ключом (пользователь, ячейка): поиск
+"в какой зоне точка" проверяет только зоны, задевающие ячейку точки, а не
+все зоны парка. Изменения применяются к индексу точечно: запись в zones
+получает новую ревизию, удаление мягкое (is_active = 0), и другие процессы
+раз в ZONES_REFRESH_SEC дочитывают только строки с ревизией новее своей.
+
+Прежняя одиночная зона из профиля (work_latitude/work_longitude/work_radius)
+работает как раньше и считается зоной с id 0.
+
+ZoneTransitionTracker выделяет въезды и выезды по каждой зоне отдельно:
+переезд из одной зоны в другую — это выезд из первой и въезд во вторую,
+хотя статус "в работе" при этом не меняется.
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from config.settings import config
+from bot.db_pool import get_pool
+from bot.geo import haversine, is_within
+from bot.transitions import ARRIVAL, DEPARTURE, CONFIRM_GAP_SEC, parse_created_at
+
+logger = logging.getLogger(__name__)
+
+CIRCLE = 'circle'
+POLYGON = 'polygon'
+
+# Зона из профиля пользователя (work_latitude/work_longitude/work_radius)
+PROFILE_ZONE_ID = 0
+PROFILE_ZONE_NAME = 'Работа'
+
+MAX_RADIUS_M = 20000
+MAX_POLYGON_POINTS = 500
+
+_M_PER_DEG = 111320.0
+
+# Зоны, задевающие больше ячеек, не раскладываются по сетке, а проверяются всегда
+MAX_CELLS_PER_ZONE = 400
+
+ZONE_COLUMNS = ('id', 'user_id', 'name', 'kind', 'latitude', 'longitude', 'radius', 'polygon',
+                'is_active', 'revision')
+
+
+class ZoneError(ValueError):
+    """Некорректное описание зоны"""
+
+
+def point_in_polygon(lat, lon, polygon):
+    """Точка внутри многоугольника [[lat, lon], ...] (метод лучей, граница — внутри)"""
+    inside = False
+    n = len(polygon)
+    for i in range(n):
+        lat1, lon1 = polygon[i]
+        lat2, lon2 = polygon[i - 1]
+        if (lat1 > lat) != (lat2 > lat):
+            cross = lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1)
+            if lon == cross:
+                return True
+            if lon < cross:
+                inside = not inside
+        elif lat1 == lat2 == lat and min(lon1, lon2) <= lon <= max(lon1, lon2):
+            return True
+    return inside
+
+
+class Zone:
+    """Круг (центр + радиус в метрах) или многоугольник с ограничивающим прямоугольником"""
+
+    __slots__ = ('id', 'user_id', 'name', 'kind', 'latitude', 'longitude', 'radius', 'polygon',
+                 'bbox', 'area')
+
+    def __init__(self, zone_id, user_id, name, kind, latitude=None, longitude=None, radius=None, polygon=None):
+        self.id = zone_id
+        self.user_id = user_id
+        self.name = name
+        self.kind = kind
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius
+        self.polygon = polygon
+        if kind == CIRCLE:
+            # С запасом 1%: _M_PER_DEG чуть больше градуса по гаверсинусу
+            dlat = radius * 1.01 / _M_PER_DEG
+            dlon = radius * 1.01 / (_M_PER_DEG * max(0.01, math.cos(math.radians(latitude))))
+            self.bbox = (latitude - dlat, longitude - dlon, latitude + dlat, longitude + dlon)
+            self.area = math.pi * radius * radius
+        else:
+            lats = [p[0] for p in polygon]
+            lons = [p[1] for p in polygon]
+            self.bbox = (min(lats), min(lons), max(lats), max(lons))
+            kx = _M_PER_DEG * math.cos(math.radians(lats[0]))
+            # Площадь по формуле шнурования в локальной проекции — для выбора самой точной зоны
+            self.area = abs(sum(
+                (polygon[i - 1][1] * kx) * (polygon[i][0] * _M_PER_DEG) -
+                (polygon[i][1] * kx) * (polygon[i - 1][0] * _M_PER_DEG)
+                for i in range(len(polygon))
+            )) / 2
+
+    @classmethod
+    def from_row(cls, row):
+        data = dict(zip(ZONE_COLUMNS, row))
+        polygon = json.loads(data['polygon']) if data['polygon'] else None
+        return cls(data['id'], data['user_id'], data['name'], data['kind'],
+                   data['latitude'], data['longitude'], data['radius'], polygon)
+
+    def contains(self, lat, lon):
+        min_lat, min_lon, max_lat, max_lon = self.bbox
+        if not (min_lat <= lat <= max_lat and min_lon <= lon <= max_lon):
+            return False
+        if self.kind == CIRCLE:
+            return is_within(lat, lon, self.latitude, self.longitude, self.radius)
+        return point_in_polygon(lat, lon, self.polygon)
+
+    def signed_distance(self, lat, lon):
+        """Расстояние до границы зоны в метрах: отрицательное внутри, положительное снаружи"""
+        if self.kind == CIRCLE:
+            return haversine(lat, lon, self.latitude, self.longitude) - self.radius
+        kx = _M_PER_DEG * math.cos(math.radians(lat))
+        px, py = lon * kx, lat * _M_PER_DEG
+        nearest = math.inf
+        for (lat1, lon1), (lat2, lon2) in zip(self.polygon, self.polygon[1:] + self.polygon[:1]):
+            x1, y1, x2, y2 = lon1 * kx, lat1 * _M_PER_DEG, lon2 * kx, lat2 * _M_PER_DEG
+            dx, dy = x2 - x1, y2 - y1
+            seg_sq = dx * dx + dy * dy
+            t = 0.0 if seg_sq == 0 else max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / seg_sq))
+            nearest = min(nearest, math.hypot(px - (x1 + t * dx), py - (y1 + t * dy)))
+        return -nearest if point_in_polygon(lat, lon, self.polygon) else nearest
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'kind': self.kind,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'radius': self.radius,
+            'polygon': self.polygon,
+        }
+
+
+def profile_zone(user_info):
+    """Зона из профиля пользователя как Zone или None, если она не задана"""
+    work_lat, work_lon = user_info.get('work_latitude'), user_info.get('work_longitude')
+    work_radius = user_info.get('work_radius')
+    if work_lat is None or work_lon is None or work_radius is None:
+        return None
+    return Zone(PROFILE_ZONE_ID, user_info.get('id'), PROFILE_ZONE_NAME, CIRCLE,
+                float(work_lat), float(work_lon), float(work_radius))
+
+
+def validate_zone(name, kind, latitude=None, longitude=None, radius=None, polygon=None):
+    """
+    Проверить и нормализовать описание зоны
+
+    Returns:
+        tuple: (name, kind, latitude, longitude, radius, polygon) для записи в БД
+    Raises:
+        ZoneError: описание некорректно
+    """
+    name = (name or '').strip()
+    if not name or len(name) > 100:
+        raise ZoneError('Название зоны — от 1 до 100 символов')
+    if kind == CIRCLE:
+        try:
+            latitude, longitude, radius = float(latitude), float(longitude), float(radius)
+        except (TypeError, ValueError):
+            raise ZoneError('Некорректные координаты или радиус зоны')
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ZoneError('Некорректные координаты центра')
+        if not (0 < radius <= MAX_RADIUS_M):
+            raise ZoneError(f'Радиус — от 1 до {MAX_RADIUS_M} м')
+        return name, kind, latitude, longitude, radius, None
+    if kind == POLYGON:
+        try:
+            points = [[float(lat), float(lon)] for lat, lon in polygon]
+        except (TypeError, ValueError):
+            raise ZoneError('Некорректные вершины многоугольника')
+        if len(points) > 1 and points[0] == points[-1]:
+            points.pop()
+        if not (3 <= len(points) <= MAX_POLYGON_POINTS):
+            raise ZoneError(f'Многоугольник — от 3 до {MAX_POLYGON_POINTS} вершин')
+        if not all(-90 <= lat <= 90 and -180 <= lon <= 180 for lat, lon in points):
+            raise ZoneError('Некорректные координаты вершин')
+        # Центр храним для карты и сортировки
+        center_lat = sum(p[0] for p in points) / len(points)
+        center_lon = sum(p[1] for p in points) / len(points)
+        return name, kind, center_lat, center_lon, None, points
+    raise ZoneError(f"Неизвестный тип зоны: {kind}")
+
+
+class ZoneIndex:
+    """Сеточный индекс зон с инкрементальной синхронизацией по ревизии"""
+
+    def __init__(self, db_path, cell_deg=0.01, refresh_sec=5.0):
+        self.db_path = db_path
+        self.cell_deg = float(cell_deg)
+        self.refresh_sec = float(refresh_sec)
+        self._zones = {}       # id -> Zone
+        self._cells = {}       # (user_id, ci, cj) -> [Zone]
+        self._large = {}       # user_id -> [Zone] — зоны больше MAX_CELLS_PER_ZONE ячеек
+        self._revision = 0
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self.stats = {'lookups': 0, 'candidates': 0, 'hits': 0, 'syncs': 0, 'applied': 0}
+
+    # ---------- сетка ----------
+
+    def _cells_of(self, zone):
+        """Ключи ячеек, которые задевает зона, или None для слишком большой зоны"""
+        min_lat, min_lon, max_lat, max_lon = zone.bbox
+        rows = range(int(math.floor(min_lat / self.cell_deg)), int(math.floor(max_lat / self.cell_deg)) + 1)
+        cols = range(int(math.floor(min_lon / self.cell_deg)), int(math.floor(max_lon / self.cell_deg)) + 1)
+        if len(rows) * len(cols) > MAX_CELLS_PER_ZONE:
+            return None
+        return [(zone.user_id, ci, cj) for ci in rows for cj in cols]
+
+    # Списки в ячейках не меняются на месте, а заменяются: поиск идёт без блокировки
+
+    def _remove(self, zone_id):
+        zone = self._zones.pop(zone_id, None)
+        if zone is None:
+            return
+        keys = self._cells_of(zone)
+        if keys is None:
+            rest = [z for z in self._large.get(zone.user_id, ()) if z.id != zone_id]
+            if rest:
+                self._large[zone.user_id] = rest
+            else:
+                self._large.pop(zone.user_id, None)
+            return
+        for key in keys:
+            rest = [z for z in self._cells.get(key, ()) if z.id != zone_id]
+            if rest:
+                self._cells[key] = rest
+            else:
+                self._cells.pop(key, None)
+
+    def _insert(self, zone):
+        self._zones[zone.id] = zone
+        keys = self._cells_of(zone)
+        if keys is None:
+            self._large[zone.user_id] = self._large.get(zone.user_id, []) + [zone]
+            return
+        for key in keys:
+            self._cells[key] = self._cells.get(key, []) + [zone]
+
+    def _apply(self, rows):
+        """Применить изменённые строки zones к индексу"""
+        for row in rows:
+            data = dict(zip(ZONE_COLUMNS, row))
+            self._remove(data['id'])
+            if data['is_active']:
+                try:
+                    zone = Zone.from_row(row)
+                except Exception as e:
+                    logger.error(f"❌ ZONES: зона {data['id']} не загружена: {e}")
+                    continue
+                self._insert(zone)
+            self._revision = max(self._revision, data['revision'])
+        self.stats['applied'] += len(rows)
+
+    def refresh(self, force=False):
+        """Дочитать изменения зон из базы (не чаще раза в refresh_sec)"""
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.refresh_sec:
+            return
+        with self._lock:
+            if not force and self._checked_at is not None and now - self._checked_at < self.refresh_sec:
+                return
+            conn = get_pool(self.db_path).get_connection()
+            try:
+                rows = conn.execute(
+                    f"SELECT {', '.join(ZONE_COLUMNS)} FROM zones WHERE revision > ? ORDER BY revision",
+                    (self._revision,)
+                ).fetchall()
+            finally:
+                conn.close()
+            self._apply(rows)
+            self._checked_at = time.monotonic()
+            self.stats['syncs'] += 1
+            if rows:
+                logger.info(f"🗺️ ZONES: применено изменений: {len(rows)}, активных зон: {len(self._zones)}")
+
+    # ---------- поиск ----------
+
+    def candidates(self, user_id, lat, lon):
+        """Зоны пользователя, задевающие ячейку точки (без проверки попадания)"""
+        self.refresh()
+        key = (user_id, int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg)))
+        candidates = self._cells.get(key, [])
+        large = self._large.get(user_id)
+        if large:
+            candidates = candidates + large
+        return candidates
+
+    def find(self, user_id, lat, lon):
+        """Зона пользователя, в которой точка (самая маленькая из перекрывающихся), или None"""
+        candidates = self.candidates(user_id, lat, lon)
+        best = None
+        for zone in candidates:
+            if zone.contains(lat, lon) and (best is None or zone.area < best.area):
+                best = zone
+        self.stats['lookups'] += 1
+        self.stats['candidates'] += len(candidates)
+        if best is not None:
+            self.stats['hits'] += 1
+        return best
+
+    def resolve(self, user_info, lat, lon):
+        """
+        Статус "в работе" и зона для точки пользователя
+
+        Returns:
+            tuple: (в работе, id зоны или None); зона из профиля — PROFILE_ZONE_ID
+        """
+        if user_info.get('role') == 'recipient':
+            return False, None
+        zone = self.find(user_info.get('id'), float(lat), float(lon))
+        if zone is not None:
+            return True, zone.id
+        zone = profile_zone(user_info)
+        if zone is not None and zone.contains(float(lat), float(lon)):
+            return True, PROFILE_ZONE_ID
+        return False, None
+
+    def get(self, zone_id):
+        self.refresh()
+        return self._zones.get(zone_id)
+
+    def zone_name(self, zone_id):
+        if zone_id == PROFILE_ZONE_ID:
+            return PROFILE_ZONE_NAME
+        zone = self.get(zone_id) if zone_id is not None else None
+        return zone.name if zone is not None else None
+
+    def user_zones(self, user_id):
+        self.refresh()
+        return sorted((z for z in self._zones.values() if z.user_id == user_id), key=lambda z: z.id)
+
+    # ---------- изменения ----------
+
+    def _write(self, sql, params, zone_id=None):
+        """Записать изменение с новой ревизией и сразу применить его к индексу"""
+        with self._lock:
+            conn = get_pool(self.db_path).get_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(sql, params)
+                zone_id = zone_id if zone_id is not None else cursor.lastrowid
+                changed = cursor.rowcount
+                row = cursor.execute(f"SELECT {', '.join(ZONE_COLUMNS)} FROM zones WHERE id = ?", (zone_id,)).fetchone()
+                conn.commit()
+            finally:
+                conn.close()
+            if row is not None:
+                self._apply([row])
+        return zone_id if changed else None
+
+    def add_zone(self, user_id, name, kind, latitude=None, longitude=None, radius=None, polygon=None):
+        """Создать зону. Возвращает id"""
+        name, kind, latitude, longitude, radius, polygon = validate_zone(name, kind, latitude, longitude, radius, polygon)
+        return self._write('''
+            INSERT INTO zones (user_id, name, kind, latitude, longitude, radius, polygon, revision)
+            VALUES (?, ?, ?, ?, ?, ?, ?, (SELECT COALESCE(MAX(revision), 0) + 1 FROM zones))
+        ''', (user_id, name, kind, latitude, longitude, radius, json.dumps(polygon) if polygon else None))
+
+    def update_zone(self, user_id, zone_id, name, kind, latitude=None, longitude=None, radius=None, polygon=None):
+        """Изменить зону пользователя. Возвращает id или None, если зоны нет"""
+        name, kind, latitude, longitude, radius, polygon = validate_zone(name, kind, latitude, longitude, radius, polygon)
+        return self._write('''
+            UPDATE zones SET name = ?, kind = ?, latitude = ?, longitude = ?, radius = ?, polygon = ?,
+                   revision = (SELECT COALESCE(MAX(revision), 0) + 1 FROM zones),
+                   updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND user_id = ? AND is_active = 1
+        ''', (name, kind, latitude, longitude, radius, json.dumps(polygon) if polygon else None,
+              zone_id, user_id), zone_id)
+
+    def delete_zone(self, user_id, zone_id):
+        """Удалить зону пользователя (мягко, чтобы другие процессы увидели изменение)"""
+        return self._write('''
+            UPDATE zones SET is_active = 0,
+                   revision = (SELECT COALESCE(MAX(revision), 0) + 1 FROM zones),
+                   updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND user_id = ? AND is_active = 1
+        ''', (zone_id, user_id), zone_id) is not None
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['zones'] = len(self._zones)
+        stats['cells'] = len(self._cells)
+        stats['revision'] = self._revision
+        stats['avg_candidates'] = round(stats['candidates'] / stats['lookups'], 3) if stats['lookups'] else 0.0
+        return stats
+
+
+class ZoneTransitionTracker:
+    """
+    Въезды и выезды по каждой зоне
+
+    Новое состояние (зона или "вне зон") подтверждается второй точкой подряд
+    или точкой, пришедшей через CONFIRM_GAP_SEC и больше после предыдущей, —
+    те же правила, что у общего статуса в bot/transitions.py. Первая точка
+    водителя только задаёт состояние. С confirm=False (зона уже подтверждена
+    при записи, см. bot/geofence.py) переход засчитывается сразу.
+    """
+
+    def __init__(self, confirm=True):
+        self.confirm = confirm
+        self._state = {}    # telegram_id -> {'zone', 'last_id', 'last_ts', 'pending'}
+
+    def last_zone(self, telegram_id):
+        """Зона последней принятой точки водителя"""
+        state = self._state.get(telegram_id)
+        if state is None:
+            return None
+        return state['pending'] if state['pending'] is not None else state['zone']
+
+    def add_point(self, telegram_id, location_id, user_id, zone_id, created_at):
+        """
+        Returns:
+            list: переходы [{'type', 'zone_id', 'user_id', 'telegram_id', 'location_id', 'created_at'}]
+        """
+        ts = parse_created_at(created_at) if isinstance(created_at, str) else created_at
+        state = self._state.get(telegram_id)
+        if state is None:
+            self._state[telegram_id] = {'zone': zone_id, 'last_id': location_id, 'last_ts': ts, 'pending': None}
+            return []
+        if location_id <= state['last_id']:
+            return []
+        gap = (ts - state['last_ts']) if ts is not None and state['last_ts'] is not None else 0
+        state['last_id'], state['last_ts'] = location_id, ts
+
+        if zone_id == state['zone']:
+            state['pending'] = None
+            return []
+        confirmed = not self.confirm or state['pending'] == zone_id or gap >= CONFIRM_GAP_SEC
+        if not confirmed:
+            state['pending'] = zone_id
+            return []
+
+        previous = state['zone']
+        state['zone'], state['pending'] = zone_id, None
+        base = {'user_id': user_id, 'telegram_id': telegram_id, 'location_id': location_id, 'created_at': created_at}
+        transitions = []
+        if previous is not None:
+            transitions.append(dict(base, type=DEPARTURE, zone_id=previous))
+        if zone_id is not None:
+            transitions.append(dict(base, type=ARRIVAL, zone_id=zone_id))
+        return transitions
+
+
+def record_transitions(database, transitions):
+    """
+    Сохранить переходы по зонам; повтор после перезапуска бота не дублируется
+
+    Returns:
+        list: только новые переходы
+    """
+    if not transitions:
+        return []
+    conn = database.get_connection()
+    new = []
+    try:
+        cursor = conn.cursor()
+        for t in transitions:
+            cursor.execute('''
+                INSERT OR IGNORE INTO zone_transitions (user_id, zone_id, type, location_id, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (t['user_id'], t['zone_id'], t['type'], t['location_id'], t['created_at']))
+            if cursor.rowcount:
+                new.append(t)
+        conn.commit()
+    finally:
+        conn.close()
+    return new
+
+
+# Индексы разделяются всеми экземплярами Database, открытыми на один и тот же файл
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_zone_index(db_path):
+    """Получить общий индекс зон для файла базы данных"""
+    key = os.path.abspath(db_path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = ZoneIndex(db_path, cell_deg=config.ZONES_GRID_CELL_DEG, refresh_sec=config.ZONES_REFRESH_SEC)
+            _indexes[key] = index
+        return index
+
@@ -44,13 +44,130 @@ load_env_file()
 class Config:
     # База данных
     DATABASE_PATH = "driver.db"
-    
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+    DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+    DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "8192"))
+    DB_MMAP_SIZE_MB = int(os.getenv("DB_MMAP_SIZE_MB", "64"))
+    DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+
+    # Кэш профилей пользователей (см. bot/user_cache.py)
+    USER_CACHE_ENABLED = os.getenv("USER_CACHE_ENABLED", "True").lower() == "true"
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+    USER_CACHE_TTL_SEC = float(os.getenv("USER_CACHE_TTL_SEC", "30"))
+
+    # Рабочие зоны водителей (см. bot/zones.py)
+    ZONES_GRID_CELL_DEG = float(os.getenv("ZONES_GRID_CELL_DEG", "0.01"))  # ~1 км по широте
+    ZONES_REFRESH_SEC = float(os.getenv("ZONES_REFRESH_SEC", "5"))  # как часто дочитывать изменения из других процессов
+
+    # Гистерезис геозон (см. bot/geofence.py)
+    GEOFENCE_HYSTERESIS = os.getenv("GEOFENCE_HYSTERESIS", "True").lower() == "true"
+    GEOFENCE_ENTER_DWELL_SEC = float(os.getenv("GEOFENCE_ENTER_DWELL_SEC", "15"))
+    GEOFENCE_EXIT_DWELL_SEC = float(os.getenv("GEOFENCE_EXIT_DWELL_SEC", "30"))
+    GEOFENCE_EXIT_MARGIN_M = float(os.getenv("GEOFENCE_EXIT_MARGIN_M", "30"))  # выезд — дальше границы на столько метров
+    GEOFENCE_MAX_ACCURACY_M = float(os.getenv("GEOFENCE_MAX_ACCURACY_M", "150"))  # точки грубее не учитываются
+    GEOFENCE_ACCURACY_WEIGHT = float(os.getenv("GEOFENCE_ACCURACY_WEIGHT", "0.5"))
+
+    # Фильтр трека перед записью (см. bot/track_filter.py)
+    TRACK_FILTER_ENABLED = os.getenv("TRACK_FILTER_ENABLED", "True").lower() == "true"
+    TRACK_FILTER_MAX_ACCURACY_M = float(os.getenv("TRACK_FILTER_MAX_ACCURACY_M", "500"))
+    TRACK_FILTER_MAX_SPEED_KMH = float(os.getenv("TRACK_FILTER_MAX_SPEED_KMH", "250"))
+    TRACK_FILTER_SMOOTH = os.getenv("TRACK_FILTER_SMOOTH", "False").lower() == "true"
+    TRACK_FILTER_STATIONARY_M = float(os.getenv("TRACK_FILTER_STATIONARY_M", "15"))
+    TRACK_FILTER_STATIONARY_SEC = float(os.getenv("TRACK_FILTER_STATIONARY_SEC", "120"))  # 0 — писать все точки стоянки
+
+    # События о новых точках (веб → бот)
+    LOCATION_EVENTS_SOCKET = os.getenv("LOCATION_EVENTS_SOCKET", "/tmp/clever_driver_locations.sock")
+    LOCATION_EVENTS_SWEEP_SEC = float(os.getenv("LOCATION_EVENTS_SWEEP_SEC", "15"))
+
+    # Пакетная запись точек из /api/location
+    INGEST_ASYNC = os.getenv("INGEST_ASYNC", "True").lower() == "true"
+    INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+    INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "200"))
+    INGEST_MAX_LATENCY_MS = int(os.getenv("INGEST_MAX_LATENCY_MS", "250"))
+    INGEST_PUT_TIMEOUT_MS = int(os.getenv("INGEST_PUT_TIMEOUT_MS", "1000"))  # ожидание места в заполненной очереди
+
+    # Хранение истории точек (см. bot/retention.py)
+    LOCATION_HOT_DAYS = int(os.getenv("LOCATION_HOT_DAYS", "7"))
+    LOCATION_RETENTION_DAYS = int(os.getenv("LOCATION_RETENTION_DAYS", "365"))  # 0 — хранить всегда
+    LOCATION_DOWNSAMPLE_MODE = os.getenv("LOCATION_DOWNSAMPLE_MODE", "interval")  # interval | dp
+    LOCATION_DOWNSAMPLE_SEC = int(os.getenv("LOCATION_DOWNSAMPLE_SEC", "60"))
+    LOCATION_DOWNSAMPLE_EPSILON_M = float(os.getenv("LOCATION_DOWNSAMPLE_EPSILON_M", "15"))
+    LOCATION_COMPACT_INTERVAL_SEC = int(os.getenv("LOCATION_COMPACT_INTERVAL_SEC", "3600"))
+
+    # Пакетный расчёт ETA (см. web/eta_refresher.py)
+    ETA_REFRESHER_ENABLED = os.getenv("ETA_REFRESHER_ENABLED", "True").lower() == "true"
+    ETA_REFRESH_INTERVAL_SEC = int(os.getenv("ETA_REFRESH_INTERVAL_SEC", "60"))
+    ETA_REFRESH_ACTIVE_SEC = int(os.getenv("ETA_REFRESH_ACTIVE_SEC", "1800"))
+    ETA_MATRIX_MAX_ELEMENTS = int(os.getenv("ETA_MATRIX_MAX_ELEMENTS", "100"))
+    ETA_TABLE_MAX_AGE_SEC = int(os.getenv("ETA_TABLE_MAX_AGE_SEC", "180"))
+    ETA_REFRESH_LOCK_FILE = os.getenv("ETA_REFRESH_LOCK_FILE", "/tmp/clever_driver_eta.lock")
+
+    # Кэш /api/eta (см. web/eta_cache.py): memory | sqlite | socket
+    ETA_CACHE_BACKEND = os.getenv("ETA_CACHE_BACKEND", "memory").lower()
+    ETA_CACHE_MAX_ENTRIES = int(os.getenv("ETA_CACHE_MAX_ENTRIES", "5000"))
+    ETA_CACHE_DB = os.getenv("ETA_CACHE_DB", "eta_cache.db")
+    ETA_CACHE_SOCKET = os.getenv("ETA_CACHE_SOCKET", "/tmp/clever_driver_eta_cache.sock")
+    ETA_STALE_MAX_SEC = int(os.getenv("ETA_STALE_MAX_SEC", "900"))
+    # Ключ кэша по ячейке geohash (7 — ~150 м) и пересчёт ETA по линии маршрута (см. web/routing/track.py)
+    ETA_GEOHASH_PRECISION = int(os.getenv("ETA_GEOHASH_PRECISION", "7"))
+    ETA_ROUTE_PROJECTION = os.getenv("ETA_ROUTE_PROJECTION", "True").lower() == "true"
+    ETA_ROUTE_CORRIDOR_M = float(os.getenv("ETA_ROUTE_CORRIDOR_M", "60"))
+    ETA_ROUTE_MAX_DRIFT = float(os.getenv("ETA_ROUTE_MAX_DRIFT", "0.25"))  # доля ETA
+    ETA_ROUTE_MAX_AGE_SEC = int(os.getenv("ETA_ROUTE_MAX_AGE_SEC", "900"))
+
+    # Провайдеры маршрутов для /api/eta (см. web/routing/)
+    ROUTING_PROVIDERS = os.getenv("ROUTING_PROVIDERS", "history,yandex,osrm,offline,estimate")  # порядок опроса
+    ROUTING_TIMEOUTS = os.getenv("ROUTING_TIMEOUTS", "yandex=10,osrm=5,offline=2")  # секунды на провайдера
+    ROUTING_BREAKER_FAILURES = int(os.getenv("ROUTING_BREAKER_FAILURES", "3"))
+    ROUTING_BREAKER_RESET_SEC = float(os.getenv("ROUTING_BREAKER_RESET_SEC", "60"))
+    ROUTING_OSRM_URL = os.getenv("ROUTING_OSRM_URL", "https://router.project-osrm.org")
+    ROUTING_OFFLINE_GRAPH = os.getenv("ROUTING_OFFLINE_GRAPH", "")  # граф .json или выгрузка OSM .osm
+    ROUTING_OFFLINE_MAX_SNAP_M = float(os.getenv("ROUTING_OFFLINE_MAX_SNAP_M", "1500"))
+
+    # Сессии веб-отслеживания (см. web/tracking_sessions.py): memory | sqlite (общие для воркеров)
+    TRACKING_SESSION_BACKEND = os.getenv("TRACKING_SESSION_BACKEND", "memory").lower()
+    TRACKING_SESSION_DB = os.getenv("TRACKING_SESSION_DB", "tracking_sessions.db")
+    TRACKING_SESSION_MAX_POINTS = int(os.getenv("TRACKING_SESSION_MAX_POINTS", "500"))  # последних точек на сессию
+
+    # Модель времени в пути по своим трекам (см. bot/travel_model.py)
+    TRAVEL_MODEL_ENABLED = os.getenv("TRAVEL_MODEL_ENABLED", "True").lower() == "true"  # дообучение в боте
+    TRAVEL_MODEL_TRAIN_INTERVAL_SEC = int(os.getenv("TRAVEL_MODEL_TRAIN_INTERVAL_SEC", "3600"))
+    TRAVEL_MODEL_CELL_DEG = float(os.getenv("TRAVEL_MODEL_CELL_DEG", "0.005"))
+    TRAVEL_MODEL_HOURS_PER_BUCKET = int(os.getenv("TRAVEL_MODEL_HOURS_PER_BUCKET", "2"))
+    TRAVEL_MODEL_TZ_OFFSET_HOURS = int(os.getenv("TRAVEL_MODEL_TZ_OFFSET_HOURS", "3"))  # МСК
+    TRAVEL_MODEL_MIN_COVERAGE = float(os.getenv("TRAVEL_MODEL_MIN_COVERAGE", "0.6"))
+    TRAVEL_MODEL_PRIMARY = os.getenv("TRAVEL_MODEL_PRIMARY", "False").lower() == "true"  # опрашивать до Яндекса
+    TRAVEL_MODEL_RELOAD_SEC = int(os.getenv("TRAVEL_MODEL_RELOAD_SEC", "600"))
+    TRAVEL_MODEL_DETOUR_DAYS = int(os.getenv("TRAVEL_MODEL_DETOUR_DAYS", "60"))  # поездки для извилистости при дообучении
+
     # Веб-сервер
-    WEB_HOST = "0.0.0.0"
-    WEB_PORT = 5000
+    WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+    WEB_PORT = int(os.getenv("WEB_PORT", "5000"))
     WEB_SECRET_KEY = os.getenv("WEB_SECRET_KEY", secrets.token_hex(32))
+    # Режим run_web.py (см. web/serving.py): dev — встроенный сервер Flask, gunicorn — pre-fork воркеры с потоками
+    WEB_SERVER = os.getenv("WEB_SERVER", "dev").lower()
+    WEB_WORKERS = int(os.getenv("WEB_WORKERS", "0"))  # 0 — 2 * CPU + 1, не больше 8
+    WEB_THREADS = int(os.getenv("WEB_THREADS", "8"))  # потоков на воркер (gthread)
+    WEB_KEEPALIVE_SEC = int(os.getenv("WEB_KEEPALIVE_SEC", "5"))
+    WEB_TIMEOUT_SEC = int(os.getenv("WEB_TIMEOUT_SEC", "60"))
+    WEB_GRACEFUL_TIMEOUT_SEC = int(os.getenv("WEB_GRACEFUL_TIMEOUT_SEC", "30"))
+    WEB_MAX_REQUESTS = int(os.getenv("WEB_MAX_REQUESTS", "0"))  # перезапуск воркера после N запросов, 0 — никогда
+    WEB_MAX_REQUESTS_JITTER = int(os.getenv("WEB_MAX_REQUESTS_JITTER", "50"))
+    WEB_BACKLOG = int(os.getenv("WEB_BACKLOG", "2048"))
+    WEB_PRELOAD = os.getenv("WEB_PRELOAD", "True").lower() == "true"  # False — SIGHUP перечитывает и код
+    WEB_PID_FILE = os.getenv("WEB_PID_FILE", "")
     
     # Telegram
+    # Рассылка уведомлений: параллельных отправок и лимиты Bot API (0 — без лимита)
+    NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "10"))
+    TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+    TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+    # HTTP-клиент Bot API в веб-процессе (см. web/telegram_client.py)
+    TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+    TELEGRAM_HTTP_POOL_SIZE = int(os.getenv("TELEGRAM_HTTP_POOL_SIZE", "16"))
+    TELEGRAM_HTTP_WORKERS = int(os.getenv("TELEGRAM_HTTP_WORKERS", "8"))
+    TELEGRAM_HTTP_TIMEOUT = float(os.getenv("TELEGRAM_HTTP_TIMEOUT", "15"))
+    WEB_NOTIFY_ASYNC = os.getenv("WEB_NOTIFY_ASYNC", "False").lower() == "true"  # отвечать до окончания рассылки
     TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
     TELEGRAM_BOT_USERNAME = os.getenv("TELEGRAM_BOT_USERNAME", "clever_driver_bot")
     TELEGRAM_TOKEN = TELEGRAM_BOT_TOKEN  # Алиас для совместимости
@@ -73,10 +190,24 @@ class Config:
     RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))
     LOGIN_RATE_LIMIT_REQUESTS = int(os.getenv("LOGIN_RATE_LIMIT_REQUESTS", "5"))
     LOGIN_RATE_LIMIT_WINDOW = int(os.getenv("LOGIN_RATE_LIMIT_WINDOW", "300"))
+    PASSWORD_RESET_RATE_LIMIT_REQUESTS = int(os.getenv("PASSWORD_RESET_RATE_LIMIT_REQUESTS", "5"))
+    PASSWORD_RESET_RATE_LIMIT_WINDOW = int(os.getenv("PASSWORD_RESET_RATE_LIMIT_WINDOW", "600"))
+    # Телеметрия OwnTracks/резервного трекера: точка раз в несколько секунд с каждого устройства
+    TELEMETRY_RATE_LIMIT_REQUESTS = int(os.getenv("TELEMETRY_RATE_LIMIT_REQUESTS", "600"))
+    TELEMETRY_RATE_LIMIT_WINDOW = int(os.getenv("TELEMETRY_RATE_LIMIT_WINDOW", "60"))
+    # Лимиты GCRA (web/rate_limit.py); выключены — все запросы пропускаются, как раньше
+    RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "False").lower() == "true"
+    RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()  # memory | shared (общий файл для воркеров)
+    RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+    RATE_LIMIT_SWEEP_SEC = float(os.getenv("RATE_LIMIT_SWEEP_SEC", "60"))
+    RATE_LIMIT_SHARED_FILE = os.getenv("RATE_LIMIT_SHARED_FILE", "/tmp/clever_driver_ratelimit.bin")
+    RATE_LIMIT_SHARED_SLOTS = int(os.getenv("RATE_LIMIT_SHARED_SLOTS", "65536"))
     
     # IP блокировка
+    IP_BLOCK_ENABLED = os.getenv("IP_BLOCK_ENABLED", "False").lower() == "true"
     MAX_FAILED_ATTEMPTS = int(os.getenv("MAX_FAILED_ATTEMPTS", "10"))
     BLOCK_DURATION_MINUTES = int(os.getenv("BLOCK_DURATION_MINUTES", "60"))
+    MAX_BLOCKED_IPS = int(os.getenv("MAX_BLOCKED_IPS", "10000"))
     
     # Пароли
     MIN_PASSWORD_LENGTH = int(os.getenv("MIN_PASSWORD_LENGTH", "8"))
@@ -4,7 +4,6 @@ import contextlib
 import os
 import sys
 import time
-import sqlite3
 
 # Добавляем путь к корневой директории проекта
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -46,7 +45,7 @@ async def monitor_database(application: Application):
 
     while True:
         try:
-            conn = sqlite3.connect('driver.db')
+            conn = db.get_connection()
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT ul.id, ul.is_at_work, ul.created_at, ul.latitude, ul.longitude
@@ -75,7 +74,7 @@ async def monitor_database(application: Application):
                         save_last_checked_id(last_checked_id)
                         save_last_checked_time(curr_ts)
                         # Проверяем статус отслеживания
-                        conn = sqlite3.connect('driver.db')
+                        conn = db.get_connection()
                         cursor = conn.cursor()
                         cursor.execute('SELECT is_active FROM tracking_status WHERE id = 1')
                         result = cursor.fetchone()
@@ -84,7 +83,7 @@ async def monitor_database(application: Application):
                         logger.info(f"📡 Отслеживание активно: {tracking_active}")
                         if tracking_active:
                             # Получаем получателей
-                            conn = sqlite3.connect('driver.db')
+                            conn = db.get_connection()
                             cursor = conn.cursor()
                             cursor.execute("SELECT telegram_id FROM users WHERE role = 'recipient'")
                             recipients = cursor.fetchall()
@@ -122,7 +121,7 @@ async def monitor_database(application: Application):
                         save_last_checked_id(last_checked_id)
                         save_last_checked_time(curr_ts)
                         # Получаем всех пользователей
-                        conn = sqlite3.connect('driver.db')
+                        conn = db.get_connection()
                         cursor = conn.cursor()
                         cursor.execute("SELECT telegram_id FROM users WHERE role IS NOT NULL")
                         users = cursor.fetchall()
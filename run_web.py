@@ -50,30 +50,22 @@ def load_env_file():
 # Загружаем .env файл ПЕРЕД всеми импортами
 load_env_file()
 
-import asyncio
-
-# Пытаемся импортировать nest_asyncio, если не установлен - пропускаем
-try:
-    import nest_asyncio
-    nest_asyncio.apply()
-except ImportError:
-    log_to_file("⚠️ nest_asyncio не установлен, пропускаем...")
-
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+def load_app():
+    """Flask приложение; в режиме gunicorn загружается в master до fork воркеров"""
+    from web.app import app
+    return app
+
 if __name__ == "__main__":
     try:
-        log_to_file("🌐 Запуск веб-приложения через run_web.py...")
-        
-        # Запускаем Flask приложение
-        from web.app import app
         from config.settings import config
+        from web.serving import serve
+        
+        log_to_file(f"🌐 Запуск веб-приложения через run_web.py (WEB_SERVER={config.WEB_SERVER})...")
         
-        app.run(
-            host=config.WEB_HOST,
-            port=config.WEB_PORT,
-            debug=False
-        )
+        # dev — встроенный сервер Flask, gunicorn — pre-fork воркеры (см. web/serving.py)
+        serve(load_app)
     except KeyboardInterrupt:
         log_to_file("\n🛑 Остановка веб-приложения...")
     except Exception as e:
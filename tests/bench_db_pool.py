@@ -0,0 +1,110 @@
+"""
+Бенчмарк слоя соединений: ops/sec до (connect/close на каждый вызов)
+и после (общий пул с WAL и кэшем подготовленных выражений).
+
+Запуск: python tests/bench_db_pool.py [--ops 5000] [--threads 4]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.db_pool import ConnectionPool
+
+
+def prepare(db_path, users=200):
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id BIGINT UNIQUE,
+            first_name TEXT,
+            role TEXT,
+            work_latitude REAL,
+            work_longitude REAL,
+            work_radius INTEGER
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS user_locations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            telegram_id BIGINT NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            is_at_work BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.executemany(
+        "INSERT INTO users (telegram_id, first_name, role, work_latitude, work_longitude, work_radius) VALUES (?, ?, 'driver', 55.75, 37.61, 100)",
+        [(1000 + i, f"Driver {i}") for i in range(users)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def workload(get_conn, ops, users=200):
+    """Смесь, похожая на ingest: чтение пользователя + вставка точки с коммитом"""
+    for i in range(ops):
+        tg = 1000 + (i % users)
+        conn = get_conn()
+        c = conn.cursor()
+        c.execute("SELECT * FROM users WHERE telegram_id = ?", (tg,))
+        row = c.fetchone()
+        conn.close()
+
+        conn = get_conn()
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO user_locations (user_id, telegram_id, latitude, longitude, is_at_work) VALUES (?, ?, ?, ?, ?)",
+            (row[0], tg, 55.75 + i * 1e-6, 37.61, 0)
+        )
+        conn.commit()
+        conn.close()
+
+
+def run(name, get_conn, ops, threads):
+    per_thread = max(1, ops // threads)
+    workers = [threading.Thread(target=workload, args=(get_conn, per_thread)) for _ in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    total = per_thread * threads * 2  # две операции на итерацию
+    print(f"{name:<28} {total:>8} ops  {elapsed:8.2f} s  {total / elapsed:10.0f} ops/sec")
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ops', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_path = os.path.join(tmp, 'raw.db')
+        pool_path = os.path.join(tmp, 'pool.db')
+        prepare(raw_path)
+        prepare(pool_path)
+
+        before = run("connect/close per call", lambda: sqlite3.connect(raw_path, timeout=5), args.ops, args.threads)
+
+        pool = ConnectionPool(pool_path, max_size=args.threads * 2)
+        after = run("pooled (WAL + pragmas)", pool.get_connection, args.ops, args.threads)
+        pool.close_all()
+
+        print(f"speedup: x{after / before:.2f}; pool stats: {pool.stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Проверка и бенчмарк геометрических ядер (bot/geo.py).
+
+Сначала сверяет пакетные функции и быстрый путь проверки радиуса с прежней
+скалярной формулой calculate_distance (точки вокруг Москвы, в том числе
+ровно у границы зоны), затем меряет пропускную способность: скалярный цикл
+против пакетных функций. С numpy пакетные функции векторные, без него —
+те же циклы (видно накладные расходы обёртки). Код возврата 1 при расхождении.
+
+    python tests/bench_geo.py --points 200000 --zones 50
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import geo
+
+CENTER = (55.7558, 37.6173)
+
+
+def reference_distance(lat1, lon1, lat2, lon2):
+    """Прежняя bot.utils.calculate_distance — эталон для сверки"""
+    R = 6371000
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    delta_lat = math.radians(lat2 - lat1)
+    delta_lon = math.radians(lon2 - lon1)
+    a = (math.sin(delta_lat / 2) ** 2 +
+         math.cos(lat1_rad) * math.cos(lat2_rad) *
+         math.sin(delta_lon / 2) ** 2)
+    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def random_points(n, rnd, spread_deg=0.3):
+    lats = [CENTER[0] + rnd.uniform(-spread_deg, spread_deg) for _ in range(n)]
+    lons = [CENTER[1] + rnd.uniform(-spread_deg, spread_deg) * 1.8 for _ in range(n)]
+    return lats, lons
+
+
+def random_zones(m, rnd):
+    lats, lons = random_points(m, rnd)
+    return [(lat, lon, rnd.choice([50, 100, 200, 500, 2000])) for lat, lon in zip(lats, lons)]
+
+
+def border_points(zones, rnd):
+    """Точки на расстоянии радиус ± 0.5 м от центра — там быстрый путь уступает гаверсинусу"""
+    lats, lons, index = [], [], []
+    for z, (lat, lon, radius) in enumerate(zones):
+        for _ in range(20):
+            bearing = rnd.uniform(0, 2 * math.pi)
+            dist = radius + rnd.uniform(-0.5, 0.5)
+            lats.append(lat + dist * math.cos(bearing) / 111195.0)
+            lons.append(lon + dist * math.sin(bearing) / (111195.0 * math.cos(math.radians(lat))))
+            index.append(z)
+    return lats, lons, index
+
+
+def check(points, zones, rnd):
+    lats, lons = points
+    failures = 0
+
+    zlat, zlon, _r = zones[0]
+    expected = [reference_distance(a, b, zlat, zlon) for a, b in zip(lats, lons)]
+    got = list(geo.haversine_many(lats, lons, zlat, zlon))
+    worst = max(abs(e - g) for e, g in zip(expected, got))
+    fast = list(geo.equirectangular_many(lats, lons, zlat, zlon))
+    worst_fast = max(abs(e - g) / max(e, 1.0) for e, g in zip(expected, fast))
+    print(f"haversine_many: макс. расхождение {worst:.2e} м; equirectangular: {worst_fast * 100:.3f}%")
+    if worst > 1e-6 or worst_fast > geo.FAST_PATH_MARGIN:
+        failures += 1
+
+    matrix = geo.distance_matrix(lats[:200], lons[:200], [z[0] for z in zones], [z[1] for z in zones])
+    worst = max(abs(reference_distance(lats[i], lons[i], z[0], z[1]) - matrix[i][j])
+                for i in range(len(matrix)) for j, z in enumerate(zones))
+    print(f"distance_matrix: макс. расхождение {worst:.2e} м")
+    failures += worst > 1e-6
+
+    blats, blons, bindex = border_points(zones, rnd)
+    all_lats, all_lons = lats + blats, lons + blons
+    all_index = [rnd.randrange(-1, len(zones)) for _ in lats] + bindex
+    expected = [i >= 0 and reference_distance(a, b, zones[i][0], zones[i][1]) <= zones[i][2]
+                for a, b, i in zip(all_lats, all_lons, all_index)]
+    got = geo.is_at_work_batch(all_lats, all_lons, zones, zone_index=all_index)
+    scalar = [i >= 0 and geo.is_within(a, b, *zones[i]) for a, b, i in zip(all_lats, all_lons, all_index)]
+    mismatches = sum(e != g for e, g in zip(expected, got)) + sum(e != s for e, s in zip(expected, scalar))
+    print(f"is_at_work_batch / is_within (по своей зоне, {len(blats)} у границы): расхождений {mismatches}")
+    failures += mismatches > 0
+
+    expected = [any(reference_distance(a, b, z[0], z[1]) <= z[2] for z in zones) for a, b in zip(all_lats, all_lons)]
+    got = geo.is_at_work_batch(all_lats, all_lons, zones + [None])
+    mismatches = sum(e != g for e, g in zip(expected, got))
+    print(f"is_at_work_batch (любая зона): расхождений {mismatches}, в зонах {sum(expected)}")
+    failures += mismatches > 0
+    return failures
+
+
+def bench(name, func, n_ops):
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    print(f"  {name:<38} {elapsed * 1000:9.1f} мс  {n_ops / elapsed / 1e6:8.2f} млн/с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, default=200000)
+    parser.add_argument('--zones', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    lats, lons = random_points(args.points, rnd)
+    zones = random_zones(args.zones, rnd)
+    print(f"numpy: {'да' if geo.np is not None else 'нет (пакетные функции в цикле)'}")
+
+    failures = check((lats[:20000], lons[:20000]), zones, rnd)
+
+    zlat, zlon, zr = zones[0]
+    index = [rnd.randrange(len(zones)) for _ in lats]
+    print(f"\nточки до одного центра, {args.points} точек:")
+    bench('скалярный calculate_distance', lambda: [reference_distance(a, b, zlat, zlon) for a, b in zip(lats, lons)],
+          args.points)
+    bench('geo.haversine_many', lambda: geo.haversine_many(lats, lons, zlat, zlon), args.points)
+    bench('geo.equirectangular_many', lambda: geo.equirectangular_many(lats, lons, zlat, zlon), args.points)
+    bench('скалярный is_within', lambda: [geo.is_within(a, b, zlat, zlon, zr) for a, b in zip(lats, lons)],
+          args.points)
+    bench('geo.within_radius', lambda: geo.within_radius(lats, lons, zlat, zlon, zr), args.points)
+
+    print(f"\nкаждая точка со своей зоной ({args.zones} зон):")
+    bench('скалярный цикл calculate_distance',
+          lambda: [reference_distance(a, b, zones[i][0], zones[i][1]) <= zones[i][2]
+                   for a, b, i in zip(lats, lons, index)], args.points)
+    bench('geo.is_at_work_batch(zone_index)', lambda: geo.is_at_work_batch(lats, lons, zones, index), args.points)
+
+    n = min(args.points, 20000)
+    print(f"\nвсе зоны для каждой точки ({n} x {args.zones} = {n * args.zones} пар):")
+    bench('скалярный цикл calculate_distance',
+          lambda: [any(reference_distance(a, b, z[0], z[1]) <= z[2] for z in zones)
+                   for a, b in zip(lats[:n], lons[:n])], n * args.zones)
+    bench('geo.is_at_work_batch', lambda: geo.is_at_work_batch(lats[:n], lons[:n], zones), n * args.zones)
+
+    print("\n✅ расхождений с эталоном нет" if not failures else f"\n❌ проверок не пройдено: {failures}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
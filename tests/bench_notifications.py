@@ -0,0 +1,113 @@
+"""
+Задержка доставки уведомлений получателям: последовательная отправка
+(как было раньше) против параллельной рассылки NotificationSystem.
+
+Бот подменяется FakeBot с заданной задержкой ответа Telegram, база —
+временная. Для каждого числа получателей печатается время до доставки
+первому, медианному и последнему получателю.
+
+    python tests/bench_notifications.py --rtt-ms 80 --recipients 1,10,100
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeBot:
+    """Бот, который отвечает через rtt секунд и запоминает время доставки"""
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.delivered = {}
+
+    async def send_message(self, chat_id, text):
+        await asyncio.sleep(self.rtt)
+        self.delivered[chat_id] = time.perf_counter()
+
+
+async def legacy_send(db, bot, recipients, text):
+    """Прежний цикл: по одному получателю, синхронные записи в базу"""
+    log_id = db.create_notification_log('automatic', sender_login='system', notification_text=text)
+    for recipient_id in recipients:
+        user_info = db.get_user_by_telegram_id(recipient_id)
+        recipient_name = f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip() if user_info else None
+        db.add_notification_detail(log_id, recipient_id, recipient_name, status="pending")
+    sent_count = 0
+    for recipient_id in recipients:
+        await bot.send_message(chat_id=recipient_id, text=text)
+        db.update_notification_detail(log_id, recipient_id, status="sent")
+        sent_count += 1
+        db.get_user_by_telegram_id(recipient_id)
+    db.complete_notification_log(log_id, sent_count, 0)
+
+
+def describe(started, bot, total):
+    times = sorted(t - started for t in bot.delivered.values())
+    if not times:
+        return "нет доставок"
+    return (f"first={times[0] * 1000:7.1f}  p50={times[len(times) // 2] * 1000:7.1f}  "
+            f"last={times[-1] * 1000:7.1f}  call={total * 1000:7.1f} ms")
+
+
+async def run(args):
+    from bot.database import db
+    from bot.notification_system import NotificationSystem
+
+    counts = [int(x) for x in args.recipients.split(',') if x]
+    base_id = 500000
+    conn = db.get_connection()
+    conn.executemany(
+        "INSERT INTO users (telegram_id, first_name, last_name, role) VALUES (?, ?, ?, 'recipient')",
+        [(base_id + i, f"Получатель{i}", "Тест") for i in range(max(counts))]
+    )
+    conn.commit()
+    conn.close()
+
+    rtt = args.rtt_ms / 1000.0
+    for count in counts:
+        recipients = [base_id + i for i in range(count)]
+        print(f"\n=== получателей: {count} (RTT {args.rtt_ms:.0f} ms) ===")
+
+        bot = FakeBot(rtt)
+        started = time.perf_counter()
+        await legacy_send(db, bot, recipients, "Ожидаю у подъезда")
+        print(f"  {'последовательно':<30}{describe(started, bot, time.perf_counter() - started)}")
+
+        variants = [
+            ("параллельно, лимиты Telegram", dict()),
+            ("параллельно, без лимитов", dict(global_rate=0, chat_rate=0)),
+        ]
+        for name, kwargs in variants:
+            bot = FakeBot(rtt)
+            system = NotificationSystem(bot, concurrency=args.concurrency, **kwargs)
+            started = time.perf_counter()
+            result = await system.send_notification_with_confirmation(
+                'automatic', {'login': 'system'}, recipients,
+                notification_text="Ожидаю у подъезда", custom_confirmation=False
+            )
+            total = time.perf_counter() - started
+            assert result['sent_count'] == count, result
+            print(f"  {name:<30}{describe(started, bot, total)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recipients', default='1,10,100')
+    parser.add_argument('--rtt-ms', type=float, default=80)
+    parser.add_argument('--concurrency', type=int, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # bot.database открывает driver.db в текущем каталоге
+        os.chdir(tmp)
+        asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
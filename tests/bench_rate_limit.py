@@ -0,0 +1,103 @@
+"""
+Бенчмарк ограничителя запросов (web/rate_limit.py) под сканированием с
+миллионов различных IP.
+
+Для сравнения воспроизведён прежний закомментированный RateLimiter: deque
+отметок времени на IP в defaultdict, которые никогда не удаляются. Печатает
+прирост памяти (tracemalloc) по мере роста числа IP, время на запрос и
+проверяет точность лимита: из серии запросов одного IP проходит ровно
+burst, через период бюджет восстанавливается.
+
+    python tests/bench_rate_limit.py --ips 2000000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict, deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web.rate_limit import Limit, MemoryStore, RateLimiter, SharedStore
+
+LIMITS = {'general': Limit(100, 60)}
+
+
+class LegacyLimiter:
+    """Прежний RateLimiter: отметка времени на каждый запрос, ключи не удаляются"""
+
+    def __init__(self, max_requests, window_seconds):
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.requests = defaultdict(deque)
+        self.lock = threading.Lock()
+
+    def allow(self, name, key, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            while self.requests[key] and now - self.requests[key][0] > self.window_seconds:
+                self.requests[key].popleft()
+            if len(self.requests[key]) >= self.max_requests:
+                return False, 0.0
+            self.requests[key].append(now)
+            return True, 0.0
+
+
+def ip(i):
+    return f"{10 + (i >> 24) % 200}.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+
+
+def scan(label, limiter, ips, checkpoints):
+    """Каждый IP делает один запрос; память замеряется в контрольных точках"""
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    now = time.time()
+    started = time.perf_counter()
+    line = []
+    for i in range(ips):
+        # 20 тыс. запросов в секунду: старые IP успевают стать неактивными
+        limiter.allow('general', ip(i), now + i / 20000)
+        if i + 1 in checkpoints:
+            line.append(f"{(i + 1) // 1000}k: {(tracemalloc.get_traced_memory()[0] - base) / 2 ** 20:6.1f} МБ")
+    elapsed = time.perf_counter() - started
+    tracemalloc.stop()
+    print(f"{label:<28} {elapsed / ips * 1e6:5.1f} мкс/запрос | " + " | ".join(line))
+
+
+def accuracy(label, limiter):
+    """Серия из 300 запросов за 0.3 с при лимите 100/60: пропускается ровно 100"""
+    now = time.time()
+    passed = sum(limiter.allow('general', '192.0.2.1', now + k / 1000)[0] for k in range(300))
+    allowed, retry_after = limiter.allow('general', '192.0.2.1', now + 0.3)
+    # Через минуту бюджет восстановлен полностью
+    later = sum(limiter.allow('general', '192.0.2.1', now + 61 + k / 1000)[0] for k in range(150))
+    print(f"{label:<28} пропущено {passed} из 300, повторить через {retry_after:.1f} с; через минуту ещё {later}")
+    return passed == 100 and not allowed and later == 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ips', type=int, default=1000000)
+    parser.add_argument('--max-keys', type=int, default=100000)
+    parser.add_argument('--slots', type=int, default=65536)
+    parser.add_argument('--legacy-ips', type=int, default=500000, help='прежний ограничитель — на меньшем числе IP')
+    args = parser.parse_args()
+
+    checkpoints = {args.ips // 4, args.ips // 2, args.ips * 3 // 4, args.ips}
+    legacy_checkpoints = {args.legacy_ips // 4, args.legacy_ips // 2, args.legacy_ips * 3 // 4, args.legacy_ips}
+    with tempfile.TemporaryDirectory() as tmp:
+        shared = lambda name: RateLimiter(SharedStore(os.path.join(tmp, name), args.slots), LIMITS)
+        memory = lambda: RateLimiter(MemoryStore(args.max_keys, sweep_sec=1), LIMITS)
+        scan('прежний (deque на IP)', LegacyLimiter(100, 60), args.legacy_ips, legacy_checkpoints)
+        scan(f'GCRA memory ({args.max_keys} ключей)', memory(), args.ips, checkpoints)
+        scan(f'GCRA shared ({args.slots} ячеек)', shared('scan.bin'), args.ips, checkpoints)
+        ok = accuracy('GCRA memory', memory()) & accuracy('GCRA shared', shared('accuracy.bin'))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
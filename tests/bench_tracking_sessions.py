@@ -0,0 +1,121 @@
+"""
+Бенчмарк хранилища сессий веб-отслеживания (web/tracking_sessions.py).
+
+Прежний WebLocationTracker воспроизведён как словарь сессий: поиск сессии
+получателя и очистка перебирают все сессии, точки копятся в списке. Для
+memory и sqlite печатает время поиска по telegram_id, очистки истекших и
+записи точки, объём точек в памяти и проверяет, что сессия sqlite видна
+второму экземпляру хранилища (другой воркер или перезапуск).
+
+    python tests/bench_tracking_sessions.py --sessions 20000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web.tracking_sessions import MemorySessionStore, SqliteSessionStore
+
+
+class LegacyStore:
+    """Прежние active_sessions: словарь и линейные проходы"""
+
+    name = 'прежний dict'
+
+    def __init__(self):
+        self.sessions = {}
+
+    def create(self, token, session_data):
+        self.sessions[token] = dict(session_data, locations=[])
+
+    def find_active(self, telegram_id, now):
+        for token, session_data in self.sessions.items():
+            if session_data['telegram_id'] == telegram_id and session_data['is_active'] and now < session_data['expires_at']:
+                return token, session_data
+        return None, None
+
+    def add_location(self, token, location):
+        self.sessions[token]['locations'].append(location)
+        return True
+
+    def cleanup(self, now):
+        expired = [token for token, s in self.sessions.items() if now > s['expires_at']]
+        for token in expired:
+            del self.sessions[token]
+        return expired
+
+    def points(self):
+        return sum(len(s['locations']) for s in self.sessions.values())
+
+
+def populate(store, sessions, rnd, now):
+    for i in range(sessions):
+        minutes = rnd.choice([30, 60, 60, 120])
+        created = now - timedelta(minutes=rnd.uniform(0, 150))
+        store.create(f"token-{i}", {'telegram_id': 10 ** 8 + i, 'user_info': {'first_name': f"User{i}", 'role': 'recipient'},
+                                    'duration_minutes': minutes, 'created_at': created,
+                                    'expires_at': created + timedelta(minutes=minutes), 'is_active': True})
+
+
+def timed(fn, n):
+    started = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - started) / n * 1e6
+
+
+def bench(store, sessions, points_per_session, rnd):
+    now = datetime.now()
+    populate(store, sessions, rnd, now)
+    lookups = [10 ** 8 + rnd.randrange(sessions) for _ in range(200)]
+    find_us = timed(lambda i: store.find_active(lookups[i], now), len(lookups))
+    location = {'latitude': 55.75, 'longitude': 37.61, 'accuracy': 10, 'timestamp': now.isoformat()}
+    writes = min(sessions, 200) * points_per_session
+    add_us = timed(lambda i: store.add_location(f"token-{i % min(sessions, 200)}", location), writes)
+    if hasattr(store, 'points'):
+        kept = store.points()
+    else:
+        kept = sum(len(store.locations(f"token-{i}")) for i in range(min(sessions, 200)))
+    started = time.perf_counter()
+    expired = len(store.cleanup(now))
+    cleanup_ms = (time.perf_counter() - started) * 1e3
+    started = time.perf_counter()
+    again = len(store.cleanup(now))
+    recleanup_ms = (time.perf_counter() - started) * 1e3
+    print(f"{store.name:<14} поиск {find_us:8.1f} мкс, точка {add_us:6.1f} мкс, очистка {cleanup_ms:7.1f} мс "
+          f"({expired} истекших), повторная {recleanup_ms:6.2f} мс ({again}); точек хранится {kept} из {writes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=20000)
+    parser.add_argument('--points', type=int, default=1000, help='точек на каждую из 200 сессий')
+    parser.add_argument('--max-points', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sessions.db')
+        for store in (LegacyStore(), MemorySessionStore(args.max_points), SqliteSessionStore(path, args.max_points)):
+            bench(store, args.sessions, args.points, random.Random(args.seed))
+
+        # Второй экземпляр на том же файле видит сессии и точки первого
+        first, second = SqliteSessionStore(path, args.max_points), SqliteSessionStore(path, args.max_points)
+        now = datetime.now()
+        first.create('shared', {'telegram_id': 42, 'user_info': {}, 'duration_minutes': 60, 'created_at': now,
+                                'expires_at': now + timedelta(minutes=60), 'is_active': True})
+        first.add_location('shared', {'latitude': 1.0, 'longitude': 2.0})
+        token, session_data = second.find_active(42, now)
+        ok = token == 'shared' and session_data['last_location'] == {'latitude': 1.0, 'longitude': 2.0}
+        print(f"sqlite: сессия видна второму экземпляру: {'да' if ok else 'нет'}")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+Бенчмарк горячих запросов к user_locations на большой истории.
+
+Засевает N точек (по умолчанию 2 млн), затем меряет задержки запросов
+«последняя точка» и get_recipient_locations без индексов (прежние тексты
+запросов) и после миграции из Database.init_db. Печатает p50/p95/p99/max в мс.
+
+Запуск: python tests/bench_user_locations.py [--rows 2000000] [--drivers 200] [--iters 200]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.database import Database
+
+OLD_LAST_BY_TELEGRAM_ID = '''
+    SELECT ul.id, ul.user_id, ul.telegram_id, ul.latitude, ul.longitude,
+           ul.accuracy, ul.altitude, ul.speed, ul.heading, ul.is_at_work, ul.created_at,
+           u.first_name, u.last_name, u.username, u.role,
+           u.work_latitude, u.work_longitude, u.work_radius
+    FROM user_locations ul
+    JOIN users u ON ul.user_id = u.id
+    WHERE ul.telegram_id = ?
+    ORDER BY ul.created_at DESC
+    LIMIT 1
+'''
+
+LAST_BY_USER_ID = '''
+    SELECT latitude, longitude
+    FROM user_locations
+    WHERE user_id = ?
+    ORDER BY id DESC LIMIT 1
+'''
+
+NEW_LAST_BY_USER_ID = '''
+    SELECT latitude, longitude
+    FROM user_last_location
+    WHERE user_id = ?
+'''
+
+OLD_RECIPIENT_LOCATIONS = '''
+    SELECT ul.id, ul.user_id, ul.telegram_id, ul.latitude, ul.longitude,
+           ul.accuracy, ul.altitude, ul.speed, ul.heading, ul.is_at_work, ul.created_at,
+           u.first_name, u.last_name, u.username, u.role
+    FROM user_locations ul
+    JOIN users u ON ul.user_id = u.id
+    WHERE u.role = 'recipient' AND ul.telegram_id IS NOT NULL
+    AND ul.id = (
+        SELECT MAX(ul2.id)
+        FROM user_locations ul2
+        WHERE ul2.telegram_id = ul.telegram_id
+    )
+    ORDER BY ul.created_at DESC
+    LIMIT ?
+'''
+
+INDEXES = ('idx_user_locations_telegram_id_id', 'idx_user_locations_user_id_id')
+
+
+def seed(database, rows, drivers, recipients, batch=50000):
+    conn = database.get_connection()
+    c = conn.cursor()
+    c.executemany(
+        "INSERT INTO users (telegram_id, first_name, role, work_latitude, work_longitude, work_radius) VALUES (?, ?, ?, 55.75, 37.61, 100)",
+        [(10000 + i, f"Driver {i}", 'driver') for i in range(drivers)] +
+        [(20000 + i, f"Recipient {i}", 'recipient') for i in range(recipients)]
+    )
+    c.execute("SELECT id, telegram_id FROM users")
+    users = c.fetchall()
+    conn.commit()
+
+    # Получатели присылают точки редко: ~1% истории
+    driver_users = [u for u in users if u[1] < 20000]
+    recipient_users = [u for u in users if u[1] >= 20000]
+    rnd = random.Random(42)
+    started = time.perf_counter()
+    base = time.time() - rows
+    for offset in range(0, rows, batch):
+        chunk = []
+        for i in range(offset, min(rows, offset + batch)):
+            user_id, tg = rnd.choice(recipient_users if rnd.random() < 0.01 else driver_users)
+            ts = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(base + i))
+            chunk.append((user_id, tg, 55.75 + rnd.uniform(-0.05, 0.05), 37.61 + rnd.uniform(-0.05, 0.05), rnd.random() < 0.3, ts))
+        c.executemany(
+            "INSERT INTO user_locations (user_id, telegram_id, latitude, longitude, is_at_work, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            chunk
+        )
+        conn.commit()
+    conn.close()
+    print(f"seeded {rows} rows in {time.perf_counter() - started:.1f} s")
+    return driver_users
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+
+    def pct(p):
+        return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+
+    return f"p50={pct(0.50):9.3f}  p95={pct(0.95):9.3f}  p99={pct(0.99):9.3f}  max={samples[-1] * 1000:9.3f} ms"
+
+
+def measure(name, fn, args_list, budget_sec):
+    """Гоняет fn по аргументам, пока не кончатся аргументы или бюджет времени"""
+    samples = []
+    deadline = time.perf_counter() + budget_sec
+    for args in args_list:
+        started = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - started)
+        if time.perf_counter() > deadline:
+            break
+    print(f"  {name:<34} n={len(samples):<5} {percentiles(samples)}")
+
+
+def run_sql(database, sql):
+    def fn(*params):
+        conn = database.get_connection()
+        conn.execute(sql, params).fetchall()
+        conn.close()
+    return fn
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--drivers', type=int, default=200)
+    parser.add_argument('--recipients', type=int, default=400)
+    parser.add_argument('--iters', type=int, default=200)
+    parser.add_argument('--budget', type=float, default=30.0, help='лимит времени на один запрос, сек')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        database = Database(db_path)
+        conn = database.get_connection()
+        for name in INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        # Засев идёт в обход add_user_location — user_last_location заполнит миграция в init_db
+        conn.execute("DROP TABLE IF EXISTS user_last_location")
+        conn.commit()
+        conn.close()
+
+        driver_users = seed(database, args.rows, args.drivers, args.recipients)
+        rnd = random.Random(7)
+        picks = [rnd.choice(driver_users) for _ in range(args.iters)]
+
+        print("before (без индексов, прежние запросы):")
+        measure("last location by telegram_id", run_sql(database, OLD_LAST_BY_TELEGRAM_ID), [(tg,) for _, tg in picks], args.budget)
+        measure("last location by user_id", run_sql(database, LAST_BY_USER_ID), [(uid,) for uid, _ in picks], args.budget)
+        measure("get_recipient_locations", run_sql(database, OLD_RECIPIENT_LOCATIONS), [(50,)] * args.iters, args.budget)
+
+        started = time.perf_counter()
+        database.init_db()
+        print(f"migration (init_db: индексы + user_last_location): {time.perf_counter() - started:.1f} s")
+
+        print("after (индексы, user_last_location):")
+        measure("last location by telegram_id", database.get_user_last_location, [(tg,) for _, tg in picks], args.budget)
+        measure("last location by user_id", run_sql(database, NEW_LAST_BY_USER_ID), [(uid,) for uid, _ in picks], args.budget)
+        measure("get_recipient_locations", database.get_recipient_locations, [(50,)] * args.iters, args.budget)
+        database.pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Нагрузочный бенчмарк режимов run_web.py (web/serving.py): встроенный сервер
+Flask против gunicorn (pre-fork воркеры с потоками).
+
+Каждый режим запускается отдельным процессом run_web.py во временном
+каталоге (своя driver.db), затем несколько процессов-клиентов держат по
+несколько keep-alive соединений и в течение --duration секунд запрашивают
+--path. Печатает запросов в секунду, p50/p99 задержки и число ошибок.
+
+    python tests/bench_web_server.py --clients 4 --connections 8 --duration 10 --path /
+"""
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, port, workers, threads, workdir):
+    env = dict(os.environ, WEB_SERVER=mode, WEB_HOST='127.0.0.1', WEB_PORT=str(port),
+               WEB_WORKERS=str(workers), WEB_THREADS=str(threads))
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'run_web.py')], cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"{mode}: сервер завершился с кодом {process.returncode}")
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{mode}: сервер не ответил за 60 с")
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def client(args):
+    """Процесс-клиент: connections потоков, у каждого своё keep-alive соединение"""
+    port, path, connections, duration = args
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        local = []
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                conn.request('GET', path, headers={'User-Agent': 'Mozilla/5.0 (bench)'})
+                response = conn.getresponse()
+                response.read()
+                if response.status >= 500:
+                    raise http.client.HTTPException(response.status)
+                if response.getheader('Connection', '').lower() == 'close':
+                    conn.close()
+                local.append(time.perf_counter() - started)
+            except (OSError, http.client.HTTPException):
+                with lock:
+                    errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+
+def run_load(port, path, clients, connections, duration):
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(client, [(port, path, connections, duration)] * clients)
+    latencies = sorted(l for result in results for l in result[0])
+    errors = sum(result[1] for result in results)
+    return len(latencies) / duration, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='dev,gunicorn')
+    parser.add_argument('--path', default='/')
+    parser.add_argument('--clients', type=int, default=4, help='процессов-клиентов')
+    parser.add_argument('--connections', type=int, default=8, help='соединений на клиента')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=0, help='воркеров gunicorn, 0 — по WEB_WORKERS по умолчанию')
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"{args.clients}x{args.connections} соединений, {args.duration:g} с, GET {args.path}")
+    for mode in args.modes.split(','):
+        with tempfile.TemporaryDirectory() as workdir:
+            port = free_port()
+            process = start_server(mode, port, args.workers, args.threads, workdir)
+            try:
+                rps, p50, p99, errors = run_load(port, args.path, args.clients, args.connections, args.duration)
+            finally:
+                stop_server(process)
+        print(f"{mode:<10} {rps:8.0f} запросов/с, p50 {p50:7.1f} мс, p99 {p99:7.1f} мс, ошибок {errors}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+Бенчмарк поиска рабочей зоны (bot/zones.py): линейный перебор против сеточного индекса.
+
+Заводит во временной базе пользователя с N зонами (круги 50–500 м и
+прямоугольные многоугольники вокруг Москвы), затем для M случайных точек
+ищет зону перебором всех зон и через ZoneIndex.find и сверяет ответы.
+Печатает время на поиск и среднее число проверенных зон. Код возврата 1
+при расхождении.
+
+    python tests/bench_zones.py --zones 100 500 2000 --points 20000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.database import Database
+from bot.zones import CIRCLE, POLYGON, ZoneIndex
+
+CENTER = (55.7558, 37.6173)
+SPREAD_DEG = 0.25
+
+
+def seed_zones(index, user_id, count, rnd):
+    for i in range(count):
+        lat = CENTER[0] + rnd.uniform(-SPREAD_DEG, SPREAD_DEG)
+        lon = CENTER[1] + rnd.uniform(-SPREAD_DEG, SPREAD_DEG) * 1.8
+        if i % 4 == 3:
+            dlat, dlon = rnd.uniform(0.001, 0.004), rnd.uniform(0.002, 0.007)
+            index.add_zone(user_id, f"zone-{i}", POLYGON, polygon=[
+                [lat - dlat, lon - dlon], [lat - dlat, lon + dlon], [lat + dlat, lon + dlon], [lat + dlat, lon - dlon],
+            ])
+        else:
+            index.add_zone(user_id, f"zone-{i}", CIRCLE, lat, lon, rnd.choice([50, 100, 200, 500]))
+
+
+def linear_find(zones, lat, lon):
+    best = None
+    for zone in zones:
+        if zone.contains(lat, lon) and (best is None or zone.area < best.area):
+            best = zone
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--zones', type=int, nargs='+', default=[100, 500, 2000])
+    parser.add_argument('--points', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    failures = 0
+    for count in args.zones:
+        rnd = random.Random(args.seed)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'zones.db')
+            Database(path)
+            index = ZoneIndex(path, refresh_sec=3600)
+            started = time.perf_counter()
+            seed_zones(index, 1, count, rnd)
+            seed_ms = (time.perf_counter() - started) * 1000
+
+            # Точки рядом с зонами, чтобы часть попаданий была, и случайные
+            zones = index.user_zones(1)
+            points = []
+            for _ in range(args.points):
+                if rnd.random() < 0.5:
+                    zone = rnd.choice(zones)
+                    points.append((zone.latitude + rnd.uniform(-0.004, 0.004), zone.longitude + rnd.uniform(-0.007, 0.007)))
+                else:
+                    points.append((CENTER[0] + rnd.uniform(-SPREAD_DEG, SPREAD_DEG),
+                                   CENTER[1] + rnd.uniform(-SPREAD_DEG, SPREAD_DEG) * 1.8))
+
+            started = time.perf_counter()
+            expected = [linear_find(zones, lat, lon) for lat, lon in points]
+            linear_us = (time.perf_counter() - started) / len(points) * 1e6
+
+            started = time.perf_counter()
+            got = [index.find(1, lat, lon) for lat, lon in points]
+            index_us = (time.perf_counter() - started) / len(points) * 1e6
+
+            mismatches = sum((e.id if e else None) != (g.id if g else None) for e, g in zip(expected, got))
+            failures += mismatches > 0
+            stats = index.get_stats()
+            print(f"зон {count:>5} (запись {seed_ms:.0f} мс): перебор {linear_us:8.1f} мкс/точка, "
+                  f"индекс {index_us:6.1f} мкс/точка (проверено зон в среднем {stats['avg_candidates']}), "
+                  f"попаданий {sum(1 for g in got if g)}, расхождений {mismatches}")
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
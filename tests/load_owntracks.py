@@ -0,0 +1,180 @@
+"""
+Нагрузочный прогон приёма точек OwnTracks.
+
+Режим http: шлёт OwnTracks-пакеты на запущенный веб-сервер с заданной
+частотой и числом устройств, печатает задержки ответов.
+    python tests/load_owntracks.py http --url http://127.0.0.1:5000/api/location \
+        --devices 50 --rate 200 --duration 30 --telegram-ids 1001,1002
+
+Режим direct: без веб-сервера, на временной базе сравнивает запись точки
+коммитом на каждую точку и через LocationIngest (пакетная запись).
+    python tests/load_owntracks.py direct --rate 2000 --duration 10 --devices 50
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def owntracks_payload(rnd, base_lat=55.75, base_lon=37.61):
+    return {
+        '_type': 'location',
+        'lat': base_lat + rnd.uniform(-0.01, 0.01),
+        'lon': base_lon + rnd.uniform(-0.01, 0.01),
+        'tst': int(time.time()),
+        'acc': rnd.randint(5, 50),
+        'vel': rnd.randint(0, 60),
+        'tid': 'lt',
+    }
+
+
+def percentiles(samples):
+    if not samples:
+        return "нет данных"
+    samples = sorted(samples)
+
+    def pct(p):
+        return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+
+    return f"p50={pct(0.50):.2f}  p95={pct(0.95):.2f}  p99={pct(0.99):.2f}  max={samples[-1] * 1000:.2f} ms"
+
+
+def paced(rate, duration, workers, worker_fn):
+    """Запускает worker_fn(i) с суммарной частотой rate в течение duration секунд"""
+    interval = workers / float(rate)
+    stop_at = time.monotonic() + duration
+
+    def loop(worker_id):
+        next_at = time.monotonic() + random.random() * interval
+        i = 0
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                return
+            if next_at > now:
+                time.sleep(next_at - now)
+            worker_fn(worker_id, i)
+            i += 1
+            next_at += interval
+
+    threads = [threading.Thread(target=loop, args=(w,)) for w in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def run_http(args):
+    telegram_ids = [int(x) for x in args.telegram_ids.split(',') if x]
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    rnd = random.Random(1)
+
+    def send(worker_id, i):
+        tg = telegram_ids[(worker_id + i) % len(telegram_ids)] if telegram_ids else None
+        url = args.url + (f"?user_id={tg}" if tg else '')
+        body = json.dumps(owntracks_payload(rnd)).encode('utf-8')
+        req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=10) as resp:
+                resp.read()
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+        except Exception:
+            with lock:
+                errors[0] += 1
+
+    started = time.monotonic()
+    paced(args.rate, args.duration, args.devices, send)
+    elapsed = time.monotonic() - started
+    print(f"sent={len(latencies) + errors[0]} ok={len(latencies)} errors={errors[0]} "
+          f"throughput={len(latencies) / elapsed:.0f} req/s")
+    print(f"latency: {percentiles(latencies)}")
+
+
+def run_direct(args):
+    from bot.database import Database
+    from bot.ingest import LocationIngest
+
+    def prepare(path):
+        database = Database(path)
+        conn = database.get_connection()
+        conn.executemany(
+            "INSERT INTO users (telegram_id, first_name, role, work_latitude, work_longitude, work_radius) VALUES (?, ?, 'driver', 55.75, 37.61, 300)",
+            [(1000 + i, f"Driver {i}") for i in range(args.devices)]
+        )
+        conn.commit()
+        users = [dict(zip(('id', 'telegram_id', 'role', 'work_latitude', 'work_longitude', 'work_radius'), row))
+                 for row in conn.execute("SELECT id, telegram_id, role, work_latitude, work_longitude, work_radius FROM users")]
+        conn.close()
+        return database, users
+
+    def scenario(name, database, users, accept):
+        latencies = []
+        lock = threading.Lock()
+        rnd = random.Random(2)
+
+        def send(worker_id, i):
+            user = users[worker_id % len(users)]
+            payload = owntracks_payload(rnd)
+            started = time.perf_counter()
+            point = database.make_location_point(user, user['telegram_id'], payload['lat'], payload['lon'],
+                                                 accuracy=payload['acc'], speed=payload['vel'])
+            accept(point)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+        started = time.monotonic()
+        paced(args.rate, args.duration, args.devices, send)
+        elapsed = time.monotonic() - started
+        print(f"{name:<24} accepted={len(latencies)} ({len(latencies) / elapsed:.0f}/s)  ack {percentiles(latencies)}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database, users = prepare(os.path.join(tmp, 'sync.db'))
+        scenario("commit per point", database, users, lambda p: database.add_locations_batch([p]))
+
+        database, users = prepare(os.path.join(tmp, 'batched.db'))
+        ingest = LocationIngest(database, max_queue=args.queue, batch_size=args.batch, max_latency_ms=args.latency_ms)
+        scenario("write-behind batches", database, users, ingest.submit)
+        ingest.stop()
+        stats = ingest.get_stats()
+        print("ingest stats: " + ", ".join(f"{k}={v}" for k, v in stats.items()))
+        conn = database.get_connection()
+        stored = conn.execute("SELECT COUNT(*) FROM user_locations").fetchone()[0]
+        conn.close()
+        print(f"stored rows: {stored}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices=['http', 'direct'])
+    parser.add_argument('--url', default='http://127.0.0.1:5000/api/location')
+    parser.add_argument('--telegram-ids', default='', help='telegram_id водителей через запятую (параметр user_id)')
+    parser.add_argument('--devices', type=int, default=20, help='число одновременных устройств (потоков)')
+    parser.add_argument('--rate', type=float, default=100, help='суммарная частота точек в секунду')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--queue', type=int, default=10000)
+    parser.add_argument('--batch', type=int, default=200)
+    parser.add_argument('--latency-ms', type=int, default=250)
+    args = parser.parse_args()
+
+    if args.mode == 'http':
+        run_http(args)
+    else:
+        run_direct(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""
+Повторный прогон треков: сырой флаг "в зоне" против гистерезиса (bot/geofence.py).
+
+Прежний путь: is_at_work = точка внутри радиуса, уведомления — TransitionDetector
+с подтверждением следующей точкой или паузой. Новый: статус даёт GeofenceEngine
+(полоса гистерезиса, время пребывания, фильтр по accuracy), детектор уведомляет
+по первой смене статуса (confirm=False). Антиспам MIN_NOTIFY_INTERVAL_SEC
+одинаков для обоих путей.
+
+Синтетические треки (--synthetic) строятся с известной истиной: водитель
+подъезжает, стоит в зоне, уезжает, подолгу стоит у самой границы снаружи и
+изнутри; координаты зашумлены по accuracy, часть точек — грубые выбросы.
+Уведомление засчитывается верным, если в окне [-60 с; +300 с] от него есть
+истинный переход того же типа; остальные — ложные. Задержка — от истинного
+пересечения границы до уведомления.
+
+По реальной базе (--db) истины нет: печатается число смен статуса и
+уведомлений для зон из профилей водителей.
+
+    python tests/replay_geofence.py --synthetic 50
+    python tests/replay_geofence.py --db driver.db
+"""
+
+import argparse
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import config
+from bot.geofence import create_geofence_engine
+from bot.transitions import ARRIVAL, DEPARTURE, TransitionDetector
+from bot.zones import profile_zone
+
+M_PER_DEG = 111320.0
+CENTER = (55.7558, 37.6173)
+RADIUS_M = 150
+MATCH_BEFORE_SEC = 60
+MATCH_AFTER_SEC = 300
+
+
+def offset(lat, lon, north_m, east_m):
+    return lat + north_m / M_PER_DEG, lon + east_m / (M_PER_DEG * math.cos(math.radians(lat)))
+
+
+def created_at(ts):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
+
+
+# ---------- синтетика ----------
+
+def true_track(rnd):
+    """Истинное расстояние от центра зоны по времени: [(ts_offset, расстояние_м), ...]"""
+    plan = [
+        ('stay', 1500, 120),
+        ('drive', 40, None),                    # подъезд и работа
+        ('stay', None, rnd.randint(300, 900)),
+        ('drive', 1500, None),                  # отъезд
+        ('stay', None, 120),
+        ('drive', RADIUS_M + rnd.uniform(15, 35), None),    # стоянка у границы снаружи
+        ('stay', None, rnd.randint(300, 900)),
+        ('drive', RADIUS_M - rnd.uniform(15, 35), None),    # стоянка у границы внутри
+        ('stay', None, rnd.randint(300, 900)),
+        ('drive', 1500, None),
+        ('stay', None, 120),
+    ]
+    points = []
+    t, d = 0, 1500.0
+    for kind, target, duration in plan:
+        if kind == 'drive':
+            speed = rnd.uniform(5, 12)
+            while d != target:
+                step = rnd.choice([3, 5, 5, 5, 8])
+                t += step
+                d = max(d - speed * step, target) if target < d else min(d + speed * step, target)
+                points.append((t, d))
+        else:
+            end = t + duration
+            while t < end:
+                t += rnd.choice([3, 5, 5, 5, 8, 15])
+                points.append((t, d))
+    return points
+
+
+def noisy_points(track, rnd, base_ts, bearing):
+    """Зашумлённые точки трека и истинные переходы [(тип, ts)]"""
+    points, truth = [], []
+    inside = None
+    for t, d in track:
+        ts = base_ts + t
+        is_inside = d <= RADIUS_M
+        if inside is not None and is_inside != inside:
+            truth.append((ARRIVAL if is_inside else DEPARTURE, ts))
+        inside = is_inside
+        if rnd.random() < 0.03:
+            accuracy = rnd.uniform(100, 300)        # выброс: сеть вместо GPS
+            sigma = accuracy
+        else:
+            accuracy = rnd.uniform(5, 40)
+            sigma = accuracy / 2
+        north = d * math.cos(bearing) + rnd.gauss(0, sigma)
+        east = d * math.sin(bearing) + rnd.gauss(0, sigma)
+        lat, lon = offset(CENTER[0], CENTER[1], north, east)
+        points.append((ts, lat, lon, accuracy))
+    return points, truth
+
+
+def synthetic_drivers(count, seed):
+    rnd = random.Random(seed)
+    base_ts = time.mktime((2024, 1, 1, 8, 0, 0, 0, 0, -1))
+    drivers = []
+    for d in range(count):
+        user_info = {'id': d + 1, 'role': 'driver', 'work_latitude': CENTER[0],
+                     'work_longitude': CENTER[1], 'work_radius': RADIUS_M}
+        points, truth = noisy_points(true_track(rnd), rnd, base_ts, rnd.uniform(0, 2 * math.pi))
+        drivers.append((user_info, points, truth))
+    return drivers
+
+
+# ---------- прогон ----------
+
+def notify(detector, telegram_id, location_id, user_id, is_at_work, ts):
+    """Точка через детектор; возвращает (тип, ts) отправленного уведомления или None"""
+    detector.add_point(telegram_id, location_id, user_id, is_at_work, created_at(ts))
+    candidate = detector.evaluate(telegram_id)
+    if candidate and not detector.is_too_early(telegram_id, candidate):
+        detector.mark_sent(telegram_id, candidate)
+        return candidate['type'], ts
+    return None
+
+
+def run(user_info, points, hysteresis, engine=None):
+    """Уведомления и число смен статуса по треку одного водителя"""
+    zone = profile_zone(user_info)
+    detector = TransitionDetector(confirm=not hysteresis)
+    sent, flips, last = [], 0, None
+    for location_id, (ts, lat, lon, accuracy) in enumerate(points, start=1):
+        if hysteresis:
+            is_at_work = engine.update(user_info, lat, lon, accuracy, ts=ts)['is_at_work']
+        else:
+            is_at_work = zone.contains(lat, lon)
+        flips += last is not None and is_at_work != last
+        last = is_at_work
+        result = notify(detector, user_info['id'], location_id, user_info['id'], is_at_work, ts)
+        if result:
+            sent.append(result)
+    return sent, flips
+
+
+def score(sent, truth):
+    """(верные, ложные, пропущенные, задержки)"""
+    unmatched = list(truth)
+    correct, false, latencies = 0, 0, []
+    for kind, ts in sent:
+        match = next((t for t in unmatched if t[0] == kind and -MATCH_BEFORE_SEC <= ts - t[1] <= MATCH_AFTER_SEC), None)
+        if match is None:
+            false += 1
+            continue
+        unmatched.remove(match)
+        correct += 1
+        latencies.append(ts - match[1])
+    return correct, false, len(unmatched), latencies
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def replay_synthetic(count, seed):
+    drivers = synthetic_drivers(count, seed)
+    engine = create_geofence_engine()
+    truth_total = sum(len(truth) for _, _, truth in drivers)
+    print(f"водителей {count}, точек {sum(len(p) for _, p, _ in drivers)}, истинных переходов {truth_total}")
+    for label, hysteresis in (('сырой флаг', False), ('гистерезис', True)):
+        totals = [0, 0, 0, 0, []]
+        started = time.perf_counter()
+        for user_info, points, truth in drivers:
+            sent, flips = run(user_info, points, hysteresis, engine)
+            correct, false, missed, latencies = score(sent, truth)
+            totals[0] += flips
+            totals[1] += correct
+            totals[2] += false
+            totals[3] += missed
+            totals[4].extend(latencies)
+        elapsed = time.perf_counter() - started
+        print(f"{label:>11}: смен статуса {totals[0]:5}, уведомлений верных {totals[1]:4}, ложных {totals[2]:4}, "
+              f"пропущено {totals[3]:3}, задержка p50 {percentile(totals[4], 0.5):5.0f} с, "
+              f"p90 {percentile(totals[4], 0.9):5.0f} с ({elapsed * 1000:.0f} мс)")
+    print(f"engine: {engine.get_stats()}")
+    return 0
+
+
+def replay_db(db_path):
+    conn = sqlite3.connect(db_path)
+    users = {row[0]: {'id': row[0], 'role': row[1], 'work_latitude': row[2], 'work_longitude': row[3],
+                      'work_radius': row[4]}
+             for row in conn.execute('SELECT id, role, work_latitude, work_longitude, work_radius FROM users')}
+    tracks = {}
+    for user_id, lat, lon, accuracy, created in conn.execute(
+        'SELECT user_id, latitude, longitude, accuracy, created_at FROM user_locations ORDER BY id'
+    ):
+        user_info = users.get(user_id)
+        if user_info is None or user_info['role'] == 'recipient' or profile_zone(user_info) is None:
+            continue
+        ts = time.mktime(time.strptime(created, '%Y-%m-%d %H:%M:%S'))
+        tracks.setdefault(user_id, []).append((ts, lat, lon, accuracy))
+    conn.close()
+
+    engine = create_geofence_engine()
+    print(f"водителей {len(tracks)}, точек {sum(len(p) for p in tracks.values())}")
+    for label, hysteresis in (('сырой флаг', False), ('гистерезис', True)):
+        flips = notifications = 0
+        for user_id, points in tracks.items():
+            sent, user_flips = run(users[user_id], points, hysteresis, engine)
+            flips += user_flips
+            notifications += len(sent)
+        print(f"{label:>11}: смен статуса {flips:5}, уведомлений {notifications:5}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=None, help='путь к driver.db для прогона реальной истории')
+    parser.add_argument('--synthetic', type=int, default=50, help='число синтетических водителей, если --db не задан')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    print(f"enter_dwell {config.GEOFENCE_ENTER_DWELL_SEC} с, exit_dwell {config.GEOFENCE_EXIT_DWELL_SEC} с, "
+          f"exit_margin {config.GEOFENCE_EXIT_MARGIN_M} м, max_accuracy {config.GEOFENCE_MAX_ACCURACY_M} м")
+    if args.db:
+        return replay_db(args.db)
+    return replay_synthetic(args.synthetic, args.seed)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
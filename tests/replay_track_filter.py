@@ -0,0 +1,112 @@
+"""
+Прогон фильтра трека (bot/track_filter.py) по синтетическим поездкам.
+
+Водитель едет по прямой, стоит, снова едет; к координатам добавлен шум по
+accuracy, часть точек — грубые (accuracy в сотни метров) и невозможные
+скачки на 0.5–3 км с обычной accuracy. Печатает, сколько точек отсеяно и
+по какой причине, долю сэкономленных записей, сколько скачков прошло в базу
+и ошибку положения записанных точек до и после фильтра (--smooth —
+со сглаживанием Калмана).
+
+    python tests/replay_track_filter.py --drivers 50 [--smooth]
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.geo import haversine
+from bot.track_filter import TrackFilter
+
+M_PER_DEG = 111320.0
+CENTER = (55.7558, 37.6173)
+
+
+def offset(lat, lon, north_m, east_m):
+    return lat + north_m / M_PER_DEG, lon + east_m / (M_PER_DEG * math.cos(math.radians(lat)))
+
+
+def synthetic_track(rnd):
+    """[(ts, истинные lat/lon, измеренные lat/lon, accuracy, скачок?, в движении?)]"""
+    bearing = rnd.uniform(0, 2 * math.pi)
+    points, t, position = [], 0.0, 0.0
+    for kind, duration in (('drive', 600), ('stay', 900), ('drive', 600), ('stay', 600)):
+        speed = rnd.uniform(8, 16) if kind == 'drive' else 0.0
+        end = t + duration
+        while t < end:
+            step = rnd.choice([3, 5, 5, 5, 8])
+            t += step
+            position += speed * step
+            true_lat, true_lon = offset(CENTER[0], CENTER[1], position * math.cos(bearing), position * math.sin(bearing))
+            jump = False
+            roll = rnd.random()
+            if roll < 0.02:
+                accuracy = rnd.uniform(600, 2000)       # вышка вместо GPS
+                noise = accuracy
+            elif roll < 0.04:
+                accuracy = rnd.uniform(5, 20)           # скачок с "хорошей" accuracy
+                noise = rnd.uniform(500, 3000)
+                jump = True
+            else:
+                accuracy = rnd.uniform(5, 25)
+                noise = accuracy / 2
+            angle = rnd.uniform(0, 2 * math.pi)
+            error = abs(rnd.gauss(0, noise)) if not jump else noise
+            lat, lon = offset(true_lat, true_lon, error * math.cos(angle), error * math.sin(angle))
+            points.append((t, true_lat, true_lon, lat, lon, accuracy, jump, speed > 0))
+    return points
+
+
+def rms(values):
+    return math.sqrt(sum(v * v for v in values) / len(values)) if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--drivers', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--smooth', action='store_true', help='сглаживание Калмана (TRACK_FILTER_SMOOTH)')
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    track_filter = TrackFilter(smooth=args.smooth)
+    base_ts = time.time()
+    total = jumps = jumps_stored = 0
+    errors = {True: ([], []), False: ([], [])}    # в движении / на стоянке: (сырые, после фильтра)
+    started = time.perf_counter()
+    for user_id in range(1, args.drivers + 1):
+        for t, true_lat, true_lon, lat, lon, accuracy, jump, moving in synthetic_track(rnd):
+            total += 1
+            jumps += jump
+            ts = base_ts + t
+            f_lat, f_lon, reason = track_filter.check(user_id, lat, lon, accuracy, ts)
+            if reason:
+                continue
+            point = {'latitude': f_lat, 'longitude': f_lon, 'is_at_work': 0, 'zone_id': None}
+            if track_filter.redundant(user_id, point, ts):
+                continue
+            jumps_stored += jump
+            errors[moving][0].append(haversine(lat, lon, true_lat, true_lon))
+            errors[moving][1].append(haversine(f_lat, f_lon, true_lat, true_lon))
+    elapsed = time.perf_counter() - started
+
+    stats = track_filter.get_stats()
+    print(f"точек {total}, скачков {jumps}; {elapsed / total * 1e6:.1f} мкс/точка")
+    print(f"отсеяно: accuracy {stats['rejected_accuracy']}, скорость {stats['rejected_speed']}, "
+          f"стоянка {stats['dropped_stationary']}; записано {stats['stored']} "
+          f"(экономия записей {stats['saved_writes_pct']}%)")
+    print(f"скачков записано: {jumps_stored} из {jumps}, сбросов оценки: {stats['resets']}")
+    for moving, label in ((True, 'в движении'), (False, 'на стоянке')):
+        raw, filtered = errors[moving]
+        print(f"ошибка записанных точек {label}, м: сырые RMS {rms(raw):.1f}, после фильтра RMS {rms(filtered):.1f} "
+              f"({len(raw)} точек)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
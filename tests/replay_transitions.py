@@ -0,0 +1,196 @@
+"""
+Повторный прогон истории user_locations: сравнение событийного детектора
+(bot.transitions.TransitionDetector) с прежним опросом monitor_database.
+
+Опрос воспроизведён дословно (последние 200 строк, группировка по водителю,
+четыре шаблона перехода) и вызывается после каждой новой строки — это самый
+частый опрос, при котором он ничего не пропускает. Внешние ограничения
+(антиспам 30 минут, статус отслеживания, наличие получателей) считаются
+пройденными: они одинаковы для обоих путей и сверяются не здесь.
+
+Запуск:
+    python tests/replay_transitions.py --db driver.db
+    python tests/replay_transitions.py --synthetic 20000 --drivers 30
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.transitions import TransitionDetector
+
+
+class LegacyPoller:
+    """Логика прежнего monitor_database без обращений к БД и Telegram"""
+
+    def __init__(self):
+        self.per_user_last_checked_id = {}
+        self.per_user_last_checked_time = {}
+        self.per_user_last_notification_type = {}
+
+    def poll(self, rows):
+        """rows — последние 200 строк (id, user_id, telegram_id, is_at_work, created_at) по убыванию id"""
+        sent = []
+        by_user = defaultdict(list)
+        for rec_id, user_id, tg_id, is_at_work, created_at in rows:
+            by_user[tg_id].append((rec_id, user_id, is_at_work, created_at))
+
+        for tg_id, entries in by_user.items():
+            if len(entries) < 2:
+                continue
+            (curr_id, _inviter_user_id, curr_is_at_work, curr_time) = entries[0]
+            (_prev_id, _prev_user_id, prev_is_at_work, prev_time) = entries[1]
+            prev2_is_at_work = entries[2][2] if len(entries) >= 3 else None
+            try:
+                curr_ts = time.mktime(time.strptime(curr_time, "%Y-%m-%d %H:%M:%S"))
+                prev_ts = time.mktime(time.strptime(prev_time, "%Y-%m-%d %H:%M:%S"))
+            except Exception:
+                continue
+            dt_prev_curr = curr_ts - prev_ts
+
+            def confirmed_transition(new_state):
+                if prev2_is_at_work is not None and prev2_is_at_work == new_state:
+                    return True
+                return dt_prev_curr >= 5
+
+            last_checked_id = self.per_user_last_checked_id.get(tg_id, 0)
+            last_checked_time = self.per_user_last_checked_time.get(tg_id, 0.0)
+            last_notification_type = self.per_user_last_notification_type.get(tg_id)
+
+            checks = [
+                ('arrival', prev_is_at_work == 0 and curr_is_at_work == 1 and confirmed_transition(1)),
+                ('arrival', prev_is_at_work == 1 and curr_is_at_work == 1 and prev2_is_at_work == 0),
+                ('departure', prev_is_at_work == 1 and curr_is_at_work == 0 and confirmed_transition(0)),
+                ('departure', prev_is_at_work == 0 and curr_is_at_work == 0 and prev2_is_at_work == 1),
+            ]
+            for kind, matched in checks:
+                if (
+                    matched and curr_id != last_checked_id and
+                    last_notification_type != kind and
+                    curr_ts - last_checked_time >= 10
+                ):
+                    self.per_user_last_checked_id[tg_id] = curr_id
+                    self.per_user_last_checked_time[tg_id] = curr_ts
+                    self.per_user_last_notification_type[tg_id] = kind
+                    sent.append((tg_id, kind, curr_id))
+        return sent
+
+
+def load_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute(
+        """
+        SELECT ul.id, ul.user_id, ul.telegram_id, ul.is_at_work, ul.created_at
+        FROM user_locations ul
+        JOIN users u ON ul.user_id = u.id
+        WHERE u.role IN ('driver', 'admin') AND ul.telegram_id IS NOT NULL
+        ORDER BY ul.id
+        """
+    )
+    rows = c.fetchall()
+    conn.close()
+    return rows
+
+
+def synthetic_rows(count, drivers, seed=1):
+    """Случайные поездки: водители стоят, въезжают и выезжают, интервалы 1–30 с, бывает дребезг"""
+    rnd = random.Random(seed)
+    now = {d: datetime(2024, 1, 1, 8, 0, 0) for d in range(drivers)}
+    state = {d: 0 for d in range(drivers)}
+    rows = []
+    for rec_id in range(1, count + 1):
+        d = rnd.randrange(drivers)
+        now[d] += timedelta(seconds=rnd.choice([1, 2, 3, 4, 6, 10, 15, 30]))
+        if rnd.random() < 0.15:
+            state[d] = 1 - state[d]
+        is_at_work = state[d] if rnd.random() > 0.05 else 1 - state[d]
+        rows.append((rec_id, d + 1, 100000 + d, is_at_work, now[d].strftime('%Y-%m-%d %H:%M:%S')))
+    return rows
+
+
+def run_legacy(rows, limit=200):
+    """Опрос после каждой новой строки по последним limit строкам"""
+    poller = LegacyPoller()
+    sent = []
+    recent = []
+    for row in rows:
+        recent.insert(0, row)
+        del recent[limit:]
+        sent.extend(poller.poll(recent))
+    return sent
+
+
+def run_incremental(rows):
+    detector = TransitionDetector()
+    sent = []
+    for rec_id, user_id, tg_id, is_at_work, created_at in rows:
+        if not detector.add_point(tg_id, rec_id, user_id, is_at_work, created_at):
+            continue
+        candidate = detector.evaluate(tg_id)
+        if candidate and not detector.is_too_early(tg_id, candidate):
+            detector.mark_sent(tg_id, candidate)
+            sent.append((tg_id, candidate['type'], candidate['curr_id']))
+    return sent
+
+
+def replay(rows):
+    """
+    Строгое сравнение идёт по каждому водителю отдельно: правила перехода у
+    опроса и детектора по-водительские, а общее окно в 200 строк — артефакт
+    опроса (редко отчитывающийся водитель выпадает из него при большом числе
+    активных водителей). Его потери считаются отдельно по общему прогону.
+    """
+    by_driver = defaultdict(list)
+    for row in rows:
+        by_driver[row[2]].append(row)
+
+    started = time.perf_counter()
+    legacy = sorted(n for driver_rows in by_driver.values() for n in run_legacy(driver_rows))
+    legacy_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    incremental = run_incremental(rows)
+    incremental_elapsed = time.perf_counter() - started
+
+    legacy_global = run_legacy(rows)
+    return sorted(incremental), legacy, legacy_global, legacy_elapsed, incremental_elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default=None, help='путь к driver.db для прогона реальной истории')
+    parser.add_argument('--synthetic', type=int, default=5000, help='число синтетических точек, если --db не задан')
+    parser.add_argument('--drivers', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rows = load_rows(args.db) if args.db else synthetic_rows(args.synthetic, args.drivers, args.seed)
+    incremental, legacy, legacy_global, legacy_elapsed, incremental_elapsed = replay(rows)
+
+    print(f"rows: {len(rows)}")
+    print(f"legacy poller:      {len(legacy):6} notifications  {legacy_elapsed:8.3f} s")
+    print(f"event-driven:       {len(incremental):6} notifications  {incremental_elapsed:8.3f} s")
+    lost = len(set(incremental) - set(legacy_global))
+    print(f"legacy poller (общее окно 200 строк): {len(legacy_global)} notifications, не совпало с событийным: {lost}")
+    if legacy == incremental:
+        print("OK: результаты совпадают")
+        return 0
+    for i, (a, b) in enumerate(zip(legacy, incremental)):
+        if a != b:
+            print(f"MISMATCH #{i}: legacy={a} event={b}")
+            break
+    else:
+        print(f"MISMATCH: разная длина ({len(legacy)} vs {len(incremental)})")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,8 +10,10 @@ import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from bot.database import db
+from bot.state import state_store
 from bot.notification_system import notification_system
 from bot.main import monitor_database
+from bot.location_events import location_events, make_location_event
 
 
 class FakeBot:
@@ -41,22 +43,17 @@ def clear_tables():
     c.execute('DELETE FROM notification_logs')
     c.execute('DELETE FROM invitations')
     c.execute('DELETE FROM user_locations')
+    c.execute('DELETE FROM user_last_location')
     c.execute('DELETE FROM users')
     conn.commit()
     conn.close()
+    # Пользователи удалены в обход Database — сбрасываем кэш профилей
+    db.user_cache.clear()
 
 
 def ensure_files_reset():
-    # Сбрасываем антиспам
-    base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot')
-    arr = os.path.abspath(os.path.join(base_dir, 'last_arrival_time.txt'))
-    dep = os.path.abspath(os.path.join(base_dir, 'last_departure_time.txt'))
-    for path in (arr, dep):
-        try:
-            with open(path, 'w') as f:
-                f.write('0')
-        except Exception:
-            pass
+    # Сбрасываем антиспам и последние уведомления по водителям
+    state_store.reset()
 
 
 def create_user(telegram_id: int, role: str, first_name: str = None, last_name: str = None):
@@ -94,12 +91,16 @@ def insert_location(telegram_id: int, is_at_work: int, created_at: datetime):
         raise RuntimeError(f'user not found for telegram_id={telegram_id}')
     user_id = row[0]
     # Вставляем запись с заданным created_at
+    created_at_str = created_at.strftime('%Y-%m-%d %H:%M:%S')
     c.execute('''
         INSERT INTO user_locations (user_id, telegram_id, latitude, longitude, is_at_work, created_at)
         VALUES (?, ?, 55.75, 37.61, ?, ?)
-    ''', (user_id, telegram_id, is_at_work, created_at.strftime('%Y-%m-%d %H:%M:%S')))
+    ''', (user_id, telegram_id, is_at_work, created_at_str))
+    location_id = c.lastrowid
     conn.commit()
     conn.close()
+    # Запись идёт в обход add_user_location, поэтому событие публикуем сами
+    location_events.publish(make_location_event(location_id, user_id, telegram_id, is_at_work, created_at_str, 'driver'))
 
 
 async def run_scenarios():
@@ -6,16 +6,12 @@ import sys
 import re
 import json
 import logging
-import requests
 import hashlib
 import hmac
 import time
 import pytz
-import sqlite3
 import asyncio
-import threading
 import traceback
-import math
 from datetime import datetime, timedelta
 from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, make_response, send_from_directory
 # Опциональный импорт Flask-Limiter: не обязателен для работы приложения
@@ -36,9 +32,17 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 # Импортируем наши модули
 from config.settings import config
 from bot.database import Database
+from bot.ingest import location_ingest
+from bot.zones import ZoneError, CIRCLE, PROFILE_ZONE_ID, PROFILE_ZONE_NAME
+from web.telegram_client import telegram_client
+from web.singleflight import SingleFlight, SingleFlightTimeout
+from web.eta_cache import create_eta_cache
+from web.eta_refresher import create_eta_refresher
+from web.routing import create_routing_engine, geohash, make_route_entry, estimate_along_route
 from bot.utils import format_distance, format_timestamp, validate_coordinates, create_work_notification, calculate_distance, is_at_work, get_greeting
 from web.location_web_tracker import location_web_tracker, web_tracker
-from web.security import security_check, auth_security_check, password_reset_security_check, security_manager, log_security_event, login_rate_limit, password_reset_rate_limit, csrf_protect
+from web.serving import register_fork_hook
+from web.security import security_check, auth_security_check, password_reset_security_check, security_manager, security_layer, log_security_event, login_rate_limit, password_reset_rate_limit, csrf_protect
 
 # Загружаем переменные окружения из .env файла
 def load_env_file():
@@ -101,9 +105,25 @@ app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(seconds=int(os.environ.get(
 # Создаем новый экземпляр базы данных
 db = Database("driver.db")
 
+# Кэш /api/eta (ограниченный, хранилище из ETA_CACHE_BACKEND) — он же хранит общие паузы после 429
+eta_cache = create_eta_cache()
+# Пакетный расчёт ETA всех активных водителей (запускается при первом /api/eta)
+eta_refresher = create_eta_refresher(db, backoff_store=eta_cache)
+# Провайдеры маршрутов для /api/eta по порядку ROUTING_PROVIDERS
+routing_engine = create_routing_engine(backoff_store=eta_cache)
+
 # Регистрируем Blueprint для веб-отслеживания
 app.register_blueprint(location_web_tracker)
 
+# Проверки безопасности маршрутов (декораторы из web/security.py) — один before_request
+security_layer.init_app(app)
+
+# Потоки, соединения и блокировки, которые воркер gunicorn не может унаследовать от master (web/serving.py)
+for _component in (location_ingest, telegram_client, eta_refresher, routing_engine, eta_cache, db.zone_index,
+                   db.geofence, db.track_filter, security_manager, security_layer, web_tracker.store):
+    if _component is not None:
+        register_fork_hook(_component.reset_after_fork)
+
 # Middleware для установки правильных заголовков
 # @app.after_request
 # def add_header(response):
@@ -115,90 +135,10 @@ app.register_blueprint(location_web_tracker)
 # Небольшой кэш для ETA, чтобы не выбивать лимиты Yandex Routing API
 # Кэшируем на короткое время (по умолчанию 60 сек) и учитываем Retry-After
 # Ключ кэша зависит от пользователя/координат и флага пробок
+# Ответы, stale-записи и время последних вызовов хранит eta_cache (web/eta_cache.py)
 # ------------------------------
-_eta_cache_store = {}
-_eta_cache_lock = threading.Lock()
-_eta_global_next_allowed_ts = 0.0  # глобальная отсечка времени следующего запроса с учётом Retry-After
-_eta_stale_store = {}  # храним последний успешный ответ без TTL для режима stale-on-error
-_eta_last_call_ts = {}  # последнее обращение к внешнему API по ключу маршрута (для троттлинга)
-_eta_stale_meta = {}   # последняя позиция авто для ключа маршрута (для принятия решения по движению)
-
-def _eta_cache_get(cache_key: str):
-    now_ts = time.time()
-    with _eta_cache_lock:
-        entry = _eta_cache_store.get(cache_key)
-        if entry and entry.get('expires_at', 0) > now_ts:
-            return entry['data']
-    return None
-
-def _eta_cache_set(cache_key: str, data: dict, ttl_sec: int):
-    expires_at = time.time() + max(1, int(ttl_sec))
-    with _eta_cache_lock:
-        _eta_cache_store[cache_key] = {
-            'data': data,
-            'expires_at': expires_at,
-        }
-        # Параллельно запоминаем как последний успешный ответ (для stale-on-error)
-        _eta_stale_store[cache_key] = {
-            'data': data,
-            'ts': time.time(),
-        }
-
-def _eta_stale_get(cache_key: str, max_age_sec: int):
-    if max_age_sec <= 0:
-        return None
-    now_ts = time.time()
-    with _eta_cache_lock:
-        entry = _eta_stale_store.get(cache_key)
-        if entry and (now_ts - entry.get('ts', 0)) <= max_age_sec:
-            return entry['data']
-    return None
-
-def _eta_stale_set_meta(cache_key: str, car_lat: float, car_lon: float):
-    with _eta_cache_lock:
-        _eta_stale_meta[cache_key] = {
-            'lat': float(car_lat),
-            'lon': float(car_lon),
-            'ts': time.time(),
-        }
-
-def _eta_stale_get_meta(cache_key: str):
-    with _eta_cache_lock:
-        return _eta_stale_meta.get(cache_key)
-
-def _eta_set_global_backoff(retry_after_header: str):
-    """Учитываем Retry-After из ответа Яндекса.
-    Поддерживает оба формата: число секунд или HTTP-date.
-    """
-    global _eta_global_next_allowed_ts
-    if not retry_after_header:
-        return
-    retry_after_header = str(retry_after_header).strip()
-    try:
-        # Формат в секундах
-        sec = int(retry_after_header)
-        _eta_global_next_allowed_ts = max(_eta_global_next_allowed_ts, time.time() + max(1, sec))
-        return
-    except Exception:
-        pass
-    # Попробуем распарсить HTTP-date
-    try:
-        from email.utils import parsedate_to_datetime
-        dt = parsedate_to_datetime(retry_after_header)
-        if dt is not None:
-            _eta_global_next_allowed_ts = max(_eta_global_next_allowed_ts, dt.timestamp())
-    except Exception:
-        # игнорируем, если не удалось распарсить
-        pass
-
-def _eta_set_default_backoff(seconds: int = None):
-    """Устанавливаем дефолтный backoff, если сервер не прислал Retry-After."""
-    global _eta_global_next_allowed_ts
-    try:
-        sec = int(seconds) if seconds is not None else int(os.environ.get('ETA_DEFAULT_BACKOFF_SEC', 60))
-    except Exception:
-        sec = 60
-    _eta_global_next_allowed_ts = max(_eta_global_next_allowed_ts, time.time() + max(1, sec))
+# Одновременные промахи кэша по одному маршруту объединяются в один вызов провайдера
+_eta_flight = SingleFlight(timeout=float(os.environ.get('ETA_SINGLEFLIGHT_TIMEOUT_SEC', 15)))
 
 # Добавляем заголовки безопасности для всех ответов
 @app.after_request
@@ -272,6 +212,62 @@ def get_current_user_role():
         return db.get_user_role_by_login(user_login)
     return None
 
+def get_invited_recipient_ids(inviter_id):
+    """telegram_id получателей, принявших приглашение отправителя"""
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT DISTINCT recipient_telegram_id
+            FROM invitations
+            WHERE inviter_id = ?
+              AND status = 'accepted'
+              AND recipient_telegram_id IS NOT NULL
+            """,
+            (inviter_id,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def get_role_telegram_ids(role=None):
+    """telegram_id пользователей с указанной ролью (без роли — всех пользователей с ролями)"""
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    try:
+        if role:
+            cursor.execute("SELECT telegram_id FROM users WHERE role = ? AND telegram_id IS NOT NULL", (role,))
+        else:
+            cursor.execute("SELECT telegram_id FROM users WHERE role IS NOT NULL")
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def deliver_logged_notification(notification_log_id, recipients, text):
+    """Параллельно разослать text получателям, записав детали доставки в лог. Возвращает (sent, failed)"""
+    if notification_log_id:
+        users = db.get_users_by_telegram_ids(recipients)
+        details = []
+        for telegram_id in recipients:
+            recipient_info = users.get(telegram_id)
+            recipient_name = f"{recipient_info.get('first_name', '')} {recipient_info.get('last_name', '')}".strip() if recipient_info else None
+            details.append((telegram_id, recipient_name, 'pending'))
+        db.add_notification_details_batch(notification_log_id, details)
+
+    results = telegram_client.send_many(recipients, text)
+    for result in results:
+        if not result['ok']:
+            logger.error(f"Ошибка отправки уведомления пользователю {result['chat_id']}: {result['error']}")
+
+    if notification_log_id:
+        db.update_notification_details_batch(notification_log_id, [
+            (result['chat_id'], 'sent' if result['ok'] else 'failed', result['error'])
+            for result in results
+        ])
+    sent_count = sum(1 for result in results if result['ok'])
+    return sent_count, len(results) - sent_count
+
 def send_telegram_arrival(user_id):
     """Отправка ручного уведомления о прибытии всем пользователям с ролями, с логированием и подтверждением."""
     # Определяем отправителя и его роль (user_id может быть telegram_id или login)
@@ -301,22 +297,7 @@ def send_telegram_arrival(user_id):
         return False
 
     # Получаем всех получателей, принявших приглашение текущего отправителя
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            """
-            SELECT DISTINCT recipient_telegram_id
-            FROM invitations
-            WHERE inviter_id = ?
-              AND status = 'accepted'
-              AND recipient_telegram_id IS NOT NULL
-            """,
-            (user_info.get('id'),)
-        )
-        users = cursor.fetchall()
-    finally:
-        conn.close()
+    users = get_invited_recipient_ids(user_info.get('id'))
 
     # Если получателей нет — завершаем лог и отправляем подтверждение отправителю
     if not users:
@@ -326,37 +307,9 @@ def send_telegram_arrival(user_id):
         logger.info("Ручное уведомление: получателей нет — лог создан, подтверждение отправлено")
         return True
 
-    # Добавляем детали для получателей (pending)
-    for (telegram_id,) in users:
-        recipient_info = db.get_user_by_telegram_id(telegram_id)
-        recipient_name = f"{recipient_info.get('first_name', '')} {recipient_info.get('last_name', '')}".strip() if recipient_info else None
-        db.add_notification_detail(
-            notification_log_id=notification_log_id,
-            recipient_telegram_id=telegram_id,
-            recipient_name=recipient_name,
-            status="pending"
-        )
-
-    # Отправляем уведомления
-    token = os.environ.get('TELEGRAM_TOKEN') or os.environ.get('TELEGRAM_BOT_TOKEN') or 'default_token'
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-
-    sent_count = 0
-    failed_count = 0
+    # Отправляем уведомления (детали pending → sent/failed пишутся пакетами)
     total_users = len(users)
-    for (telegram_id,) in users:
-        try:
-            response = requests.post(url, data={"chat_id": telegram_id, "text": notification_text}, timeout=15)
-            if response.status_code == 200 and response.json().get('ok'):
-                sent_count += 1
-                db.update_notification_detail(notification_log_id, telegram_id, "sent")
-            else:
-                error_msg = response.json().get('description') if response.headers.get('content-type','').startswith('application/json') else f"HTTP {response.status_code}"
-                failed_count += 1
-                db.update_notification_detail(notification_log_id, telegram_id, "failed", error_msg)
-        except Exception as e:
-            failed_count += 1
-            db.update_notification_detail(notification_log_id, telegram_id, "failed", str(e))
+    sent_count, failed_count = deliver_logged_notification(notification_log_id, users, notification_text)
 
     # Завершаем лог и отправляем подтверждение
     db.complete_notification_log(notification_log_id, sent_count, failed_count)
@@ -396,11 +349,7 @@ def send_confirmation_messages(notification_log_id, sender_info, notification_te
             failed_recipients.append(f"• {recipient_name} (ошибка: {error_msg})")
     
     # Отправляем подтверждение водителям
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT telegram_id FROM users WHERE role = 'driver' AND telegram_id IS NOT NULL")
-    drivers = cursor.fetchall()
-    conn.close()
+    drivers = get_role_telegram_ids('driver')
     
     if drivers:
         driver_confirmation = f"""✅ Уведомления отправлены {len(successful_recipients)} получателям:
@@ -417,25 +366,14 @@ def send_confirmation_messages(notification_log_id, sender_info, notification_te
 {chr(10).join(failed_recipients)}"""
         
         # Отправляем подтверждение водителям
-        token = os.environ.get('TELEGRAM_TOKEN', 'default_token')
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
-        
-        for (driver_telegram_id,) in drivers:
-            try:
-                response = requests.post(url, data={"chat_id": driver_telegram_id, "text": driver_confirmation}, timeout=15)
-                if response.status_code == 200 and response.json().get('ok'):
-                    logger.info(f"✅ Подтверждение отправлено водителю {driver_telegram_id}")
-                else:
-                    logger.error(f"❌ Ошибка отправки подтверждения водителю {driver_telegram_id}")
-            except Exception as e:
-                logger.error(f"❌ Ошибка отправки подтверждения водителю {driver_telegram_id}: {e}")
+        for result in telegram_client.send_many(drivers, driver_confirmation):
+            if result['ok']:
+                logger.info(f"✅ Подтверждение отправлено водителю {result['chat_id']}")
+            else:
+                logger.error(f"❌ Ошибка отправки подтверждения водителю {result['chat_id']}: {result['error']}")
     
     # Отправляем подтверждение администраторам
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT telegram_id FROM users WHERE role = 'admin' AND telegram_id IS NOT NULL")
-    admins = cursor.fetchall()
-    conn.close()
+    admins = get_role_telegram_ids('admin')
     
     if admins:
         sender_name = f"{sender_info.get('first_name', '')} {sender_info.get('last_name', '')}".strip()
@@ -458,15 +396,11 @@ def send_confirmation_messages(notification_log_id, sender_info, notification_te
 {chr(10).join(failed_recipients)}"""
         
         # Отправляем подтверждение администраторам
-        for (admin_telegram_id,) in admins:
-            try:
-                response = requests.post(url, data={"chat_id": admin_telegram_id, "text": admin_confirmation}, timeout=15)
-                if response.status_code == 200 and response.json().get('ok'):
-                    logger.info(f"✅ Подтверждение отправлено администратору {admin_telegram_id}")
-                else:
-                    logger.error(f"❌ Ошибка отправки подтверждения администратору {admin_telegram_id}")
-            except Exception as e:
-                logger.error(f"❌ Ошибка отправки подтверждения администратору {admin_telegram_id}: {e}")
+        for result in telegram_client.send_many(admins, admin_confirmation):
+            if result['ok']:
+                logger.info(f"✅ Подтверждение отправлено администратору {result['chat_id']}")
+            else:
+                logger.error(f"❌ Ошибка отправки подтверждения администратору {result['chat_id']}: {result['error']}")
     
     # Отмечаем, что подтверждения отправлены
     db.mark_confirmation_sent(notification_log_id)
@@ -508,8 +442,6 @@ def send_telegram_code(telegram_contact, code):
             logger.info(f"Отправка кода username (без @): @{username}")
         
         # Отправляем сообщение через Telegram Bot API
-        url = f"https://api.telegram.org/bot{os.environ.get('TELEGRAM_TOKEN', 'default_token')}/sendMessage"
-        
         # Упрощенное сообщение без Markdown для избежания ошибок форматирования
         message_text = f"""🔐 Код подтверждения для привязки аккаунта
 
@@ -524,22 +456,19 @@ def send_telegram_code(telegram_contact, code):
 • Вы начали диалог с ботом @{os.environ.get('TELEGRAM_BOT_USERNAME', 'default_bot_username')}"""
         
         # Сначала пробуем без parse_mode
-        data = {
-            'chat_id': chat_id,
-            'text': message_text
-        }
-        
         logger.info(f"Отправка сообщения в {chat_id}")
-        response = requests.post(url, json=data, timeout=10)
-        logger.info(f"sendMessage response: HTTP {response.status_code}")
-        
-        if response.status_code == 200:
-            result = response.json()
-            if result.get('ok'):
+        result = telegram_client.send_message(chat_id, message_text)
+        logger.info(f"sendMessage response: HTTP {result['status']}")
+        
+        if result['status'] is None:
+            logger.error(f"Ошибка отправки кода: {result['error']}")
+            return False, f"Ошибка отправки кода: {result['error']}"
+        if result['status'] == 200:
+            if result['ok']:
                 logger.info(f"Код {code} отправлен пользователю {chat_id}")
                 return True, "Код отправлен в Telegram"
             else:
-                error_msg = result.get('description', 'Неизвестная ошибка')
+                error_msg = result['error'] or 'Неизвестная ошибка'
                 logger.error(f"Ошибка отправки кода: {error_msg}")
                 
                 # Обрабатываем специфические ошибки
@@ -563,13 +492,9 @@ def send_telegram_code(telegram_contact, code):
                 else:
                     return False, f"Ошибка отправки: {error_msg}"
         else:
-            logger.error(f"HTTP ошибка {response.status_code} при отправке кода")
-            try:
-                error_data = response.json()
-                logger.error(f"Детали ошибки: {error_data}")
-            except:
-                logger.error(f"Текст ответа: {response.text}")
-            return False, f"Ошибка отправки (HTTP {response.status_code})"
+            logger.error(f"HTTP ошибка {result['status']} при отправке кода")
+            logger.error(f"Детали ошибки: {result['error']}")
+            return False, f"Ошибка отправки (HTTP {result['status']})"
         
     except Exception as e:
         logger.error(f"Ошибка отправки кода: {e}")
@@ -1089,65 +1014,35 @@ def api_location():
             ok, _ = validate_coordinates(latitude, longitude)
             if ok:
                 if user:
-                    # Используем новую систему с user_locations
-                    if telegram_id:
-                        # Для пользователей с telegram_id
-                        location_id = db.add_user_location(
-                            telegram_id=telegram_id,
-                            latitude=latitude,
-                            longitude=longitude,
-                            accuracy=data.get('accuracy'),
-                            altitude=data.get('altitude'),
-                            speed=data.get('speed'),
-                            heading=data.get('heading')
-                        )
-                        
-                        if location_id:
-                            # Получаем сохраненное местоположение для получения правильного статуса
-                            last_location = db.get_user_last_location(telegram_id)
-                            at_work = last_location.get('is_at_work', False) if last_location else False
-                            distance = last_location.get('distance_to_work', 0) if last_location else 0
-                            logger.info(f"Сохранено в user_locations: latitude={latitude}, longitude={longitude}, is_at_work={at_work}")
-                        else:
-                            logger.error(f"Не удалось сохранить местоположение пользователя {telegram_id}")
-                            return jsonify({'success': False, 'error': 'Database error'}), 500
+                    # Геозону (зоны пользователя и зону из профиля) считаем один раз в памяти,
+                    # точку отдаём в фоновую пакетную запись и сразу отвечаем устройству
+                    user_work_lat = user.get('work_latitude')
+                    user_work_lon = user.get('work_longitude')
+                    distance = calculate_distance(latitude, longitude, user_work_lat, user_work_lon) if user_work_lat and user_work_lon else None
+                    if not telegram_id and distance is None:
+                        # Исторически для пользователей без telegram_id это ошибка (точку при этом сохраняли)
+                        logger.warning(f"Рабочие координаты не установлены у пользователя ID={user.get('id')}")
+                    
+                    # Для пользователей без telegram_id в поле telegram_id пишется их id
+                    point = db.make_location_point(
+                        user, telegram_id or user['id'], latitude, longitude,
+                        accuracy=data.get('accuracy'),
+                        altitude=data.get('altitude'),
+                        speed=data.get('speed'),
+                        heading=data.get('heading'),
+                        timestamp=tst
+                    )
+                    at_work = bool(point['is_at_work'])
+                    if point['filtered']:
+                        # Выброс или повтор стоянки: устройству отвечаем как обычно, в базу не пишем
+                        logger.debug(f"Точка пользователя {telegram_id or user.get('id')} отсеяна фильтром трека: {point['filtered']}")
+                    elif not location_ingest.submit(point):
+                        logger.error(f"Не удалось сохранить местоположение пользователя {telegram_id or user.get('id')}")
+                        return jsonify({'success': False, 'error': 'Database error'}), 500
                     else:
-                        # Для пользователей без telegram_id (прямое сохранение)
-                        conn = sqlite3.connect(db.db_path)
-                        c = conn.cursor()
-                        try:
-                            from bot.utils import is_at_work
-                            user_role = user.get('role')
-                            user_work_lat = user.get('work_latitude')
-                            user_work_lon = user.get('work_longitude')
-                            user_work_radius = user.get('work_radius')
-                            is_at_work_status = is_at_work(latitude, longitude, user_role, user_work_lat, user_work_lon, user_work_radius)
-                            
-                            c.execute('''
-                                INSERT INTO user_locations 
-                                (user_id, telegram_id, latitude, longitude, accuracy, altitude, speed, heading, is_at_work)
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            ''', (user['id'], user['id'], latitude, longitude, data.get('accuracy'), data.get('altitude'), data.get('speed'), data.get('heading'), is_at_work_status))
-                            
-                            location_id = c.lastrowid
-                            conn.commit()
-                            logger.info(f"Сохранено в user_locations (без telegram_id): latitude={latitude}, longitude={longitude}, is_at_work={is_at_work_status}")
-                            
-                            # Вычисляем расстояние
-                            from bot.utils import calculate_distance
-                            if user_work_lat and user_work_lon:
-                                distance = calculate_distance(latitude, longitude, user_work_lat, user_work_lon)
-                            else:
-                                # Если координаты не установлены, возвращаем ошибку
-                                return jsonify({'success': False, 'error': 'Рабочие координаты не установлены. Настройте их в профиле.'}), 400
-                            
-                            at_work = is_at_work_status
-                        except Exception as e:
-                            conn.close()
-                            logger.error(f"Ошибка сохранения местоположения пользователя без telegram_id: {e}")
-                            return jsonify({'success': False, 'error': 'Database error'}), 500
-                        finally:
-                            conn.close()
+                        logger.info(f"Принято в user_locations: latitude={latitude}, longitude={longitude}, is_at_work={at_work}, zone_id={point['zone_id']}")
+                    if not telegram_id and distance is None:
+                        return jsonify({'success': False, 'error': 'Рабочие координаты не установлены. Настройте их в профиле.'}), 400
                 else:
                     # Fallback для случаев без пользователя - возвращаем ошибку
                     return jsonify({'success': False, 'error': 'Необходимо авторизоваться для отслеживания местоположения'}), 401
@@ -1174,6 +1069,75 @@ def api_location():
         logger.error(f"Ошибка добавления местоположения: {e}")
         return jsonify({'_type': 'status'}), 200
 
+@app.route('/api/ingest_stats')
+@security_check
+def api_ingest_stats():
+    """Метрики пакетной записи точек (только для администратора)"""
+    if get_current_user_role() != 'admin':
+        return jsonify({'success': False, 'error': 'Доступ запрещен'}), 403
+    return jsonify({'success': True, 'ingest': location_ingest.get_stats(), 'zones': db.zone_index.get_stats(),
+                    'geofence': db.geofence.get_stats() if db.geofence is not None else None,
+                    'track_filter': db.track_filter.get_stats() if db.track_filter is not None else None,
+                    'rate_limit': security_manager.get_rate_limit_stats(), 'security': security_layer.get_stats(),
+                    'tracking_sessions': web_tracker.store.get_stats()})
+
+def _zone_request_args(data):
+    """Поля зоны из JSON запроса в порядке аргументов ZoneIndex.add_zone/update_zone"""
+    return (data.get('name'), data.get('kind', CIRCLE), data.get('latitude'), data.get('longitude'),
+            data.get('radius'), data.get('polygon'))
+
+@app.route('/api/zones', methods=['GET', 'POST'])
+@security_check
+def api_zones():
+    """Рабочие зоны текущего водителя: список (GET) и создание (POST JSON)"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    if user.get('role') not in ('driver', 'admin'):
+        return jsonify({'success': False, 'error': 'Зоны доступны только водителям'}), 403
+    if request.method == 'POST':
+        try:
+            zone_id = db.zone_index.add_zone(user['id'], *_zone_request_args(request.get_json(silent=True) or {}))
+        except ZoneError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        logger.info(f"🗺️ ZONES: пользователь {user['id']} добавил зону {zone_id}")
+        return jsonify({'success': True, 'zone': db.zone_index.get(zone_id).to_dict()})
+    profile_zone = None
+    if user.get('work_latitude') is not None and user.get('work_longitude') is not None:
+        profile_zone = {'id': PROFILE_ZONE_ID, 'name': PROFILE_ZONE_NAME, 'kind': CIRCLE,
+                        'latitude': user['work_latitude'], 'longitude': user['work_longitude'],
+                        'radius': user.get('work_radius')}
+    return jsonify({'success': True, 'profile_zone': profile_zone,
+                    'zones': [z.to_dict() for z in db.zone_index.user_zones(user['id'])]})
+
+@app.route('/api/zones/<int:zone_id>', methods=['POST', 'DELETE'])
+@security_check
+def api_zone(zone_id):
+    """Изменение (POST JSON) и удаление зоны текущего водителя"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    if request.method == 'DELETE':
+        if not db.zone_index.delete_zone(user['id'], zone_id):
+            return jsonify({'success': False, 'error': 'Зона не найдена'}), 404
+        return jsonify({'success': True})
+    try:
+        updated = db.zone_index.update_zone(user['id'], zone_id, *_zone_request_args(request.get_json(silent=True) or {}))
+    except ZoneError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if updated is None:
+        return jsonify({'success': False, 'error': 'Зона не найдена'}), 404
+    return jsonify({'success': True, 'zone': db.zone_index.get(zone_id).to_dict()})
+
+@app.route('/api/eta_stats')
+@security_check
+def api_eta_stats():
+    """Метрики объединения запросов /api/eta (только для администратора)"""
+    if get_current_user_role() != 'admin':
+        return jsonify({'success': False, 'error': 'Доступ запрещен'}), 403
+    return jsonify({'success': True, 'singleflight': _eta_flight.get_stats(), 'refresher': eta_refresher.get_stats(),
+                    'providers': routing_engine.get_stats(), 'cache': eta_cache.get_stats()})
+
 @app.route('/api/notify', methods=['POST'])
 @security_check
 def api_notify():
@@ -1209,6 +1173,9 @@ def api_notify():
         
         # Используем telegram_id если есть, иначе логин
         user_id = user.get('telegram_id') or user.get('login')
+        if config.WEB_NOTIFY_ASYNC:
+            telegram_client.submit(send_telegram_arrival, user_id)
+            return jsonify({'success': True, 'queued': True})
         if send_telegram_arrival(user_id):
             return jsonify({'success': True})
         else:
@@ -1246,23 +1213,11 @@ def api_user1():
         text = f"{greeting} {name}"
         
         # Отправляем уведомления всем пользователям с ролями
-        token = token_env
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
-        
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT telegram_id FROM users WHERE role IS NOT NULL")
-        users = cursor.fetchall()
-        conn.close()
-        
-        sent_count = 0
-        for (user_telegram_id,) in users:
-            try:
-                response = requests.post(url, data={"chat_id": user_telegram_id, "text": text}, timeout=15)
-                if response.status_code == 200 and response.json().get('ok'):
-                    sent_count += 1
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления пользователю {user_telegram_id}: {e}")
+        users = get_role_telegram_ids()
+        if config.WEB_NOTIFY_ASYNC and users:
+            telegram_client.submit(deliver_logged_notification, None, users, text)
+            return jsonify({'success': True, 'queued': True})
+        sent_count, _failed = deliver_logged_notification(None, users, text)
         
         if sent_count > 0:
             return jsonify({'success': True})
@@ -1298,23 +1253,11 @@ def api_user2():
         text = f"{greeting} {name}"
         
         # Отправляем уведомления всем пользователям с ролями
-        token = os.environ.get('TELEGRAM_TOKEN', 'default_token')
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
-        
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT telegram_id FROM users WHERE role IS NOT NULL")
-        users = cursor.fetchall()
-        conn.close()
-        
-        sent_count = 0
-        for (user_telegram_id,) in users:
-            try:
-                response = requests.post(url, data={"chat_id": user_telegram_id, "text": text}, timeout=15)
-                if response.status_code == 200 and response.json().get('ok'):
-                    sent_count += 1
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления пользователю {user_telegram_id}: {e}")
+        users = get_role_telegram_ids()
+        if config.WEB_NOTIFY_ASYNC and users:
+            telegram_client.submit(deliver_logged_notification, None, users, text)
+            return jsonify({'success': True, 'queued': True})
+        sent_count, _failed = deliver_logged_notification(None, users, text)
         
         if sent_count > 0:
             return jsonify({'success': True})
@@ -1330,6 +1273,19 @@ def api_user2():
         logger.error(f"Ошибка user2: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def send_button_notification(notification_log_id, user, users, text):
+    """Рассылка по кнопке: отправка, завершение лога и подтверждение. Возвращает число отправленных"""
+    sent_count, failed_count = deliver_logged_notification(notification_log_id, users, text)
+    
+    # Завершение лога и подтверждение отправителю
+    if notification_log_id:
+        try:
+            db.complete_notification_log(notification_log_id, sent_count, failed_count)
+            send_confirmation_messages(notification_log_id, user, text, 'button')
+        except Exception as e:
+            logger.error(f"API_BUTTON: ошибка завершения лога/подтверждения: {e}")
+    return sent_count
+
 @app.route('/api/button/<int:idx>', methods=['POST'])
 @security_check
 def api_button(idx):
@@ -1359,9 +1315,6 @@ def api_button(idx):
         greeting = get_greeting() + '!'
         name = buttons[idx]
         text = f"{greeting} {name}"
-        # Используем TELEGRAM_TOKEN или TELEGRAM_BOT_TOKEN
-        token = os.environ.get('TELEGRAM_TOKEN') or os.environ.get('TELEGRAM_BOT_TOKEN') or 'default_token'
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
         # Создаём лог уведомления для кнопки
         try:
             notification_log_id = db.create_notification_log(
@@ -1376,57 +1329,13 @@ def api_button(idx):
             notification_log_id = None
         
         # Получаем получателей, принявших приглашение текущего отправителя
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute(
-                """
-                SELECT DISTINCT recipient_telegram_id
-                FROM invitations
-                WHERE inviter_id = ?
-                  AND status = 'accepted'
-                  AND recipient_telegram_id IS NOT NULL
-                """,
-                (user.get('id') if user else None,)
-            )
-            users = cursor.fetchall()
-        finally:
-            conn.close()
+        users = get_invited_recipient_ids(user.get('id') if user else None)
         
         logger.info(f"API_BUTTON: найдено пользователей для уведомлений users={len(users)}")
-        sent_count = 0
-        for (user_telegram_id,) in users:
-            # pending деталь, если лог создан
-            if notification_log_id:
-                try:
-                    recipient_info = db.get_user_by_telegram_id(user_telegram_id)
-                    recipient_name = f"{recipient_info.get('first_name', '')} {recipient_info.get('last_name', '')}".strip() if recipient_info else None
-                    db.add_notification_detail(notification_log_id, user_telegram_id, recipient_name, 'pending')
-                except Exception as e:
-                    logger.error(f"API_BUTTON: ошибка pending-детали: {e}")
-            try:
-                response = requests.post(url, data={"chat_id": user_telegram_id, "text": text}, timeout=15)
-                if response.status_code == 200 and response.json().get('ok'):
-                    sent_count += 1
-                    if notification_log_id:
-                        db.update_notification_detail(notification_log_id, user_telegram_id, 'sent')
-                else:
-                    if notification_log_id:
-                        error_msg = response.json().get('description') if response.headers.get('content-type','').startswith('application/json') else f"HTTP {response.status_code}"
-                        db.update_notification_detail(notification_log_id, user_telegram_id, 'failed', error_msg)
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления пользователю {user_telegram_id}: {e}")
-                if notification_log_id:
-                    db.update_notification_detail(notification_log_id, user_telegram_id, 'failed', str(e))
-        
-        # Завершение лога и подтверждение отправителю
-        if notification_log_id:
-            try:
-                failed_count = max(0, len(users) - sent_count)
-                db.complete_notification_log(notification_log_id, sent_count, failed_count)
-                send_confirmation_messages(notification_log_id, user, text, 'button')
-            except Exception as e:
-                logger.error(f"API_BUTTON: ошибка завершения лога/подтверждения: {e}")
+        if config.WEB_NOTIFY_ASYNC and users:
+            telegram_client.submit(send_button_notification, notification_log_id, user, users, text)
+            return jsonify({'success': True, 'queued': True})
+        sent_count = send_button_notification(notification_log_id, user, users, text)
 
         if sent_count > 0:
             return jsonify({'success': True})
@@ -1454,15 +1363,17 @@ def test_route():
 @security_check
 def api_eta():
     """ETA до рабочей точки (МСК) через Yandex Routing Matrix API с учётом пробок.
-    Требует переменную окружения YANDEX_ROUTING_API_KEY.
+    Требует переменную окружения YANDEX_ROUTING_API_KEY; если пробки не обязательны
+    (ETA_REQUIRE_TRAFFIC=false), используются фолбэки из web/routing/.
     """
     try:
+        # Без ключа Яндекса ETA возможна только через фолбэки (OSRM, локальный граф, оценка)
+        require_traffic = os.environ.get('ETA_REQUIRE_TRAFFIC', 'true').lower() in ('1', 'true', 'yes')
         api_key = os.environ.get('YANDEX_ROUTING_API_KEY')
-        if not api_key:
+        if not api_key and require_traffic:
             return jsonify({'success': False, 'error': 'YANDEX_ROUTING_API_KEY is not set'}), 200
 
-        import sqlite3
-        conn = sqlite3.connect('driver.db')
+        conn = db.get_connection()
         cursor = conn.cursor()
 
         user = get_current_user()
@@ -1509,9 +1420,8 @@ def api_eta():
         cursor.execute(
             """
             SELECT latitude, longitude
-            FROM user_locations
+            FROM user_last_location
             WHERE user_id = ?
-            ORDER BY id DESC LIMIT 1
             """,
             (car_user_id,)
         )
@@ -1522,154 +1432,18 @@ def api_eta():
 
         car_lat, car_lon = float(loc[0]), float(loc[1])
 
-        import requests
         # Диагностические параметры
         args = request.args or {}
         force_traffic = args.get('traffic')  # '1' / '0' or None
         compare = args.get('compare') in ('1', 'true', 'yes')
         debug = args.get('debug') in ('1', 'true', 'yes')
-        # Требовать ли пробки всегда
-        require_traffic = os.environ.get('ETA_REQUIRE_TRAFFIC', 'true').lower() in ('1', 'true', 'yes')
         # Разрешить фолбэк при 429 даже если require_traffic=true (по умолчанию выключено)
         allow_fallback_on_429 = os.environ.get('ETA_FALLBACK_ON_429', 'false').lower() in ('1', 'true', 'yes')
 
-        def build_payload(consider_traffic: bool):
-            return {
-                "sources": [{"latitude": car_lat, "longitude": car_lon}],
-                "targets": [{"latitude": float(work_lat), "longitude": float(work_lon)}],
-                # Оставляем минимально необходимый набор аннотаций для снижения нагрузки
-                "annotations": ["distance", "jam_time", "expected_time"],
-                "consider_traffic": consider_traffic,
-                "transport": "car"
-            }
-
-        # Эндпоинты Yandex Routes Matrix: сначала облачный, затем легаси как фолбэк
-        env_full_url = os.environ.get('YANDEX_ROUTING_MATRIX_URL')
-        env_base_url = os.environ.get('YANDEX_ROUTING_BASE_URL')
-        endpoint_candidates = []
-        if env_full_url:
-            endpoint_candidates.append(env_full_url.strip())
-        if env_base_url:
-            endpoint_candidates.append(env_base_url.rstrip('/') + '/routes/v2/matrix')
-            endpoint_candidates.append(env_base_url.rstrip('/') + '/v2/matrix')
-        # Облачные варианты (оба встречаются в документации/примерах)
-        endpoint_candidates.append('https://routes.api.cloud.yandex.net/routes/v2/matrix')
-        endpoint_candidates.append('https://routes.api.cloud.yandex.net/v2/matrix')
-        # Легаси варианты (можно отключить через YANDEX_ROUTING_DISABLE_LEGACY)
-        disable_legacy = os.environ.get('YANDEX_ROUTING_DISABLE_LEGACY', 'false').lower() in ('1', 'true', 'yes')
-        if not disable_legacy:
-            endpoint_candidates.append('https://api.routing.yandex.net/v2/matrix')
-            endpoint_candidates.append('https://api.routing.yandex.net/v2/distancematrix')
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Api-Key {api_key}',
-            # Дублируем схему для совместимости со старыми/прокси конфигурациями
-            'X-Api-Key': api_key
-        }
-        def call_and_parse(consider_traffic: bool):
-            payload = build_payload(consider_traffic)
-            # Глобальный backoff с учётом Retry-After
-            now_ts = time.time()
-            global _eta_global_next_allowed_ts
-            if now_ts < _eta_global_next_allowed_ts:
-                # Преждевременно не обращаемся к внешнему API
-                class Resp:
-                    status_code = 429
-                    headers = {'Retry-After': str(int(_eta_global_next_allowed_ts - now_ts) + 1)}
-                    def json(self):
-                        return {"errors": ["Too many requests (local backoff)"]}
-                r = Resp()
-            else:
-                r = None
-                url_used = None
-                last_exc = None
-                for candidate in endpoint_candidates:
-                    try:
-                        resp = requests.post(candidate, json=payload, headers=headers, timeout=10)
-                        # Если это не 404, принимаем ответ и выходим
-                        if getattr(resp, 'status_code', None) != 404:
-                            r = resp
-                            url_used = candidate
-                            break
-                        # 404 — пробуем следующий кандидат
-                        r = resp
-                        url_used = candidate
-                    except Exception as e:
-                        last_exc = e
-                        continue
-                # Если ни один кандидат не сработал — формируем ответ 503 без принудительного ухода на legacy
-                if r is None:
-                    class Resp:
-                        status_code = 503
-                        headers = {}
-                        def json(self_inner):
-                            return {"errors": ["All endpoints failed"], "last_exception": str(last_exc) if last_exc else None}
-                        @property
-                        def text(self_inner):
-                            return "All endpoints failed"
-                    r = Resp()
-                    url_used = 'multiple'
-                # Сохраняем глобальный Retry-After, если вернулся 429
-                if r.status_code == 429:
-                    # Глобальный бэкофф по Retry-After или дефолтный, если заголовка нет
-                    ra = r.headers.get('Retry-After') if hasattr(r, 'headers') else None
-                    if ra:
-                        _eta_set_global_backoff(ra)
-                    else:
-                        _eta_set_default_backoff()
-            result = {
-                'http_status': r.status_code,
-                'consider_traffic': consider_traffic,
-                'eta_seconds': None,
-                'distance_meters': None,
-                'source': None,
-                'raw': None
-            }
-            if r.status_code != 200:
-                try:
-                    parsed = r.json()
-                    result['raw'] = ({'endpoint_used': url_used, 'response': parsed} if debug else parsed)
-                except Exception:
-                    try:
-                        txt = r.text
-                        result['raw'] = ({'endpoint_used': url_used, 'response': txt} if debug else txt)
-                    except Exception:
-                        result['raw'] = None
-                return result
-            data = r.json()
-            result['raw'] = ({'endpoint_used': url_used, 'response': data} if debug else None)
-            try:
-                matrix = data.get('matrix') or data
-                if isinstance(matrix, dict):
-                    if 'distances' in matrix and matrix['distances'] and matrix['distances'][0]:
-                        result['distance_meters'] = matrix['distances'][0][0]
-                    # основные поля времени
-                    if 'jam_times' in matrix and matrix['jam_times'] and matrix['jam_times'][0] and matrix['jam_times'][0][0] is not None:
-                        result['eta_seconds'] = matrix['jam_times'][0][0]
-                        result['source'] = 'jam_times'
-                    elif 'expected_times' in matrix and matrix['expected_times'] and matrix['expected_times'][0] and matrix['expected_times'][0][0] is not None:
-                        result['eta_seconds'] = matrix['expected_times'][0][0]
-                        result['source'] = 'expected_times'
-                    elif 'times' in matrix and matrix['times'] and matrix['times'][0] and matrix['times'][0][0] is not None:
-                        result['eta_seconds'] = matrix['times'][0][0]
-                        result['source'] = 'times'
-                    elif 'durations' in matrix and matrix['durations'] and matrix['durations'][0] and matrix['durations'][0][0] is not None:
-                        result['eta_seconds'] = matrix['durations'][0][0]
-                        result['source'] = 'durations'
-                    elif 'weights' in matrix and matrix['weights'] and matrix['weights'][0]:
-                        w = matrix['weights'][0][0]
-                        if isinstance(w, dict):
-                            if 'jam_time' in w and w['jam_time'] is not None:
-                                result['eta_seconds'] = w['jam_time']
-                                result['source'] = 'weights.jam_time'
-                            elif 'time' in w and w['time'] is not None:
-                                result['eta_seconds'] = w['time']
-                                result['source'] = 'weights.time'
-                            if 'distance' in w and w['distance'] is not None and result['distance_meters'] is None:
-                                result['distance_meters'] = w['distance']
-            except Exception:
-                pass
-            return result
+        def call_and_parse(consider_traffic: bool, fallback: bool = False):
+            # Провайдеры с пробками (fallback=False) или фолбэки; таймауты, backoff и автоматы защиты — в routing_engine
+            return routing_engine.route(car_lat, car_lon, float(work_lat), float(work_lon),
+                                        consider_traffic=consider_traffic, fallback=fallback, debug=debug)
 
         # Выбор режима
         if compare and not require_traffic:
@@ -1688,134 +1462,159 @@ def api_eta():
         else:
             # Если требуем пробки, игнорируем параметр и всегда включаем
             consider = True if require_traffic else (True if force_traffic is None else (force_traffic in ('1', 'true', 'yes')))
-            # Ключ кэша/троттлинга: маршрут конкретного водителя (объединяем просмотры разных пользователей)
-            cache_key = f"eta2:car:{car_user_id}:" \
-                        f"{car_lat:.5f},{car_lon:.5f}->{float(work_lat):.5f},{float(work_lon):.5f}:" \
-                        f"traffic={int(consider)}"
+            # Ключ кэша/троттлинга: маршрут конкретного водителя (объединяем просмотры разных пользователей).
+            # Начало маршрута — ячейка geohash, чтобы соседние точки попадали в одну запись
+            route_key = f"eta3:car:{car_user_id}->{float(work_lat):.5f},{float(work_lon):.5f}:traffic={int(consider)}"
+            cache_key = f"{route_key}:from={geohash(car_lat, car_lon, config.ETA_GEOHASH_PRECISION)}"
             # Попытка вернуть из кэша
-            cached = _eta_cache_get(cache_key)
+            cached = eta_cache.get(cache_key)
             if cached is not None:
                 return jsonify(cached)
 
-            # Серверный троттлинг: если последний внешний вызов для этого ключа был недавно, отдаём кэш/стейл
-            try:
-                min_interval_sec = int(os.environ.get('ETA_MIN_INTERVAL_SEC', 30))
-            except Exception:
-                min_interval_sec = 30
-            now_ts_local = time.time()
-            last_ts_local = _eta_last_call_ts.get(cache_key)
-            if last_ts_local is not None and (now_ts_local - last_ts_local) < max(0, min_interval_sec):
-                stale_window_sec = int(os.environ.get('ETA_STALE_ON_ERROR_SEC', 300)) if os.environ.get('ETA_STALE_ON_ERROR_SEC') else 300
-                stale = _eta_stale_get(cache_key, stale_window_sec)
-                if stale is not None:
-                    return jsonify(stale)
-                # Если нет ничего — мягкая ошибка, чтобы фронт не дёргал чаще
-                return jsonify({'success': False, 'error': 'ETA throttled, try later'}), 200
+            # Основной путь: ETA из таблицы, которую заполняет пакетный расчёт
+            if config.ETA_REFRESHER_ENABLED and consider:
+                eta_refresher.ensure_started()
+                row = db.get_driver_eta(car_user_id)
+                if (row is not None and row['consider_traffic']
+                        and time.time() - row['computed_at'] <= config.ETA_TABLE_MAX_AGE_SEC
+                        and calculate_distance(row['work_lat'], row['work_lon'], float(work_lat), float(work_lon)) < 1.0):
+                    return jsonify({
+                        'success': True,
+                        'eta_seconds': row['eta_seconds'],
+                        'distance_meters': row['distance_meters'],
+                        'source': row['source'],
+                        'consider_traffic': True,
+                        'computed_at': row['computed_at'],
+                        'debug': ({'batch': True, 'age_sec': round(time.time() - row['computed_at'], 1)} if debug else None)
+                    })
+
+            # Машина едет по маршруту из прошлого ответа провайдера — досчитываем ETA локально
+            if config.ETA_ROUTE_PROJECTION:
+                projected, reason = estimate_along_route(
+                    eta_cache.get_route(route_key), car_lat, car_lon,
+                    corridor_m=config.ETA_ROUTE_CORRIDOR_M, max_drift=config.ETA_ROUTE_MAX_DRIFT)
+                if projected is not None:
+                    projected['debug'] = ({'route_key': route_key} if debug else None)
+                    return jsonify(projected)
+
+            def remember_route(payload):
+                """Сохранить линию маршрута для следующих обновлений позиции"""
+                if not config.ETA_ROUTE_PROJECTION or payload.get('eta_seconds') is None:
+                    return
+                points = routing_engine.geometry(car_lat, car_lon, float(work_lat), float(work_lon))
+                if points:
+                    eta_cache.set_route(route_key, make_route_entry(points, car_lat, car_lon, payload),
+                                        config.ETA_ROUTE_MAX_AGE_SEC)
+
+            def resolve_eta():
+                """Промах кэша: троттлинг, stale, вызов провайдера и фолбэки. Возвращает (payload, status)"""
+                # Пока ждали очереди, ответ мог появиться от предыдущего ведущего вызова
+                cached = eta_cache.get(cache_key)
+                if cached is not None:
+                    return cached, 200
 
-            # Если автомобиль почти не двигался, можно вернуть последний успешный результат (stale) без похода во внешний API
-            try:
-                min_move_m = float(os.environ.get('ETA_MIN_MOVEMENT_M', 30))
-            except Exception:
-                min_move_m = 30.0
-            prev_meta = _eta_stale_get_meta(cache_key)
-            if prev_meta is not None:
+                # Серверный троттлинг: если последний внешний вызов для этого ключа был недавно, отдаём кэш/стейл
                 try:
-                    prev_lat = float(prev_meta.get('lat'))
-                    prev_lon = float(prev_meta.get('lon'))
-                    # Используем ту же функцию дистанции
-                    moved_m = calculate_distance(prev_lat, prev_lon, float(car_lat), float(car_lon))
-                    if moved_m < max(0.0, min_move_m):
-                        stale_window_sec = int(os.environ.get('ETA_STALE_ON_NO_MOVE_SEC', 600)) if os.environ.get('ETA_STALE_ON_NO_MOVE_SEC') else 600
-                        stale = _eta_stale_get(cache_key, stale_window_sec)
-                        if stale is not None:
-                            return jsonify(stale)
+                    min_interval_sec = int(os.environ.get('ETA_MIN_INTERVAL_SEC', 30))
                 except Exception:
-                    pass
-
-            # Вызываем внешний API
-            _eta_last_call_ts[cache_key] = now_ts_local
-            res = call_and_parse(consider)
-
-            # Если 429 — попробуем вернуть последний валидный кэш (если есть)
-            if res['http_status'] == 429:
-                cached = _eta_cache_get(cache_key)
-                if cached is not None:
-                    return jsonify(cached)
-                # Stale-on-error: вернём последний успешный ответ в пределах окна
+                    min_interval_sec = 30
+                now_ts_local = time.time()
+                last_ts_local = eta_cache.get_last_call(cache_key)
+                if last_ts_local is not None and (now_ts_local - last_ts_local) < max(0, min_interval_sec):
+                    stale_window_sec = int(os.environ.get('ETA_STALE_ON_ERROR_SEC', 300)) if os.environ.get('ETA_STALE_ON_ERROR_SEC') else 300
+                    stale = eta_cache.get_stale(cache_key, stale_window_sec)
+                    if stale is not None:
+                        return stale, 200
+                    # Если нет ничего — мягкая ошибка, чтобы фронт не дёргал чаще
+                    return {'success': False, 'error': 'ETA throttled, try later'}, 200
+
+                # Если автомобиль почти не двигался, можно вернуть последний успешный результат (stale) без похода во внешний API
                 try:
-                    stale_window_sec = int(os.environ.get('ETA_STALE_ON_ERROR_SEC', 300))
+                    min_move_m = float(os.environ.get('ETA_MIN_MOVEMENT_M', 30))
                 except Exception:
-                    stale_window_sec = 300
-                stale = _eta_stale_get(cache_key, stale_window_sec)
-                if stale is not None:
-                    return jsonify(stale)
-                # Если строго требуются пробки и не разрешён фолбэк при 429 — возвращаем ошибку
-                if require_traffic and not allow_fallback_on_429:
-                    return jsonify({'success': False, 'error': 'Yandex API HTTP 429', 'car_lat': car_lat, 'car_lon': car_lon, 'work_lat': float(work_lat), 'work_lon': float(work_lon), 'debug': (res['raw'] if debug else None)}), 200
-
-            if res['http_status'] != 200:
-                # Разрешаем фолбэки только если пробки не обязательны
-                if not require_traffic:
-                    # Поставщик-фолбэк: OSRM (публичный демо-сервер). Если выключен, сразу идём к приблизительной оценке.
-                    use_osrm = os.environ.get('USE_OSRM_FALLBACK', 'true').lower() in ('1', 'true', 'yes')
-                    if use_osrm:
-                        try:
-                            osrm_url = (
-                                f"https://router.project-osrm.org/route/v1/driving/"
-                                f"{float(car_lon):.6f},{float(car_lat):.6f};{float(work_lon):.6f},{float(work_lat):.6f}?overview=false&alternatives=false&annotations=duration"
-                            )
-                            osrm_resp = requests.get(osrm_url, timeout=10)
-                            if osrm_resp.status_code == 200:
-                                osrm_json = osrm_resp.json()
-                                if osrm_json.get('routes'):
-                                    duration_sec = int(max(0, osrm_json['routes'][0].get('duration', 0)))
-                                    distance_m = calculate_distance(car_lat, car_lon, float(work_lat), float(work_lon))
-                                    response_payload = {
-                                        'success': True,
-                                        'eta_seconds': duration_sec,
-                                        'distance_meters': int(distance_m),
-                                        'source': 'osrm_fallback',
-                                        'consider_traffic': consider,
-                                        'debug': (res['raw'] if debug else None)
-                                    }
-                                    _eta_cache_set(cache_key, response_payload, ttl_sec=int(os.environ.get('ETA_CACHE_TTL_SEC', 60)))
-                                    return jsonify(response_payload)
-                        except Exception:
-                            pass
-                    # Серверный фолбэк: приблизительная оценка ETA по прямому расстоянию и средней скорости
+                    min_move_m = 30.0
+                prev_meta = eta_cache.get_meta(cache_key)
+                if prev_meta is not None:
                     try:
-                        avg_speed_kmh = float(os.environ.get('ETA_FALLBACK_SPEED_KMH', 30))  # дефолт 30 км/ч
-                        distance_m = calculate_distance(car_lat, car_lon, float(work_lat), float(work_lon))
-                        eta_sec = int(max(0, (distance_m / (max(1e-3, avg_speed_kmh) * 1000.0 / 3600.0))))
-                        response_payload = {
-                            'success': True,
-                            'eta_seconds': eta_sec,
-                            'distance_meters': int(distance_m),
-                            'source': 'fallback_estimate',
-                            'consider_traffic': consider,
-                            'debug': (res['raw'] if debug else None)
-                        }
-                        # Кэшируем и возвращаем фолбэк, чтобы не дёргать внешний API
-                        _eta_cache_set(cache_key, response_payload, ttl_sec=int(os.environ.get('ETA_CACHE_TTL_SEC', 60)))
-                        return jsonify(response_payload)
+                        prev_lat = float(prev_meta.get('lat'))
+                        prev_lon = float(prev_meta.get('lon'))
+                        # Используем ту же функцию дистанции
+                        moved_m = calculate_distance(prev_lat, prev_lon, float(car_lat), float(car_lon))
+                        if moved_m < max(0.0, min_move_m):
+                            stale_window_sec = int(os.environ.get('ETA_STALE_ON_NO_MOVE_SEC', 600)) if os.environ.get('ETA_STALE_ON_NO_MOVE_SEC') else 600
+                            stale = eta_cache.get_stale(cache_key, stale_window_sec)
+                            if stale is not None:
+                                return stale, 200
                     except Exception:
-                        return jsonify({'success': False, 'error': f'Yandex API HTTP {res["http_status"]}', 'car_lat': car_lat, 'car_lon': car_lon, 'work_lat': float(work_lat), 'work_lon': float(work_lon), 'debug': (res['raw'] if debug else None)}), 200
-                # Здесь require_traffic=True и нет валидного ответа — возвращаем ошибку поставщика
-                return jsonify({'success': False, 'error': f'Yandex API HTTP {res["http_status"]}', 'car_lat': car_lat, 'car_lon': car_lon, 'work_lat': float(work_lat), 'work_lon': float(work_lon), 'debug': (res['raw'] if debug else None)}), 200
-
-            response_payload = {
-                'success': True,
-                'eta_seconds': (int(res['eta_seconds']) if res['eta_seconds'] is not None else None),
-                'distance_meters': (int(res['distance_meters']) if res['distance_meters'] is not None else None),
-                'source': res['source'],
-                'consider_traffic': consider,
-                'debug': (res['raw'] if debug else None)
-            }
-
-            # Сохраняем в кэш на 60 секунд
-            _eta_cache_set(cache_key, response_payload, ttl_sec=int(os.environ.get('ETA_CACHE_TTL_SEC', 60)))
-            _eta_stale_set_meta(cache_key, car_lat, car_lon)
-            return jsonify(response_payload)
+                        pass
+
+                # Вызываем внешний API
+                eta_cache.set_last_call(cache_key, now_ts_local)
+                res = call_and_parse(consider)
+
+                # Если 429 — попробуем вернуть последний валидный кэш (если есть)
+                if res['http_status'] == 429:
+                    cached = eta_cache.get(cache_key)
+                    if cached is not None:
+                        return cached, 200
+                    # Stale-on-error: вернём последний успешный ответ в пределах окна
+                    try:
+                        stale_window_sec = int(os.environ.get('ETA_STALE_ON_ERROR_SEC', 300))
+                    except Exception:
+                        stale_window_sec = 300
+                    stale = eta_cache.get_stale(cache_key, stale_window_sec)
+                    if stale is not None:
+                        return stale, 200
+                    # Если строго требуются пробки и не разрешён фолбэк при 429 — возвращаем ошибку
+                    if require_traffic and not allow_fallback_on_429:
+                        return {'success': False, 'error': 'Yandex API HTTP 429', 'car_lat': car_lat, 'car_lon': car_lon, 'work_lat': float(work_lat), 'work_lon': float(work_lon), 'debug': (res['raw'] if debug else None)}, 200
+
+                if res['http_status'] != 200:
+                    # Разрешаем фолбэки только если пробки не обязательны
+                    if not require_traffic:
+                        # Фолбэки по порядку ROUTING_PROVIDERS: OSRM, локальный граф, оценка по прямой
+                        fb = call_and_parse(consider, fallback=True)
+                        if fb['eta_seconds'] is not None:
+                            response_payload = {
+                                'success': True,
+                                'eta_seconds': int(fb['eta_seconds']),
+                                'distance_meters': (int(fb['distance_meters']) if fb['distance_meters'] is not None else None),
+                                'source': fb['source'],
+                                'consider_traffic': consider,
+                                'debug': ({'primary': res['raw'], 'errors': res['errors'] + fb['errors']} if debug else None)
+                            }
+                            # Кэшируем и возвращаем фолбэк, чтобы не дёргать внешний API
+                            eta_cache.set(cache_key, response_payload, ttl_sec=int(os.environ.get('ETA_CACHE_TTL_SEC', 60)))
+                            remember_route(response_payload)
+                            return response_payload, 200
+                    # Пробки обязательны или все фолбэки отказали — возвращаем ошибку поставщика
+                    return {'success': False, 'error': f'Yandex API HTTP {res["http_status"]}', 'car_lat': car_lat, 'car_lon': car_lon, 'work_lat': float(work_lat), 'work_lon': float(work_lon), 'debug': (res['raw'] if debug else None)}, 200
+
+                response_payload = {
+                    'success': True,
+                    'eta_seconds': (int(res['eta_seconds']) if res['eta_seconds'] is not None else None),
+                    'distance_meters': (int(res['distance_meters']) if res['distance_meters'] is not None else None),
+                    'source': res['source'],
+                    'consider_traffic': consider,
+                    'debug': (res['raw'] if debug else None)
+                }
+
+                # Сохраняем в кэш на 60 секунд
+                eta_cache.set(cache_key, response_payload, ttl_sec=int(os.environ.get('ETA_CACHE_TTL_SEC', 60)))
+                eta_cache.set_meta(cache_key, car_lat, car_lon)
+                remember_route(response_payload)
+                return response_payload, 200
+
+            # Одновременные запросы по одному маршруту ждут один вызов провайдера
+            flight_key = f"{cache_key}:debug" if debug else cache_key
+            try:
+                (payload, status), _shared = _eta_flight.do(flight_key, resolve_eta)
+            except SingleFlightTimeout:
+                stale = eta_cache.get_stale(cache_key, int(os.environ.get('ETA_STALE_ON_ERROR_SEC', 300)))
+                if stale is not None:
+                    return jsonify(stale)
+                return jsonify({'success': False, 'error': 'ETA timeout, try later'}), 200
+            return jsonify(payload), status
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 200
 
@@ -2863,8 +2662,7 @@ def current_location():
         user = get_current_user()
 
         # Получаем последнее местоположение из базы данных
-        import sqlite3
-        conn = sqlite3.connect('driver.db')
+        conn = db.get_connection()
         cursor = conn.cursor()
 
         user_location = None
@@ -2919,9 +2717,8 @@ def current_location():
                     cursor.execute(
                         """
                         SELECT ul.latitude, ul.longitude, ul.is_at_work, ul.created_at, ul.heading
-                        FROM user_locations ul
+                        FROM user_last_location ul
                         WHERE ul.user_id = ?
-                        ORDER BY ul.id DESC LIMIT 1
                         """,
                         (inviter_id,)
                     )
@@ -2947,9 +2744,8 @@ def current_location():
                     cursor.execute(
                         """
                         SELECT ul.latitude, ul.longitude, ul.is_at_work, ul.created_at, ul.heading
-                        FROM user_locations ul
+                        FROM user_last_location ul
                         WHERE ul.user_id = ?
-                        ORDER BY ul.id DESC LIMIT 1
                         """,
                         (self_id,)
                     )
@@ -2974,23 +2770,6 @@ def current_location():
             return jsonify({'success': False, 'status': 'Необходима авторизация'}), 200
         
         # Вычисляем расстояние до работы
-        try:
-            from bot.utils import calculate_distance
-        except ImportError:
-            # Fallback: простая функция расчета расстояния
-            import math
-            def calculate_distance(lat1, lon1, lat2, lon2):
-                R = 6371000  # Радиус Земли в метрах
-                lat1_rad = math.radians(lat1)
-                lat2_rad = math.radians(lat2)
-                delta_lat = math.radians(lat2 - lat1)
-                delta_lon = math.radians(lon2 - lon1)
-                a = (math.sin(delta_lat / 2) ** 2 + 
-                     math.cos(lat1_rad) * math.cos(lat2_rad) * 
-                     math.sin(delta_lon / 2) ** 2)
-                c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-                return R * c
-
         if work_lat and work_lon:
             distance = calculate_distance(lat, lon, work_lat, work_lon)
         else:
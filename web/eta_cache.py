@@ -0,0 +1,456 @@
+"""
+Ограниченный кэш ETA (LRU + TTL) с подключаемым хранилищем
+
+Хранит четыре вида записей по ключу маршрута:
+- fresh — ответ /api/eta на ETA_CACHE_TTL_SEC;
+- stale — последний успешный ответ для stale-on-error (не дольше ETA_STALE_MAX_SEC);
+- meta — позиция машины при последнем успешном ответе (проверка "не двигалась");
+- call — время последнего обращения к провайдеру (серверный троттлинг);
+- route — линия маршрута для пересчёта ETA по ходу движения (web/routing/track.py);
+и глобальные паузы провайдеров после 429 (backoff), которые читает RoutingEngine.
+
+Хранилища (ETA_CACHE_BACKEND):
+- memory — словарь в процессе, как раньше, но с ограничением ETA_CACHE_MAX_ENTRIES;
+- sqlite — файл ETA_CACHE_DB, общий для всех воркеров и переживает перезапуск;
+- socket — отдельный процесс-кэш на Unix-сокете ETA_CACHE_SOCKET:
+      python -m web.eta_cache serve
+  Если сервис недоступен, кэш работает как промах и приложение ходит к провайдеру.
+"""
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from config.settings import config
+
+logger = logging.getLogger(__name__)
+
+FRESH = 'fresh'
+STALE = 'stale'
+META = 'meta'
+CALL = 'call'
+ROUTE = 'route'
+BACKOFF = 'backoff'
+
+
+class MemoryBackend:
+    """Записи в OrderedDict процесса: вытеснение по LRU и по сроку жизни"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max(1, int(max_entries))
+        self._entries = OrderedDict()   # (ns, key) -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0, 'expired': 0}
+
+    def get(self, ns, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get((ns, key))
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            if entry[0] <= now:
+                del self._entries[(ns, key)]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end((ns, key))
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def set(self, ns, key, value, ttl):
+        with self._lock:
+            self._entries[(ns, key)] = (time.time() + max(1.0, float(ttl)), value)
+            self._entries.move_to_end((ns, key))
+            self.stats['sets'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def delete(self, ns, key):
+        with self._lock:
+            self._entries.pop((ns, key), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+        stats['max_entries'] = self.max_entries
+        stats['backend'] = self.name
+        return stats
+
+
+class SqliteBackend:
+    """
+    Таблица eta_cache в отдельном файле SQLite (WAL), общая для процессов
+
+    Срок жизни проверяется при чтении; просроченные и лишние по LRU записи
+    удаляются не на каждой записи, а раз в prune_every вставок.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, db_path='eta_cache.db', max_entries=5000, prune_every=100):
+        from bot.db_pool import get_pool
+
+        self.db_path = db_path
+        self.max_entries = max(1, int(max_entries))
+        self.prune_every = max(1, int(prune_every))
+        self._pool = get_pool(db_path)
+        self._lock = threading.Lock()
+        self._sets_since_prune = 0
+        self.stats = {'hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0, 'expired': 0, 'errors': 0}
+        conn = self._pool.get_connection()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS eta_cache (
+                    ns TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (ns, key)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_eta_cache_accessed ON eta_cache(accessed_at)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def get(self, ns, key):
+        now = time.time()
+        conn = self._pool.get_connection()
+        try:
+            row = conn.execute("SELECT value, expires_at FROM eta_cache WHERE ns = ? AND key = ?", (ns, key)).fetchone()
+            if row is None:
+                self._count('misses')
+                return None
+            if row[1] <= now:
+                conn.execute("DELETE FROM eta_cache WHERE ns = ? AND key = ? AND expires_at <= ?", (ns, key, now))
+                conn.commit()
+                self._count('expired')
+                self._count('misses')
+                return None
+            conn.execute("UPDATE eta_cache SET accessed_at = ? WHERE ns = ? AND key = ?", (now, ns, key))
+            conn.commit()
+            self._count('hits')
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            self._count('errors')
+            logger.warning(f"ETA_CACHE: ошибка чтения {ns}/{key}: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def set(self, ns, key, value, ttl):
+        now = time.time()
+        conn = self._pool.get_connection()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO eta_cache (ns, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (ns, key, json.dumps(value, ensure_ascii=False), now + max(1.0, float(ttl)), now)
+            )
+            conn.commit()
+            self._count('sets')
+            with self._lock:
+                self._sets_since_prune += 1
+                prune = self._sets_since_prune >= self.prune_every
+                if prune:
+                    self._sets_since_prune = 0
+            if prune:
+                self._prune(conn, now)
+        except sqlite3.Error as e:
+            self._count('errors')
+            logger.warning(f"ETA_CACHE: ошибка записи {ns}/{key}: {e}")
+        finally:
+            conn.close()
+
+    def _prune(self, conn, now):
+        expired = conn.execute("DELETE FROM eta_cache WHERE expires_at <= ?", (now,)).rowcount
+        total = conn.execute("SELECT COUNT(*) FROM eta_cache").fetchone()[0]
+        evicted = 0
+        if total > self.max_entries:
+            evicted = conn.execute(
+                "DELETE FROM eta_cache WHERE (ns, key) IN "
+                "(SELECT ns, key FROM eta_cache ORDER BY accessed_at LIMIT ?)",
+                (total - self.max_entries,)
+            ).rowcount
+        conn.commit()
+        self._count('expired', max(0, expired))
+        self._count('evictions', max(0, evicted))
+
+    def delete(self, ns, key):
+        conn = self._pool.get_connection()
+        try:
+            conn.execute("DELETE FROM eta_cache WHERE ns = ? AND key = ?", (ns, key))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def clear(self):
+        conn = self._pool.get_connection()
+        try:
+            conn.execute("DELETE FROM eta_cache")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def reset_after_fork(self):
+        # Соединения пула сбрасывает reset_all_pools()
+        self._lock = threading.Lock()
+
+    def get_stats(self):
+        conn = self._pool.get_connection()
+        try:
+            entries = conn.execute("SELECT COUNT(*) FROM eta_cache").fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        finally:
+            conn.close()
+        with self._lock:
+            stats = dict(self.stats)
+        stats.update(entries=entries, max_entries=self.max_entries, backend=self.name, path=self.db_path)
+        return stats
+
+
+class SocketBackend:
+    """
+    Клиент процесса-кэша на Unix-сокете (см. serve)
+
+    Протокол — по строке JSON на запрос и ответ. Соединение своё у каждого
+    потока; при ошибке соединение переоткрывается на следующем запросе.
+    """
+
+    name = 'socket'
+
+    def __init__(self, path='/tmp/clever_driver_eta_cache.sock', timeout=0.5):
+        self.path = path
+        self.timeout = float(timeout)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0}
+        self._available = True
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            conn = self._local.conn = (sock, sock.makefile('rb'))
+        return conn
+
+    def _drop(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn[1].close()
+                conn[0].close()
+            except OSError:
+                pass
+
+    def _request(self, message):
+        with self._lock:
+            self.stats['requests'] += 1
+        try:
+            sock, reader = self._conn()
+            sock.sendall(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+            line = reader.readline()
+            if not line:
+                raise ConnectionError("кэш закрыл соединение")
+            response = json.loads(line)
+        except (OSError, ValueError) as e:
+            self._drop()
+            with self._lock:
+                self.stats['errors'] += 1
+                was_available, self._available = self._available, False
+            # Пишем в лог только переход в недоступность, а не каждый запрос
+            if was_available:
+                logger.warning(f"ETA_CACHE: сервис {self.path} недоступен: {e}")
+            return None
+        if not self._available:
+            self._available = True
+            logger.info(f"✅ ETA_CACHE: сервис {self.path} снова доступен")
+        return response
+
+    def get(self, ns, key):
+        response = self._request({'op': 'get', 'ns': ns, 'key': key})
+        return response.get('value') if response else None
+
+    def set(self, ns, key, value, ttl):
+        self._request({'op': 'set', 'ns': ns, 'key': key, 'value': value, 'ttl': ttl})
+
+    def delete(self, ns, key):
+        self._request({'op': 'delete', 'ns': ns, 'key': key})
+
+    def clear(self):
+        self._request({'op': 'clear'})
+
+    def reset_after_fork(self):
+        # Сокеты родителя не используем: у потоков ребёнка будут свои
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def get_stats(self):
+        response = self._request({'op': 'stats'})
+        stats = dict(response.get('value') or {}) if response else {}
+        with self._lock:
+            stats['client'] = dict(self.stats)
+        stats['backend'] = self.name
+        stats['path'] = self.path
+        return stats
+
+
+def serve(path, max_entries):
+    """Процесс-кэш для SocketBackend: MemoryBackend за Unix-сокетом"""
+    backend = MemoryBackend(max_entries)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    message = json.loads(line)
+                    op = message.get('op')
+                    value = None
+                    if op == 'get':
+                        value = backend.get(message['ns'], message['key'])
+                    elif op == 'set':
+                        backend.set(message['ns'], message['key'], message['value'], message.get('ttl', 60))
+                    elif op == 'delete':
+                        backend.delete(message['ns'], message['key'])
+                    elif op == 'clear':
+                        backend.clear()
+                    elif op == 'stats':
+                        value = backend.get_stats()
+                    response = {'ok': True, 'value': value}
+                except (ValueError, KeyError, TypeError) as e:
+                    response = {'ok': False, 'error': str(e)}
+                self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = Server(path, Handler)
+    os.chmod(path, 0o600)
+    logger.info(f"🗄️ ETA-кэш слушает {path} (до {max_entries} записей)")
+    return server
+
+
+class EtaCache:
+    """Записи /api/eta поверх хранилища; все сроки ограничены stale_max_sec"""
+
+    def __init__(self, backend, stale_max_sec=900):
+        self.backend = backend
+        self.stale_max_sec = max(1, int(stale_max_sec))
+
+    def get(self, key):
+        return self.backend.get(FRESH, key)
+
+    def set(self, key, data, ttl_sec):
+        self.backend.set(FRESH, key, data, ttl_sec)
+        # Параллельно запоминаем как последний успешный ответ (для stale-on-error)
+        self.backend.set(STALE, key, {'data': data, 'ts': time.time()}, self.stale_max_sec)
+
+    def get_stale(self, key, max_age_sec):
+        if max_age_sec <= 0:
+            return None
+        entry = self.backend.get(STALE, key)
+        if entry and (time.time() - entry.get('ts', 0)) <= max_age_sec:
+            return entry['data']
+        return None
+
+    def set_meta(self, key, car_lat, car_lon):
+        self.backend.set(META, key, {'lat': float(car_lat), 'lon': float(car_lon), 'ts': time.time()},
+                         self.stale_max_sec)
+
+    def get_meta(self, key):
+        return self.backend.get(META, key)
+
+    def get_last_call(self, key):
+        return self.backend.get(CALL, key)
+
+    def set_last_call(self, key, ts):
+        self.backend.set(CALL, key, ts, self.stale_max_sec)
+
+    def get_route(self, key):
+        return self.backend.get(ROUTE, key)
+
+    def set_route(self, key, entry, ttl_sec):
+        self.backend.set(ROUTE, key, entry, ttl_sec)
+
+    def get_backoff(self, name):
+        """До какого времени (unix) провайдер name на паузе после 429, или None"""
+        until = self.backend.get(BACKOFF, name)
+        return until if until and until > time.time() else None
+
+    def set_backoff(self, name, until):
+        current = self.get_backoff(name) or 0
+        if until > current:
+            self.backend.set(BACKOFF, name, until, until - time.time())
+
+    def clear(self):
+        self.backend.clear()
+
+    def reset_after_fork(self):
+        self.backend.reset_after_fork()
+
+    def get_stats(self):
+        stats = self.backend.get_stats()
+        stats['stale_max_sec'] = self.stale_max_sec
+        return stats
+
+
+def create_eta_cache():
+    """Кэш с хранилищем из ETA_CACHE_BACKEND"""
+    backend_name = config.ETA_CACHE_BACKEND
+    if backend_name == 'sqlite':
+        backend = SqliteBackend(config.ETA_CACHE_DB, config.ETA_CACHE_MAX_ENTRIES)
+    elif backend_name == 'socket':
+        backend = SocketBackend(config.ETA_CACHE_SOCKET)
+    else:
+        if backend_name != 'memory':
+            logger.warning(f"⚠️ ETA_CACHE_BACKEND: неизвестное хранилище {backend_name}, используем memory")
+        backend = MemoryBackend(config.ETA_CACHE_MAX_ENTRIES)
+    # stale-записи должны жить не меньше самого длинного окна, в котором их читают
+    stale_max_sec = max(config.ETA_STALE_MAX_SEC,
+                        int(os.environ.get('ETA_STALE_ON_ERROR_SEC', 300)),
+                        int(os.environ.get('ETA_STALE_ON_NO_MOVE_SEC', 600)))
+    return EtaCache(backend, stale_max_sec)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] != ['serve']:
+        print("Использование: python -m web.eta_cache serve")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    server = serve(config.ETA_CACHE_SOCKET, config.ETA_CACHE_MAX_ENTRIES)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(config.ETA_CACHE_SOCKET)
@@ -0,0 +1,348 @@
+"""
+Фоновый пакетный расчёт ETA через Yandex Routes Matrix
+
+Раз в ETA_REFRESH_INTERVAL_SEC собираем всех активных водителей (последняя
+точка не старше ETA_REFRESH_ACTIVE_SEC) с их рабочими точками и считаем ETA
+матричными запросами много-ко-многим: источники — машины, цели — различные
+рабочие точки. Размер матрицы ограничен ETA_MATRIX_MAX_ELEMENTS, при
+необходимости водители делятся на несколько запросов. Результаты пишутся в
+общую таблицу driver_eta, откуда их читает /api/eta.
+
+Если веб-приложение запущено в нескольких процессах, считает только тот,
+кто держит файловую блокировку ETA_REFRESH_LOCK_FILE.
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from config.settings import config
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессной блокировки нет, считает каждый процесс
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def matrix_endpoints():
+    """Эндпоинты Yandex Routes Matrix: сначала облачный, затем легаси как фолбэк"""
+    env_full_url = os.environ.get('YANDEX_ROUTING_MATRIX_URL')
+    env_base_url = os.environ.get('YANDEX_ROUTING_BASE_URL')
+    endpoint_candidates = []
+    if env_full_url:
+        endpoint_candidates.append(env_full_url.strip())
+    if env_base_url:
+        endpoint_candidates.append(env_base_url.rstrip('/') + '/routes/v2/matrix')
+        endpoint_candidates.append(env_base_url.rstrip('/') + '/v2/matrix')
+    # Облачные варианты (оба встречаются в документации/примерах)
+    endpoint_candidates.append('https://routes.api.cloud.yandex.net/routes/v2/matrix')
+    endpoint_candidates.append('https://routes.api.cloud.yandex.net/v2/matrix')
+    # Легаси варианты (можно отключить через YANDEX_ROUTING_DISABLE_LEGACY)
+    disable_legacy = os.environ.get('YANDEX_ROUTING_DISABLE_LEGACY', 'false').lower() in ('1', 'true', 'yes')
+    if not disable_legacy:
+        endpoint_candidates.append('https://api.routing.yandex.net/v2/matrix')
+        endpoint_candidates.append('https://api.routing.yandex.net/v2/distancematrix')
+    return endpoint_candidates
+
+
+def matrix_headers(api_key):
+    return {
+        'Content-Type': 'application/json',
+        'Authorization': f'Api-Key {api_key}',
+        # Дублируем схему для совместимости со старыми/прокси конфигурациями
+        'X-Api-Key': api_key
+    }
+
+
+def _cell(rows, i, j):
+    try:
+        return rows[i][j]
+    except (IndexError, KeyError, TypeError):
+        return None
+
+
+def parse_matrix_cell(data, i, j):
+    """
+    Время и расстояние для источника i и цели j из ответа Matrix API
+
+    Returns:
+        tuple: (eta_seconds, distance_meters, source) — None там, где данных нет
+    """
+    eta_seconds = None
+    distance_meters = None
+    source = None
+    matrix = data.get('matrix') or data
+    if not isinstance(matrix, dict):
+        return eta_seconds, distance_meters, source
+    if matrix.get('distances'):
+        distance_meters = _cell(matrix['distances'], i, j)
+    # основные поля времени
+    for field in ('jam_times', 'expected_times', 'times', 'durations'):
+        if matrix.get(field):
+            value = _cell(matrix[field], i, j)
+            if value is not None:
+                return value, distance_meters, field
+    if matrix.get('weights'):
+        w = _cell(matrix['weights'], i, j)
+        if isinstance(w, dict):
+            if w.get('jam_time') is not None:
+                eta_seconds, source = w['jam_time'], 'weights.jam_time'
+            elif w.get('time') is not None:
+                eta_seconds, source = w['time'], 'weights.time'
+            if w.get('distance') is not None and distance_meters is None:
+                distance_meters = w['distance']
+    return eta_seconds, distance_meters, source
+
+
+def retry_after_seconds(header, default):
+    """Retry-After в секундах: число секунд или HTTP-date"""
+    if not header:
+        return default
+    header = str(header).strip()
+    try:
+        return max(1, int(header))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(1, int(parsedate_to_datetime(header).timestamp() - time.time()))
+    except Exception:
+        return default
+
+
+def plan_batches(candidates, max_elements):
+    """
+    Разбить водителей на матричные запросы не больше max_elements ячеек
+
+    Водители с одинаковой рабочей точкой делят одну цель, поэтому сначала
+    группируем по цели.
+
+    Returns:
+        list: [{'sources': [...], 'targets': [...], 'pairs': [(кандидат, i, j)]}]
+    """
+    def target_key(c):
+        return (round(float(c['work_lat']), 6), round(float(c['work_lon']), 6))
+
+    batches = []
+    batch = None
+    for candidate in sorted(candidates, key=target_key):
+        key = target_key(candidate)
+        if batch is not None:
+            new_targets = len(batch['targets']) + (0 if key in batch['target_index'] else 1)
+            if (len(batch['sources']) + 1) * new_targets > max_elements:
+                batch = None
+        if batch is None:
+            batch = {'sources': [], 'targets': [], 'target_index': {}, 'pairs': []}
+            batches.append(batch)
+        if key not in batch['target_index']:
+            batch['target_index'][key] = len(batch['targets'])
+            batch['targets'].append({'latitude': key[0], 'longitude': key[1]})
+        batch['pairs'].append((candidate, len(batch['sources']), batch['target_index'][key]))
+        batch['sources'].append({'latitude': float(candidate['car_lat']), 'longitude': float(candidate['car_lon'])})
+    for batch in batches:
+        del batch['target_index']
+    return batches
+
+
+class EtaRefresher:
+    """Периодический пакетный пересчёт ETA всех активных водителей"""
+
+    def __init__(self, database, interval_sec=60, active_sec=1800, max_elements=100,
+                 lock_path=None, consider_traffic=True, backoff_store=None):
+        self.database = database
+        # Общая с /api/eta пауза после 429: квота Яндекса у них одна
+        self.backoff_store = backoff_store
+        self.interval_sec = max(5, int(interval_sec))
+        self.active_sec = int(active_sec)
+        self.max_elements = max(1, int(max_elements))
+        self.lock_path = lock_path
+        self.consider_traffic = consider_traffic
+        self._session = None
+        self._lock_file = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._backoff_until = 0.0
+        self.stats = {
+            'ticks': 0,
+            'skipped_not_leader': 0,
+            'skipped_backoff': 0,
+            'drivers': 0,
+            'requests': 0,
+            'updated': 0,
+            'errors': 0,
+            'last_tick_ms': 0.0,
+            'last_refresh_ts': None,
+        }
+
+    @property
+    def api_key(self):
+        return os.environ.get('YANDEX_ROUTING_API_KEY')
+
+    def _acquire_leadership(self):
+        """Считает только один процесс — тот, кто удерживает файловую блокировку"""
+        if fcntl is None or not self.lock_path:
+            return True
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self.lock_path, 'a+')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        logger.info(f"🧭 ETA: процесс {os.getpid()} считает ETA для всех водителей")
+        return True
+
+    def _post(self, payload):
+        """POST в первый эндпоинт, который ответил не 404"""
+        if self._session is None:
+            self._session = requests.Session()
+        headers = matrix_headers(self.api_key)
+        response = None
+        for candidate in matrix_endpoints():
+            try:
+                response = self._session.post(candidate, json=payload, headers=headers, timeout=10)
+            except Exception as e:
+                logger.warning(f"ETA: эндпоинт {candidate} недоступен: {e}")
+                continue
+            if response.status_code != 404:
+                break
+        return response
+
+    def refresh_once(self):
+        """Один пересчёт. Возвращает число обновлённых водителей"""
+        if not self.api_key:
+            return 0
+        now = time.time()
+        if self.backoff_store is not None:
+            self._backoff_until = max(self._backoff_until, self.backoff_store.get_backoff('yandex') or 0)
+        if now < self._backoff_until:
+            self.stats['skipped_backoff'] += 1
+            return 0
+        active_since = (datetime.now(timezone.utc) - timedelta(seconds=self.active_sec)).strftime('%Y-%m-%d %H:%M:%S')
+        candidates = self.database.get_eta_candidates(active_since)
+        self.stats['drivers'] = len(candidates)
+        updated = 0
+        for batch in plan_batches(candidates, self.max_elements):
+            payload = {
+                "sources": batch['sources'],
+                "targets": batch['targets'],
+                "annotations": ["distance", "jam_time", "expected_time"],
+                "consider_traffic": self.consider_traffic,
+                "transport": "car"
+            }
+            self.stats['requests'] += 1
+            response = self._post(payload)
+            if response is None:
+                self.stats['errors'] += 1
+                continue
+            if response.status_code == 429:
+                delay = retry_after_seconds(response.headers.get('Retry-After'), int(os.environ.get('ETA_DEFAULT_BACKOFF_SEC', 60)))
+                self._backoff_until = time.time() + delay
+                if self.backoff_store is not None:
+                    self.backoff_store.set_backoff('yandex', self._backoff_until)
+                logger.warning(f"ETA: Matrix API вернул 429, пауза {delay}s")
+                self.stats['errors'] += 1
+                break
+            if response.status_code != 200:
+                logger.warning(f"ETA: Matrix API HTTP {response.status_code}")
+                self.stats['errors'] += 1
+                continue
+            try:
+                data = response.json()
+            except ValueError:
+                self.stats['errors'] += 1
+                continue
+            computed_at = time.time()
+            etas = []
+            for candidate, i, j in batch['pairs']:
+                eta_seconds, distance_meters, source = parse_matrix_cell(data, i, j)
+                if eta_seconds is None:
+                    continue
+                etas.append({
+                    'user_id': candidate['user_id'],
+                    'eta_seconds': int(eta_seconds),
+                    'distance_meters': int(distance_meters) if distance_meters is not None else None,
+                    'source': source,
+                    'consider_traffic': 1 if self.consider_traffic else 0,
+                    'car_lat': candidate['car_lat'],
+                    'car_lon': candidate['car_lon'],
+                    'work_lat': candidate['work_lat'],
+                    'work_lon': candidate['work_lon'],
+                    'location_id': candidate['location_id'],
+                    'computed_at': computed_at,
+                })
+            self.database.save_driver_etas(etas)
+            updated += len(etas)
+        self.stats['updated'] += updated
+        self.stats['last_refresh_ts'] = time.time()
+        return updated
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            try:
+                if self._acquire_leadership():
+                    self.stats['ticks'] += 1
+                    self.refresh_once()
+                else:
+                    self.stats['skipped_not_leader'] += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"❌ Ошибка пакетного расчёта ETA: {e}")
+            self.stats['last_tick_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            self._stop.wait(self.interval_sec)
+
+    def ensure_started(self):
+        """Запустить фоновый поток, если он ещё не работает (в этом процессе)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='eta-refresher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout=5)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def reset_after_fork(self):
+        """В дочернем процессе после fork: поток, сессия и блокировка родителя недействительны"""
+        self._thread = None
+        self._session = None
+        self._lock_file = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['leader'] = self._lock_file is not None or fcntl is None
+        stats['backoff_sec'] = max(0, round(self._backoff_until - time.time(), 1))
+        return stats
+
+
+def create_eta_refresher(database, backoff_store=None):
+    """Экземпляр с настройками из config (с пробками — как /api/eta по умолчанию)"""
+    return EtaRefresher(
+        database,
+        interval_sec=config.ETA_REFRESH_INTERVAL_SEC,
+        active_sec=config.ETA_REFRESH_ACTIVE_SEC,
+        max_elements=config.ETA_MATRIX_MAX_ELEMENTS,
+        lock_path=config.ETA_REFRESH_LOCK_FILE,
+        backoff_store=backoff_store,
+    )
@@ -0,0 +1,156 @@
+"""
+Инспекция входных данных запроса одним проходом
+
+Раньше SecurityManager прогонял каждое значение через три списка регулярных
+выражений (XSS, SQL, командные инъекции) — около двухсот отдельных поисков
+на значение, а вложенный словарь или список превращался в строку заново для
+каждой проверки. InspectionEngine собирает правила каждой категории в одно
+регулярное выражение-альтернацию с именованными группами (по имени группы
+видно, какое правило сработало), а перед ним проверяет дешёвый префильтр —
+символы или слова, без которых ни одно правило категории совпасть не может.
+Слова строки выделяются один раз на значение и сверяются с множеством
+ключевых слов категории (union, select, rm, curl ...), вместо того чтобы
+в каждой позиции перебирать альтернативу из десятков слов.
+
+Плоская альтернация из сотни ветвей медленнее сотни отдельных поисков:
+движок re пробует каждую ветвь в каждой позиции строки. Поэтому ведущие
+литералы правил ('<iframe', '<img', 'javascript:' ...) сворачиваются в
+префиксное дерево, и в каждой позиции проверяется один символ на уровень.
+
+Решения те же, что у прежних проверок: значение подозрительно, если
+совпадает хотя бы одно правило (re.search); у словаря и списка проверяется
+str() каждого значения верхнего уровня — один раз для всех категорий.
+"""
+
+import re
+
+# Квантификаторы: символ перед ними уже не часть ведущего литерала
+_QUANTIFIERS = set('*+?{')
+# Экранированные символы, которые обозначают сами себя
+_ESCAPED_LITERALS = set('.()[]{}*+?|^$\\/-:<>=\'"')
+
+_WORD = re.compile(r'\w+')
+# Символы вне ASCII, которые re.IGNORECASE считает равными латинским буквам
+_ASCII_FOLD = {0x130: 'i', 0x131: 'i', 0x17f: 's', 0x212a: 'k'}
+
+
+def _literal_prefix(pattern):
+    """Ведущий литерал шаблона и остаток: ('<iframe', '[^>]*>')"""
+    chars, i = [], 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and i + 1 < len(pattern) and pattern[i + 1] in _ESCAPED_LITERALS:
+            char, step = pattern[i + 1], 2
+        elif c.isalnum() or c in '<>:=_ -/!\'"':
+            char, step = c, 1
+        else:
+            break
+        if pattern[i + step:i + step + 1] in _QUANTIFIERS:
+            break
+        chars.append(char)
+        i += step
+    return ''.join(chars), pattern[i:]
+
+
+def _trie_regex(rules, fold):
+    """Альтернация правил [(имя, шаблон)] с общими ведущими литералами в префиксном дереве"""
+    root = {}
+    branches = []
+    for name, pattern in rules:
+        literal, rest = _literal_prefix(pattern)
+        if not literal:
+            branches.append(f"(?P<{name}>{pattern})")
+            continue
+        node = root
+        for char in (literal.lower() if fold else literal):
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(f"(?P<{name}>{rest})")
+
+    def emit(node):
+        alternatives = [re.escape(char) + emit(child) for char, child in node.items() if char is not None]
+        alternatives += node.get(None, [])
+        return alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+
+    if root:
+        branches.insert(0, emit(root))
+    return '|'.join(branches)
+
+
+class InspectionEngine:
+    """Правила по категориям, скомпилированные в одну альтернацию на категорию"""
+
+    def __init__(self, categories, prefilters=None, keywords=None, flags=re.IGNORECASE):
+        """
+        Args:
+            categories: [(категория, [шаблон, ...]), ...] — порядок проверки категорий
+            prefilters: {категория: шаблон} и keywords: {категория: {слово, ...}} —
+                        любое правило категории срабатывает, только если совпал её
+                        шаблон-префильтр или в строке есть одно из её слов (\\b...\\b);
+                        категория без того и другого проверяется всегда
+        """
+        prefilters = prefilters or {}
+        self.fold = bool(flags & re.IGNORECASE)
+        self._keywords = {category: frozenset(w.lower() if self.fold else w for w in words)
+                          for category, words in (keywords or {}).items()}
+        self.categories = []
+        self.rules = {}         # имя группы -> (категория, шаблон)
+        self._regex = {}
+        self._prefilter = {}
+        for category, patterns in categories:
+            named = []
+            for pattern in dict.fromkeys(patterns):     # повторы в списках правил не нужны
+                name = f"r{len(self.rules)}"
+                self.rules[name] = (category, pattern)
+                named.append((name, pattern))
+            self.categories.append(category)
+            self._regex[category] = re.compile(_trie_regex(named, self.fold), flags)
+            if prefilters.get(category):
+                self._prefilter[category] = re.compile(prefilters[category], flags)
+
+    def _words(self, text):
+        words = _WORD.findall(text)
+        if self.fold:
+            return {w.translate(_ASCII_FOLD).lower() for w in words}
+        return set(words)
+
+    def _passes_prefilter(self, category, text, words):
+        prefilter = self._prefilter.get(category)
+        keywords = self._keywords.get(category)
+        if prefilter is None and keywords is None:
+            return True
+        if prefilter is not None and prefilter.search(text):
+            return True
+        return keywords is not None and not keywords.isdisjoint(words)
+
+    def match(self, text, categories=None):
+        """Первое сработавшее правило для строки: (категория, шаблон) или None"""
+        words = self._words(text) if self._keywords else ()
+        for category in categories or self.categories:
+            if not self._passes_prefilter(category, text, words):
+                continue
+            found = self._regex[category].search(text)
+            if found:
+                return self.rules[found.lastgroup]
+        return None
+
+    def inspect(self, data, categories=None):
+        """
+        Проверить значение запроса: строку, словарь или список
+
+        Returns:
+            tuple | None: (категория, шаблон, проверенная строка) первого срабатывания
+        """
+        if isinstance(data, str):
+            values = (data,)
+        elif isinstance(data, dict):
+            values = data.values()
+        elif isinstance(data, list):
+            values = data
+        else:
+            return None
+        for value in values:
+            text = value if isinstance(value, str) else str(value)
+            found = self.match(text, categories)
+            if found:
+                return found[0], found[1], text
+        return None
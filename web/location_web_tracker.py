@@ -11,20 +11,19 @@ import uuid
 from datetime import datetime, timedelta
 from flask import Blueprint, request, jsonify, render_template, session
 from bot.database import db
+from web.tracking_sessions import create_session_store
 
 logger = logging.getLogger(__name__)
 
 # Создаем Blueprint для веб-отслеживания
 location_web_tracker = Blueprint('location_web_tracker', __name__)
 
-# Хранилище активных сессий отслеживания
-active_tracking_sessions = {}
-
 class WebLocationTracker:
     """Класс для управления веб-отслеживанием местоположений"""
     
-    def __init__(self):
-        self.active_sessions = {}
+    def __init__(self, store=None):
+        # Сессии: индекс по telegram_id, сроки истечения, последние точки (web/tracking_sessions.py)
+        self.store = store if store is not None else create_session_store()
     
     def create_tracking_session(self, telegram_id, duration_minutes=60):
         """Создать сессию отслеживания"""
@@ -45,11 +44,10 @@ class WebLocationTracker:
                 'duration_minutes': duration_minutes,
                 'created_at': datetime.now(),
                 'expires_at': datetime.now() + timedelta(minutes=duration_minutes),
-                'is_active': True,
-                'locations': []
+                'is_active': True
             }
             
-            self.active_sessions[session_token] = session_data
+            self.store.create(session_token, session_data)
             
             logger.info(f"Создана веб-сессия отслеживания для {telegram_id}: {session_token}")
             return session_token
@@ -68,12 +66,10 @@ class WebLocationTracker:
                 return None
             
             # Проверяем, нет ли уже активной сессии для этого пользователя
-            for token, session_data in self.active_sessions.items():
-                if (session_data['telegram_id'] == telegram_id and 
-                    session_data['is_active'] and 
-                    datetime.now() < session_data['expires_at']):
-                    logger.info(f"Найдена активная сессия для {telegram_id}: {token}")
-                    return token
+            token, _session_data = self.find_active_session(telegram_id)
+            if token:
+                logger.info(f"Найдена активная сессия для {telegram_id}: {token}")
+                return token
             
             # Создаем новую сессию
             return self.create_tracking_session(telegram_id, duration_minutes)
@@ -84,19 +80,27 @@ class WebLocationTracker:
     
     def get_session_info(self, session_token):
         """Получить информацию о сессии"""
-        return self.active_sessions.get(session_token)
+        return self.store.get(session_token)
+    
+    def find_active_session(self, telegram_id):
+        """Активная неистекшая сессия пользователя: (токен, данные) или (None, None)"""
+        return self.store.find_active(telegram_id, datetime.now())
+    
+    def get_session_locations(self, session_token):
+        """Последние точки сессии (не больше TRACKING_SESSION_MAX_POINTS)"""
+        return self.store.locations(session_token)
     
     def add_location_to_session(self, session_token, latitude, longitude, accuracy=None, 
                                altitude=None, speed=None, heading=None):
         """Добавить местоположение в сессию"""
         try:
-            session_data = self.active_sessions.get(session_token)
+            session_data = self.store.get(session_token)
             if not session_data or not session_data['is_active']:
                 return False
             
             # Проверяем, не истекла ли сессия
             if datetime.now() > session_data['expires_at']:
-                session_data['is_active'] = False
+                self.store.set_active(session_token, False)
                 return False
             
             # Определяем статус "в работе" с учетом роли и индивидуальных настроек пользователя
@@ -122,6 +126,10 @@ class WebLocationTracker:
                 heading=heading
             )
             
+            if location_id is None:
+                # Точка отсеяна фильтром трека (выброс или повтор стоянки) — сессия жива, в историю не пишем
+                return True
+            
             if location_id:
                 # Получаем сохраненное местоположение для получения правильного статуса "в работе"
                 saved_location = db.get_user_last_location(session_data['telegram_id'])
@@ -139,7 +147,7 @@ class WebLocationTracker:
                     'is_at_work': at_work,
                     'timestamp': datetime.now().isoformat()
                 }
-                session_data['locations'].append(location_data)
+                self.store.add_location(session_token, location_data)
                 
                 logger.debug(f"Добавлено местоположение в сессию {session_token}: {latitude}, {longitude}")
                 return True
@@ -153,8 +161,7 @@ class WebLocationTracker:
     def stop_session(self, session_token):
         """Остановить сессию отслеживания"""
         try:
-            if session_token in self.active_sessions:
-                self.active_sessions[session_token]['is_active'] = False
+            if self.store.set_active(session_token, False):
                 logger.info(f"Остановлена веб-сессия отслеживания: {session_token}")
                 return True
             return False
@@ -166,15 +173,10 @@ class WebLocationTracker:
     def cleanup_expired_sessions(self):
         """Очистить истекшие сессии"""
         try:
-            current_time = datetime.now()
-            expired_sessions = []
-            
-            for token, session_data in self.active_sessions.items():
-                if current_time > session_data['expires_at']:
-                    expired_sessions.append(token)
+            # Хранилище снимает только истекшие сессии, не перебирая остальные
+            expired_sessions = self.store.cleanup(datetime.now())
             
             for token in expired_sessions:
-                del self.active_sessions[token]
                 logger.info(f"Удалена истекшая сессия: {token}")
             
             return len(expired_sessions)
@@ -189,20 +191,19 @@ class WebLocationTracker:
             self.cleanup_expired_sessions()
             
             active_info = []
-            for token, session_data in self.active_sessions.items():
-                if session_data['is_active']:
-                    user_info = session_data['user_info']
-                    remaining_time = (session_data['expires_at'] - datetime.now()).total_seconds() / 60
-                    
-                    active_info.append({
-                        'session_token': token,
-                        'telegram_id': session_data['telegram_id'],
-                        'user_name': f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip(),
-                        'duration_minutes': session_data['duration_minutes'],
-                        'remaining_minutes': max(0, int(remaining_time)),
-                        'locations_count': len(session_data['locations']),
-                        'created_at': session_data['created_at'].isoformat()
-                    })
+            for token, session_data in self.store.active(datetime.now()):
+                user_info = session_data['user_info']
+                remaining_time = (session_data['expires_at'] - datetime.now()).total_seconds() / 60
+                
+                active_info.append({
+                    'session_token': token,
+                    'telegram_id': session_data['telegram_id'],
+                    'user_name': f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip(),
+                    'duration_minutes': session_data['duration_minutes'],
+                    'remaining_minutes': max(0, int(remaining_time)),
+                    'locations_count': session_data['locations_count'],
+                    'created_at': session_data['created_at'].isoformat()
+                })
             
             return active_info
             
@@ -267,8 +268,8 @@ def get_tracking_status(session_token):
             'success': True,
             'is_active': session_info['is_active'],
             'remaining_minutes': max(0, int(remaining_time)),
-            'locations_count': len(session_info['locations']),
-            'last_location': session_info['locations'][-1] if session_info['locations'] else None
+            'locations_count': session_info['locations_count'],
+            'last_location': session_info['last_location']
         })
         
     except Exception as e:
@@ -313,24 +314,21 @@ def get_user_session(telegram_id):
     """API для получения активной сессии пользователя"""
     try:
         # Проверяем, есть ли активная сессия для пользователя
-        for token, session_data in web_tracker.active_sessions.items():
-            if (session_data['telegram_id'] == telegram_id and 
-                session_data['is_active'] and 
-                datetime.now() < session_data['expires_at']):
-                
-                user_info = session_data['user_info']
-                remaining_time = (session_data['expires_at'] - datetime.now()).total_seconds() / 60
-                
-                return jsonify({
-                    'success': True,
-                    'has_active_session': True,
-                    'session_token': token,
-                    'telegram_id': telegram_id,
-                    'user_name': f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip(),
-                    'remaining_minutes': max(0, int(remaining_time)),
-                    'locations_count': len(session_data['locations']),
-                    'last_location': session_data['locations'][-1] if session_data['locations'] else None
-                })
+        token, session_data = web_tracker.find_active_session(telegram_id)
+        if token:
+            user_info = session_data['user_info']
+            remaining_time = (session_data['expires_at'] - datetime.now()).total_seconds() / 60
+            
+            return jsonify({
+                'success': True,
+                'has_active_session': True,
+                'session_token': token,
+                'telegram_id': telegram_id,
+                'user_name': f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip(),
+                'remaining_minutes': max(0, int(remaining_time)),
+                'locations_count': session_data['locations_count'],
+                'last_location': session_data['last_location']
+            })
         
         # Нет активной сессии
         return jsonify({
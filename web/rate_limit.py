@@ -0,0 +1,208 @@
+"""
+Ограничение частоты запросов по алгоритму GCRA
+
+GCRA (generic cell rate algorithm) — "ведро токенов" без счётчиков: на
+каждый ключ (лимит + IP) хранится одно число, теоретическое время прибытия
+следующего запроса (TAT). Лимит N запросов за P секунд даёт интервал
+T = P / N; запрос разрешён, если TAT - now <= T * (burst - 1), после чего
+TAT = max(TAT, now) + T. Ключ с TAT в прошлом ничем не отличается от
+отсутствующего, поэтому такие ключи можно удалять без потери точности.
+
+Хранилища (RATE_LIMIT_BACKEND):
+- memory — словарь процесса, не больше RATE_LIMIT_MAX_KEYS ключей: раз в
+  RATE_LIMIT_SWEEP_SEC удаляются ключи с TAT в прошлом, при переполнении
+  вытесняется давно не обращавшийся ключ;
+- shared — файл RATE_LIMIT_SHARED_FILE фиксированного размера
+  (RATE_LIMIT_SHARED_SLOTS ячеек по 8 байт), отображённый в память всех
+  воркеров. Ключ попадает в ячейку по crc32; два ключа в одной ячейке делят
+  один лимит — ошибка только в строгую сторону. Ячейка меняется под
+  блокировкой записи fcntl, так что воркеры видят общий TAT. Без fcntl
+  (Windows) вместо него используется memory.
+
+Память не зависит от числа различных IP: в memory она ограничена числом
+ключей, в shared — размером файла.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from config.settings import config
+
+try:
+    import fcntl
+except ImportError:  # Windows: общего хранилища нет, лимиты в памяти процесса
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_SLOT = struct.Struct('d')
+# Блокировки потоков в shared: fcntl-блокировки принадлежат процессу, потоки ими не разделяются
+_THREAD_STRIPES = 64
+
+
+class Limit:
+    """rate запросов за period секунд, сразу — не больше burst"""
+
+    __slots__ = ('rate', 'period', 'burst', 'interval', 'tolerance')
+
+    def __init__(self, rate, period, burst=None):
+        self.rate = max(1, int(rate))
+        self.period = float(period)
+        self.burst = max(1, int(burst if burst is not None else rate))
+        self.interval = self.period / self.rate
+        self.tolerance = self.interval * (self.burst - 1)
+
+    def __repr__(self):
+        return f"Limit({self.rate}/{self.period:g}s, burst={self.burst})"
+
+
+def gcra(tat, now, limit):
+    """Решение по ключу: (разрешено, новый TAT, через сколько секунд повторить)"""
+    tat = max(tat or 0.0, now)
+    if tat - now > limit.tolerance:
+        return False, tat, tat - now - limit.tolerance
+    return True, tat + limit.interval, 0.0
+
+
+class MemoryStore:
+    """TAT ключей в словаре процесса с ограничением по числу ключей"""
+
+    name = 'memory'
+
+    def __init__(self, max_keys=100000, sweep_sec=60):
+        self.max_keys = max(1, int(max_keys))
+        self.sweep_sec = float(sweep_sec)
+        self._tat = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + self.sweep_sec
+        self.stats = {'evictions': 0, 'swept': 0}
+
+    def update(self, key, limit, now):
+        with self._lock:
+            allowed, tat, retry_after = gcra(self._tat.get(key), now, limit)
+            self._tat[key] = tat
+            self._tat.move_to_end(key)
+            if len(self._tat) > self.max_keys:
+                self._tat.popitem(last=False)
+                self.stats['evictions'] += 1
+            if time.monotonic() >= self._next_sweep:
+                self._sweep(now)
+        return allowed, retry_after
+
+    def _sweep(self, now):
+        expired = [key for key, tat in self._tat.items() if tat <= now]
+        for key in expired:
+            del self._tat[key]
+        self.stats['swept'] += len(expired)
+        self._next_sweep = time.monotonic() + self.sweep_sec
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, keys=len(self._tat), max_keys=self.max_keys)
+
+
+class SharedStore:
+    """TAT в ячейках файла, отображённого в память всех воркеров"""
+
+    name = 'shared'
+
+    def __init__(self, path='/tmp/clever_driver_ratelimit.bin', slots=65536):
+        self.path = path
+        self.slots = max(1, int(slots))
+        size = self.slots * _SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size != size:
+            # Размер изменился (другое число ячеек) — старые TAT не годятся
+            os.ftruncate(self._fd, 0)
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._locks = [threading.Lock() for _ in range(_THREAD_STRIPES)]
+        self.stats = {'lock_errors': 0}
+
+    def update(self, key, limit, now):
+        slot = zlib.crc32(key.encode('utf-8')) % self.slots
+        offset = slot * _SLOT.size
+        with self._locks[slot % _THREAD_STRIPES]:
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, _SLOT.size, offset)
+            except OSError:
+                # Без блокировки возможна гонка двух воркеров — лимит чуть мягче, но запрос не теряем
+                self.stats['lock_errors'] += 1
+            try:
+                allowed, tat, retry_after = gcra(_SLOT.unpack_from(self._map, offset)[0], now, limit)
+                _SLOT.pack_into(self._map, offset, tat)
+            finally:
+                try:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, _SLOT.size, offset)
+                except OSError:
+                    pass
+        return allowed, retry_after
+
+    def reset_after_fork(self):
+        self._locks = [threading.Lock() for _ in range(_THREAD_STRIPES)]
+
+    def get_stats(self):
+        return dict(self.stats, slots=self.slots, bytes=self.slots * _SLOT.size, path=self.path)
+
+
+class RateLimiter:
+    """Именованные лимиты (general, login ...) поверх одного хранилища"""
+
+    def __init__(self, store, limits, enabled=True):
+        self.store = store
+        self.limits = dict(limits)
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.stats = {'allowed': 0, 'limited': 0}
+
+    def allow(self, name, key, now=None):
+        """
+        Проверить и учесть запрос
+
+        Returns:
+            tuple: (разрешено, через сколько секунд повторить)
+        """
+        limit = self.limits.get(name)
+        if not self.enabled or limit is None:
+            return True, 0.0
+        allowed, retry_after = self.store.update(f"{name}:{key}", limit, time.time() if now is None else now)
+        with self._lock:
+            self.stats['allowed' if allowed else 'limited'] += 1
+        return allowed, retry_after
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+        self.store.reset_after_fork()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats.update(enabled=self.enabled, backend=self.store.name, store=self.store.get_stats(),
+                     limits={name: repr(limit) for name, limit in self.limits.items()})
+        return stats
+
+
+def create_store():
+    if config.RATE_LIMIT_BACKEND == 'shared' and fcntl is None:
+        logger.warning("⚠️ RATE LIMIT: fcntl недоступен на этой платформе, лимиты в памяти процесса")
+    elif config.RATE_LIMIT_BACKEND == 'shared':
+        try:
+            return SharedStore(config.RATE_LIMIT_SHARED_FILE, config.RATE_LIMIT_SHARED_SLOTS)
+        except OSError as e:
+            logger.error(f"❌ RATE LIMIT: общее хранилище {config.RATE_LIMIT_SHARED_FILE} недоступно ({e}), лимиты в памяти процесса")
+    elif config.RATE_LIMIT_BACKEND != 'memory':
+        logger.warning(f"⚠️ RATE LIMIT: неизвестное хранилище {config.RATE_LIMIT_BACKEND}, используем memory")
+    return MemoryStore(config.RATE_LIMIT_MAX_KEYS, config.RATE_LIMIT_SWEEP_SEC)
+
+
+def create_rate_limiter(limits):
+    return RateLimiter(create_store(), limits, enabled=config.RATE_LIMIT_ENABLED)
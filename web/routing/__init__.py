@@ -0,0 +1,24 @@
+"""
+Провайдеры маршрутов для расчёта ETA
+
+- providers.py — Yandex Routes Matrix, OSRM, локальный граф, модель по своим трекам, оценка по прямой
+- engine.py — реестр с таймаутами, статистикой и автоматами защиты
+- graph.py — импорт OSM и поиск маршрута A* без сети
+- track.py — пересчёт ETA по линии маршрута и ключи кэша по geohash
+"""
+
+from web.routing.breaker import CircuitBreaker
+from web.routing.engine import RoutingEngine, create_routing_engine
+from web.routing.graph import RoadGraph, RouteNotFound
+from web.routing.providers import (
+    ProviderError, RoutingProvider, YandexMatrixProvider, OsrmProvider,
+    OfflineGraphProvider, HistoryProvider, StraightLineProvider,
+)
+from web.routing.track import RouteTrack, geohash, make_route_entry, estimate_along_route
+
+__all__ = [
+    'CircuitBreaker', 'RoutingEngine', 'create_routing_engine', 'RoadGraph', 'RouteNotFound',
+    'ProviderError', 'RoutingProvider', 'YandexMatrixProvider', 'OsrmProvider',
+    'OfflineGraphProvider', 'HistoryProvider', 'StraightLineProvider',
+    'RouteTrack', 'geohash', 'make_route_entry', 'estimate_along_route',
+]
@@ -0,0 +1,67 @@
+"""
+Автомат защиты (circuit breaker) для провайдеров маршрутов
+"""
+
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    После failure_threshold ошибок подряд провайдер выключается на
+    reset_timeout секунд (или на Retry-After, если провайдер его прислал).
+    Затем пропускается один пробный вызов: успех закрывает автомат, ошибка
+    снова открывает.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.state = CLOSED
+        self.failures = 0
+        self.open_until = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Можно ли сейчас обращаться к провайдеру"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() < self.open_until:
+                    return False
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            # HALF_OPEN: только один пробный вызов
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self, retry_after=None):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if retry_after or self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                pause = max(float(retry_after or 0), self.reset_timeout if not retry_after else 0)
+                self.open_until = max(self.open_until, time.monotonic() + pause)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'open_for_sec': max(0.0, round(self.open_until - time.monotonic(), 1)) if self.state == OPEN else 0.0,
+            }
@@ -0,0 +1,217 @@
+"""
+Реестр провайдеров маршрутов с таймаутами, статистикой здоровья и автоматами защиты
+"""
+
+import logging
+import os
+import threading
+import time
+
+from config.settings import config
+from web.routing.breaker import CircuitBreaker
+from web.routing.providers import (
+    PROVIDER_CLASSES, HistoryProvider, OfflineGraphProvider, OsrmProvider, ProviderError,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_timeouts(spec):
+    """'yandex=10,osrm=5' -> {'yandex': 10.0, 'osrm': 5.0}"""
+    timeouts = {}
+    for item in (spec or '').split(','):
+        if '=' not in item:
+            continue
+        name, value = item.split('=', 1)
+        try:
+            timeouts[name.strip()] = float(value)
+        except ValueError:
+            logger.warning(f"⚠️ ROUTING_TIMEOUTS: неверное значение для {name.strip()}: {value}")
+    return timeouts
+
+
+class RoutingEngine:
+    """
+    Опрашивает провайдеров по порядку до первого успешного ответа
+
+    Провайдеры с пробками (supports_traffic) — основной уровень, остальные —
+    фолбэки; api_eta опрашивает уровни отдельно, чтобы между ними вернуть
+    stale-ответ при 429. Провайдер с открытым автоматом пропускается и
+    считается отказавшим с последней ошибкой (так 429 с Retry-After
+    продолжает отдаваться без обращения к API, пока не истечёт пауза).
+
+    backoff_store (EtaCache) делает паузы после 429 общими для всех процессов:
+    429 у одного воркера останавливает обращения к провайдеру у остальных.
+    """
+
+    def __init__(self, providers, failure_threshold=3, reset_timeout=60.0, backoff_store=None):
+        self.providers = list(providers)
+        self.backoff_store = backoff_store
+        self.breakers = {p.name: CircuitBreaker(failure_threshold, reset_timeout) for p in self.providers}
+        self._last_error = {}
+        self._lock = threading.Lock()
+        self.health = {p.name: {
+            'calls': 0,
+            'successes': 0,
+            'failures': 0,
+            'skipped_open': 0,
+            'avg_latency_ms': 0.0,
+            'last_latency_ms': None,
+            'last_error': None,
+            'last_success_ts': None,
+        } for p in self.providers}
+
+    def get(self, name):
+        for provider in self.providers:
+            if provider.name == name:
+                return provider
+        return None
+
+    def _record(self, name, latency_ms, error=None):
+        with self._lock:
+            h = self.health[name]
+            h['calls'] += 1
+            h['last_latency_ms'] = round(latency_ms, 1)
+            # Экспоненциальное сглаживание, чтобы видеть текущую задержку, а не среднюю за всё время
+            h['avg_latency_ms'] = round(latency_ms if h['calls'] == 1 else 0.8 * h['avg_latency_ms'] + 0.2 * latency_ms, 1)
+            if error is None:
+                h['successes'] += 1
+                h['last_success_ts'] = time.time()
+            else:
+                h['failures'] += 1
+                h['last_error'] = str(error)
+
+    def route(self, car_lat, car_lon, work_lat, work_lon, consider_traffic=True, fallback=False, debug=False):
+        """
+        ETA от первого ответившего провайдера уровня (fallback=False — с пробками)
+
+        Returns:
+            dict: результат провайдера плюс 'provider' и 'errors'; при отказе всех —
+                  http_status первой ошибки (или 503) и eta_seconds=None
+        """
+        errors = []
+        first_error = None
+        for provider in self.providers:
+            if provider.supports_traffic == fallback:
+                continue
+            breaker = self.breakers[provider.name]
+            shared_until = self.backoff_store.get_backoff(provider.name) if self.backoff_store else None
+            if shared_until:
+                with self._lock:
+                    self.health[provider.name]['skipped_open'] += 1
+                error = ProviderError(f'{provider.name}: backoff {int(shared_until - time.time()) + 1}s',
+                                      http_status=429, raw={"errors": ["Too many requests (local backoff)"]})
+                errors.append({'provider': provider.name, 'error': str(error), 'http_status': 429})
+                first_error = first_error or error
+                continue
+            if not breaker.allow():
+                with self._lock:
+                    self.health[provider.name]['skipped_open'] += 1
+                error = self._last_error.get(provider.name) or ProviderError('circuit open')
+                errors.append({'provider': provider.name, 'error': f'circuit open: {error}'})
+                first_error = first_error or error
+                continue
+            started = time.perf_counter()
+            try:
+                result = provider.route(car_lat, car_lon, work_lat, work_lon,
+                                        consider_traffic=consider_traffic, debug=debug)
+            except Exception as e:
+                error = e if isinstance(e, ProviderError) else ProviderError(f'{provider.name}: {e}')
+                self._record(provider.name, (time.perf_counter() - started) * 1000, error)
+                if error.soft:
+                    breaker.record_success()
+                else:
+                    self._last_error[provider.name] = error
+                    breaker.record_failure(error.retry_after)
+                if error.retry_after and self.backoff_store is not None:
+                    self.backoff_store.set_backoff(provider.name, time.time() + error.retry_after)
+                errors.append({'provider': provider.name, 'error': str(error), 'http_status': error.http_status})
+                first_error = first_error or error
+                logger.warning(f"⚠️ Провайдер маршрутов {provider.name}: {error}")
+                continue
+            self._record(provider.name, (time.perf_counter() - started) * 1000)
+            breaker.record_success()
+            result['provider'] = provider.name
+            result['errors'] = errors
+            return result
+        return {
+            'http_status': (first_error.http_status if first_error and first_error.http_status else 503),
+            'consider_traffic': consider_traffic,
+            'eta_seconds': None,
+            'distance_meters': None,
+            'source': None,
+            'raw': (first_error.raw if first_error and first_error.raw is not None else str(first_error) if first_error else None),
+            'provider': None,
+            'errors': errors,
+        }
+
+    def geometry(self, car_lat, car_lon, work_lat, work_lon):
+        """Линия маршрута от первого провайдера с supports_geometry или None"""
+        for provider in self.providers:
+            if not provider.supports_geometry:
+                continue
+            # Пауза до allow(): в HALF_OPEN allow() занимает пробный запрос, его надо завершить
+            if self.backoff_store is not None and self.backoff_store.get_backoff(provider.name):
+                continue
+            if not self.breakers[provider.name].allow():
+                continue
+            started = time.perf_counter()
+            try:
+                points = provider.geometry(car_lat, car_lon, work_lat, work_lon)
+            except Exception as e:
+                error = e if isinstance(e, ProviderError) else ProviderError(f'{provider.name}: {e}')
+                self._record(provider.name, (time.perf_counter() - started) * 1000, error)
+                if error.soft:
+                    self.breakers[provider.name].record_success()
+                else:
+                    self.breakers[provider.name].record_failure(error.retry_after)
+                if error.retry_after and self.backoff_store is not None:
+                    self.backoff_store.set_backoff(provider.name, time.time() + error.retry_after)
+                logger.warning(f"⚠️ Провайдер маршрутов {provider.name} (линия маршрута): {error}")
+                continue
+            self._record(provider.name, (time.perf_counter() - started) * 1000)
+            self.breakers[provider.name].record_success()
+            if len(points) >= 2:
+                return points
+        return None
+
+    def reset_after_fork(self):
+        for provider in self.providers:
+            provider.reset_after_fork()
+
+    def get_stats(self):
+        with self._lock:
+            return {p.name: dict(self.health[p.name], timeout_sec=p.timeout,
+                                 supports_traffic=p.supports_traffic,
+                                 breaker=self.breakers[p.name].snapshot())
+                    for p in self.providers}
+
+
+def create_routing_engine(backoff_store=None):
+    """Реестр из ROUTING_PROVIDERS (порядок опроса) с таймаутами из ROUTING_TIMEOUTS"""
+    timeouts = parse_timeouts(config.ROUTING_TIMEOUTS)
+    use_osrm = os.environ.get('USE_OSRM_FALLBACK', 'true').lower() in ('1', 'true', 'yes')
+    providers = []
+    for name in (n.strip() for n in config.ROUTING_PROVIDERS.split(',')):
+        if not name:
+            continue
+        cls = PROVIDER_CLASSES.get(name)
+        if cls is None:
+            logger.warning(f"⚠️ ROUTING_PROVIDERS: неизвестный провайдер {name}")
+            continue
+        kwargs = {'timeout': timeouts[name]} if name in timeouts else {}
+        if cls is OsrmProvider:
+            if not use_osrm:
+                continue
+            kwargs['base_url'] = config.ROUTING_OSRM_URL
+        elif cls is OfflineGraphProvider:
+            if not config.ROUTING_OFFLINE_GRAPH:
+                continue
+            kwargs['graph_path'] = config.ROUTING_OFFLINE_GRAPH
+            kwargs['max_snap_m'] = config.ROUTING_OFFLINE_MAX_SNAP_M
+        elif cls is HistoryProvider:
+            kwargs.update(db_path=config.DATABASE_PATH, min_coverage=config.TRAVEL_MODEL_MIN_COVERAGE,
+                          reload_sec=config.TRAVEL_MODEL_RELOAD_SEC, primary=config.TRAVEL_MODEL_PRIMARY)
+        providers.append(cls(**kwargs))
+    return RoutingEngine(providers, config.ROUTING_BREAKER_FAILURES, config.ROUTING_BREAKER_RESET_SEC,
+                         backoff_store=backoff_store)
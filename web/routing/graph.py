@@ -0,0 +1,306 @@
+"""
+Локальный дорожный граф для расчёта ETA без сети
+
+Граф строится один раз из выгрузки OpenStreetMap (.osm XML, например
+вырезанной osmium/Overpass для своего города) и сохраняется в компактный
+JSON. Время проезда ребра — длина / скорость, скорость берётся из maxspeed
+или по типу дороги (HIGHWAY_SPEEDS_KMH). Маршрут ищется A* по времени.
+
+    python -m web.routing.graph build moscow.osm data/road_graph.json
+    python -m web.routing.graph route data/road_graph.json 55.75 37.61 55.70 37.53
+"""
+
+import heapq
+import json
+import math
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+from bot.utils import calculate_distance
+
+GRAPH_FORMAT_VERSION = 1
+
+# Средние скорости по типу дороги (км/ч), если у пути нет maxspeed
+HIGHWAY_SPEEDS_KMH = {
+    'motorway': 90, 'motorway_link': 50,
+    'trunk': 70, 'trunk_link': 40,
+    'primary': 50, 'primary_link': 35,
+    'secondary': 45, 'secondary_link': 30,
+    'tertiary': 40, 'tertiary_link': 30,
+    'unclassified': 30, 'residential': 25,
+    'living_street': 10, 'service': 15, 'road': 25,
+}
+
+# Скорость "подъезда" от точки до ближайшего узла графа
+ACCESS_SPEED_KMH = 15
+
+# Ячейка пространственного индекса, градусы (~1 км по широте)
+GRID_CELL_DEG = 0.01
+
+
+class RouteNotFound(Exception):
+    """Точки вне графа или между ними нет пути"""
+
+
+def _parse_maxspeed(value):
+    if not value:
+        return None
+    value = value.strip().lower()
+    try:
+        if value.endswith('mph'):
+            return float(value[:-3].strip()) * 1.609
+        return float(value.split()[0])
+    except (ValueError, IndexError):
+        return None
+
+
+class RoadGraph:
+    """Ориентированный граф дорог: узлы — координаты, рёбра — (сосед, метры, секунды)"""
+
+    def __init__(self):
+        self.lat = []
+        self.lon = []
+        self.adj = []
+        self.max_speed_mps = 1.0
+        self._grid = None
+
+    def __len__(self):
+        return len(self.lat)
+
+    @property
+    def edge_count(self):
+        return sum(len(edges) for edges in self.adj)
+
+    def add_node(self, lat, lon):
+        self.lat.append(float(lat))
+        self.lon.append(float(lon))
+        self.adj.append([])
+        self._grid = None
+        return len(self.lat) - 1
+
+    def add_edge(self, u, v, length_m=None, speed_kmh=25, oneway=False):
+        if length_m is None:
+            length_m = calculate_distance(self.lat[u], self.lon[u], self.lat[v], self.lon[v])
+        speed_mps = max(1.0, float(speed_kmh)) / 3.6
+        seconds = length_m / speed_mps
+        self.max_speed_mps = max(self.max_speed_mps, speed_mps)
+        self.adj[u].append((v, length_m, seconds))
+        if not oneway:
+            self.adj[v].append((u, length_m, seconds))
+
+    # ---------- привязка точки к графу ----------
+
+    def _build_grid(self):
+        grid = {}
+        for node, (lat, lon) in enumerate(zip(self.lat, self.lon)):
+            if not self.adj[node]:
+                continue
+            key = (int(math.floor(lat / GRID_CELL_DEG)), int(math.floor(lon / GRID_CELL_DEG)))
+            grid.setdefault(key, []).append(node)
+        self._grid = grid
+
+    def nearest_node(self, lat, lon, max_distance_m=1500):
+        """
+        Ближайший узел, из которого есть рёбра
+
+        Returns:
+            tuple: (узел, расстояние в метрах) или (None, None)
+        """
+        if self._grid is None:
+            self._build_grid()
+        ci, cj = int(math.floor(lat / GRID_CELL_DEG)), int(math.floor(lon / GRID_CELL_DEG))
+        # Сколько колец ячеек нужно обойти, чтобы покрыть max_distance_m по долготе
+        cell_m = GRID_CELL_DEG * 111320 * max(0.1, math.cos(math.radians(lat)))
+        max_ring = int(max_distance_m // cell_m) + 1
+        best, best_dist = None, None
+        for ring in range(max_ring + 1):
+            for di in range(-ring, ring + 1):
+                for dj in range(-ring, ring + 1):
+                    if max(abs(di), abs(dj)) != ring:
+                        continue
+                    for node in self._grid.get((ci + di, cj + dj), ()):
+                        dist = calculate_distance(lat, lon, self.lat[node], self.lon[node])
+                        if best_dist is None or dist < best_dist:
+                            best, best_dist = node, dist
+            # Узлы из следующих колец заведомо дальше ring * cell_m
+            if best_dist is not None and best_dist <= ring * cell_m:
+                break
+        if best_dist is None or best_dist > max_distance_m:
+            return None, None
+        return best, best_dist
+
+    # ---------- поиск пути ----------
+
+    def shortest_time(self, source, target, deadline=None):
+        """
+        A* по времени проезда; эвристика — прямое расстояние на максимальной скорости графа
+
+        Returns:
+            tuple: (секунды, метры)
+        Raises:
+            RouteNotFound: пути нет
+            TimeoutError: не уложились в deadline (time.monotonic())
+        """
+        seconds, meters, _path = self.shortest_path(source, target, deadline)
+        return seconds, meters
+
+    def shortest_path(self, source, target, deadline=None):
+        """То же, что shortest_time, плюс список узлов пути: (секунды, метры, [узлы])"""
+        if source == target:
+            return 0.0, 0.0, [source]
+        t_lat, t_lon = self.lat[target], self.lon[target]
+        speed = self.max_speed_mps
+
+        def h(node):
+            return calculate_distance(self.lat[node], self.lon[node], t_lat, t_lon) / speed
+
+        best = {source: 0.0}
+        length = {source: 0.0}
+        prev = {}
+        heap = [(h(source), 0.0, source)]
+        expanded = 0
+        while heap:
+            _, g, node = heapq.heappop(heap)
+            if node == target:
+                path = [node]
+                while path[-1] != source:
+                    path.append(prev[path[-1]])
+                path.reverse()
+                return g, length[node], path
+            if g > best.get(node, math.inf):
+                continue
+            expanded += 1
+            if deadline is not None and expanded % 2048 == 0 and time.monotonic() > deadline:
+                raise TimeoutError("поиск маршрута не уложился в таймаут")
+            for neighbour, meters, seconds in self.adj[node]:
+                cost = g + seconds
+                if cost < best.get(neighbour, math.inf):
+                    best[neighbour] = cost
+                    length[neighbour] = length[node] + meters
+                    prev[neighbour] = node
+                    heapq.heappush(heap, (cost + h(neighbour), cost, neighbour))
+        raise RouteNotFound("между точками нет пути")
+
+    def route(self, from_lat, from_lon, to_lat, to_lon, max_snap_m=1500, timeout=None, with_path=False):
+        """
+        Время и длина маршрута между произвольными точками
+
+        Returns:
+            tuple: (секунды, метры) — с учётом подъезда к узлам графа;
+                   с with_path=True третьим элементом — точки маршрута [[lat, lon], ...]
+        """
+        source, snap_from = self.nearest_node(from_lat, from_lon, max_snap_m)
+        target, snap_to = self.nearest_node(to_lat, to_lon, max_snap_m)
+        if source is None or target is None:
+            raise RouteNotFound("точка вне покрытия графа")
+        deadline = time.monotonic() + timeout if timeout else None
+        seconds, meters, path = self.shortest_path(source, target, deadline)
+        access_m = snap_from + snap_to
+        seconds, meters = seconds + access_m / (ACCESS_SPEED_KMH / 3.6), meters + access_m
+        if not with_path:
+            return seconds, meters
+        points = [[from_lat, from_lon]] + [[self.lat[n], self.lon[n]] for n in path] + [[to_lat, to_lon]]
+        return seconds, meters, points
+
+    # ---------- загрузка и сохранение ----------
+
+    def to_dict(self):
+        edges = []
+        for u, neighbours in enumerate(self.adj):
+            for v, meters, seconds in neighbours:
+                edges.append([u, v, round(meters, 1), round(seconds, 2)])
+        return {
+            'version': GRAPH_FORMAT_VERSION,
+            'nodes': [[round(lat, 7), round(lon, 7)] for lat, lon in zip(self.lat, self.lon)],
+            'edges': edges,
+        }
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, separators=(',', ':'))
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != GRAPH_FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия графа: {data.get('version')}")
+        graph = cls()
+        for lat, lon in data['nodes']:
+            graph.add_node(lat, lon)
+        for u, v, meters, seconds in data['edges']:
+            graph.adj[u].append((v, meters, seconds))
+            if seconds > 0:
+                graph.max_speed_mps = max(graph.max_speed_mps, meters / seconds)
+        return graph
+
+    @classmethod
+    def load(cls, path):
+        """Граф из JSON (save) или напрямую из выгрузки OSM (.osm / .xml)"""
+        if path.endswith(('.osm', '.xml')):
+            return cls.from_osm(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    @classmethod
+    def from_osm(cls, path):
+        """Импорт дорог для автомобиля из OSM XML потоковым разбором"""
+        coords = {}
+        ways = []
+        for _event, elem in ET.iterparse(path, events=('end',)):
+            if elem.tag == 'node':
+                coords[elem.get('id')] = (float(elem.get('lat')), float(elem.get('lon')))
+                elem.clear()
+            elif elem.tag == 'way':
+                tags = {t.get('k'): t.get('v') for t in elem.findall('tag')}
+                highway = tags.get('highway')
+                if highway in HIGHWAY_SPEEDS_KMH and tags.get('access') not in ('no', 'private') \
+                        and tags.get('motor_vehicle') != 'no':
+                    refs = [nd.get('ref') for nd in elem.findall('nd')]
+                    speed = _parse_maxspeed(tags.get('maxspeed')) or HIGHWAY_SPEEDS_KMH[highway]
+                    oneway = tags.get('oneway', 'no')
+                    if highway in ('motorway', 'motorway_link') or tags.get('junction') == 'roundabout':
+                        oneway = tags.get('oneway', 'yes')
+                    if oneway == '-1':
+                        refs.reverse()
+                    ways.append((refs, speed, oneway in ('yes', 'true', '1', '-1')))
+                elem.clear()
+
+        graph = cls()
+        index = {}
+        for refs, speed, oneway in ways:
+            prev = None
+            for ref in refs:
+                if ref not in coords:
+                    prev = None
+                    continue
+                node = index.get(ref)
+                if node is None:
+                    node = index[ref] = graph.add_node(*coords[ref])
+                if prev is not None and prev != node:
+                    graph.add_edge(prev, node, speed_kmh=speed, oneway=oneway)
+                prev = node
+        return graph
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if len(argv) == 3 and argv[0] == 'build':
+        started = time.perf_counter()
+        graph = RoadGraph.from_osm(argv[1])
+        graph.save(argv[2])
+        print(f"✅ Граф сохранён: {len(graph)} узлов, {graph.edge_count} рёбер, "
+              f"{time.perf_counter() - started:.1f} с")
+        return 0
+    if len(argv) == 6 and argv[0] == 'route':
+        graph = RoadGraph.load(argv[1])
+        started = time.perf_counter()
+        seconds, meters = graph.route(*map(float, argv[2:]))
+        print(f"🧭 {seconds / 60:.1f} мин, {meters / 1000:.2f} км "
+              f"(поиск {(time.perf_counter() - started) * 1000:.1f} мс)")
+        return 0
+    print(__doc__)
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,314 @@
+"""
+Провайдеры маршрутов для /api/eta
+
+У всех один метод route(car_lat, car_lon, work_lat, work_lon, consider_traffic, debug),
+который возвращает словарь результата:
+    {'http_status', 'consider_traffic', 'eta_seconds', 'distance_meters', 'source', 'raw'}
+или бросает ProviderError. Провайдеры с supports_geometry умеют ещё geometry() —
+точки маршрута [[lat, lon], ...] для пересчёта ETA по ходу движения (web/routing/track.py).
+Таймауты, здоровье и автомат защиты — в RoutingEngine.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import requests
+
+from bot.utils import calculate_distance
+from web.eta_refresher import matrix_endpoints, matrix_headers, parse_matrix_cell, retry_after_seconds
+from web.routing.graph import RoadGraph, RouteNotFound
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderError(Exception):
+    """
+    Провайдер не вернул ETA; retry_after — пауза в секундах, raw — ответ для диагностики
+
+    soft=True — провайдер исправен, но не знает ответа для этих точек (вне графа,
+    мало истории): автомат защиты такие ошибки не считает.
+    """
+
+    def __init__(self, message, http_status=None, retry_after=None, raw=None, soft=False):
+        super().__init__(message)
+        self.http_status = http_status
+        self.retry_after = retry_after
+        self.raw = raw
+        self.soft = soft
+
+
+def _result(consider_traffic, eta_seconds=None, distance_meters=None, source=None, raw=None, http_status=200):
+    return {
+        'http_status': http_status,
+        'consider_traffic': consider_traffic,
+        'eta_seconds': eta_seconds,
+        'distance_meters': distance_meters,
+        'source': source,
+        'raw': raw,
+    }
+
+
+class RoutingProvider:
+    """Базовый провайдер"""
+
+    name = 'base'
+    # Учитывает ли провайдер пробки (такие опрашиваются первыми, остальные — фолбэки)
+    supports_traffic = False
+    # Отдаёт ли провайдер линию маршрута (geometry)
+    supports_geometry = False
+
+    def __init__(self, timeout=10.0):
+        self.timeout = float(timeout)
+
+    def route(self, car_lat, car_lon, work_lat, work_lon, consider_traffic=True, debug=False):
+        raise NotImplementedError
+
+    def geometry(self, car_lat, car_lon, work_lat, work_lon):
+        """Точки маршрута [[lat, lon], ...] от машины до рабочей точки"""
+        raise NotImplementedError
+
+    def reset_after_fork(self):
+        pass
+
+
+class _SessionMixin:
+    _session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    def reset_after_fork(self):
+        self._session = None
+
+
+class YandexMatrixProvider(_SessionMixin, RoutingProvider):
+    """Yandex Routes Matrix (1x1) с учётом пробок"""
+
+    name = 'yandex'
+    supports_traffic = True
+
+    def route(self, car_lat, car_lon, work_lat, work_lon, consider_traffic=True, debug=False):
+        api_key = os.environ.get('YANDEX_ROUTING_API_KEY')
+        if not api_key:
+            raise ProviderError('YANDEX_ROUTING_API_KEY is not set')
+        payload = {
+            "sources": [{"latitude": float(car_lat), "longitude": float(car_lon)}],
+            "targets": [{"latitude": float(work_lat), "longitude": float(work_lon)}],
+            # Оставляем минимально необходимый набор аннотаций для снижения нагрузки
+            "annotations": ["distance", "jam_time", "expected_time"],
+            "consider_traffic": consider_traffic,
+            "transport": "car"
+        }
+        headers = matrix_headers(api_key)
+        response = None
+        url_used = None
+        last_exc = None
+        for candidate in matrix_endpoints():
+            try:
+                response = self.session.post(candidate, json=payload, headers=headers, timeout=self.timeout)
+            except Exception as e:
+                last_exc = e
+                continue
+            url_used = candidate
+            # 404 — пробуем следующий кандидат
+            if response.status_code != 404:
+                break
+        if response is None:
+            raise ProviderError('All endpoints failed', http_status=503,
+                                raw={"errors": ["All endpoints failed"], "last_exception": str(last_exc) if last_exc else None})
+
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        raw = {'endpoint_used': url_used, 'response': body} if debug else body
+
+        if response.status_code == 429:
+            # Retry-After (секунды или HTTP-date) или дефолтный backoff
+            retry_after = retry_after_seconds(response.headers.get('Retry-After'),
+                                              int(os.environ.get('ETA_DEFAULT_BACKOFF_SEC', 60)))
+            raise ProviderError('Yandex API HTTP 429', http_status=429, retry_after=retry_after, raw=raw)
+        if response.status_code != 200:
+            raise ProviderError(f'Yandex API HTTP {response.status_code}', http_status=response.status_code, raw=raw)
+
+        eta_seconds, distance_meters, source = parse_matrix_cell(body if isinstance(body, dict) else {}, 0, 0)
+        return _result(consider_traffic, eta_seconds, distance_meters, source, raw if debug else None)
+
+
+class OsrmProvider(_SessionMixin, RoutingProvider):
+    """OSRM (по умолчанию публичный демо-сервер) — без пробок"""
+
+    name = 'osrm'
+    supports_geometry = True
+
+    def __init__(self, base_url='https://router.project-osrm.org', timeout=5.0):
+        super().__init__(timeout)
+        self.base_url = base_url.rstrip('/')
+
+    def _request(self, car_lat, car_lon, work_lat, work_lon, overview='false'):
+        url = (
+            f"{self.base_url}/route/v1/driving/"
+            f"{float(car_lon):.6f},{float(car_lat):.6f};{float(work_lon):.6f},{float(work_lat):.6f}"
+            f"?overview={overview}&alternatives=false" + ("&geometries=geojson" if overview != 'false' else "")
+        )
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except Exception as e:
+            raise ProviderError(f'OSRM: {e}')
+        if response.status_code != 200:
+            raise ProviderError(f'OSRM HTTP {response.status_code}', http_status=response.status_code,
+                                retry_after=(60 if response.status_code == 429 else None))
+        data = response.json()
+        if not data.get('routes'):
+            raise ProviderError(f"OSRM: {data.get('code', 'no route')}", http_status=200)
+        return url, data['routes'][0]
+
+    def geometry(self, car_lat, car_lon, work_lat, work_lon):
+        _url, route = self._request(car_lat, car_lon, work_lat, work_lon, overview='full')
+        coordinates = (route.get('geometry') or {}).get('coordinates') or []
+        return [[lat, lon] for lon, lat in coordinates]
+
+    def route(self, car_lat, car_lon, work_lat, work_lon, consider_traffic=True, debug=False):
+        url, route = self._request(car_lat, car_lon, work_lat, work_lon)
+        distance = route.get('distance')
+        if distance is None:
+            distance = calculate_distance(car_lat, car_lon, float(work_lat), float(work_lon))
+        return _result(consider_traffic, int(max(0, route.get('duration', 0))), int(distance), 'osrm_fallback',
+                       ({'url': url} if debug else None))
+
+
+class OfflineGraphProvider(RoutingProvider):
+    """Локальный граф дорог (web/routing/graph.py): работает без сети"""
+
+    name = 'offline'
+    supports_geometry = True
+
+    def __init__(self, graph_path=None, graph=None, max_snap_m=1500, timeout=2.0):
+        super().__init__(timeout)
+        self.graph_path = graph_path
+        self.max_snap_m = max_snap_m
+        self._graph = graph
+        self._load_error = None
+        self._lock = threading.Lock()
+
+    @property
+    def graph(self):
+        """Граф загружается при первом запросе; ошибка загрузки запоминается"""
+        if self._graph is None and self._load_error is None:
+            with self._lock:
+                if self._graph is None and self._load_error is None:
+                    started = time.perf_counter()
+                    try:
+                        self._graph = RoadGraph.load(self.graph_path)
+                        logger.info(f"🗺️ Загружен граф дорог {self.graph_path}: {len(self._graph)} узлов "
+                                    f"за {time.perf_counter() - started:.1f} с")
+                    except Exception as e:
+                        self._load_error = str(e)
+                        logger.error(f"❌ Не удалось загрузить граф дорог {self.graph_path}: {e}")
+        if self._graph is None:
+            raise ProviderError(f'offline graph unavailable: {self._load_error}')
+        return self._graph
+
+    def route(self, car_lat, car_lon, work_lat, work_lon, consider_traffic=True, debug=False):
+        graph = self.graph
+        try:
+            seconds, meters = graph.route(float(car_lat), float(car_lon), float(work_lat), float(work_lon),
+                                          max_snap_m=self.max_snap_m, timeout=self.timeout)
+        except RouteNotFound as e:
+            raise ProviderError(f'offline: {e}', soft=True)
+        except TimeoutError as e:
+            raise ProviderError(f'offline: {e}')
+        return _result(consider_traffic, int(seconds), int(meters), 'offline_graph',
+                       ({'nodes': len(graph)} if debug else None))
+
+    def geometry(self, car_lat, car_lon, work_lat, work_lon):
+        graph = self.graph
+        try:
+            _seconds, _meters, points = graph.route(float(car_lat), float(car_lon), float(work_lat), float(work_lon),
+                                                    max_snap_m=self.max_snap_m, timeout=self.timeout, with_path=True)
+        except RouteNotFound as e:
+            raise ProviderError(f'offline: {e}', soft=True)
+        except TimeoutError as e:
+            raise ProviderError(f'offline: {e}')
+        return points
+
+
+class HistoryProvider(RoutingProvider):
+    """
+    Модель типичного времени в пути по своим трекам (bot/travel_model.py)
+
+    Отвечает, только если путь покрыт историей не меньше чем на min_coverage.
+    Модель перечитывается из базы раз в reload_sec (её дообучает бот).
+    С primary=True считается провайдером "с пробками" и опрашивается до
+    платных: время суток и день недели уже учитывают типичные заторы.
+    """
+
+    name = 'history'
+
+    def __init__(self, db_path='driver.db', min_coverage=0.6, reload_sec=600, primary=False, timeout=1.0):
+        super().__init__(timeout)
+        self.db_path = db_path
+        self.min_coverage = float(min_coverage)
+        self.reload_sec = reload_sec
+        self.supports_traffic = primary
+        self._model = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None or time.monotonic() - self._loaded_at > self.reload_sec:
+            with self._lock:
+                if self._model is None or time.monotonic() - self._loaded_at > self.reload_sec:
+                    from bot.db_pool import get_pool
+                    from bot.travel_model import TravelTimeModel
+
+                    conn = get_pool(self.db_path).get_connection()
+                    try:
+                        self._model = TravelTimeModel.load(conn)
+                    finally:
+                        conn.close()
+                    self._loaded_at = time.monotonic()
+        return self._model
+
+    def route(self, car_lat, car_lon, work_lat, work_lon, consider_traffic=True, debug=False):
+        model = self.model
+        if not model:
+            raise ProviderError('history: model is not trained', soft=True)
+        seconds, meters, coverage = model.predict(float(car_lat), float(car_lon), float(work_lat), float(work_lon))
+        if seconds is None or coverage < self.min_coverage:
+            raise ProviderError(f'history: coverage {coverage:.0%} < {self.min_coverage:.0%}', soft=True)
+        return _result(consider_traffic, int(seconds), int(meters), 'history_model',
+                       ({'coverage': round(coverage, 3), 'model_size': model.size} if debug else None))
+
+
+class StraightLineProvider(RoutingProvider):
+    """Приблизительная оценка по прямому расстоянию и средней скорости — не отказывает никогда"""
+
+    name = 'estimate'
+
+    def __init__(self, speed_kmh=None, timeout=1.0):
+        super().__init__(timeout)
+        self._speed_kmh = speed_kmh
+
+    @property
+    def speed_kmh(self):
+        if self._speed_kmh is not None:
+            return float(self._speed_kmh)
+        return float(os.environ.get('ETA_FALLBACK_SPEED_KMH', 30))  # дефолт 30 км/ч
+
+    def route(self, car_lat, car_lon, work_lat, work_lon, consider_traffic=True, debug=False):
+        distance_m = calculate_distance(car_lat, car_lon, float(work_lat), float(work_lon))
+        eta_sec = int(max(0, distance_m / (max(1e-3, self.speed_kmh) * 1000.0 / 3600.0)))
+        return _result(consider_traffic, eta_sec, int(distance_m), 'fallback_estimate')
+
+
+PROVIDER_CLASSES = {
+    cls.name: cls for cls in (YandexMatrixProvider, OsrmProvider, OfflineGraphProvider, HistoryProvider,
+                              StraightLineProvider)
+}
@@ -0,0 +1,165 @@
+"""
+Пересчёт ETA по линии маршрута без обращения к провайдеру
+
+После ответа провайдера запоминаем линию маршрута и ETA в момент фиксации.
+На следующих обновлениях позиции проецируем машину на линию: если она в
+коридоре маршрута, оставшееся время пропорционально оставшейся части пути.
+Если машина ушла с маршрута, поехала назад или оценка по пройденному пути
+разошлась с оценкой по прошедшему времени (стоит в пробке), возвращаем None —
+нужно спросить провайдера заново.
+
+Ключи кэша строятся по ячейкам geohash, а не по координатам с точностью до
+метра, чтобы соседние точки попадали в одну запись.
+"""
+
+import math
+import time
+
+_GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Метров в градусе широты (для локальной плоской проекции)
+_M_PER_DEG = 111320.0
+
+# Допустимый "откат" назад по маршруту (шум GPS), метры
+BACKTRACK_TOLERANCE_M = 50.0
+
+
+def geohash(lat, lon, precision=7):
+    """Geohash точки: 7 символов — ячейка ~150x150 м, 8 — ~40x20 м"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def simplify_points(points, min_step_m=10.0):
+    """Убрать точки ближе min_step_m к предыдущей (первая и последняя сохраняются)"""
+    if len(points) <= 2:
+        return [list(p) for p in points]
+    result = [list(points[0])]
+    for lat, lon in points[1:-1]:
+        last_lat, last_lon = result[-1]
+        dy = (lat - last_lat) * _M_PER_DEG
+        dx = (lon - last_lon) * _M_PER_DEG * math.cos(math.radians(lat))
+        if dx * dx + dy * dy >= min_step_m * min_step_m:
+            result.append([lat, lon])
+    result.append(list(points[-1]))
+    return result
+
+
+class RouteTrack:
+    """Линия маршрута с накопленной длиной; расстояния — в локальной плоской проекции"""
+
+    def __init__(self, points):
+        self.points = [(float(lat), float(lon)) for lat, lon in points]
+        self._lat0 = self.points[0][0]
+        self._kx = _M_PER_DEG * math.cos(math.radians(self._lat0))
+        self._xy = [self._to_xy(lat, lon) for lat, lon in self.points]
+        self.cumulative = [0.0]
+        for (x1, y1), (x2, y2) in zip(self._xy, self._xy[1:]):
+            self.cumulative.append(self.cumulative[-1] + math.hypot(x2 - x1, y2 - y1))
+
+    @property
+    def length(self):
+        return self.cumulative[-1]
+
+    def _to_xy(self, lat, lon):
+        return lon * self._kx, lat * _M_PER_DEG
+
+    def project(self, lat, lon):
+        """
+        Ближайшая точка маршрута
+
+        Returns:
+            tuple: (пройдено по маршруту в метрах, расстояние от маршрута в метрах)
+        """
+        px, py = self._to_xy(float(lat), float(lon))
+        best_offset, best_lateral = 0.0, math.inf
+        for i, ((x1, y1), (x2, y2)) in enumerate(zip(self._xy, self._xy[1:])):
+            dx, dy = x2 - x1, y2 - y1
+            seg_sq = dx * dx + dy * dy
+            t = 0.0 if seg_sq == 0 else max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / seg_sq))
+            cx, cy = x1 + t * dx, y1 + t * dy
+            lateral = math.hypot(px - cx, py - cy)
+            if lateral < best_lateral:
+                best_lateral = lateral
+                best_offset = self.cumulative[i] + t * math.sqrt(seg_sq)
+        return best_offset, best_lateral
+
+
+def make_route_entry(points, car_lat, car_lon, payload, min_step_m=10.0):
+    """Запись для кэша: линия маршрута и ETA в момент ответа провайдера"""
+    points = simplify_points(points, min_step_m)
+    track = RouteTrack(points)
+    offset, _lateral = track.project(car_lat, car_lon)
+    return {
+        'points': points,
+        'fix_offset_m': offset,
+        'fix_ts': time.time(),
+        'eta_seconds': payload['eta_seconds'],
+        'distance_meters': payload.get('distance_meters'),
+        'source': payload.get('source'),
+        'consider_traffic': payload.get('consider_traffic'),
+    }
+
+
+def estimate_along_route(entry, car_lat, car_lon, corridor_m=60.0, max_drift=0.25, min_drift_sec=90, now=None):
+    """
+    ETA по сохранённой линии маршрута
+
+    Returns:
+        tuple: (payload или None, причина) — причина для отладки, когда оценки нет
+    """
+    if not entry or entry.get('eta_seconds') is None:
+        return None, 'no_route'
+    track = RouteTrack(entry['points'])
+    if track.length <= 0:
+        return None, 'empty_route'
+    offset, lateral = track.project(car_lat, car_lon)
+    if lateral > corridor_m:
+        return None, 'off_route'
+    fix_offset = float(entry.get('fix_offset_m') or 0.0)
+    if offset < fix_offset - BACKTRACK_TOLERANCE_M:
+        return None, 'backtrack'
+    remaining_at_fix = track.length - fix_offset
+    if remaining_at_fix <= 0:
+        return None, 'empty_route'
+    remaining_share = max(0.0, track.length - offset) / remaining_at_fix
+    eta_at_fix = float(entry['eta_seconds'])
+    eta = eta_at_fix * remaining_share
+
+    # По прошедшему времени машина должна была доехать до eta_at_fix - elapsed.
+    # Если она заметно отстаёт (пробка, остановка) или опережает — ждём свежий ответ.
+    elapsed = (now if now is not None else time.time()) - float(entry.get('fix_ts') or 0)
+    by_time = max(0.0, eta_at_fix - elapsed)
+    if abs(eta - by_time) > max(min_drift_sec, max_drift * eta_at_fix):
+        return None, 'drift'
+
+    distance = entry.get('distance_meters')
+    return {
+        'success': True,
+        'eta_seconds': int(round(eta)),
+        'distance_meters': (int(distance * remaining_share) if distance is not None else None),
+        'source': entry.get('source'),
+        'consider_traffic': entry.get('consider_traffic'),
+        'projected': True,
+        'route_progress_m': int(offset - fix_offset),
+    }, None
@@ -1,80 +1,152 @@
 import re
+import bisect
+import math
 import logging
 import time
 import hashlib
 import secrets
 from datetime import datetime, timedelta
-from collections import defaultdict, deque
+from collections import OrderedDict, defaultdict
 from flask import request, jsonify, session, g
-from functools import wraps
 import threading
 
+from web.inspection import InspectionEngine
+from web.rate_limit import Limit, create_rate_limiter
+
 logger = logging.getLogger(__name__)
 
+# Порядок проверки значений запроса в декораторах
+INJECTION_CATEGORIES = ('xss', 'sql', 'command')
+DETECTED_LABELS = {'xss': 'XSS ATTACK', 'sql': 'SQL INJECTION', 'command': 'COMMAND INJECTION', 'csrf': 'CSRF ATTACK'}
+# Без этих символов ни одно XSS-правило не совпадёт: теги начинаются с '<',
+# схемы javascript:/vbscript: содержат ':', обработчики и innerHTML — '=',
+# eval и document.write — '(', остаётся маркер JSTAG. Командным правилам без
+# слова из списка нужен спецсимвол или буква/цифра в конце строки (\b$\b)
+INSPECTION_PREFILTERS = {'xss': r'[<:=(]|jstag', 'csrf': r'<', 'command': r'[\\|&;`()\[\]{}]|\w$'}
+# Каждое SQL-правило и первое командное требуют одного из этих слов целиком
+SQL_KEYWORDS = {'union', 'select', 'insert', 'update', 'delete', 'drop', 'create', 'alter',
+                'exec', 'execute', 'script', 'or', 'and'}
+COMMAND_KEYWORDS = {'cat', 'chmod', 'chown', 'cp', 'curl', 'cut', 'dd', 'df', 'du', 'echo', 'env', 'find',
+                    'grep', 'head', 'id', 'kill', 'less', 'ls', 'mkdir', 'mv', 'nc', 'netcat', 'nmap', 'ping',
+                    'ps', 'pwd', 'rm', 'rmdir', 'sed', 'sh', 'sort', 'ssh', 'su', 'sudo', 'tail', 'tar',
+                    'telnet', 'touch', 'wget', 'who', 'whoami'}
+
+
+class RoutePolicy:
+    """Какие проверки security_check выполняются для пути и по какому лимиту"""
+    
+    __slots__ = ('name', 'rate_limit', 'check_user_agent', 'check_args', 'check_body', 'bypass')
+    
+    def __init__(self, name, rate_limit='general', check_user_agent=True, check_args=True, check_body=True, bypass=False):
+        self.name = name
+        self.rate_limit = rate_limit
+        self.check_user_agent = check_user_agent
+        self.check_args = check_args
+        self.check_body = check_body
+        self.bypass = bypass
+
+DEFAULT_POLICY = RoutePolicy('default')
+# Полный пропуск всех проверок, включая rate limiting
+WHITELIST_POLICY = RoutePolicy('whitelist', rate_limit=None, check_user_agent=False, check_args=False,
+                               check_body=False, bypass=True)
+# Телеметрия OwnTracks и резервного трекера: нетипичные UA, частые точки — свой лимит, без инспекции
+TELEMETRY_POLICY = RoutePolicy('telemetry', rate_limit='telemetry', check_user_agent=False, check_args=False,
+                               check_body=False)
+# Мягкие проверки: только лимит, без инспекции UA/параметров
+SOFT_POLICY = RoutePolicy('soft', check_user_agent=False, check_args=False, check_body=False)
+# Мягкая проверка POST форм; JSON зон проверяется по схеме в bot/zones.py (validate_zone)
+SOFT_POST_POLICY = RoutePolicy('soft_post', check_body=False)
+
+ROUTE_POLICIES = {
+    '/telegram_login': WHITELIST_POLICY,
+    '/api/location': TELEMETRY_POLICY,
+    '/': SOFT_POLICY,
+    '/invite': SOFT_POLICY,
+    '/invite_auth': SOFT_POLICY,
+    '/bind_telegram_form': SOFT_POLICY,
+    '/api/eta': SOFT_POLICY,
+    '/settings': SOFT_POST_POLICY,
+    '/select_role': SOFT_POST_POLICY,
+    '/api/zones': SOFT_POST_POLICY,
+}
+ROUTE_PREFIX_POLICIES = (('/api/zones/', SOFT_POST_POLICY),)
+
+def route_policy(path):
+    """Политика проверок для пути запроса"""
+    policy = ROUTE_POLICIES.get(path)
+    if policy is not None:
+        return policy
+    for prefix, prefix_policy in ROUTE_PREFIX_POLICIES:
+        if path.startswith(prefix):
+            return prefix_policy
+    return DEFAULT_POLICY
+
+def rate_limited(message, retry_after):
+    """Ответ 429 с заголовком Retry-After"""
+    return message, 429, {'Retry-After': str(max(1, math.ceil(retry_after)))}
+
 class RateLimiter:
-    """Ограничитель скорости запросов для защиты от брутфорс атак"""
+    """Ограничитель скорости запросов для защиты от брутфорс атак (один именованный лимит GCRA)"""
     
-    def __init__(self, max_requests=10000, window_seconds=1):  # Временно отключено для локальной разработки
+    def __init__(self, limiter, name, max_requests, window_seconds):
+        self.limiter = limiter
+        self.name = name
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self.requests = defaultdict(lambda: deque())
-        self.lock = threading.Lock()
+    
+    def check(self, identifier):
+        """Учитывает запрос: (разрешен ли, через сколько секунд повторить)"""
+        return self.limiter.allow(self.name, identifier)
     
     def is_allowed(self, identifier):
         """Проверяет, разрешен ли запрос для данного идентификатора"""
-        # Временно отключено для локальной разработки
-        return True
-        
-        # Оригинальная логика закомментирована
-        # now = time.time()
-        # 
-        # with self.lock:
-        #     # Очищаем старые запросы
-        #     while (self.requests[identifier] and 
-        #            now - self.requests[identifier][0] > self.window_seconds):
-        #         self.requests[identifier].popleft()
-        #     
-        #     # Проверяем лимит
-        #     if len(self.requests[identifier]) >= self.max_requests:
-        #         return False
-        #     
-        #     # Добавляем текущий запрос
-        #     self.requests[identifier].append(now)
-        #     return True
+        return self.check(identifier)[0]
 
 class IPBlocker:
     """Блокировщик IP-адресов для защиты от атак"""
     
-    def __init__(self, max_failed_attempts=5, block_duration_minutes=30):
+    def __init__(self, limiter, max_failed_attempts=5, block_duration_minutes=30, enabled=True, max_blocked=10000):
+        # Неудачные попытки считает лимит 'failed' в limiter: состояние фиксированного размера на IP
+        self.limiter = limiter
         self.max_failed_attempts = max_failed_attempts
         self.block_duration_minutes = block_duration_minutes
-        self.failed_attempts = defaultdict(int)
-        self.blocked_ips = {}
+        self.enabled = enabled
+        self.max_blocked = max_blocked
+        self.blocked_ips = OrderedDict()    # ip -> время окончания блокировки, по возрастанию
         self.lock = threading.Lock()
     
     def is_blocked(self, ip):
         """Проверяет, заблокирован ли IP"""
-        # Временно отключено для локальной разработки
-        return False
-        
-        # Оригинальная логика закомментирована
-        # with self.lock:
-        #     if ip in self.blocked_ips:
-        #         if time.time() - self.blocked_ips[ip] < self.block_duration_minutes * 60:
-        #             return True
-        #         else:
-        #             # Разблокируем IP
-        #             del self.blocked_ips[ip]
-        #             self.failed_attempts[ip] = 0
-        #     return False
+        if not self.enabled:
+            return False
+        with self.lock:
+            until = self.blocked_ips.get(ip)
+            if until is None:
+                return False
+            if time.time() < until:
+                return True
+            # Разблокируем IP
+            del self.blocked_ips[ip]
+            return False
     
     def record_failed_attempt(self, ip):
         """Записывает неудачную попытку"""
+        if not self.enabled:
+            return
+        allowed, _ = self.limiter.allow('failed', ip)
+        if allowed:
+            return
+        now = time.time()
         with self.lock:
-            self.failed_attempts[ip] += 1
-            if self.failed_attempts[ip] >= self.max_failed_attempts:
-                self.blocked_ips[ip] = time.time()
-                logger.warning(f"IP {ip} заблокирован на {self.block_duration_minutes} минут")
+            # Истёкшие блокировки в начале словаря; при переполнении снимаем самую раннюю
+            while self.blocked_ips:
+                ip_first, until = next(iter(self.blocked_ips.items()))
+                if until > now and len(self.blocked_ips) < self.max_blocked:
+                    break
+                del self.blocked_ips[ip_first]
+            self.blocked_ips.pop(ip, None)
+            self.blocked_ips[ip] = now + self.block_duration_minutes * 60
+        logger.warning(f"IP {ip} заблокирован на {self.block_duration_minutes} минут")
 
 class SecurityManager:
     """Менеджер безопасности для защиты от различных типов атак"""
@@ -108,8 +180,6 @@ class SecurityManager:
             r'<style[^>]*>',
             r'<base[^>]*>',
             r'<bgsound[^>]*>',
-            r'<link[^>]*>',
-            r'<meta[^>]*>',
             r'<title[^>]*>',
             r'<xmp[^>]*>',
             r'<plaintext[^>]*>',
@@ -247,101 +317,74 @@ class SecurityManager:
             r'<form[^>]*action\s*=\s*["\'][^"\']*["\'][^>]*>',
         ]
         
-        # Компилируем регулярные выражения для производительности
-        self.xss_regex = [re.compile(pattern, re.IGNORECASE) for pattern in self.xss_patterns]
-        self.sql_regex = [re.compile(pattern, re.IGNORECASE) for pattern in self.sql_patterns]
-        self.command_regex = [re.compile(pattern, re.IGNORECASE) for pattern in self.command_patterns]
-        self.csrf_regex = [re.compile(pattern, re.IGNORECASE) for pattern in self.csrf_patterns]
-        
-        # Инициализируем ограничители (читаем значения из config)
-        try:
-            from config.settings import config as _cfg
-            # Временно увеличиваем лимиты для локальной разработки
-            general_max = getattr(_cfg, 'RATE_LIMIT_REQUESTS', 10000)  # Увеличено с 100 до 10000
-            general_win = getattr(_cfg, 'RATE_LIMIT_WINDOW', 60)
-            login_max = getattr(_cfg, 'LOGIN_RATE_LIMIT_REQUESTS', 100)  # Увеличено с 5 до 100
-            login_win = getattr(_cfg, 'LOGIN_RATE_LIMIT_WINDOW', 300)
-            pwd_max = getattr(_cfg, 'LOGIN_RATE_LIMIT_REQUESTS', 100)  # Увеличено с 10 до 100
-            pwd_win = 600
-        except Exception:
-            # Временно увеличенные лимиты для локальной разработки
-            general_max, general_win = 10000, 60  # Увеличено с 100 до 10000
-            login_max, login_win = 100, 300  # Увеличено с 5 до 100
-            pwd_max, pwd_win = 100, 600  # Увеличено с 10 до 100
-
-        self.rate_limiter = RateLimiter(max_requests=general_max, window_seconds=general_win)
-        self.login_rate_limiter = RateLimiter(max_requests=login_max, window_seconds=login_win)  # попытки входа
-        self.password_reset_rate_limiter = RateLimiter(max_requests=pwd_max, window_seconds=pwd_win)  # восстановление пароля
-        # Временно увеличиваем лимиты для локальной разработки
-        self.ip_blocker = IPBlocker(max_failed_attempts=100, block_duration_minutes=1)
+        # Все правила — в одной альтернации на категорию (см. web/inspection.py)
+        self.inspector = InspectionEngine(
+            [('xss', self.xss_patterns), ('sql', self.sql_patterns),
+             ('command', self.command_patterns), ('csrf', self.csrf_patterns)],
+            prefilters=INSPECTION_PREFILTERS,
+            keywords={'sql': SQL_KEYWORDS, 'command': COMMAND_KEYWORDS},
+        )
+        
+        # Ограничители: именованные лимиты GCRA поверх одного хранилища (web/rate_limit.py)
+        from config.settings import config as _cfg
+        limits = {
+            'general': Limit(_cfg.RATE_LIMIT_REQUESTS, _cfg.RATE_LIMIT_WINDOW),
+            'telemetry': Limit(_cfg.TELEMETRY_RATE_LIMIT_REQUESTS, _cfg.TELEMETRY_RATE_LIMIT_WINDOW),
+            'login': Limit(_cfg.LOGIN_RATE_LIMIT_REQUESTS, _cfg.LOGIN_RATE_LIMIT_WINDOW),
+            'password_reset': Limit(_cfg.PASSWORD_RESET_RATE_LIMIT_REQUESTS, _cfg.PASSWORD_RESET_RATE_LIMIT_WINDOW),
+            # Блокировка на попытке номер MAX_FAILED_ATTEMPTS подряд
+            'failed': Limit(_cfg.MAX_FAILED_ATTEMPTS, _cfg.BLOCK_DURATION_MINUTES * 60,
+                            burst=max(1, _cfg.MAX_FAILED_ATTEMPTS - 1)),
+        }
+        self.limiter = create_rate_limiter(limits)
+        self.rate_limiters = {name: RateLimiter(self.limiter, name, limit.rate, limit.period)
+                              for name, limit in limits.items() if name != 'failed'}
+        self.rate_limiter = self.rate_limiters['general']
+        self.login_rate_limiter = self.rate_limiters['login']  # попытки входа
+        self.password_reset_rate_limiter = self.rate_limiters['password_reset']  # восстановление пароля
+        self.ip_blocker = IPBlocker(self.limiter, max_failed_attempts=_cfg.MAX_FAILED_ATTEMPTS,
+                                    block_duration_minutes=_cfg.BLOCK_DURATION_MINUTES,
+                                    enabled=_cfg.IP_BLOCK_ENABLED, max_blocked=_cfg.MAX_BLOCKED_IPS)
+    
+    def reset_after_fork(self):
+        """Новые блокировки в дочернем процессе (воркеры gunicorn)"""
+        self.limiter.reset_after_fork()
+        self.ip_blocker.lock = threading.Lock()
+    
+    def get_rate_limit_stats(self):
+        stats = self.limiter.get_stats()
+        with self.ip_blocker.lock:
+            stats['blocked_ips'] = len(self.ip_blocker.blocked_ips)
+        return stats
+    
+    def _check(self, data, categories):
+        """Проверка значения по правилам категорий; первое срабатывание пишется в лог"""
+        found = self.inspector.inspect(data, categories)
+        if found is None:
+            return False
+        category, pattern, text = found
+        logger.error(f"{DETECTED_LABELS[category]} DETECTED: {pattern} in data: {text[:100]}...")
+        return True
     
     def check_xss(self, data):
         """Проверка на XSS-атаки"""
-        if isinstance(data, str):
-            for pattern in self.xss_regex:
-                if pattern.search(data):
-                    logger.error(f"XSS ATTACK DETECTED: {pattern.pattern} in data: {data[:100]}...")
-                    return True
-        elif isinstance(data, dict):
-            for key, value in data.items():
-                if self.check_xss(str(value)):
-                    return True
-        elif isinstance(data, list):
-            for item in data:
-                if self.check_xss(str(item)):
-                    return True
-        return False
+        return self._check(data, ('xss',))
     
     def check_sql_injection(self, data):
         """Проверка на SQL-инъекции"""
-        if isinstance(data, str):
-            for pattern in self.sql_regex:
-                if pattern.search(data):
-                    logger.error(f"SQL INJECTION DETECTED: {pattern.pattern} in data: {data[:100]}...")
-                    return True
-        elif isinstance(data, dict):
-            for key, value in data.items():
-                if self.check_sql_injection(str(value)):
-                    return True
-        elif isinstance(data, list):
-            for item in data:
-                if self.check_sql_injection(str(item)):
-                    return True
-        return False
+        return self._check(data, ('sql',))
     
     def check_command_injection(self, data):
         """Проверка на командные инъекции"""
-        if isinstance(data, str):
-            for pattern in self.command_regex:
-                if pattern.search(data):
-                    logger.error(f"COMMAND INJECTION DETECTED: {pattern.pattern} in data: {data[:100]}...")
-                    return True
-        elif isinstance(data, dict):
-            for key, value in data.items():
-                if self.check_command_injection(str(value)):
-                    return True
-        elif isinstance(data, list):
-            for item in data:
-                if self.check_command_injection(str(item)):
-                    return True
-        return False
+        return self._check(data, ('command',))
     
     def check_csrf(self, data):
         """Проверка на CSRF атаки"""
-        if isinstance(data, str):
-            for pattern in self.csrf_regex:
-                if pattern.search(data):
-                    logger.error(f"CSRF ATTACK DETECTED: {pattern.pattern} in data: {data[:100]}...")
-                    return True
-        elif isinstance(data, dict):
-            for key, value in data.items():
-                if self.check_csrf(str(value)):
-                    return True
-        elif isinstance(data, list):
-            for item in data:
-                if self.check_csrf(str(item)):
-                    return True
-        return False
+        return self._check(data, ('csrf',))
+    
+    def check_injection(self, data):
+        """XSS, SQL- и командные инъекции одним проходом по значению"""
+        return self._check(data, INJECTION_CATEGORIES)
     
     def check_user_agent(self, user_agent):
         """Проверка User-Agent на вредоносные паттерны"""
@@ -425,215 +468,230 @@ class SecurityManager:
 # Создаем глобальный экземпляр менеджера безопасности
 security_manager = SecurityManager()
 
+# ------------------------------
+# Слой политик: декораторы только помечают view-функцию при импорте, а проверки
+# выполняет один before_request. План проверок для правила URL собирается
+# при первом запросе к нему и дальше берётся из словаря
+# ------------------------------
+
+def _register(f, kind):
+    """Добавить набор проверок к view-функции; внешний декоратор проверяется первым"""
+    f.security_checks = (kind,) + getattr(f, 'security_checks', ())
+    return f
+
 def security_check(f):
-    """Декоратор для проверки безопасности запросов"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        ip_address = request.remote_addr
-        logger.info(f"SECURITY: Проверяем путь {request.path} для IP {ip_address}")
-        
-        # Белый список для системных эндпоинтов телеметрии (OwnTracks и резервный трекер)
-        # Для них допускаем упрощённые проверки, чтобы избежать ложных срабатываний и 403
-        telemetry_paths = {'/api/location'}
-        # Пути с мягкими проверками (минимальные проверки, без жёсткой инспекции UA/параметров)
-        # Добавляем /telegram_login в белый список для полного пропуска всех проверок
-        soft_paths = {'/', '/invite', '/invite_auth', '/telegram_login', '/bind_telegram_form', '/api/eta'}
-        # Белый список для полного пропуска всех проверок (включая rate limiting)
-        whitelist_paths = {'/telegram_login'}
-        # Пути для мягкой проверки POST форм
-        soft_post_paths = {'/settings', '/invite_auth', '/bind_telegram_form', '/select_role'}
-        is_telemetry = request.path in telemetry_paths
-        is_soft = request.path in soft_paths
-        is_whitelisted = request.path in whitelist_paths
-        
-        logger.info(f"SECURITY: is_telemetry={is_telemetry}, is_soft={is_soft}, is_whitelisted={is_whitelisted}")
-        
-        # Если путь в белом списке - пропускаем все проверки
-        if is_whitelisted:
-            logger.info(f"SECURITY: Путь {request.path} в белом списке, пропускаем все проверки")
-            return f(*args, **kwargs)
-        
-        # Восстанавливаем блокировку IP
-        if security_manager.ip_blocker.is_blocked(ip_address):
-            logger.warning(f"SECURITY: Заблокированный IP пытается получить доступ: {ip_address}")
-            return "Access denied - IP blocked", 403
-        
-        # Проверяем rate limiting
-        if not security_manager.rate_limiter.is_allowed(ip_address):
-            logger.warning(f"SECURITY: Rate limit exceeded for IP: {ip_address}")
-            return "Rate limit exceeded", 429
-        
-        # Проверяем User-Agent (кроме телеметрии OwnTracks — у неё могут быть нетипичные UA)
-        if not is_telemetry and not is_soft:
-            user_agent = request.headers.get('User-Agent', '')
-            if security_manager.check_user_agent(user_agent):
-                logger.error(f"SECURITY: Блокирован подозрительный User-Agent: {user_agent}")
-                security_manager.ip_blocker.record_failed_attempt(ip_address)
-                return "Access denied", 403
-        
-        # Проверяем GET параметры (пропускаем для телеметрии)
-        if request.args and not is_telemetry and not is_soft:
-            for key, value in request.args.items():
-                if (security_manager.check_xss(value) or 
-                    security_manager.check_sql_injection(value) or
-                    security_manager.check_command_injection(value)):
-                    logger.error(f"SECURITY: Блокированы подозрительные GET параметры: {key}={value}")
-                    security_manager.ip_blocker.record_failed_attempt(ip_address)
-                    return "Access denied", 403
-        
-        # Проверяем POST данные (пропускаем глубокую проверку для телеметрии)
-        if request.method == 'POST' and not is_telemetry and request.path not in soft_post_paths and not is_soft:
-            if request.is_json:
-                data = request.get_json()
-                if data:
-                    if (security_manager.check_xss(data) or 
-                        security_manager.check_sql_injection(data) or
-                        security_manager.check_command_injection(data)):
-                        logger.error(f"SECURITY: Блокированы подозрительные POST данные: {data}")
-                        security_manager.ip_blocker.record_failed_attempt(ip_address)
-                        return jsonify({'error': 'Access denied'}), 403
-            else:
-                for key, value in request.form.items():
-                    if (security_manager.check_xss(value) or 
-                        security_manager.check_sql_injection(value) or
-                        security_manager.check_command_injection(value)):
-                        logger.error(f"SECURITY: Блокированы подозрительные POST данные: {key}={value}")
-                        security_manager.ip_blocker.record_failed_attempt(ip_address)
-                        return "Access denied", 403
-        
-        return f(*args, **kwargs)
-    return decorated_function
+    """Проверки по политике пути: блокировка IP, лимит, User-Agent, GET и POST параметры"""
+    return _register(f, 'standard')
 
 def auth_security_check(f):
-    """Декоратор для проверки безопасности маршрутов аутентификации (менее строгий)"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        ip_address = request.remote_addr
-        
-        # Белый список для полного пропуска всех проверок
-        whitelist_paths = {'/telegram_login'}
-        if request.path in whitelist_paths:
-            logger.info(f"AUTH_SECURITY: Путь {request.path} в белом списке, пропускаем все проверки")
-            return f(*args, **kwargs)
-        
-        # Проверяем блокировку IP
-        if security_manager.ip_blocker.is_blocked(ip_address):
-            logger.warning(f"SECURITY: Заблокированный IP пытается получить доступ: {ip_address}")
-            return "Access denied - IP blocked", 403
-        
-        # Проверяем rate limiting
-        if not security_manager.rate_limiter.is_allowed(ip_address):
-            logger.warning(f"SECURITY: Rate limit exceeded for IP: {ip_address}")
-            return "Rate limit exceeded", 429
-        
-        # Проверяем User-Agent (менее строго для аутентификации)
-        user_agent = request.headers.get('User-Agent', '')
-        if security_manager.check_user_agent(user_agent):
-            logger.warning(f"SECURITY: Подозрительный User-Agent для аутентификации: {user_agent}")
-            # Не блокируем, но логируем
-        
-        # Проверяем GET параметры
-        if request.args:
-            for key, value in request.args.items():
-                if (security_manager.check_xss(value) or 
-                    security_manager.check_sql_injection(value) or
-                    security_manager.check_command_injection(value)):
-                    logger.error(f"SECURITY: Блокированы подозрительные GET параметры: {key}={value}")
-                    security_manager.ip_blocker.record_failed_attempt(ip_address)
-                    return "Access denied", 403
-        
-        # НЕ проверяем POST данные для аутентификации (они могут содержать легитимные символы)
-        
-        return f(*args, **kwargs)
-    return decorated_function
+    """Проверки маршрутов аутентификации (менее строгие: POST данные не проверяются)"""
+    return _register(f, 'auth')
 
 def login_rate_limit(f):
-    """Декоратор для ограничения скорости входа в систему"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        ip_address = request.remote_addr
-        
-        # Белый список для полного пропуска всех проверок
-        whitelist_paths = {'/telegram_login'}
-        if request.path in whitelist_paths:
-            logger.info(f"LOGIN_RATE_LIMIT: Путь {request.path} в белом списке, пропускаем все проверки")
-            return f(*args, **kwargs)
-        
-        # Включаем лимит попыток входа
-        if not security_manager.login_rate_limiter.is_allowed(ip_address):
-            logger.warning(f"SECURITY: Login rate limit exceeded for IP: {ip_address}")
-            security_manager.ip_blocker.record_failed_attempt(ip_address)
-            return "Too many login attempts. Please try again later.", 429
-        
-        return f(*args, **kwargs)
-    return decorated_function
+    """Ограничение скорости входа в систему"""
+    return _register(f, 'login')
 
 def password_reset_rate_limit(f):
-    """Декоратор для ограничения скорости восстановления пароля (более мягкий)"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        ip_address = request.remote_addr
-        
-        # Белый список для полного пропуска всех проверок
-        whitelist_paths = {'/telegram_login'}
-        if request.path in whitelist_paths:
-            logger.info(f"PASSWORD_RESET_RATE_LIMIT: Путь {request.path} в белом списке, пропускаем все проверки")
-            return f(*args, **kwargs)
-        
-        # Включаем лимит попыток восстановления пароля
-        if not security_manager.password_reset_rate_limiter.is_allowed(ip_address):
-            logger.warning(f"SECURITY: Password reset rate limit exceeded for IP: {ip_address}")
-            return "Too many password reset attempts. Please try again later.", 429
-        
-        return f(*args, **kwargs)
-    return decorated_function
+    """Ограничение скорости восстановления пароля (более мягкое)"""
+    return _register(f, 'password_reset')
 
 def password_reset_security_check(f):
-    """Декоратор для проверки безопасности восстановления пароля (очень мягкий)"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        ip_address = request.remote_addr
-        
-        # Белый список для полного пропуска всех проверок
-        whitelist_paths = {'/telegram_login'}
-        if request.path in whitelist_paths:
-            logger.info(f"PASSWORD_RESET_SECURITY: Путь {request.path} в белом списке, пропускаем все проверки")
-            return f(*args, **kwargs)
-        
-        # Проверяем только общий rate limiting (не блокируем IP)
-        if not security_manager.rate_limiter.is_allowed(ip_address):
-            logger.warning(f"SECURITY: General rate limit exceeded for password reset: {ip_address}")
-            return "Rate limit exceeded", 429
-        
-        # Проверяем User-Agent (только логируем)
-        user_agent = request.headers.get('User-Agent', '')
-        if security_manager.check_user_agent(user_agent):
-            logger.warning(f"SECURITY: Подозрительный User-Agent для восстановления пароля: {user_agent}")
-            # Не блокируем, только логируем
-        
-        # Проверяем GET параметры (только логируем)
-        if request.args:
-            for key, value in request.args.items():
-                if (security_manager.check_xss(value) or 
-                    security_manager.check_sql_injection(value) or
-                    security_manager.check_command_injection(value)):
-                    logger.warning(f"SECURITY: Подозрительные GET параметры для восстановления пароля: {key}={value}")
-                    # Не блокируем, только логируем
-        
-        return f(*args, **kwargs)
-    return decorated_function
+    """Проверки восстановления пароля (очень мягкие: подозрительное только логируется)"""
+    return _register(f, 'password_reset_security')
 
 def csrf_protect(f):
-    """Декоратор для защиты от CSRF атак"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if request.method == 'POST':
-            token = request.form.get('csrf_token') or request.headers.get('X-CSRF-Token')
-            if not token or not security_manager.validate_csrf_token(token):
-                logger.error(f"SECURITY: CSRF token validation failed for IP: {request.remote_addr}")
-                return "CSRF token validation failed", 403
-        return f(*args, **kwargs)
-    return decorated_function
+    """Защита от CSRF атак"""
+    return _register(f, 'csrf')
+
+def _check_ip_blocked(ip_address):
+    if security_manager.ip_blocker.is_blocked(ip_address):
+        logger.warning(f"SECURITY: Заблокированный IP пытается получить доступ: {ip_address}")
+        return "Access denied - IP blocked", 403
+
+def _check_rate_limit(ip_address, name, message, record_failure=False):
+    allowed, retry_after = security_manager.rate_limiters[name].check(ip_address)
+    if not allowed:
+        logger.warning(f"SECURITY: Rate limit exceeded for IP: {ip_address} ({name})")
+        if record_failure:
+            security_manager.ip_blocker.record_failed_attempt(ip_address)
+        return rate_limited(message, retry_after)
+
+def _check_user_agent(ip_address, block):
+    user_agent = request.headers.get('User-Agent', '')
+    if security_manager.check_user_agent(user_agent):
+        if not block:
+            logger.warning(f"SECURITY: Подозрительный User-Agent для {request.path}: {user_agent}")
+            return None
+        logger.error(f"SECURITY: Блокирован подозрительный User-Agent: {user_agent}")
+        security_manager.ip_blocker.record_failed_attempt(ip_address)
+        return "Access denied", 403
+
+def _check_args(ip_address, block):
+    for key, value in request.args.items():
+        if security_manager.check_injection(value):
+            if not block:
+                logger.warning(f"SECURITY: Подозрительные GET параметры для {request.path}: {key}={value}")
+                continue
+            logger.error(f"SECURITY: Блокированы подозрительные GET параметры: {key}={value}")
+            security_manager.ip_blocker.record_failed_attempt(ip_address)
+            return "Access denied", 403
+
+def _check_body(ip_address):
+    if request.method != 'POST':
+        return None
+    if request.is_json:
+        data = request.get_json()
+        if data and security_manager.check_injection(data):
+            logger.error(f"SECURITY: Блокированы подозрительные POST данные: {data}")
+            security_manager.ip_blocker.record_failed_attempt(ip_address)
+            return jsonify({'error': 'Access denied'}), 403
+        return None
+    for key, value in request.form.items():
+        if security_manager.check_injection(value):
+            logger.error(f"SECURITY: Блокированы подозрительные POST данные: {key}={value}")
+            security_manager.ip_blocker.record_failed_attempt(ip_address)
+            return "Access denied", 403
+
+def _check_csrf(ip_address):
+    if request.method == 'POST':
+        token = request.form.get('csrf_token') or request.headers.get('X-CSRF-Token')
+        if not token or not security_manager.validate_csrf_token(token):
+            logger.error(f"SECURITY: CSRF token validation failed for IP: {ip_address}")
+            return "CSRF token validation failed", 403
+
+def _expand(kind, policy):
+    """Шаги проверки одного набора: [(функция, аргументы после IP), ...]"""
+    if kind == 'csrf':
+        return [(_check_csrf, ())]
+    if policy.bypass:
+        # Путь в белом списке — пропускаем все проверки
+        return []
+    if kind == 'standard':
+        steps = [(_check_ip_blocked, ()), (_check_rate_limit, (policy.rate_limit, "Rate limit exceeded"))]
+        if policy.check_user_agent:
+            steps.append((_check_user_agent, (True,)))
+        if policy.check_args:
+            steps.append((_check_args, (True,)))
+        if policy.check_body:
+            steps.append((_check_body, ()))
+        return steps
+    if kind == 'auth':
+        return [(_check_ip_blocked, ()), (_check_rate_limit, ('general', "Rate limit exceeded")),
+                (_check_user_agent, (False,)), (_check_args, (True,))]
+    if kind == 'login':
+        return [(_check_rate_limit, ('login', "Too many login attempts. Please try again later.", True))]
+    if kind == 'password_reset':
+        return [(_check_rate_limit, ('password_reset', "Too many password reset attempts. Please try again later."))]
+    if kind == 'password_reset_security':
+        return [(_check_rate_limit, ('general', "Rate limit exceeded")),
+                (_check_user_agent, (False,)), (_check_args, (False,))]
+    raise ValueError(f"Неизвестный набор проверок: {kind}")
+
+def compile_plan(checks, rule):
+    """План проверок для правила URL: шаги всех наборов по порядку, без повторов"""
+    policy = route_policy(rule)
+    plan = []
+    for kind in checks:
+        for step in _expand(kind, policy):
+            if step not in plan:
+                plan.append(step)
+    return tuple(plan)
+
+class LatencyHistogram:
+    """Время проверок безопасности на запрос по фиксированным корзинам (мкс)"""
+    
+    BOUNDS_US = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(self.BOUNDS_US) + 1)
+        self.total_us = 0.0
+        self.max_us = 0.0
+    
+    def record(self, seconds):
+        us = seconds * 1e6
+        index = bisect.bisect_left(self.BOUNDS_US, us)
+        with self.lock:
+            self.counts[index] += 1
+            self.total_us += us
+            if us > self.max_us:
+                self.max_us = us
+    
+    def _quantile(self, counts, total, q):
+        """Верхняя граница корзины, в которую попадает квантиль q"""
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= q * total:
+                return self.BOUNDS_US[index] if index < len(self.BOUNDS_US) else None
+        return None
+    
+    def get_stats(self):
+        with self.lock:
+            counts, total_us, max_us = list(self.counts), self.total_us, self.max_us
+        total = sum(counts)
+        labels = [f"<={b}" for b in self.BOUNDS_US] + [f">{self.BOUNDS_US[-1]}"]
+        return {
+            'requests': total,
+            'mean_us': round(total_us / total, 1) if total else 0.0,
+            'max_us': round(max_us, 1),
+            'p50_us': self._quantile(counts, total, 0.5) if total else None,
+            'p90_us': self._quantile(counts, total, 0.9) if total else None,
+            'p99_us': self._quantile(counts, total, 0.99) if total else None,
+            'buckets_us': {label: count for label, count in zip(labels, counts) if count},
+        }
+
+class SecurityLayer:
+    """Один before_request вместо стопки декораторов на каждом маршруте"""
+    
+    def __init__(self):
+        self._plans = {}        # (endpoint, правило URL) -> шаги проверки
+        self.timings = LatencyHistogram()
+        self.blocked = defaultdict(int)    # имя шага -> сколько запросов он остановил
+        self.lock = threading.Lock()
+    
+    def init_app(self, app):
+        self.app = app
+        app.before_request(self.before_request)
+    
+    def _plan(self, rule):
+        key = (rule.endpoint, rule.rule)
+        plan = self._plans.get(key)
+        if plan is None:
+            view = self.app.view_functions.get(rule.endpoint)
+            plan = compile_plan(getattr(view, 'security_checks', ()), rule.rule)
+            self._plans[key] = plan
+        return plan
+    
+    def before_request(self):
+        rule = request.url_rule
+        if rule is None:
+            return None
+        plan = self._plan(rule)
+        if not plan:
+            return None
+        started = time.perf_counter()
+        ip_address = request.remote_addr
+        response = None
+        for check, args in plan:
+            response = check(ip_address, *args)
+            if response is not None:
+                with self.lock:
+                    self.blocked[check.__name__.lstrip('_')] += 1
+                break
+        self.timings.record(time.perf_counter() - started)
+        return response
+    
+    def reset_after_fork(self):
+        self.lock = threading.Lock()
+        self.timings.lock = threading.Lock()
+    
+    def get_stats(self):
+        with self.lock:
+            blocked = dict(self.blocked)
+        return {'timings': self.timings.get_stats(), 'blocked': blocked, 'routes': len(self._plans)}
+
+security_layer = SecurityLayer()
 
 def log_security_event(event_type, details, ip_address=None):
     """Логирование событий безопасности"""
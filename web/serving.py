@@ -0,0 +1,154 @@
+"""
+Режимы запуска веб-приложения (run_web.py)
+
+WEB_SERVER:
+- dev — встроенный сервер Flask (app.run), один процесс, как раньше;
+- gunicorn — master и WEB_WORKERS pre-fork воркеров по WEB_THREADS потоков
+  (gthread), keep-alive WEB_KEEPALIVE_SEC. Приложение загружается в master
+  до fork (WEB_PRELOAD): воркеры делят память модулей, а всё, что нельзя
+  унаследовать (соединения SQLite, потоки, HTTP-сессии, блокировки),
+  сбрасывают хуки register_fork_hook в post_fork. gunicorn входит в
+  requirements.txt (кроме Windows, где его нет); driver-web.service
+  запускается в этом режиме.
+
+Плавная перезагрузка в режиме gunicorn: SIGHUP — новые воркеры получают
+запросы, старые дорабатывают текущие (до WEB_GRACEFUL_TIMEOUT_SEC). С
+WEB_PRELOAD=True код приложения при этом не перечитывается — для выката
+нового кода SIGUSR2 (новый master) и SIGTERM старому, либо WEB_PRELOAD=False.
+
+Кэши и состояния в памяти процесса у каждого воркера свои. shared_state_report
+перечисляет те, что в многопроцессном режиме стоит перевести в общее
+хранилище (ETA_CACHE_BACKEND, RATE_LIMIT_BACKEND, TRACKING_SESSION_BACKEND).
+"""
+
+import logging
+import os
+
+from config.settings import config
+
+logger = logging.getLogger(__name__)
+
+# Сброс унаследованного от master состояния в воркере: по порядку регистрации
+_fork_hooks = []
+
+
+def register_fork_hook(hook):
+    """Вызвать hook() в каждом воркере сразу после fork"""
+    _fork_hooks.append(hook)
+    return hook
+
+
+def reset_after_fork():
+    """Соединения пулов SQLite и зарегистрированные состояния — заново в дочернем процессе"""
+    from bot.db_pool import reset_all_pools
+
+    reset_all_pools()
+    for hook in _fork_hooks:
+        try:
+            hook()
+        except Exception as e:
+            logger.error(f"❌ SERVING: ошибка сброса состояния после fork ({getattr(hook, '__qualname__', hook)}): {e}")
+
+
+def worker_count():
+    if config.WEB_WORKERS > 0:
+        return config.WEB_WORKERS
+    return min(2 * (os.cpu_count() or 1) + 1, 8)
+
+
+def shared_state_report(workers):
+    """Состояния в памяти воркера, которые при нескольких воркерах расходятся"""
+    if workers <= 1:
+        return []
+    issues = []
+    if config.ETA_CACHE_BACKEND == 'memory':
+        issues.append("кэш /api/eta и паузы после 429 — ETA_CACHE_BACKEND=sqlite или socket")
+    if config.RATE_LIMIT_ENABLED and config.RATE_LIMIT_BACKEND == 'memory':
+        issues.append("лимиты запросов делятся на число воркеров — RATE_LIMIT_BACKEND=shared")
+    if config.TRACKING_SESSION_BACKEND == 'memory':
+        issues.append("сессии веб-отслеживания видны одному воркеру — TRACKING_SESSION_BACKEND=sqlite")
+    if config.GEOFENCE_HYSTERESIS or config.TRACK_FILTER_ENABLED:
+        issues.append("гистерезис геозон и фильтр трека ведут состояние устройства в воркере, "
+                      "точки одного устройства лучше направлять в один воркер")
+    return issues
+
+
+def gunicorn_options():
+    """Настройки gunicorn из config.settings"""
+    return {
+        'bind': f"{config.WEB_HOST}:{config.WEB_PORT}",
+        'workers': worker_count(),
+        'worker_class': 'gthread',
+        'threads': max(1, config.WEB_THREADS),
+        'keepalive': config.WEB_KEEPALIVE_SEC,
+        'timeout': config.WEB_TIMEOUT_SEC,
+        'graceful_timeout': config.WEB_GRACEFUL_TIMEOUT_SEC,
+        'max_requests': config.WEB_MAX_REQUESTS,
+        'max_requests_jitter': config.WEB_MAX_REQUESTS_JITTER if config.WEB_MAX_REQUESTS else 0,
+        'backlog': config.WEB_BACKLOG,
+        'preload_app': config.WEB_PRELOAD,
+        'pidfile': config.WEB_PID_FILE or None,
+        'accesslog': None,
+        'errorlog': '-',
+        'proc_name': 'clever-driver-web',
+    }
+
+
+def _post_fork(server, worker):
+    reset_after_fork()
+
+
+def _when_ready(server):
+    options = gunicorn_options()
+    logger.info(f"🌐 SERVING: gunicorn на {options['bind']}, воркеров {options['workers']} "
+                f"по {options['threads']} потоков, keep-alive {options['keepalive']} с")
+    for issue in shared_state_report(options['workers']):
+        logger.warning(f"⚠️ SERVING: в памяти воркера: {issue}")
+
+
+def _on_reload(server):
+    logger.info("🔄 SERVING: SIGHUP — плавный перезапуск воркеров")
+
+
+def create_gunicorn_server(app_loader, options=None):
+    """
+    Сервер gunicorn, встроенный в процесс run_web.py
+
+    Args:
+        app_loader: функция без аргументов, возвращающая WSGI-приложение
+        options: настройки gunicorn поверх gunicorn_options()
+
+    Raises:
+        ImportError: gunicorn не установлен
+    """
+    from gunicorn.app.base import BaseApplication
+
+    settings = dict(gunicorn_options(), post_fork=_post_fork, when_ready=_when_ready, on_reload=_on_reload)
+    settings.update(options or {})
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in settings.items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            return app_loader()
+
+    return Server()
+
+
+def serve(app_loader, server=None):
+    """Запустить приложение в режиме WEB_SERVER; на платформе без gunicorn (Windows) — встроенный сервер Flask"""
+    server = server or config.WEB_SERVER
+    if server == 'gunicorn':
+        try:
+            gunicorn_server = create_gunicorn_server(app_loader)
+        except ImportError:
+            logger.error("❌ SERVING: gunicorn не установлен (pip install gunicorn), запускаем встроенный сервер Flask")
+        else:
+            gunicorn_server.run()
+            return
+    elif server != 'dev':
+        logger.warning(f"⚠️ WEB_SERVER: неизвестный режим {server}, запускаем встроенный сервер Flask")
+    app_loader().run(host=config.WEB_HOST, port=config.WEB_PORT, debug=False, threaded=True)
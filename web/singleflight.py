@@ -0,0 +1,83 @@
+"""
+Объединение одновременных запросов (single-flight)
+
+Пока по ключу выполняется вызов, остальные потоки с тем же ключом не
+повторяют его, а ждут результат ведущего и получают тот же ответ (или ту
+же ошибку). Используется в /api/eta, чтобы несколько получателей одного
+водителя, открывших трекер одновременно, не тратили квоту провайдера
+маршрутов на одинаковые запросы.
+"""
+
+import threading
+
+
+class SingleFlightTimeout(Exception):
+    """Ведущий вызов не завершился за отведённое время"""
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Не больше одного одновременного вызова на ключ"""
+
+    def __init__(self, timeout=15.0):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'coalesced': 0, 'timeouts': 0, 'errors': 0}
+
+    def do(self, key, func, timeout=None):
+        """
+        Выполнить func() или дождаться уже идущего вызова с тем же ключом
+
+        Returns:
+            tuple: (результат, shared) — shared=True, если результат получен от чужого вызова
+        Raises:
+            SingleFlightTimeout: ведущий вызов не успел за timeout секунд
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+                self.stats['calls'] += 1
+            else:
+                call.waiters += 1
+                leader = False
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            if not call.event.wait(self.timeout if timeout is None else timeout):
+                with self._lock:
+                    self.stats['timeouts'] += 1
+                raise SingleFlightTimeout(f"Запрос {key} не завершился вовремя")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self.stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.result, False
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['in_flight'] = len(self._calls)
+        return stats
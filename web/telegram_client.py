@@ -0,0 +1,169 @@
+"""
+Общий клиент Telegram Bot API для веб-процесса
+
+Одна requests.Session с пулом keep-alive соединений на весь процесс и пул
+потоков для параллельной отправки нескольким получателям. В режиме
+"поставить в очередь и ответить" (WEB_NOTIFY_ASYNC) рассылка целиком
+уходит в фоновый поток, а обработчик Flask отвечает сразу.
+
+Адрес API задаётся TELEGRAM_API_URL, поэтому клиент можно проверить на
+локальной HTTP-заглушке (см. tests/bench_telegram_client.py).
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config.settings import config
+
+logger = logging.getLogger(__name__)
+
+# Максимальная пауза по ответу 429 (retry_after), которую готовы выждать
+MAX_RETRY_AFTER_SEC = 5
+
+
+class TelegramClient:
+    """Отправка сообщений через Bot API с переиспользованием соединений"""
+
+    def __init__(self, api_url=None, token=None, pool_size=None, workers=None, timeout=None):
+        self.api_url = (api_url or config.TELEGRAM_API_URL).rstrip('/')
+        self._token = token
+        self.pool_size = pool_size or config.TELEGRAM_HTTP_POOL_SIZE
+        self.workers = workers or config.TELEGRAM_HTTP_WORKERS
+        self.timeout = timeout or config.TELEGRAM_HTTP_TIMEOUT
+        self._lock = threading.Lock()
+        self._session = None
+        self._executor = None
+        self._background = None
+        self.stats = {'sent': 0, 'failed': 0, 'retried': 0, 'queued': 0}
+
+    @property
+    def token(self):
+        return (self._token or os.environ.get('TELEGRAM_TOKEN')
+                or os.environ.get('TELEGRAM_BOT_TOKEN') or 'default_token')
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+            return self._session
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='telegram-send')
+            return self._executor
+
+    @property
+    def background(self):
+        with self._lock:
+            if self._background is None:
+                # Отдельный пул, чтобы фоновые рассылки не занимали воркеры send_many
+                self._background = ThreadPoolExecutor(max_workers=2, thread_name_prefix='telegram-deliver')
+            return self._background
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def send_message(self, chat_id, text, **params):
+        """
+        Отправить одно сообщение
+
+        Returns:
+            dict: chat_id, ok, status (HTTP-код или None при сетевой ошибке),
+                  error (описание ошибки Telegram/сети или None)
+        """
+        url = f"{self.api_url}/bot{self.token}/sendMessage"
+        payload = {'chat_id': chat_id, 'text': text}
+        payload.update(params)
+        for attempt in range(2):
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout)
+            except Exception as e:
+                self._count('failed')
+                return {'chat_id': chat_id, 'ok': False, 'status': None, 'error': str(e)}
+
+            body = None
+            if response.headers.get('content-type', '').startswith('application/json'):
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = None
+
+            if response.status_code == 429 and attempt == 0:
+                retry_after = ((body or {}).get('parameters') or {}).get('retry_after', 1)
+                if retry_after <= MAX_RETRY_AFTER_SEC:
+                    self._count('retried')
+                    logger.warning(f"⏳ Telegram просит подождать {retry_after}s перед отправкой в {chat_id}")
+                    time.sleep(retry_after)
+                    continue
+
+            if response.status_code == 200 and body and body.get('ok'):
+                self._count('sent')
+                return {'chat_id': chat_id, 'ok': True, 'status': 200, 'error': None}
+
+            error = (body or {}).get('description') or f"HTTP {response.status_code}"
+            self._count('failed')
+            return {'chat_id': chat_id, 'ok': False, 'status': response.status_code, 'error': error}
+
+    def send_many(self, chat_ids, text, **params):
+        """Параллельно отправить один текст нескольким получателям; результаты в порядке chat_ids"""
+        chat_ids = list(chat_ids)
+        if len(chat_ids) <= 1:
+            return [self.send_message(chat_id, text, **params) for chat_id in chat_ids]
+        futures = [self.executor.submit(self.send_message, chat_id, text, **params) for chat_id in chat_ids]
+        return [future.result() for future in futures]
+
+    def submit(self, func, *args, **kwargs):
+        """Выполнить рассылку в фоне (режим "поставить в очередь и ответить")"""
+        self._count('queued')
+
+        def run():
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"❌ Ошибка фоновой рассылки {getattr(func, '__name__', func)}: {e}")
+
+        return self.background.submit(run)
+
+    def reset_after_fork(self):
+        """Сбросить сессию и пул потоков в дочернем процессе после fork"""
+        self._lock = threading.Lock()
+        self._session = None
+        self._executor = None
+        self._background = None
+
+    def close(self):
+        # Сначала дожидаемся фоновых рассылок — они пользуются executor и session
+        with self._lock:
+            background, self._background = self._background, None
+        if background is not None:
+            background.shutdown(wait=True)
+        with self._lock:
+            executor, self._executor = self._executor, None
+            session, self._session = self._session, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        if session is not None:
+            session.close()
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+
+telegram_client = TelegramClient()
+atexit.register(telegram_client.close)
@@ -0,0 +1,329 @@
+"""
+Хранилище сессий веб-отслеживания (web/location_web_tracker.py)
+
+Раньше сессии лежали в словаре процесса: поиск сессии получателя и очистка
+истекших перебирали все сессии, список точек каждой сессии рос без
+ограничения, а после перезапуска или в другом воркере gunicorn сессии не было.
+
+Хранилища (TRACKING_SESSION_BACKEND):
+- memory — словарь процесса с индексом telegram_id -> токены, кучей сроков
+  истечения (очистка снимает с вершины только истекшие) и кольцевым буфером
+  последних TRACKING_SESSION_MAX_POINTS точек на сессию;
+- sqlite — таблицы в файле TRACKING_SESSION_DB: индексы по (telegram_id,
+  expires_at) и по expires_at, точки в ячейках кольца (token, seq % N), так
+  что запись точки — одна вставка без удаления старых. Сессии видны всем
+  воркерам и переживают перезапуск.
+
+Сессия — словарь: telegram_id, user_info, duration_minutes, created_at,
+expires_at (datetime), is_active, locations_count (всего принято точек) и
+last_location; история точек — locations(token).
+"""
+
+import heapq
+import json
+import logging
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime
+
+from config.settings import config
+
+logger = logging.getLogger(__name__)
+
+
+def _session_view(session_data, last_location):
+    return dict(session_data, last_location=last_location)
+
+
+class MemorySessionStore:
+    """Сессии в памяти процесса: индекс по telegram_id, куча сроков, кольцо точек"""
+
+    name = 'memory'
+
+    def __init__(self, max_points=500):
+        self.max_points = max(1, int(max_points))
+        self._sessions = {}         # токен -> данные сессии
+        self._points = {}           # токен -> deque последних точек
+        self._by_telegram = {}      # telegram_id -> множество токенов неудалённых сессий
+        self._expiry = []           # куча (expires_at, токен)
+        self._lock = threading.Lock()
+        self.stats = {'created': 0, 'expired': 0, 'points': 0}
+
+    def create(self, token, session_data):
+        with self._lock:
+            self._sessions[token] = dict(session_data, locations_count=0)
+            self._points[token] = deque(maxlen=self.max_points)
+            self._by_telegram.setdefault(session_data['telegram_id'], set()).add(token)
+            heapq.heappush(self._expiry, (session_data['expires_at'].timestamp(), token))
+            self.stats['created'] += 1
+
+    def get(self, token):
+        with self._lock:
+            session_data = self._sessions.get(token)
+            if session_data is None:
+                return None
+            points = self._points[token]
+            return _session_view(session_data, points[-1] if points else None)
+
+    def find_active(self, telegram_id, now):
+        """Токен и данные самой новой активной неистекшей сессии пользователя или (None, None)"""
+        with self._lock:
+            token, session_data = None, None
+            for candidate in self._by_telegram.get(telegram_id, ()):
+                s = self._sessions[candidate]
+                if s['is_active'] and now < s['expires_at'] and (
+                        session_data is None or s['created_at'] > session_data['created_at']):
+                    token, session_data = candidate, s
+            if session_data is None:
+                return None, None
+            points = self._points[token]
+            return token, _session_view(session_data, points[-1] if points else None)
+
+    def add_location(self, token, location):
+        with self._lock:
+            session_data = self._sessions.get(token)
+            if session_data is None:
+                return False
+            self._points[token].append(location)
+            session_data['locations_count'] += 1
+            self.stats['points'] += 1
+            return True
+
+    def locations(self, token):
+        with self._lock:
+            return list(self._points.get(token, ()))
+
+    def set_active(self, token, is_active):
+        with self._lock:
+            session_data = self._sessions.get(token)
+            if session_data is None:
+                return False
+            session_data['is_active'] = is_active
+            return True
+
+    def cleanup(self, now):
+        """Удалить истекшие сессии; возвращает их токены"""
+        expired = []
+        deadline = now.timestamp()
+        with self._lock:
+            while self._expiry and self._expiry[0][0] < deadline:
+                _expires_at, token = heapq.heappop(self._expiry)
+                session_data = self._sessions.pop(token, None)
+                if session_data is None:
+                    continue
+                del self._points[token]
+                tokens = self._by_telegram[session_data['telegram_id']]
+                tokens.discard(token)
+                if not tokens:
+                    del self._by_telegram[session_data['telegram_id']]
+                expired.append(token)
+            self.stats['expired'] += len(expired)
+        return expired
+
+    def active(self, now):
+        """[(токен, данные)] активных неистекших сессий"""
+        with self._lock:
+            return [(token, _session_view(s, self._points[token][-1] if self._points[token] else None))
+                    for token, s in self._sessions.items() if s['is_active'] and now < s['expires_at']]
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats, sessions=len(self._sessions), heap=len(self._expiry))
+        stats.update(backend=self.name, max_points=self.max_points)
+        return stats
+
+
+class SqliteSessionStore:
+    """Сессии в SQLite (WAL), общие для воркеров и переживающие перезапуск"""
+
+    name = 'sqlite'
+    _COLUMNS = "token, telegram_id, user_info, duration_minutes, created_at, expires_at, is_active, locations_count"
+
+    def __init__(self, db_path='tracking_sessions.db', max_points=500):
+        from bot.db_pool import get_pool
+
+        self.db_path = db_path
+        self.max_points = max(1, int(max_points))
+        self._pool = get_pool(db_path)
+        self._lock = threading.Lock()
+        self.stats = {'created': 0, 'expired': 0, 'points': 0, 'errors': 0}
+        conn = self._pool.get_connection()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tracking_sessions (
+                    token TEXT PRIMARY KEY,
+                    telegram_id INTEGER NOT NULL,
+                    user_info TEXT NOT NULL,
+                    duration_minutes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    is_active INTEGER NOT NULL DEFAULT 1,
+                    locations_count INTEGER NOT NULL DEFAULT 0
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tracking_sessions_telegram "
+                         "ON tracking_sessions(telegram_id, expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tracking_sessions_expires ON tracking_sessions(expires_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tracking_session_points (
+                    token TEXT NOT NULL,
+                    slot INTEGER NOT NULL,
+                    seq INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (token, slot)
+                ) WITHOUT ROWID
+            """)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _session(self, conn, row):
+        token, telegram_id, user_info, duration, created_at, expires_at, is_active, count = row
+        last = None
+        if count:
+            point = conn.execute("SELECT data FROM tracking_session_points WHERE token = ? AND slot = ?",
+                                 (token, (count - 1) % self.max_points)).fetchone()
+            last = json.loads(point[0]) if point else None
+        return {
+            'telegram_id': telegram_id,
+            'user_info': json.loads(user_info),
+            'duration_minutes': duration,
+            'created_at': datetime.fromtimestamp(created_at),
+            'expires_at': datetime.fromtimestamp(expires_at),
+            'is_active': bool(is_active),
+            'locations_count': count,
+            'last_location': last,
+        }
+
+    def create(self, token, session_data):
+        conn = self._pool.get_connection()
+        try:
+            conn.execute(
+                f"INSERT INTO tracking_sessions ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (token, session_data['telegram_id'], json.dumps(session_data['user_info'], ensure_ascii=False, default=str),
+                 session_data['duration_minutes'], session_data['created_at'].timestamp(),
+                 session_data['expires_at'].timestamp(), int(session_data['is_active']))
+            )
+            conn.commit()
+            self._count('created')
+        finally:
+            conn.close()
+
+    def get(self, token):
+        conn = self._pool.get_connection()
+        try:
+            row = conn.execute(f"SELECT {self._COLUMNS} FROM tracking_sessions WHERE token = ?", (token,)).fetchone()
+            return self._session(conn, row) if row else None
+        finally:
+            conn.close()
+
+    def find_active(self, telegram_id, now):
+        conn = self._pool.get_connection()
+        try:
+            row = conn.execute(
+                f"SELECT {self._COLUMNS} FROM tracking_sessions "
+                "WHERE telegram_id = ? AND expires_at > ? AND is_active = 1 ORDER BY created_at DESC LIMIT 1",
+                (telegram_id, now.timestamp())
+            ).fetchone()
+            return (row[0], self._session(conn, row)) if row else (None, None)
+        finally:
+            conn.close()
+
+    def add_location(self, token, location):
+        conn = self._pool.get_connection()
+        try:
+            # UPDATE первым берёт блокировку записи: номер точки и ячейка кольца не гонятся между воркерами
+            if conn.execute("UPDATE tracking_sessions SET locations_count = locations_count + 1 WHERE token = ?",
+                            (token,)).rowcount == 0:
+                conn.rollback()
+                return False
+            seq = conn.execute("SELECT locations_count FROM tracking_sessions WHERE token = ?", (token,)).fetchone()[0] - 1
+            conn.execute("INSERT OR REPLACE INTO tracking_session_points (token, slot, seq, data) VALUES (?, ?, ?, ?)",
+                         (token, seq % self.max_points, seq, json.dumps(location, ensure_ascii=False, default=str)))
+            conn.commit()
+            self._count('points')
+            return True
+        except sqlite3.Error as e:
+            conn.rollback()
+            self._count('errors')
+            logger.warning(f"TRACKING_SESSIONS: ошибка записи точки в сессию {token}: {e}")
+            return False
+        finally:
+            conn.close()
+
+    def locations(self, token):
+        conn = self._pool.get_connection()
+        try:
+            rows = conn.execute("SELECT data FROM tracking_session_points WHERE token = ? ORDER BY seq", (token,)).fetchall()
+            return [json.loads(row[0]) for row in rows]
+        finally:
+            conn.close()
+
+    def set_active(self, token, is_active):
+        conn = self._pool.get_connection()
+        try:
+            updated = conn.execute("UPDATE tracking_sessions SET is_active = ? WHERE token = ?",
+                                   (int(is_active), token)).rowcount
+            conn.commit()
+            return updated > 0
+        finally:
+            conn.close()
+
+    def cleanup(self, now):
+        conn = self._pool.get_connection()
+        try:
+            deadline = now.timestamp()
+            expired = [row[0] for row in conn.execute(
+                "SELECT token FROM tracking_sessions WHERE expires_at < ?", (deadline,)).fetchall()]
+            if expired:
+                conn.executemany("DELETE FROM tracking_session_points WHERE token = ?", [(t,) for t in expired])
+                conn.execute("DELETE FROM tracking_sessions WHERE expires_at < ?", (deadline,))
+                conn.commit()
+            self._count('expired', len(expired))
+            return expired
+        finally:
+            conn.close()
+
+    def active(self, now):
+        conn = self._pool.get_connection()
+        try:
+            rows = conn.execute(f"SELECT {self._COLUMNS} FROM tracking_sessions WHERE expires_at > ? AND is_active = 1",
+                                (now.timestamp(),)).fetchall()
+            return [(row[0], self._session(conn, row)) for row in rows]
+        finally:
+            conn.close()
+
+    def reset_after_fork(self):
+        # Соединения пула сбрасывает reset_all_pools()
+        self._lock = threading.Lock()
+
+    def get_stats(self):
+        conn = self._pool.get_connection()
+        try:
+            sessions = conn.execute("SELECT COUNT(*) FROM tracking_sessions").fetchone()[0]
+        except sqlite3.Error:
+            sessions = None
+        finally:
+            conn.close()
+        with self._lock:
+            stats = dict(self.stats)
+        stats.update(sessions=sessions, backend=self.name, max_points=self.max_points, path=self.db_path)
+        return stats
+
+
+def create_session_store():
+    """Хранилище сессий из TRACKING_SESSION_BACKEND"""
+    backend_name = config.TRACKING_SESSION_BACKEND
+    if backend_name == 'sqlite':
+        return SqliteSessionStore(config.TRACKING_SESSION_DB, config.TRACKING_SESSION_MAX_POINTS)
+    if backend_name != 'memory':
+        logger.warning(f"⚠️ TRACKING_SESSION_BACKEND: неизвестное хранилище {backend_name}, используем memory")
+    return MemorySessionStore(config.TRACKING_SESSION_MAX_POINTS)